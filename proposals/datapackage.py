@@ -0,0 +1,75 @@
+"""
+Storage format of proposal data packages (ProposalDataPackage / EquipmentDataSection).
+
+A package is split into a skeleton (proposal, client, equipment_list, ...) and one
+section per equipment with its equipment_details / equipment_specifications /
+tech_processes entries. Sections are content-addressed (sha256 of canonical JSON), so
+proposals with the same equipment share them; the skeleton keeps equipment_id -> hash.
+Both parts are stored as zlib-compressed JSON.
+
+Kept free of model imports so migrations can use it.
+"""
+import hashlib
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+SECTION_KEYS = ('equipment_details', 'equipment_specifications', 'tech_processes')
+# Служебные ключи скелета: ссылки на секции и какие из SECTION_KEYS были в пакете
+SECTIONS_REF_KEY = '_equipment_sections'
+SECTIONS_PRESENT_KEY = '_section_keys'
+
+COMPRESSION_LEVEL = 6
+
+
+def encode(value):
+    """Canonical JSON bytes (sorted keys, no whitespace)."""
+    return json.dumps(
+        value, cls=DjangoJSONEncoder, ensure_ascii=False, sort_keys=True, separators=(',', ':')
+    ).encode('utf-8')
+
+
+def compress(value):
+    raw = encode(value)
+    return zlib.compress(raw, COMPRESSION_LEVEL), len(raw)
+
+
+def decompress(payload):
+    return json.loads(zlib.decompress(bytes(payload)).decode('utf-8'))
+
+
+def split(package):
+    """package -> (skeleton, {hash: section}). Equipment ids become strings, as after a JSON round trip."""
+    package = package or {}
+    skeleton = {key: value for key, value in package.items() if key not in SECTION_KEYS}
+    present = [key for key in SECTION_KEYS if isinstance(package.get(key), dict)]
+    by_equipment = {}
+    for key in present:
+        for equipment_id, value in package[key].items():
+            by_equipment.setdefault(str(equipment_id), {})[key] = value
+
+    refs, sections = {}, {}
+    for equipment_id, section in by_equipment.items():
+        section_hash = hashlib.sha256(encode(section)).hexdigest()
+        refs[equipment_id] = section_hash
+        sections[section_hash] = section
+    skeleton[SECTIONS_REF_KEY] = refs
+    skeleton[SECTIONS_PRESENT_KEY] = present
+    return skeleton, sections
+
+
+def join(skeleton, sections):
+    """Inverse of split(); missing sections are skipped."""
+    package = dict(skeleton or {})
+    refs = package.pop(SECTIONS_REF_KEY, {}) or {}
+    present = package.pop(SECTIONS_PRESENT_KEY, []) or []
+    for key in present:
+        package[key] = {}
+    for equipment_id, section_hash in refs.items():
+        section = sections.get(section_hash)
+        if section is None:
+            continue
+        for key, value in section.items():
+            package.setdefault(key, {})[equipment_id] = value
+    return package
@@ -0,0 +1,110 @@
+"""
+Sparse fieldsets: ?fields=a,b / ?omit=c,d on read requests.
+
+SparseFieldsetsMixin (serializers) drops unrequested fields from the top-level serializer.
+SparseFieldsetsViewMixin (generic views) trims the queryset to match: skips prefetches /
+select_related that only feed dropped fields and defers their columns.
+"""
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def _split(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+def parse_sparse_fieldsets(request):
+    """Return (fields or None, omit) requested for a read request."""
+    if request is None or request.method not in SAFE_METHODS:
+        return None, set()
+    fields = request.query_params.get('fields')
+    return (_split(fields) or None) if fields is not None else None, _split(request.query_params.get('omit'))
+
+
+class SparseFieldsetsMixin:
+    """
+    Applies ?fields= / ?omit= to the root serializer (or the child of a root list serializer).
+    Nested serializers keep all their fields; unknown names are ignored.
+    """
+
+    def _is_sparse_root(self):
+        from rest_framework.serializers import ListSerializer
+        parent = getattr(self, 'parent', None)
+        if parent is None:
+            return True
+        return isinstance(parent, ListSerializer) and parent.child is self and parent.parent is None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self._is_sparse_root():
+            return fields
+        only, omit = parse_sparse_fieldsets(self.context.get('request'))
+        if only is not None:
+            fields = {name: field for name, field in fields.items() if name in only}
+        for name in omit:
+            fields.pop(name, None)
+        return fields
+
+
+class SparseFieldsetsViewMixin:
+    """
+    Queryset trimming for views whose serializer uses SparseFieldsetsMixin.
+
+    sparse_prefetch_map: serializer field -> prefetch_related lookups it needs
+    sparse_select_map:   serializer field -> select_related lookups it needs
+    sparse_requires:     serializer field -> model columns it reads (kept even if not listed)
+    Concrete model columns of dropped fields are deferred (a column read by a kept
+    method field but missing from sparse_requires still works, at one query per row).
+    """
+    sparse_prefetch_map = {}
+    sparse_select_map = {}
+    sparse_requires = {}
+
+    def get_sparse_fieldsets(self):
+        if not hasattr(self, '_sparse_fieldsets'):
+            self._sparse_fieldsets = parse_sparse_fieldsets(getattr(self, 'request', None))
+        return self._sparse_fieldsets
+
+    def sparse_field_wanted(self, name):
+        only, omit = self.get_sparse_fieldsets()
+        return (only is None or name in only) and name not in omit
+
+    def apply_sparse_fieldsets(self, queryset):
+        only, omit = self.get_sparse_fieldsets()
+        if only is None and not omit:
+            return queryset
+
+        prefetches = []
+        for field_name, lookups in self.sparse_prefetch_map.items():
+            if self.sparse_field_wanted(field_name):
+                prefetches.extend(lookups)
+        queryset = queryset.prefetch_related(None)
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+
+        selects = []
+        for field_name, lookups in self.sparse_select_map.items():
+            if self.sparse_field_wanted(field_name):
+                selects.extend(lookups)
+        queryset = queryset.select_related(None)
+        if selects:
+            queryset = queryset.select_related(*selects)
+
+        model = queryset.model
+        concrete = {f.name for f in model._meta.concrete_fields if not f.primary_key}
+        required = set()
+        for field_name, columns in self.sparse_requires.items():
+            if self.sparse_field_wanted(field_name):
+                required.update(columns)
+        # With ?fields= every unrequested column is a candidate; with ?omit= only the omitted ones
+        candidates = concrete if only is not None else omit
+        deferred = [
+            name for name in candidates
+            if name in concrete and name not in required and not self.sparse_field_wanted(name)
+        ]
+        # Columns of selected relations can't be deferred
+        selected_roots = {lookup.split('__')[0] for lookup in selects}
+        deferred = [name for name in deferred if name not in selected_roots]
+        if deferred:
+            queryset = queryset.defer(*deferred)
+        return queryset
@@ -0,0 +1,158 @@
+"""
+Minimal RFC 6902 (JSON Patch) / RFC 6901 (JSON Pointer) support.
+
+apply_patch(document, operations) applies add / remove / replace / move / copy / test
+to a copy of the document and returns (new_document, touched_paths). Only the
+containers along each operation path are copied, untouched subtrees are shared.
+Errors raise JSONPatchError (a ValueError) with the index of the failing operation.
+"""
+import copy
+
+OPERATIONS = ('add', 'remove', 'replace', 'move', 'copy', 'test')
+
+
+class JSONPatchError(ValueError):
+    pass
+
+
+def parse_pointer(pointer):
+    """'/a/b~1c/0' -> ['a', 'b/c', '0']."""
+    if not isinstance(pointer, str):
+        raise JSONPatchError(f'Invalid JSON pointer: {pointer!r}')
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise JSONPatchError(f'JSON pointer must start with "/": {pointer!r}')
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def _index(container, token, allow_end=False):
+    if token == '-' and allow_end:
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token.startswith('0')):
+        raise JSONPatchError(f'Invalid array index: {token!r}')
+    index = int(token)
+    limit = len(container) if allow_end else len(container) - 1
+    if index > limit:
+        raise JSONPatchError(f'Array index out of range: {token}')
+    return index
+
+
+def _get(document, tokens):
+    node = document
+    for token in tokens:
+        if isinstance(node, list):
+            node = node[_index(node, token)]
+        elif isinstance(node, dict):
+            if token not in node:
+                raise JSONPatchError(f'Path not found: /{"/".join(tokens)}')
+            node = node[token]
+        else:
+            raise JSONPatchError(f'Path not found: /{"/".join(tokens)}')
+    return node
+
+
+def _parent(document, tokens):
+    """Copy containers down to the parent of tokens[-1]; returns (new_document, parent)."""
+    root = copy.copy(document)
+    node = root
+    for token in tokens[:-1]:
+        if isinstance(node, list):
+            index = _index(node, token)
+            node[index] = copy.copy(node[index])
+            node = node[index]
+        elif isinstance(node, dict):
+            if token not in node:
+                raise JSONPatchError(f'Path not found: /{"/".join(tokens)}')
+            node[token] = copy.copy(node[token])
+            node = node[token]
+        else:
+            raise JSONPatchError(f'Path not found: /{"/".join(tokens)}')
+    if not isinstance(node, (list, dict)):
+        raise JSONPatchError(f'Path not found: /{"/".join(tokens)}')
+    return root, node
+
+
+def _add(document, tokens, value):
+    if not tokens:
+        return value
+    document, parent = _parent(document, tokens)
+    if isinstance(parent, list):
+        parent.insert(_index(parent, tokens[-1], allow_end=True), value)
+    else:
+        parent[tokens[-1]] = value
+    return document
+
+
+def _remove(document, tokens):
+    if not tokens:
+        raise JSONPatchError('Cannot remove the document root')
+    document, parent = _parent(document, tokens)
+    if isinstance(parent, list):
+        del parent[_index(parent, tokens[-1])]
+    else:
+        if tokens[-1] not in parent:
+            raise JSONPatchError(f'Path not found: /{"/".join(tokens)}')
+        del parent[tokens[-1]]
+    return document
+
+
+def _json_equal(left, right):
+    """
+    'test' equality (RFC 6902 4.6): same JSON type and value. Numbers compare by value
+    (1 == 1.0), but booleans are not numbers here (true != 1).
+    """
+    if isinstance(left, bool) or isinstance(right, bool):
+        return type(left) is type(right) and left == right
+    if isinstance(left, (int, float)) or isinstance(right, (int, float)):
+        return isinstance(left, (int, float)) and isinstance(right, (int, float)) and left == right
+    if isinstance(left, list):
+        return isinstance(right, list) and len(left) == len(right) and all(
+            _json_equal(a, b) for a, b in zip(left, right)
+        )
+    if isinstance(left, dict):
+        return isinstance(right, dict) and left.keys() == right.keys() and all(
+            _json_equal(value, right[key]) for key, value in left.items()
+        )
+    return type(left) is type(right) and left == right
+
+
+def apply_patch(document, operations):
+    """Apply RFC 6902 operations; returns (new_document, touched pointers as token lists)."""
+    if not isinstance(operations, list):
+        raise JSONPatchError('Patch must be a list of operations')
+    touched = []
+    for number, operation in enumerate(operations):
+        try:
+            if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+                raise JSONPatchError(f'Unknown operation: {operation!r}')
+            op = operation['op']
+            tokens = parse_pointer(operation.get('path'))
+            if op in ('add', 'replace', 'test') and 'value' not in operation:
+                raise JSONPatchError(f'"{op}" requires a value')
+
+            if op == 'add':
+                document = _add(document, tokens, copy.deepcopy(operation['value']))
+            elif op == 'remove':
+                document = _remove(document, tokens)
+            elif op == 'replace':
+                _get(document, tokens)
+                document = _add(_remove(document, tokens), tokens, copy.deepcopy(operation['value'])) \
+                    if tokens else copy.deepcopy(operation['value'])
+            elif op in ('move', 'copy'):
+                source = parse_pointer(operation.get('from'))
+                value = _get(document, source)
+                if op == 'move':
+                    if tokens[:len(source)] == source and tokens != source:
+                        raise JSONPatchError('Cannot move a value into one of its children')
+                    document = _remove(document, source)
+                    touched.append(source)
+                document = _add(document, tokens, copy.deepcopy(value) if op == 'copy' else value)
+            else:
+                if not _json_equal(_get(document, tokens), operation['value']):
+                    raise JSONPatchError(f'Test failed at {operation.get("path")}')
+                continue
+        except JSONPatchError as e:
+            raise JSONPatchError(f'Operation {number}: {e}')
+        touched.append(tokens)
+    return document, touched
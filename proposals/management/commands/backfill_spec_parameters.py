@@ -0,0 +1,60 @@
+"""
+Django management command: fill the parameter dictionary and typed values of existing
+EquipmentSpecification / EquipmentDetails rows (parameter, value_numeric, value_unit).
+
+New and updated rows are typed on save; this is for rows written before migration 0053
+and for re-parsing after SpecParameterService.UNIT_ALIASES changes (--all).
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from proposals.models import EquipmentDetails, EquipmentSpecification
+from proposals.services import SpecParameterService
+
+
+class Command(BaseCommand):
+    help = 'Backfill SpecParameter links and parsed numeric values of specifications and details.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Rows per batch (default 2000).',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Re-parse all rows, not only rows without a parameter.',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options['chunk_size'])
+        for model, name_field, value_field in (
+            (EquipmentSpecification, 'spec_parameter_name', 'spec_parameter_value'),
+            (EquipmentDetails, 'detail_parameter_name', 'detail_parameter_value'),
+        ):
+            pk_name = model._meta.pk.name
+            qs = model.objects.order_by(pk_name).only(pk_name, name_field, value_field)
+            if not options['all']:
+                qs = qs.filter(parameter__isnull=True)
+            updated = 0
+            numeric = 0
+            last_pk = 0
+            while True:
+                # Keyset batches: rows updated in a batch drop out of the parameter__isnull filter
+                batch = list(qs.filter(**{f'{pk_name}__gt': last_pk})[:chunk_size])
+                if not batch:
+                    break
+                last_pk = getattr(batch[-1], pk_name)
+                SpecParameterService.prepare(batch, name_field, value_field)
+                with transaction.atomic():
+                    model.objects.bulk_update(batch, ['parameter', 'value_numeric', 'value_unit'])
+                updated += len(batch)
+                numeric += sum(1 for obj in batch if obj.value_numeric is not None)
+                self.stdout.write(f'{model.__name__}: {updated} rows...')
+            self.stdout.write(
+                self.style.SUCCESS(f'{model.__name__}: updated={updated}, with numeric value={numeric}')
+            )
+
+        units = SpecParameterService.refresh_units()
+        self.stdout.write(self.style.SUCCESS(f'Done. Units set for {units} parameters.'))
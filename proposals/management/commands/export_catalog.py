@@ -0,0 +1,42 @@
+"""
+Django management command: export the equipment catalog to CSV / XLSX.
+
+Streams equipment with iterator(chunk_size) (see CatalogExportService), so the catalog
+is never loaded into memory at once. The file can be edited and fed to import_catalog.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from proposals.services import CatalogExportService
+
+
+class Command(BaseCommand):
+    help = 'Export Equipment (with categories, manufacturers, types, prices, logistics, specs) to CSV/XLSX.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Output file (.csv or .xlsx).')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'xlsx'],
+            default=None,
+            help='Output format (default: from file extension, csv otherwise).',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Equipment rows fetched per DB round trip (default 1000).',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('xlsx' if path.lower().endswith('.xlsx') else 'csv')
+        try:
+            if fmt == 'xlsx':
+                with open(path, 'wb') as f:
+                    CatalogExportService.write_xlsx(f, chunk_size=options['chunk_size'])
+            else:
+                with open(path, 'w', encoding='utf-8', newline='') as f:
+                    for chunk in CatalogExportService.iter_csv(chunk_size=options['chunk_size']):
+                        f.write(chunk)
+        except (OSError, ImportError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Catalog exported to {path}'))
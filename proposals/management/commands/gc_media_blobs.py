@@ -0,0 +1,95 @@
+"""
+Django management command: garbage-collect the content-addressed media store (MediaBlob).
+
+Reconciles MediaBlob.ref_count with EquipmentPhoto / EquipmentDocument rows and deletes
+blobs nobody references. With --adopt-legacy, moves pre-existing photo/document files
+(uuid names) into the store first, so duplicates collapse into one blob.
+"""
+import logging
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from proposals.models import EquipmentDocument, EquipmentPhoto
+from proposals.services import MediaStoreService
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Reconcile MediaBlob reference counts and delete unreferenced media blobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be deleted.',
+        )
+        parser.add_argument(
+            '--grace-minutes',
+            type=int,
+            default=60,
+            help='Keep unreferenced blobs younger than this (default 60).',
+        )
+        parser.add_argument(
+            '--adopt-legacy',
+            action='store_true',
+            help='Move photo/document files without content_hash into the blob store.',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        if options['adopt_legacy']:
+            if dry_run:
+                self.stdout.write(self.style.WARNING('DRY RUN: --adopt-legacy skipped.'))
+            else:
+                adopted, freed = self._adopt_legacy()
+                self.stdout.write(
+                    self.style.SUCCESS(f'Adopted {adopted} files, removed {freed / 1024 / 1024:.1f} MB of legacy files.')
+                )
+
+        fixed = MediaStoreService.reconcile_ref_counts()
+        self.stdout.write(f'Reference counts fixed: {fixed}')
+
+        deleted, freed = MediaStoreService.gc(grace_minutes=options['grace_minutes'], dry_run=dry_run)
+        verb = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(
+            self.style.SUCCESS(f'{verb} {deleted} unreferenced blobs ({freed / 1024 / 1024:.1f} MB).')
+        )
+
+    def _adopt_legacy(self):
+        adopted = 0
+        freed = 0
+        sources = (
+            (EquipmentPhoto, 'image'),
+            (EquipmentDocument, 'file'),
+        )
+        for model, field_name in sources:
+            qs = model.objects.filter(content_hash__isnull=True).exclude(**{field_name: ''}).exclude(
+                **{f'{field_name}__isnull': True}
+            )
+            for obj in qs.iterator(chunk_size=200):
+                field_file = getattr(obj, field_name)
+                old_name = field_file.name
+                try:
+                    with field_file.storage.open(old_name, 'rb') as fh:
+                        fh.name = os.path.basename(old_name)
+                        blob = MediaStoreService.store_upload(fh)
+                except Exception as e:
+                    logger.warning('Adopt failed for %s %s (%s): %s', model.__name__, obj.pk, old_name, e)
+                    continue
+                with transaction.atomic():
+                    model.objects.filter(pk=obj.pk).update(**{field_name: blob.file.name, 'content_hash': blob.sha256})
+                    MediaStoreService.acquire(blob.sha256)
+                adopted += 1
+                still_used = (
+                    EquipmentPhoto.objects.filter(image=old_name).exists()
+                    or EquipmentDocument.objects.filter(file=old_name).exists()
+                )
+                if not still_used and old_name != blob.file.name:
+                    try:
+                        freed += field_file.storage.size(old_name)
+                        field_file.storage.delete(old_name)
+                    except Exception as e:
+                        logger.warning('Could not delete legacy file %s: %s', old_name, e)
+        return adopted, freed
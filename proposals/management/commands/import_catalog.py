@@ -0,0 +1,65 @@
+"""
+Django management command: import the equipment catalog from CSV / XLSX.
+
+Column format: see CatalogImportService (the output of export_catalog can be edited and
+imported back). Rows are written in batches; invalid rows are reported and skipped.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from proposals.services import CatalogImportService
+
+
+class Command(BaseCommand):
+    help = 'Import Equipment (with categories, manufacturers, types, prices, logistics, specs) from CSV/XLSX.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file.')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Rows per transaction (default 500).',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Validate and write inside transactions that are rolled back.',
+        )
+        parser.add_argument(
+            '--no-create-refs',
+            action='store_true',
+            help='Treat unknown categories / manufacturers / types as row errors instead of creating them.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('DRY RUN: changes are rolled back.'))
+        service = CatalogImportService(
+            batch_size=options['batch_size'],
+            create_missing_refs=not options['no_create_refs'],
+            dry_run=options['dry_run'],
+        )
+        try:
+            with open(path, 'rb') as f:
+                summary = service.run(
+                    CatalogImportService.iter_rows(f, path),
+                    progress=lambda data: self.stdout.write(
+                        f"processed={data['processed']} created={data['created']} "
+                        f"updated={data['updated']} failed={data['failed']}"
+                    ),
+                )
+        except (OSError, ImportError) as e:
+            raise CommandError(str(e))
+
+        for error in summary['errors']:
+            self.stdout.write(self.style.ERROR(f"row {error['row']}: {error['error']}"))
+        if summary['failed'] > len(summary['errors']):
+            self.stdout.write(self.style.WARNING(
+                f"... and {summary['failed'] - len(summary['errors'])} more failed rows"
+            ))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Done. Processed={summary['processed']} Created={summary['created']} "
+                f"Updated={summary['updated']} Failed={summary['failed']}"
+            )
+        )
@@ -3,11 +3,24 @@ Django management command: migrate equipment_imagelinks (JSONB) to local Equipme
 
 Parses equipment.equipment_imagelinks, downloads images from Google Drive / Yandex Disk,
 optimizes and saves to EquipmentPhoto. Logs errors for inactive or invalid links.
+
+Pipeline: downloads run in a thread pool (with a per-host concurrency cap so Google /
+Yandex do not throttle us), Pillow optimization runs in a process pool, DB writes stay
+in the main thread. Finished links are appended to a checkpoint file so reruns skip them.
 """
+import hashlib
 import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from proposals.models import Equipment
-from proposals.services import CloudImageImportService
+from proposals.services import CloudImageImportService, MediaStoreService
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +43,37 @@ def _iter_imagelinks(equipment):
             yield (link, '', i)
 
 
+def _checkpoint_key(equipment_id, url):
+    return f"{equipment_id}:{hashlib.sha1(url.encode('utf-8')).hexdigest()}"
+
+
+class _HostLimiter:
+    """Per-host semaphores: at most `limit` concurrent downloads per netloc."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def for_url(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.limit)
+            return self._semaphores[host]
+
+
+def _download(url, limiter):
+    """Thread-pool stage: resolve cloud link and download bytes. Returns bytes or None."""
+    # Yandex resolution hits the API of the link's host, so it is capped too
+    with limiter.for_url(url):
+        download_url = CloudImageImportService.get_download_url(url)
+    if not download_url:
+        return None
+    with limiter.for_url(download_url):
+        return CloudImageImportService.download_bytes(download_url)
+
+
 class Command(BaseCommand):
     help = (
         'Migrate equipment_imagelinks (JSONB) to local EquipmentPhoto: '
@@ -48,6 +92,40 @@ class Command(BaseCommand):
             default=None,
             help='Process only this equipment_id (optional).',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Download threads (default 8).',
+        )
+        parser.add_argument(
+            '--per-host',
+            type=int,
+            default=4,
+            help='Max concurrent downloads per host (default 4).',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=None,
+            help='Processes for image optimization (default: CPU count).',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Equipment rows fetched per DB round trip (default 200).',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(str(settings.MEDIA_ROOT), '.migrate_equipment_photos.checkpoint'),
+            help='File with finished links; reruns skip them.',
+        )
+        parser.add_argument(
+            '--reset-checkpoint',
+            action='store_true',
+            help='Ignore and truncate the checkpoint file before starting.',
+        )
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
@@ -55,18 +133,51 @@ class Command(BaseCommand):
         if dry_run:
             self.stdout.write(self.style.WARNING('DRY RUN: no files will be created.'))
 
-        qs = Equipment.objects.all().order_by('equipment_id')
+        qs = Equipment.objects.all().order_by('equipment_id').only('equipment_id', 'equipment_imagelinks')
         if equipment_id is not None:
             qs = qs.filter(equipment_id=equipment_id)
             if not qs.exists():
                 self.stdout.write(self.style.ERROR(f'Equipment id={equipment_id} not found.'))
                 return
 
-        total_ok = 0
-        total_skip = 0
-        total_fail = 0
+        checkpoint_path = options['checkpoint']
+        done = set()
+        if options['reset_checkpoint'] and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        elif os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                done = {line.strip() for line in f if line.strip()}
+            self.stdout.write(f'Checkpoint: {len(done)} links already migrated, skipping them.')
 
-        for equipment in qs:
+        self.total_ok = 0
+        self.total_skip = 0
+        self.total_fail = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+        jobs = self._iter_jobs(qs.iterator(chunk_size=options['chunk_size']), done)
+
+        if dry_run:
+            for equipment_pk, url, name, idx in jobs:
+                self.stdout.write(f'Would import: equipment_id={equipment_pk} idx={idx} url={url[:60]}...')
+                self.total_ok += 1
+        else:
+            os.makedirs(os.path.dirname(checkpoint_path) or '.', exist_ok=True)
+            with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+                self._run_pipeline(jobs, checkpoint, options)
+
+        self._report(final=True)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Done. Created={self.total_ok} Skipped={self.total_skip} Failed={self.total_fail}'
+            )
+        )
+
+    def _iter_jobs(self, equipment_iter, done):
+        """Yield (equipment_id, url, name, idx) for cloud links not in checkpoint."""
+        for equipment in equipment_iter:
             for url, name, idx in _iter_imagelinks(equipment):
                 if not CloudImageImportService.detect_source(url):
                     self.stdout.write(
@@ -74,36 +185,107 @@ class Command(BaseCommand):
                             f'Equipment {equipment.equipment_id} link[{idx}]: not Google/Yandex, skip: {url[:60]}...'
                         )
                     )
-                    total_skip += 1
+                    self.total_skip += 1
                     continue
-                if dry_run:
-                    self.stdout.write(
-                        f'Would import: equipment_id={equipment.equipment_id} idx={idx} url={url[:60]}...'
-                    )
-                    total_ok += 1
+                if _checkpoint_key(equipment.equipment_id, url) in done:
+                    self.total_skip += 1
                     continue
-                photo = CloudImageImportService.import_and_save(equipment, url, name=name, sort_order=idx)
-                if photo:
-                    total_ok += 1
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'Equipment {equipment.equipment_id} link[{idx}]: saved -> {photo.image.name}'
-                        )
-                    )
-                else:
-                    total_fail += 1
-                    logger.warning(
-                        'Import failed: equipment_id=%s idx=%s url=%s',
-                        equipment.equipment_id, idx, url[:80],
-                    )
-                    self.stdout.write(
-                        self.style.ERROR(
-                            f'Equipment {equipment.equipment_id} link[{idx}]: failed (link inactive or download error): {url[:60]}...'
-                        )
-                    )
+                yield (equipment.equipment_id, url, name, idx)
+
+    def _run_pipeline(self, jobs, checkpoint, options):
+        workers = max(1, options['workers'])
+        limiter = _HostLimiter(max(1, options['per_host']))
+        # Bound in-flight work so raw image bytes don't pile up in memory
+        max_in_flight = workers * 4
+        pending = {}
+
+        # Fork the optimizer processes before any download thread exists: a child forked while
+        # a thread holds a lock (logging, SSL, DB driver) can deadlock. A 'fork' pool starts all
+        # workers on the first submit; spawn / forkserver workers would lack Django setup.
+        with ProcessPoolExecutor(
+            max_workers=options['processes'], mp_context=multiprocessing.get_context('fork')
+        ) as optimizers:
+            optimizers.submit(os.getpid).result()
+            with ThreadPoolExecutor(max_workers=workers) as downloads:
+                jobs = iter(jobs)
+                exhausted = False
+                while True:
+                    while not exhausted and len(pending) < max_in_flight:
+                        job = next(jobs, None)
+                        if job is None:
+                            exhausted = True
+                            break
+                        pending[downloads.submit(_download, job[1], limiter)] = ('download', job)
+                    if not pending:
+                        break
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        stage, job = pending.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            logger.warning('Migrate photo %s failed: %s', stage, e)
+                            result = None
+                        if not result:
+                            self._fail(job)
+                        elif stage == 'download':
+                            self.bytes_in += len(result)
+                            source_sha256 = hashlib.sha256(result).hexdigest()
+                            blob = MediaStoreService.find_by_source(source_sha256)
+                            if blob is not None:
+                                # Same original already optimized and stored: reuse it, skip re-encoding
+                                self._save(job + (source_sha256,), None, checkpoint, blob=blob)
+                                continue
+                            future = optimizers.submit(CloudImageImportService.optimize_image, result)
+                            pending[future] = ('optimize', job + (source_sha256,))
+                        else:
+                            self._save(job, result, checkpoint)
+                    self._report()
+
+    def _save(self, job, jpeg_bytes, checkpoint, blob=None):
+        equipment_pk, url, name, idx, source_sha256 = job
+        if blob is not None:
+            try:
+                photo = MediaStoreService.attach_photo(equipment_pk, blob, name=name, sort_order=idx)
+            except Exception as e:
+                logger.warning('Attach blob failed for equipment %s: %s', equipment_pk, e)
+                photo = None
+        else:
+            photo = CloudImageImportService.save_photo(
+                equipment_pk, jpeg_bytes, name=name, sort_order=idx, source_sha256=source_sha256
+            )
+        if not photo:
+            self._fail(job)
+            return
+        self.total_ok += 1
+        self.bytes_out += len(jpeg_bytes) if jpeg_bytes else 0
+        checkpoint.write(_checkpoint_key(equipment_pk, url) + '\n')
+        checkpoint.flush()
+        self.stdout.write(
+            self.style.SUCCESS(f'Equipment {equipment_pk} link[{idx}]: saved -> {photo.image.name}')
+        )
 
+    def _fail(self, job):
+        equipment_pk, url, _name, idx = job[:4]
+        self.total_fail += 1
+        logger.warning('Import failed: equipment_id=%s idx=%s url=%s', equipment_pk, idx, url[:80])
         self.stdout.write(
-            self.style.SUCCESS(
-                f'Done. Created={total_ok} Skipped={total_skip} Failed={total_fail}'
+            self.style.ERROR(
+                f'Equipment {equipment_pk} link[{idx}]: failed (link inactive or download error): {url[:60]}...'
             )
         )
+
+    def _report(self, final=False):
+        """Print throughput every 10 seconds (and once at the end)."""
+        now = time.monotonic()
+        if not final and now - self.last_report < 10:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 0.001)
+        processed = self.total_ok + self.total_fail
+        self.stdout.write(
+            f'[{elapsed:.0f}s] processed={processed} ok={self.total_ok} failed={self.total_fail} '
+            f'skipped={self.total_skip} | {processed / elapsed:.2f} links/s, '
+            f'in {self.bytes_in / elapsed / 1024 / 1024:.2f} MB/s, '
+            f'saved {self.bytes_out / 1024 / 1024:.1f} MB'
+        )
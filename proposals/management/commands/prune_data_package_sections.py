@@ -0,0 +1,25 @@
+"""
+Delete EquipmentDataSection rows no longer referenced by any stored proposal data package.
+"""
+from django.core.management.base import BaseCommand
+from proposals.services import ProposalDataPackageService
+
+
+class Command(BaseCommand):
+    help = 'Delete shared data package sections that no proposal references any more.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-minutes',
+            type=int,
+            default=None,
+            help='Keep sections written within this many minutes '
+                 '(default DATA_PACKAGE_SECTION_PRUNE_GRACE_SECONDS).',
+        )
+
+    def handle(self, *args, **options):
+        grace_minutes = options['grace_minutes']
+        deleted = ProposalDataPackageService.prune_sections(
+            grace_seconds=grace_minutes * 60 if grace_minutes is not None else None
+        )
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unused sections.'))
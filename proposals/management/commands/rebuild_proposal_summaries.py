@@ -0,0 +1,28 @@
+"""
+Django management command: rebuild ProposalSummary rows from the proposals.
+
+Summaries are kept current after each commit (ProposalSummaryService.mark_dirty);
+this recomputes all of them, e.g. after raw SQL changes or a restored dump.
+last_exported_at is kept.
+"""
+from django.core.management.base import BaseCommand
+from proposals.services import ProposalSummaryService
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized proposal summaries (proposals grid / dashboard).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Proposals refreshed per query (default 500).',
+        )
+
+    def handle(self, *args, **options):
+        total = ProposalSummaryService.rebuild_all(
+            batch_size=max(1, options['batch_size']),
+            progress=lambda done: self.stdout.write(f'Refreshed {done}'),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Done. Summaries={total}'))
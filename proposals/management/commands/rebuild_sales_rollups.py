@@ -0,0 +1,26 @@
+"""
+Django management command: recompute daily sales rollups (SalesDailyRollup).
+
+By default processes the queued days, like the Celery Beat task; --all queues every
+day with proposals or rollup rows first (e.g. after raw SQL changes or a restored dump).
+"""
+from django.core.management.base import BaseCommand
+from proposals.services import SalesRollupService
+
+
+class Command(BaseCommand):
+    help = 'Recompute daily sales rollups (queued days, or all days with --all).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Rebuild every day, not only the queued ones.',
+        )
+
+    def handle(self, *args, **options):
+        if options['all']:
+            days = SalesRollupService.rebuild_all()
+        else:
+            days = SalesRollupService.refresh()
+        self.stdout.write(self.style.SUCCESS(f'Done. Days={days}'))
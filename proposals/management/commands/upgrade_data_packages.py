@@ -0,0 +1,67 @@
+"""
+Django management command: upgrade stored proposal data packages to the current schema.
+
+Packages are upgraded lazily when read; this runs the same upgrade for all outdated
+packages (ProposalDataPackage.schema_version < ProposalDataPackageService.SCHEMA_VERSION)
+in batches, one transaction per package.
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from proposals.models import CommercialProposal, ProposalDataPackage
+from proposals.services import ProposalDataPackageService
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Upgrade stored proposal data packages to the current schema version.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Packages loaded per round trip (default 200).',
+        )
+        parser.add_argument(
+            '--proposal-id',
+            type=int,
+            default=None,
+            help='Upgrade only this proposal (optional).',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        target = ProposalDataPackageService.SCHEMA_VERSION
+        outdated = ProposalDataPackage.objects.filter(schema_version__lt=target)
+        if options['proposal_id'] is not None:
+            outdated = outdated.filter(proposal_id=options['proposal_id'])
+
+        total = outdated.count()
+        self.stdout.write(f'{total} packages below schema {target}.')
+        upgraded = failed = 0
+        last_id = 0
+        while True:
+            # Keyset pagination: upgraded rows leave the filter, failed ones are skipped by id
+            ids = list(
+                outdated.filter(proposal_id__gt=last_id).order_by('proposal_id')
+                .values_list('proposal_id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            proposals = CommercialProposal.objects.in_bulk(ids)
+            for proposal_id in ids:
+                try:
+                    with transaction.atomic():
+                        ProposalDataPackageService.load(proposal_id, proposal=proposals.get(proposal_id))
+                    upgraded += 1
+                except Exception as e:
+                    failed += 1
+                    logger.warning('Data package upgrade failed for proposal %s: %s', proposal_id, e)
+                    self.stdout.write(self.style.ERROR(f'Proposal {proposal_id}: {e}'))
+            self.stdout.write(f'Processed {upgraded + failed}/{total}')
+
+        self.stdout.write(self.style.SUCCESS(f'Done. Upgraded={upgraded} Failed={failed}'))
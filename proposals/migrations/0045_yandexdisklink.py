@@ -0,0 +1,33 @@
+# Generated migration: persisted Yandex Disk direct links (refreshed by Celery beat)
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0044_crmdeal_stage_title'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='YandexDiskLink',
+            fields=[
+                ('link_id', models.AutoField(primary_key=True, serialize=False, verbose_name='ID ссылки')),
+                ('url_hash', models.CharField(max_length=64, unique=True, verbose_name='SHA-256 публичной ссылки')),
+                ('public_url', models.TextField(verbose_name='Публичная ссылка')),
+                ('direct_url', models.TextField(blank=True, null=True, verbose_name='Прямая ссылка')),
+                ('expires_at', models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Прямая ссылка действительна до')),
+                ('resolved_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата получения')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='Последняя ошибка')),
+                ('fail_count', models.PositiveIntegerField(default=0, verbose_name='Количество ошибок подряд')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Прямая ссылка Яндекс.Диска',
+                'verbose_name_plural': 'Прямые ссылки Яндекс.Диска',
+                'db_table': 'yandex_disk_link',
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated migration: per-photo status of asynchronous equipment image import
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0045_yandexdisklink'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EquipmentPhotoImport',
+            fields=[
+                ('import_id', models.AutoField(primary_key=True, serialize=False, verbose_name='ID импорта')),
+                ('source_url', models.TextField(verbose_name='Исходная ссылка')),
+                ('name', models.CharField(blank=True, max_length=255, verbose_name='Подпись')),
+                ('sort_order', models.PositiveIntegerField(default=0, verbose_name='Порядок')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('processing', 'Загружается'), ('done', 'Загружено'), ('failed', 'Ошибка')], default='pending', max_length=20, verbose_name='Статус')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('equipment', models.ForeignKey(db_column='equipment_id', on_delete=django.db.models.deletion.CASCADE, related_name='photo_imports', to='proposals.equipment', verbose_name='Оборудование')),
+                ('photo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='imports', to='proposals.equipmentphoto', verbose_name='Фото')),
+            ],
+            options={
+                'verbose_name': 'Импорт фото оборудования',
+                'verbose_name_plural': 'Импорт фото оборудования',
+                'db_table': 'equipment_photo_import',
+                'ordering': ['sort_order', 'pk'],
+                'indexes': [models.Index(fields=['equipment', 'status'], name='eq_photo_import_status_idx')],
+            },
+        ),
+    ]
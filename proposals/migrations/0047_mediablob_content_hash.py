@@ -0,0 +1,42 @@
+# Generated migration: content-addressed media store (MediaBlob) and content_hash on photos/documents
+
+from django.db import migrations, models
+import proposals.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0046_equipmentphotoimport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('blob_id', models.AutoField(primary_key=True, serialize=False, verbose_name='ID файла')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='SHA-256 содержимого')),
+                ('source_sha256', models.CharField(blank=True, db_index=True, max_length=64, null=True, verbose_name='SHA-256 исходника (для оптимизированных фото)')),
+                ('file', models.FileField(max_length=255, upload_to=proposals.models.media_blob_upload_to, verbose_name='Файл')),
+                ('size', models.PositiveBigIntegerField(default=0, verbose_name='Размер (байт)')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Медиафайл',
+                'verbose_name_plural': 'Медиафайлы',
+                'db_table': 'media_blob',
+            },
+        ),
+        migrations.AddField(
+            model_name='equipmentphoto',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True, verbose_name='SHA-256 файла (MediaBlob)'),
+        ),
+        migrations.AddField(
+            model_name='equipmentdocument',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True, verbose_name='SHA-256 файла (MediaBlob)'),
+        ),
+    ]
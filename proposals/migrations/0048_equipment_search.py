@@ -0,0 +1,61 @@
+# Generated migration: full-text (tsvector) and trigram search for Equipment
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_search_vector(apps, schema_editor):
+    Equipment = apps.get_model('proposals', 'Equipment')
+    EquipmentSpecification = apps.get_model('proposals', 'EquipmentSpecification')
+    config = getattr(settings, 'EQUIPMENT_SEARCH_CONFIG', 'russian')
+    spec_values = (
+        EquipmentSpecification.objects.filter(equipment_id=OuterRef('pk'))
+        .values('equipment_id')
+        .annotate(text=StringAgg('spec_parameter_value', delimiter=' '))
+        .values('text')
+    )
+    ids = list(Equipment.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(ids), 1000):
+        Equipment.objects.filter(pk__in=ids[start:start + 1000]).update(
+            search_vector=(
+                SearchVector('equipment_name', weight='A', config=config)
+                + SearchVector('equipment_articule', weight='A', config='simple')
+                + SearchVector('equipment_short_description', weight='B', config=config)
+                + SearchVector(Subquery(spec_values), weight='C', config=config)
+            )
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0047_mediablob_content_hash'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='equipment',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.AddIndex(
+            model_name='equipment',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='equipment_search_vector_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='equipment',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['equipment_name'], name='equipment_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='equipment',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['equipment_articule'], name='equipment_articule_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+    ]
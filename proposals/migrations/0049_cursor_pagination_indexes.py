@@ -0,0 +1,25 @@
+# Generated migration: indexes matching list orderings for keyset (cursor) pagination
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0048_equipment_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='equipment',
+            index=models.Index(fields=['-created_at', '-equipment_id'], name='equipment_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentlog',
+            index=models.Index(fields=['-payment_date', '-created_at'], name='payment_log_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commercialproposal',
+            index=models.Index(fields=['-proposal_date', '-created_at'], name='commercial_proposal_date_idx'),
+        ),
+    ]
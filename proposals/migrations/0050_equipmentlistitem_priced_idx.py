@@ -0,0 +1,17 @@
+# Generated migration: partial index for latest priced EquipmentListItem per equipment
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0049_cursor_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='equipmentlistitem',
+            index=models.Index(condition=models.Q(('price_per_unit__isnull', False)), fields=['equipment', '-created_at'], name='eq_list_item_priced_idx'),
+        ),
+    ]
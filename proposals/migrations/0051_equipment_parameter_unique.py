@@ -0,0 +1,48 @@
+# Generated migration: unique (equipment, parameter name) for details / specifications / tech processes
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def dedupe_parameters(apps, schema_editor):
+    """Keep the newest row per (equipment, name) so the unique constraints can be created."""
+    for model_name, key_field in (
+        ('EquipmentDetails', 'detail_parameter_name'),
+        ('EquipmentSpecification', 'spec_parameter_name'),
+        ('EquipmentTechProcess', 'tech_name'),
+    ):
+        model = apps.get_model('proposals', model_name)
+        pk_name = model._meta.pk.name
+        duplicates = (
+            model.objects.filter(equipment__isnull=False)
+            .values('equipment_id', key_field)
+            .annotate(rows=Count(pk_name), keep=Max(pk_name))
+            .filter(rows__gt=1)
+        )
+        for group in duplicates.iterator():
+            model.objects.filter(
+                equipment_id=group['equipment_id'], **{key_field: group[key_field]}
+            ).exclude(**{pk_name: group['keep']}).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0050_equipmentlistitem_priced_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_parameters, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='equipmentdetails',
+            constraint=models.UniqueConstraint(fields=('equipment', 'detail_parameter_name'), name='equipment_details_param_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='equipmentspecification',
+            constraint=models.UniqueConstraint(fields=('equipment', 'spec_parameter_name'), name='equipment_spec_param_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='equipmenttechprocess',
+            constraint=models.UniqueConstraint(fields=('equipment', 'tech_name'), name='equipment_tech_name_uniq'),
+        ),
+    ]
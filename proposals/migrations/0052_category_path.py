@@ -0,0 +1,52 @@
+# Generated migration: materialized path for the category tree
+
+from django.db import migrations, models
+
+
+def backfill_category_paths(apps, schema_editor):
+    Category = apps.get_model('proposals', 'Category')
+    parents = dict(Category.objects.values_list('category_id', 'parent_category_id'))
+    paths = {}
+
+    def build(category_id, seen=()):
+        if category_id in paths:
+            return paths[category_id]
+        parent_id = parents.get(category_id)
+        if parent_id is None or parent_id in seen or parent_id not in parents:
+            # Root (or a broken cycle, which is cut here)
+            paths[category_id] = f'/{category_id}/'
+        else:
+            paths[category_id] = build(parent_id, seen + (category_id,)) + f'{category_id}/'
+        return paths[category_id]
+
+    updates = []
+    for category in Category.objects.all().only('category_id'):
+        category.path = build(category.category_id)
+        category.depth = category.path.count('/') - 2
+        updates.append(category)
+    Category.objects.bulk_update(updates, ['path', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0051_equipment_parameter_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=512, verbose_name='Путь в дереве'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Уровень вложенности'),
+        ),
+        migrations.RunPython(backfill_category_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='category_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated migration: parameter dictionary and typed values for specifications / details
+# Existing rows are filled by the backfill_spec_parameters management command.
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0052_category_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpecParameter',
+            fields=[
+                ('parameter_id', models.AutoField(primary_key=True, serialize=False, verbose_name='ID параметра')),
+                ('parameter_name', models.CharField(max_length=255, unique=True, verbose_name='Название параметра')),
+                ('unit', models.CharField(blank=True, max_length=32, null=True, verbose_name='Единица измерения')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Параметр характеристик',
+                'verbose_name_plural': 'Параметры характеристик',
+                'db_table': 'spec_parameter',
+            },
+        ),
+        migrations.AddField(
+            model_name='equipmentdetails',
+            name='parameter',
+            field=models.ForeignKey(blank=True, db_column='parameter_id', db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='detail_values', to='proposals.specparameter', verbose_name='Параметр'),
+        ),
+        migrations.AddField(
+            model_name='equipmentdetails',
+            name='value_numeric',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=20, null=True, verbose_name='Числовое значение'),
+        ),
+        migrations.AddField(
+            model_name='equipmentdetails',
+            name='value_unit',
+            field=models.CharField(blank=True, max_length=32, null=True, verbose_name='Единица значения'),
+        ),
+        migrations.AddField(
+            model_name='equipmentspecification',
+            name='parameter',
+            field=models.ForeignKey(blank=True, db_column='parameter_id', db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='spec_values', to='proposals.specparameter', verbose_name='Параметр'),
+        ),
+        migrations.AddField(
+            model_name='equipmentspecification',
+            name='value_numeric',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=20, null=True, verbose_name='Числовое значение'),
+        ),
+        migrations.AddField(
+            model_name='equipmentspecification',
+            name='value_unit',
+            field=models.CharField(blank=True, max_length=32, null=True, verbose_name='Единица значения'),
+        ),
+        migrations.AddIndex(
+            model_name='equipmentdetails',
+            index=models.Index(fields=['parameter', 'value_numeric'], name='eq_details_param_num_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipmentspecification',
+            index=models.Index(fields=['parameter', 'value_numeric'], name='eq_spec_param_num_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated migration: published catalog feed (tombstones + since-cursor index)
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0053_spec_parameter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogTombstone',
+            fields=[
+                ('tombstone_id', models.AutoField(primary_key=True, serialize=False, verbose_name='ID записи')),
+                ('equipment_id', models.IntegerField(db_index=True, verbose_name='ID оборудования')),
+                ('reason', models.CharField(choices=[('unpublished', 'Снято с публикации'), ('deleted', 'Удалено')], max_length=20, verbose_name='Причина')),
+                ('removed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Дата снятия')),
+            ],
+            options={
+                'verbose_name': 'Снятое с каталога оборудование',
+                'verbose_name_plural': 'Снятое с каталога оборудование',
+                'db_table': 'catalog_tombstone',
+                'ordering': ['removed_at', 'tombstone_id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='equipment',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['updated_at', 'equipment_id'], name='equipment_published_feed_idx'),
+        ),
+    ]
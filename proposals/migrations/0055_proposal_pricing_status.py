@@ -0,0 +1,18 @@
+# Generated migration: background (debounced) price recalculation state for proposals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0054_catalog_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commercialproposal',
+            name='pricing_status',
+            field=models.CharField(choices=[('stale', 'Требует пересчета'), ('computing', 'Пересчитывается'), ('fresh', 'Актуально')], default='fresh', max_length=20, verbose_name='Состояние расчета цен'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated migration: revision counter for JSON Patch saves of the proposal constructor
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0055_proposal_pricing_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='proposaltemplate',
+            name='revision',
+            field=models.PositiveIntegerField(default=0, verbose_name='Ревизия'),
+        ),
+    ]
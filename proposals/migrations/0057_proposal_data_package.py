@@ -0,0 +1,104 @@
+# Generated migration: move CommercialProposal.data_package (JSONB) to compressed side tables
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_packages(apps, schema_editor):
+    from proposals import datapackage
+
+    CommercialProposal = apps.get_model('proposals', 'CommercialProposal')
+    ProposalDataPackage = apps.get_model('proposals', 'ProposalDataPackage')
+    EquipmentDataSection = apps.get_model('proposals', 'EquipmentDataSection')
+
+    known = set()
+    rows = CommercialProposal.objects.exclude(data_package__isnull=True).values_list('proposal_id', 'data_package')
+    batch = []
+    for proposal_id, package in rows.iterator(chunk_size=200):
+        if not package:
+            continue
+        skeleton, sections = datapackage.split(package)
+        raw_size = 0
+        new_sections = []
+        for section_hash, section in sections.items():
+            payload, size = datapackage.compress(section)
+            raw_size += size
+            if section_hash not in known:
+                known.add(section_hash)
+                new_sections.append(EquipmentDataSection(section_hash=section_hash, payload=payload))
+        EquipmentDataSection.objects.bulk_create(new_sections, ignore_conflicts=True)
+        payload, size = datapackage.compress(skeleton)
+        batch.append(ProposalDataPackage(
+            proposal_id=proposal_id, payload=payload, raw_size=raw_size + size, stored_size=len(payload)
+        ))
+        if len(batch) >= 200:
+            ProposalDataPackage.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        ProposalDataPackage.objects.bulk_create(batch)
+
+
+def restore_packages(apps, schema_editor):
+    from proposals import datapackage
+
+    CommercialProposal = apps.get_model('proposals', 'CommercialProposal')
+    ProposalDataPackage = apps.get_model('proposals', 'ProposalDataPackage')
+    EquipmentDataSection = apps.get_model('proposals', 'EquipmentDataSection')
+
+    for proposal_id, payload in ProposalDataPackage.objects.values_list('proposal_id', 'payload').iterator(chunk_size=200):
+        skeleton = datapackage.decompress(payload)
+        hashes = set((skeleton.get(datapackage.SECTIONS_REF_KEY) or {}).values())
+        sections = {
+            section_hash: datapackage.decompress(section_payload)
+            for section_hash, section_payload in EquipmentDataSection.objects.filter(
+                section_hash__in=hashes
+            ).values_list('section_hash', 'payload')
+        }
+        CommercialProposal.objects.filter(pk=proposal_id).update(
+            data_package=datapackage.join(skeleton, sections)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0056_proposal_template_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EquipmentDataSection',
+            fields=[
+                ('section_id', models.AutoField(primary_key=True, serialize=False, verbose_name='ID секции')),
+                ('section_hash', models.CharField(max_length=64, unique=True, verbose_name='SHA-256 содержимого')),
+                ('payload', models.BinaryField(verbose_name='Сжатые данные')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Секция пакета данных (оборудование)',
+                'verbose_name_plural': 'Секции пакетов данных (оборудование)',
+                'db_table': 'equipment_data_section',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProposalDataPackage',
+            fields=[
+                ('package_id', models.AutoField(primary_key=True, serialize=False, verbose_name='ID пакета')),
+                ('payload', models.BinaryField(verbose_name='Сжатый скелет пакета')),
+                ('raw_size', models.PositiveIntegerField(default=0, verbose_name='Размер JSON, байт')),
+                ('stored_size', models.PositiveIntegerField(default=0, verbose_name='Размер сжатого скелета, байт')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('proposal', models.OneToOneField(db_column='proposal_id', on_delete=django.db.models.deletion.CASCADE, related_name='data_package_store', to='proposals.commercialproposal', verbose_name='КП')),
+            ],
+            options={
+                'verbose_name': 'Пакет данных КП',
+                'verbose_name_plural': 'Пакеты данных КП',
+                'db_table': 'proposal_data_package',
+            },
+        ),
+        migrations.RunPython(move_packages, restore_packages),
+        migrations.RemoveField(
+            model_name='commercialproposal',
+            name='data_package',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated migration: schema version of stored proposal data packages (upgrade on read)
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0057_proposal_data_package'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='proposaldatapackage',
+            name='schema_version',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0, verbose_name='Версия формата'),
+        ),
+    ]
@@ -0,0 +1,133 @@
+# Generated migration: denormalized ProposalSummary read model (proposals grid / dashboard)
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_summaries(apps, schema_editor):
+    from django.db.models import Count, DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value
+    from django.db.models.functions import Coalesce
+
+    CommercialProposal = apps.get_model('proposals', 'CommercialProposal')
+    EquipmentListItem = apps.get_model('proposals', 'EquipmentListItem')
+    PaymentLog = apps.get_model('proposals', 'PaymentLog')
+    ProposalSummary = apps.get_model('proposals', 'ProposalSummary')
+
+    # Same values as ProposalSummaryService._rows / build at the time of this migration
+    item_count = EquipmentListItem.objects.filter(
+        equipment_list__proposal=OuterRef('pk')
+    ).order_by().values('equipment_list__proposal').annotate(c=Count('pk')).values('c')
+    paid_amount = PaymentLog.objects.filter(
+        commercial_proposals=OuterRef('pk')
+    ).order_by().values('commercial_proposals').annotate(s=Sum('payment_value')).values('s')
+    money = DecimalField(max_digits=25, decimal_places=2)
+    copied = (
+        'proposal_name', 'outcoming_number', 'client_id', 'deal_id', 'user_id',
+        'parent_proposal_id', 'currency_ticket', 'exchange_rate', 'total_price', 'cost_price',
+        'margin_percentage', 'margin_value', 'item_count', 'proposal_status', 'pricing_status',
+        'proposal_version', 'is_active', 'proposal_date', 'valid_until', 'created_at', 'updated_at',
+    )
+    rows = CommercialProposal.objects.order_by('pk').values('proposal_id', *[
+        name for name in copied if name != 'item_count'
+    ]).annotate(
+        client_name_value=F('client__client_name'),
+        client_company_name_value=F('client__client_company_name'),
+        user_name_value=F('user__user_name'),
+        template_is_final=F('template__is_final'),
+        item_count=Coalesce(Subquery(item_count, output_field=IntegerField()), Value(0)),
+        paid_amount=Coalesce(Subquery(paid_amount, output_field=money), Value(Decimal('0')), output_field=money),
+    )
+
+    batch = []
+    for values in rows.iterator(chunk_size=500):
+        total_price = Decimal(str(values['total_price'] or 0))
+        if values['currency_ticket'] != 'KZT':
+            total_price_kzt = total_price * Decimal(str(values['exchange_rate'] or 0))
+        else:
+            total_price_kzt = total_price
+        total_price_kzt = total_price_kzt.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        paid = Decimal(str(values['paid_amount'] or 0))
+        percentage = min(paid / total_price_kzt * 100, Decimal('100')) if total_price_kzt > 0 else Decimal('0')
+        if values['template_is_final'] is None:
+            template_status = 'Not Created'
+        else:
+            template_status = 'Ready' if values['template_is_final'] else 'Draft'
+        client_name = values['client_name_value'] or ''
+        client_company_name = values['client_company_name_value'] or ''
+        batch.append(ProposalSummary(
+            proposal_id=values['proposal_id'],
+            client_name=client_name,
+            client_company_name=client_company_name,
+            client_display_name=client_company_name or client_name,
+            user_name=values['user_name_value'] or '',
+            total_price_kzt=total_price_kzt,
+            paid_amount=paid,
+            payment_percentage=percentage.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP),
+            template_status=template_status,
+            **{name: values[name] for name in copied},
+        ))
+        if len(batch) >= 500:
+            ProposalSummary.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        ProposalSummary.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0058_data_package_schema_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProposalSummary',
+            fields=[
+                ('proposal', models.OneToOneField(db_column='proposal_id', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='proposals.commercialproposal', verbose_name='КП')),
+                ('proposal_name', models.CharField(max_length=255, verbose_name='Название КП')),
+                ('outcoming_number', models.CharField(max_length=100, verbose_name='Номер КП')),
+                ('client_id', models.IntegerField(blank=True, db_index=True, null=True, verbose_name='ID клиента')),
+                ('client_name', models.CharField(blank=True, default='', max_length=255, verbose_name='Имя клиента')),
+                ('client_company_name', models.CharField(blank=True, default='', max_length=255, verbose_name='Название компании')),
+                ('client_display_name', models.CharField(blank=True, default='', max_length=255, verbose_name='Клиент (отображение)')),
+                ('deal_id', models.IntegerField(blank=True, null=True, verbose_name='ID сделки')),
+                ('user_id', models.IntegerField(blank=True, db_index=True, null=True, verbose_name='ID создателя')),
+                ('user_name', models.CharField(blank=True, default='', max_length=255, verbose_name='Создал КП')),
+                ('parent_proposal_id', models.IntegerField(blank=True, null=True, verbose_name='ID родительского КП')),
+                ('currency_ticket', models.CharField(max_length=10, verbose_name='Валюта')),
+                ('exchange_rate', models.DecimalField(decimal_places=6, max_digits=15, verbose_name='Курс валюты')),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=25, verbose_name='Итоговая цена')),
+                ('total_price_kzt', models.DecimalField(decimal_places=2, max_digits=30, verbose_name='Итоговая цена, KZT')),
+                ('cost_price', models.DecimalField(blank=True, decimal_places=2, max_digits=25, null=True, verbose_name='Себестоимость')),
+                ('margin_percentage', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True, verbose_name='Процент маржи')),
+                ('margin_value', models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True, verbose_name='Сумма маржи')),
+                ('paid_amount', models.DecimalField(decimal_places=2, default=0, max_digits=25, verbose_name='Оплачено')),
+                ('payment_percentage', models.DecimalField(decimal_places=2, default=0, max_digits=5, verbose_name='Процент оплаты')),
+                ('item_count', models.PositiveIntegerField(default=0, verbose_name='Позиций оборудования')),
+                ('template_status', models.CharField(default='Not Created', max_length=20, verbose_name='Статус шаблона')),
+                ('proposal_status', models.CharField(choices=[('draft', 'Черновик'), ('sent', 'Отправлено'), ('accepted', 'Принято'), ('rejected', 'Отклонено'), ('negotiating', 'В переговорах'), ('completed', 'Завершено')], max_length=20, verbose_name='Статус')),
+                ('pricing_status', models.CharField(choices=[('stale', 'Требует пересчета'), ('computing', 'Пересчитывается'), ('fresh', 'Актуально')], default='fresh', max_length=20, verbose_name='Состояние расчета цен')),
+                ('proposal_version', models.PositiveIntegerField(verbose_name='Версия КП')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активен')),
+                ('proposal_date', models.DateField(verbose_name='Дата КП')),
+                ('valid_until', models.DateField(blank=True, null=True, verbose_name='Срок действия КП')),
+                ('created_at', models.DateTimeField(verbose_name='Дата создания КП')),
+                ('updated_at', models.DateTimeField(verbose_name='Дата обновления КП')),
+                ('last_exported_at', models.DateTimeField(blank=True, null=True, verbose_name='Последний экспорт')),
+                ('refreshed_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления сводки')),
+            ],
+            options={
+                'verbose_name': 'Сводка КП',
+                'verbose_name_plural': 'Сводки КП',
+                'db_table': 'proposal_summary',
+                'ordering': ['-proposal_date', '-created_at'],
+                'indexes': [
+                    models.Index(fields=['is_active', '-proposal_date', '-created_at'], name='proposal_summary_list_idx'),
+                    models.Index(fields=['is_active', '-created_at'], name='proposal_summary_dash_idx'),
+                ],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
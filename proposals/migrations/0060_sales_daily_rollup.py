@@ -0,0 +1,62 @@
+# Generated migration: pre-aggregated daily sales rollups (analytics endpoint)
+
+from django.db import migrations, models
+
+
+def queue_all_days(apps, schema_editor):
+    # Rollups are built by the first Celery Beat run (SalesRollupService.refresh)
+    CommercialProposal = apps.get_model('proposals', 'CommercialProposal')
+    SalesRollupDirtyDay = apps.get_model('proposals', 'SalesRollupDirtyDay')
+
+    days = CommercialProposal.objects.order_by().values_list('proposal_date', flat=True).distinct()
+    SalesRollupDirtyDay.objects.bulk_create(
+        [SalesRollupDirtyDay(day=day) for day in days if day], batch_size=1000, ignore_conflicts=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0059_proposal_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesDailyRollup',
+            fields=[
+                ('rollup_id', models.AutoField(primary_key=True, serialize=False, verbose_name='ID записи')),
+                ('day', models.DateField(verbose_name='Дата КП')),
+                ('user_id', models.IntegerField(blank=True, null=True, verbose_name='ID менеджера')),
+                ('proposal_status', models.CharField(choices=[('draft', 'Черновик'), ('sent', 'Отправлено'), ('accepted', 'Принято'), ('rejected', 'Отклонено'), ('negotiating', 'В переговорах'), ('completed', 'Завершено')], max_length=20, verbose_name='Статус')),
+                ('currency_ticket', models.CharField(max_length=10, verbose_name='Валюта')),
+                ('proposal_count', models.PositiveIntegerField(default=0, verbose_name='Количество КП')),
+                ('total_price', models.DecimalField(decimal_places=2, default=0, max_digits=30, verbose_name='Сумма КП в валюте')),
+                ('total_price_kzt', models.DecimalField(decimal_places=2, default=0, max_digits=30, verbose_name='Сумма КП, KZT')),
+                ('cost_price_kzt', models.DecimalField(decimal_places=2, default=0, max_digits=30, verbose_name='Себестоимость, KZT')),
+                ('margin_kzt', models.DecimalField(decimal_places=2, default=0, max_digits=30, verbose_name='Маржа, KZT')),
+                ('paid_amount_kzt', models.DecimalField(decimal_places=2, default=0, max_digits=30, verbose_name='Оплачено, KZT')),
+                ('refreshed_at', models.DateTimeField(auto_now=True, verbose_name='Дата пересчета')),
+            ],
+            options={
+                'verbose_name': 'Дневная сводка продаж',
+                'verbose_name_plural': 'Дневные сводки продаж',
+                'db_table': 'sales_daily_rollup',
+                'ordering': ['day'],
+                'indexes': [models.Index(fields=['day', 'user_id'], name='sales_rollup_day_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SalesRollupDirtyDay',
+            fields=[
+                ('dirty_day_id', models.AutoField(primary_key=True, serialize=False, verbose_name='ID записи')),
+                ('day', models.DateField(unique=True, verbose_name='Дата КП')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'День к пересчету сводки продаж',
+                'verbose_name_plural': 'Дни к пересчету сводки продаж',
+                'db_table': 'sales_rollup_dirty_day',
+            },
+        ),
+        migrations.RunPython(queue_all_days, migrations.RunPython.noop),
+    ]
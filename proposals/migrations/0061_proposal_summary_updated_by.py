@@ -0,0 +1,37 @@
+# Generated migration: who last updated the proposal, in the proposal summary (nested updated_by of the list)
+
+from django.db import migrations, models
+
+
+def fill_updated_by(apps, schema_editor):
+    from django.db.models import OuterRef, Subquery
+
+    CommercialProposal = apps.get_model('proposals', 'CommercialProposal')
+    ProposalSummary = apps.get_model('proposals', 'ProposalSummary')
+    User = apps.get_model('proposals', 'User')
+
+    updated_by = CommercialProposal.objects.filter(pk=OuterRef('proposal_id')).values('updated_by_id')[:1]
+    ProposalSummary.objects.update(updated_by_id=Subquery(updated_by))
+    name = User.objects.filter(pk=OuterRef('updated_by_id')).values('user_name')[:1]
+    ProposalSummary.objects.filter(updated_by_id__isnull=False).update(updated_by_name=Subquery(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0060_sales_daily_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='proposalsummary',
+            name='updated_by_id',
+            field=models.IntegerField(blank=True, null=True, verbose_name='ID обновившего'),
+        ),
+        migrations.AddField(
+            model_name='proposalsummary',
+            name='updated_by_name',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Обновил КП'),
+        ),
+        migrations.RunPython(fill_updated_by, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated migration: time of the last pricing_status change (stuck recalculations are rescheduled)
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0061_proposal_summary_updated_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commercialproposal',
+            name='pricing_status_changed_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Дата изменения состояния расчета'),
+        ),
+    ]
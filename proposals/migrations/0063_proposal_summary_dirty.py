@@ -0,0 +1,27 @@
+# Generated migration: outbox of proposals whose summary must be refreshed
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0062_proposal_pricing_status_changed_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProposalSummaryDirty',
+            fields=[
+                ('dirty_id', models.AutoField(primary_key=True, serialize=False, verbose_name='ID записи')),
+                ('proposal_id', models.IntegerField(unique=True, verbose_name='ID КП')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Неудачных попыток')),
+                ('marked_at', models.DateTimeField(auto_now=True, verbose_name='Дата отметки')),
+            ],
+            options={
+                'verbose_name': 'КП к обновлению сводки',
+                'verbose_name_plural': 'КП к обновлению сводки',
+                'db_table': 'proposal_summary_dirty',
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated migration: indexes matching the (-created_at, -pk) cursor keys
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proposals', '0063_proposal_summary_dirty'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymentlog',
+            index=models.Index(fields=['-created_at', '-payment_id'], name='payment_log_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangerate',
+            index=models.Index(fields=['-created_at', '-rate_id'], name='exchange_rate_created_idx'),
+        ),
+        # The proposals list reads proposal_summary (proposal_summary_list_idx / _dash_idx)
+        migrations.RemoveIndex(
+            model_name='commercialproposal',
+            name='commercial_proposal_date_idx',
+        ),
+    ]
@@ -1,15 +1,24 @@
+import os
 import uuid
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.utils import timezone
 
 
 def equipment_photo_upload_to(instance, filename):
-    """Store equipment photos as photos/<uuid>.jpg for predictable paths and no collisions."""
-    ext = 'jpg'
+    """Store equipment photos as photos/<uuid>.jpg (or .webp) for predictable paths and no collisions."""
+    ext = 'webp' if filename.lower().endswith('.webp') else 'jpg'
     return f"photos/{uuid.uuid4().hex}.{ext}"
 
 
+def media_blob_upload_to(instance, filename):
+    """Content-addressed path: blobs/<sha[:2]>/<sha><ext> (identical bytes share one file)."""
+    ext = os.path.splitext(filename)[1].lower()[:10]
+    return f"blobs/{instance.sha256[:2]}/{instance.sha256}{ext}"
+
+
 class UserManager(BaseUserManager):
     """Custom user manager for User model."""
     
@@ -120,6 +129,9 @@ class Category(models.Model):
         db_column='parent_category_id',
         verbose_name='Родительская категория'
     )
+    # Материализованный путь "/<root_id>/.../<category_id>/", поддерживается CategoryTreeService (signals)
+    path = models.CharField(max_length=512, default='', blank=True, editable=False, verbose_name='Путь в дереве')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Уровень вложенности')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
     
@@ -127,6 +139,10 @@ class Category(models.Model):
         db_table = 'category'
         verbose_name = 'Категория'
         verbose_name_plural = 'Категории'
+        indexes = [
+            # LIKE 'prefix%' для выборки поддерева
+            models.Index(fields=['path'], name='category_path_idx', opclasses=['varchar_pattern_ops']),
+        ]
     
     def __str__(self):
         return self.category_name
@@ -167,6 +183,28 @@ class EquipmentTypes(models.Model):
         return self.type_name
 
 
+class SpecParameter(models.Model):
+    """
+    Dictionary of specification / detail parameter names.
+    EquipmentSpecification / EquipmentDetails rows reference it and keep a parsed numeric value
+    (in the canonical unit) beside the raw text, for index-backed range filters.
+    """
+    parameter_id = models.AutoField(primary_key=True, verbose_name='ID параметра')
+    parameter_name = models.CharField(max_length=255, unique=True, verbose_name='Название параметра')
+    # Единица, к которой приводятся числовые значения (SpecParameterService.parse_value)
+    unit = models.CharField(max_length=32, null=True, blank=True, verbose_name='Единица измерения')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        db_table = 'spec_parameter'
+        verbose_name = 'Параметр характеристик'
+        verbose_name_plural = 'Параметры характеристик'
+
+    def __str__(self):
+        return self.parameter_name
+
+
 class EquipmentDetails(models.Model):
     """EquipmentDetails model for storing equipment detail parameters."""
     detail_id = models.AutoField(primary_key=True, verbose_name='ID детали')
@@ -181,6 +219,19 @@ class EquipmentDetails(models.Model):
     )
     detail_parameter_name = models.CharField(max_length=255, verbose_name='Название параметра')
     detail_parameter_value = models.TextField(null=True, blank=True, verbose_name='Значение параметра')
+    # Нормализованный параметр и числовое значение (заполняются SpecParameterService)
+    parameter = models.ForeignKey(
+        SpecParameter,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='detail_values',
+        db_column='parameter_id',
+        db_index=False,  # покрыт составным индексом (parameter, value_numeric)
+        verbose_name='Параметр'
+    )
+    value_numeric = models.DecimalField(max_digits=20, decimal_places=6, null=True, blank=True, verbose_name='Числовое значение')
+    value_unit = models.CharField(max_length=32, null=True, blank=True, verbose_name='Единица значения')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
     
@@ -188,6 +239,14 @@ class EquipmentDetails(models.Model):
         db_table = 'equipment_details'
         verbose_name = 'Деталь оборудования'
         verbose_name_plural = 'Детали оборудования'
+        constraints = [
+            # Ключ для bulk upsert (EquipmentParameterBulkService)
+            models.UniqueConstraint(fields=['equipment', 'detail_parameter_name'], name='equipment_details_param_uniq'),
+        ]
+        indexes = [
+            # Диапазонные фильтры: parameter = X AND value_numeric BETWEEN a AND b
+            models.Index(fields=['parameter', 'value_numeric'], name='eq_details_param_num_idx'),
+        ]
     
     def __str__(self):
         return f"{self.detail_parameter_name}: {self.detail_parameter_value or 'N/A'}"
@@ -207,6 +266,19 @@ class EquipmentSpecification(models.Model):
     )
     spec_parameter_name = models.CharField(max_length=255, verbose_name='Название параметра')
     spec_parameter_value = models.TextField(null=True, blank=True, verbose_name='Значение параметра')
+    # Нормализованный параметр и числовое значение (заполняются SpecParameterService)
+    parameter = models.ForeignKey(
+        SpecParameter,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='spec_values',
+        db_column='parameter_id',
+        db_index=False,  # покрыт составным индексом (parameter, value_numeric)
+        verbose_name='Параметр'
+    )
+    value_numeric = models.DecimalField(max_digits=20, decimal_places=6, null=True, blank=True, verbose_name='Числовое значение')
+    value_unit = models.CharField(max_length=32, null=True, blank=True, verbose_name='Единица значения')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
     
@@ -214,6 +286,14 @@ class EquipmentSpecification(models.Model):
         db_table = 'equipment_specification'
         verbose_name = 'Спецификация оборудования'
         verbose_name_plural = 'Спецификации оборудования'
+        constraints = [
+            # Ключ для bulk upsert (EquipmentParameterBulkService)
+            models.UniqueConstraint(fields=['equipment', 'spec_parameter_name'], name='equipment_spec_param_uniq'),
+        ]
+        indexes = [
+            # Диапазонные фильтры: parameter = X AND value_numeric BETWEEN a AND b
+            models.Index(fields=['parameter', 'value_numeric'], name='eq_spec_param_num_idx'),
+        ]
     
     def __str__(self):
         return f"{self.spec_parameter_name}: {self.spec_parameter_value or 'N/A'}"
@@ -241,6 +321,10 @@ class EquipmentTechProcess(models.Model):
         db_table = 'equipment_tech_proccess'
         verbose_name = 'Технологический процесс оборудования'
         verbose_name_plural = 'Технологические процессы оборудования'
+        constraints = [
+            # Ключ для bulk upsert (EquipmentParameterBulkService)
+            models.UniqueConstraint(fields=['equipment', 'tech_name'], name='equipment_tech_name_uniq'),
+        ]
     
     def __str__(self):
         return self.tech_name or f"Tech Process {self.tech_id}"
@@ -297,16 +381,82 @@ class Equipment(models.Model):
     equipment_price_currency_type = models.CharField(max_length=10, null=True, blank=True, verbose_name='Тип валюты')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+    # Поисковый вектор: название, артикул, описание, значения спецификаций (EquipmentSearchService)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False, verbose_name='Поисковый вектор')
     
     class Meta:
         db_table = 'equipment'
         verbose_name = 'Оборудование'
         verbose_name_plural = 'Оборудование'
+        indexes = [
+            GinIndex(fields=['search_vector'], name='equipment_search_vector_gin'),
+            GinIndex(fields=['equipment_name'], name='equipment_name_trgm', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['equipment_articule'], name='equipment_articule_trgm', opclasses=['gin_trgm_ops']),
+            models.Index(fields=['-created_at', '-equipment_id'], name='equipment_created_idx'),
+            # Лента опубликованного каталога (EquipmentFeedService): since-курсор по (updated_at, id)
+            models.Index(
+                fields=['updated_at', 'equipment_id'], name='equipment_published_feed_idx',
+                condition=models.Q(is_published=True)
+            ),
+        ]
     
     def __str__(self):
         return self.equipment_name or f"Equipment {self.equipment_id}"
 
 
+class CatalogTombstone(models.Model):
+    """
+    Equipment removed from the published catalog feed (unpublished or deleted).
+    Feed consumers get it in "deleted" for since-cursors before removed_at.
+    Removed when the equipment is published again.
+    """
+    REASON_CHOICES = [
+        ('unpublished', 'Снято с публикации'),
+        ('deleted', 'Удалено'),
+    ]
+
+    tombstone_id = models.AutoField(primary_key=True, verbose_name='ID записи')
+    # Не ForeignKey: оборудование может быть уже удалено
+    equipment_id = models.IntegerField(db_index=True, verbose_name='ID оборудования')
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, verbose_name='Причина')
+    removed_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name='Дата снятия')
+
+    class Meta:
+        db_table = 'catalog_tombstone'
+        verbose_name = 'Снятое с каталога оборудование'
+        verbose_name_plural = 'Снятое с каталога оборудование'
+        ordering = ['removed_at', 'tombstone_id']
+
+    def __str__(self):
+        return f"Equipment {self.equipment_id} {self.reason} at {self.removed_at}"
+
+
+class MediaBlob(models.Model):
+    """
+    Content-addressed media file shared by EquipmentPhoto / EquipmentDocument rows.
+    ref_count is maintained by signals; unreferenced blobs are removed by gc_media_blobs.
+    """
+    blob_id = models.AutoField(primary_key=True, verbose_name='ID файла')
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name='SHA-256 содержимого')
+    source_sha256 = models.CharField(
+        max_length=64, null=True, blank=True, db_index=True,
+        verbose_name='SHA-256 исходника (для оптимизированных фото)'
+    )
+    file = models.FileField(upload_to=media_blob_upload_to, max_length=255, verbose_name='Файл')
+    size = models.PositiveBigIntegerField(default=0, verbose_name='Размер (байт)')
+    ref_count = models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        db_table = 'media_blob'
+        verbose_name = 'Медиафайл'
+        verbose_name_plural = 'Медиафайлы'
+
+    def __str__(self):
+        return self.file.name or self.sha256
+
+
 class EquipmentPhoto(models.Model):
     """Locally stored photo for equipment (downloaded from cloud links and optimized)."""
     equipment = models.ForeignKey(
@@ -323,6 +473,9 @@ class EquipmentPhoto(models.Model):
     )
     name = models.CharField(max_length=255, blank=True, verbose_name='Подпись')
     sort_order = models.PositiveIntegerField(default=0, verbose_name='Порядок')
+    content_hash = models.CharField(
+        max_length=64, null=True, blank=True, db_index=True, verbose_name='SHA-256 файла (MediaBlob)'
+    )
 
     class Meta:
         db_table = 'equipment_photo'
@@ -334,6 +487,80 @@ class EquipmentPhoto(models.Model):
         return f"Photo {self.pk} for {self.equipment_id}"
 
 
+class EquipmentPhotoImport(models.Model):
+    """Queued import of one cloud image link into EquipmentPhoto (processed by Celery)."""
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает'),
+        ('processing', 'Загружается'),
+        ('done', 'Загружено'),
+        ('failed', 'Ошибка'),
+    ]
+
+    import_id = models.AutoField(primary_key=True, verbose_name='ID импорта')
+    equipment = models.ForeignKey(
+        Equipment,
+        on_delete=models.CASCADE,
+        related_name='photo_imports',
+        db_column='equipment_id',
+        verbose_name='Оборудование'
+    )
+    source_url = models.TextField(verbose_name='Исходная ссылка')
+    name = models.CharField(max_length=255, blank=True, verbose_name='Подпись')
+    sort_order = models.PositiveIntegerField(default=0, verbose_name='Порядок')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='Статус')
+    error = models.TextField(null=True, blank=True, verbose_name='Ошибка')
+    photo = models.ForeignKey(
+        EquipmentPhoto,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='imports',
+        verbose_name='Фото'
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        db_table = 'equipment_photo_import'
+        verbose_name = 'Импорт фото оборудования'
+        verbose_name_plural = 'Импорт фото оборудования'
+        ordering = ['sort_order', 'pk']
+        indexes = [
+            models.Index(fields=['equipment', 'status'], name='eq_photo_import_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Import {self.pk} ({self.status}) for {self.equipment_id}"
+
+
+class YandexDiskLink(models.Model):
+    """
+    Resolved direct download link for a Yandex Disk public URL.
+    Filled and refreshed ahead of expiry by a periodic Celery job, read paths only look it up.
+    """
+    link_id = models.AutoField(primary_key=True, verbose_name='ID ссылки')
+    url_hash = models.CharField(max_length=64, unique=True, verbose_name='SHA-256 публичной ссылки')
+    public_url = models.TextField(verbose_name='Публичная ссылка')
+    direct_url = models.TextField(null=True, blank=True, verbose_name='Прямая ссылка')
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True, verbose_name='Прямая ссылка действительна до')
+    resolved_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата получения')
+    last_error = models.TextField(null=True, blank=True, verbose_name='Последняя ошибка')
+    fail_count = models.PositiveIntegerField(default=0, verbose_name='Количество ошибок подряд')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        db_table = 'yandex_disk_link'
+        verbose_name = 'Прямая ссылка Яндекс.Диска'
+        verbose_name_plural = 'Прямые ссылки Яндекс.Диска'
+
+    def __str__(self):
+        return self.public_url
+
+    def is_fresh(self):
+        return bool(self.direct_url and self.expires_at and self.expires_at > timezone.now())
+
+
 class PurchasePrice(models.Model):
     """PurchasePrice model for storing equipment purchase prices from different sources."""
     price_id = models.AutoField(primary_key=True, verbose_name='ID цены')
@@ -433,6 +660,9 @@ class EquipmentDocument(models.Model):
     file = models.FileField(upload_to='equipment_documents/', null=True, blank=True, verbose_name='Файл')
     file_url = models.URLField(null=True, blank=True, verbose_name='Ссылка на файл')
     file_size = models.PositiveIntegerField(null=True, blank=True, verbose_name='Размер файла (байт)')
+    content_hash = models.CharField(
+        max_length=64, null=True, blank=True, db_index=True, verbose_name='SHA-256 файла (MediaBlob)'
+    )
     is_for_client = models.BooleanField(default=False, verbose_name='Для клиента')
     is_internal = models.BooleanField(default=False, verbose_name='Внутренний документ')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата загрузки')
@@ -684,6 +914,14 @@ class EquipmentListItem(models.Model):
         verbose_name_plural = 'Элементы списка (оборудование)'
         unique_together = [['equipment_list', 'equipment']]
         ordering = ['order', 'created_at']
+        indexes = [
+            # Latest saved price per equipment (EquipmentSerializer.actual_price subquery)
+            models.Index(
+                fields=['equipment', '-created_at'],
+                name='eq_list_item_priced_idx',
+                condition=models.Q(price_per_unit__isnull=False),
+            ),
+        ]
     
     def __str__(self):
         return f"{self.equipment_list.list_id} - {self.equipment.equipment_name} (x{self.quantity})"
@@ -713,6 +951,12 @@ class PaymentLog(models.Model):
         db_table = 'payment_log'
         verbose_name = 'Платеж'
         verbose_name_plural = 'Платежи'
+        indexes = [
+            # Default (page-number) list order
+            models.Index(fields=['-payment_date', '-created_at'], name='payment_log_date_idx'),
+            # Keyset (?pagination=cursor) order
+            models.Index(fields=['-created_at', '-payment_id'], name='payment_log_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.payment_name} - {self.payment_value} ({self.payment_date})"
@@ -763,6 +1007,13 @@ class CommercialProposal(models.Model):
         ('negotiating', 'В переговорах'),
         ('completed', 'Завершено'),
     ]
+
+    # Состояние расчета цен (пересчет идет в фоне после сохранения, см. recalculate_proposal_task)
+    PRICING_STATUS_CHOICES = [
+        ('stale', 'Требует пересчета'),
+        ('computing', 'Пересчитывается'),
+        ('fresh', 'Актуально'),
+    ]
     
     proposal_id = models.AutoField(primary_key=True, verbose_name='ID коммерческого предложения')
     proposal_name = models.CharField(max_length=255, verbose_name='Название КП')
@@ -830,6 +1081,16 @@ class CommercialProposal(models.Model):
         verbose_name='Статус'
     )
     proposal_version = models.PositiveIntegerField(verbose_name='Версия КП')
+    pricing_status = models.CharField(
+        max_length=20,
+        choices=PRICING_STATUS_CHOICES,
+        default='fresh',
+        verbose_name='Состояние расчета цен'
+    )
+    # Когда pricing_status последний раз менялся: зависшие stale / computing перезапускаются
+    pricing_status_changed_at = models.DateTimeField(
+        null=True, blank=True, db_index=True, verbose_name='Дата изменения состояния расчета'
+    )
     
     # Self-referential ForeignKey for parent proposal
     parent_proposal = models.ForeignKey(
@@ -845,7 +1106,6 @@ class CommercialProposal(models.Model):
     # Additional fields
     comments = models.TextField(null=True, blank=True, verbose_name='Комментарии')
     bitrix_lead_link = models.URLField(null=True, blank=True, verbose_name='Ссылка на Битрикс')
-    data_package = models.JSONField(default=dict, blank=True, null=True, verbose_name='Пакет данных для конструктора')
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания записи')
@@ -868,6 +1128,235 @@ class CommercialProposal(models.Model):
     def __str__(self):
         return f"{self.outcoming_number} - {self.proposal_name}"
 
+    # Пакет данных для конструктора хранится сжатым в ProposalDataPackage и грузится при обращении
+    @property
+    def data_package(self):
+        if not hasattr(self, '_data_package'):
+            from .services import ProposalDataPackageService
+            self._data_package = ProposalDataPackageService.load(self.pk) if self.pk else {}
+        return self._data_package
+
+    @data_package.setter
+    def data_package(self, value):
+        self._data_package = value
+        self._data_package_dirty = True
+
+    def save(self, *args, **kwargs):
+        """`data_package` in update_fields (or a changed package) is written to ProposalDataPackage."""
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'data_package' in update_fields:
+            kwargs['update_fields'] = [name for name in update_fields if name != 'data_package']
+        super().save(*args, **kwargs)
+        if getattr(self, '_data_package_dirty', False):
+            from .services import ProposalDataPackageService
+            ProposalDataPackageService.store(self, self._data_package)
+            self._data_package_dirty = False
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        if fields is not None and 'data_package' in fields:
+            fields = [name for name in fields if name != 'data_package']
+            self.__dict__.pop('_data_package', None)
+            if not fields:
+                return
+        elif fields is None:
+            self.__dict__.pop('_data_package', None)
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+
+
+class EquipmentDataSection(models.Model):
+    """
+    Per-equipment section of proposal data packages (details, specifications, tech processes),
+    zlib-compressed JSON addressed by sha256; shared by all packages with the same content.
+    """
+    section_id = models.AutoField(primary_key=True, verbose_name='ID секции')
+    section_hash = models.CharField(max_length=64, unique=True, verbose_name='SHA-256 содержимого')
+    payload = models.BinaryField(verbose_name='Сжатые данные')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        db_table = 'equipment_data_section'
+        verbose_name = 'Секция пакета данных (оборудование)'
+        verbose_name_plural = 'Секции пакетов данных (оборудование)'
+
+    def __str__(self):
+        return self.section_hash
+
+
+class ProposalDataPackage(models.Model):
+    """
+    Compressed data package of a proposal (see proposals/datapackage.py), kept off the
+    commercial_proposal row and loaded only via CommercialProposal.data_package.
+    """
+    package_id = models.AutoField(primary_key=True, verbose_name='ID пакета')
+    proposal = models.OneToOneField(
+        CommercialProposal,
+        on_delete=models.CASCADE,
+        related_name='data_package_store',
+        db_column='proposal_id',
+        verbose_name='КП'
+    )
+    payload = models.BinaryField(verbose_name='Сжатый скелет пакета')
+    raw_size = models.PositiveIntegerField(default=0, verbose_name='Размер JSON, байт')
+    stored_size = models.PositiveIntegerField(default=0, verbose_name='Размер сжатого скелета, байт')
+    # Версия формата пакета (ProposalDataPackageService.SCHEMA_VERSION), для пакетного обновления
+    schema_version = models.PositiveSmallIntegerField(default=0, db_index=True, verbose_name='Версия формата')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        db_table = 'proposal_data_package'
+        verbose_name = 'Пакет данных КП'
+        verbose_name_plural = 'Пакеты данных КП'
+
+    def __str__(self):
+        return f"Data package for proposal {self.proposal_id}"
+
+
+class ProposalSummary(models.Model):
+    """
+    Denormalized read model of a proposal for the proposals grid and the dashboard:
+    one row per proposal with client / user names, totals (proposal currency and KZT),
+    payments and item count. Maintained by ProposalSummaryService (after commit of
+    changes to proposals, their equipment items, payments, clients, users and templates).
+    """
+    proposal = models.OneToOneField(
+        CommercialProposal,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='summary',
+        db_column='proposal_id',
+        verbose_name='КП'
+    )
+    proposal_name = models.CharField(max_length=255, verbose_name='Название КП')
+    outcoming_number = models.CharField(max_length=100, verbose_name='Номер КП')
+    client_id = models.IntegerField(null=True, blank=True, db_index=True, verbose_name='ID клиента')
+    client_name = models.CharField(max_length=255, blank=True, default='', verbose_name='Имя клиента')
+    client_company_name = models.CharField(max_length=255, blank=True, default='', verbose_name='Название компании')
+    # Компания клиента, а если ее нет - имя клиента
+    client_display_name = models.CharField(max_length=255, blank=True, default='', verbose_name='Клиент (отображение)')
+    deal_id = models.IntegerField(null=True, blank=True, verbose_name='ID сделки')
+    user_id = models.IntegerField(null=True, blank=True, db_index=True, verbose_name='ID создателя')
+    user_name = models.CharField(max_length=255, blank=True, default='', verbose_name='Создал КП')
+    updated_by_id = models.IntegerField(null=True, blank=True, verbose_name='ID обновившего')
+    updated_by_name = models.CharField(max_length=255, blank=True, default='', verbose_name='Обновил КП')
+    parent_proposal_id = models.IntegerField(null=True, blank=True, verbose_name='ID родительского КП')
+    currency_ticket = models.CharField(max_length=10, verbose_name='Валюта')
+    exchange_rate = models.DecimalField(max_digits=15, decimal_places=6, verbose_name='Курс валюты')
+    total_price = models.DecimalField(max_digits=25, decimal_places=2, verbose_name='Итоговая цена')
+    total_price_kzt = models.DecimalField(max_digits=30, decimal_places=2, verbose_name='Итоговая цена, KZT')
+    cost_price = models.DecimalField(max_digits=25, decimal_places=2, null=True, blank=True, verbose_name='Себестоимость')
+    margin_percentage = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True, verbose_name='Процент маржи')
+    margin_value = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True, verbose_name='Сумма маржи')
+    paid_amount = models.DecimalField(max_digits=25, decimal_places=2, default=0, verbose_name='Оплачено')
+    payment_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=0, verbose_name='Процент оплаты')
+    item_count = models.PositiveIntegerField(default=0, verbose_name='Позиций оборудования')
+    template_status = models.CharField(max_length=20, default='Not Created', verbose_name='Статус шаблона')
+    proposal_status = models.CharField(
+        max_length=20, choices=CommercialProposal.STATUS_CHOICES, verbose_name='Статус'
+    )
+    pricing_status = models.CharField(
+        max_length=20, choices=CommercialProposal.PRICING_STATUS_CHOICES, default='fresh',
+        verbose_name='Состояние расчета цен'
+    )
+    proposal_version = models.PositiveIntegerField(verbose_name='Версия КП')
+    is_active = models.BooleanField(default=True, verbose_name='Активен')
+    proposal_date = models.DateField(verbose_name='Дата КП')
+    valid_until = models.DateField(null=True, blank=True, verbose_name='Срок действия КП')
+    created_at = models.DateTimeField(verbose_name='Дата создания КП')
+    updated_at = models.DateTimeField(verbose_name='Дата обновления КП')
+    # Последний успешный экспорт PDF / DOCX (не пересчитывается из КП)
+    last_exported_at = models.DateTimeField(null=True, blank=True, verbose_name='Последний экспорт')
+    refreshed_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления сводки')
+
+    class Meta:
+        db_table = 'proposal_summary'
+        verbose_name = 'Сводка КП'
+        verbose_name_plural = 'Сводки КП'
+        ordering = ['-proposal_date', '-created_at']
+        indexes = [
+            # Proposals grid: active rows in list order
+            models.Index(fields=['is_active', '-proposal_date', '-created_at'], name='proposal_summary_list_idx'),
+            # Dashboard: active proposals by creation date
+            models.Index(fields=['is_active', '-created_at'], name='proposal_summary_dash_idx'),
+        ]
+
+    def __str__(self):
+        return f"Summary of {self.outcoming_number}"
+
+
+class ProposalSummaryDirty(models.Model):
+    """
+    Proposals whose ProposalSummary is out of date (outbox of ProposalSummaryService):
+    written in the same transaction as the proposal change, deleted in the transaction
+    that refreshes the summary, so a failed or lost refresh is retried by Celery Beat.
+    """
+    dirty_id = models.AutoField(primary_key=True, verbose_name='ID записи')
+    # Без FK: запись удаленного КП тоже обрабатывается (сводка удаляется каскадом)
+    proposal_id = models.IntegerField(unique=True, verbose_name='ID КП')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Неудачных попыток')
+    marked_at = models.DateTimeField(auto_now=True, verbose_name='Дата отметки')
+
+    class Meta:
+        db_table = 'proposal_summary_dirty'
+        verbose_name = 'КП к обновлению сводки'
+        verbose_name_plural = 'КП к обновлению сводки'
+
+    def __str__(self):
+        return str(self.proposal_id)
+
+
+class SalesDailyRollup(models.Model):
+    """
+    Pre-aggregated sales analytics: active proposals per proposal date, manager, status
+    and currency. Rebuilt per day by SalesRollupService (Celery Beat) from
+    CommercialProposal and PaymentLog; the analytics endpoint reads only this table.
+    Amounts are in KZT except total_price (proposal currency).
+    """
+    rollup_id = models.AutoField(primary_key=True, verbose_name='ID записи')
+    day = models.DateField(verbose_name='Дата КП')
+    user_id = models.IntegerField(null=True, blank=True, verbose_name='ID менеджера')
+    proposal_status = models.CharField(
+        max_length=20, choices=CommercialProposal.STATUS_CHOICES, verbose_name='Статус'
+    )
+    currency_ticket = models.CharField(max_length=10, verbose_name='Валюта')
+    proposal_count = models.PositiveIntegerField(default=0, verbose_name='Количество КП')
+    total_price = models.DecimalField(max_digits=30, decimal_places=2, default=0, verbose_name='Сумма КП в валюте')
+    total_price_kzt = models.DecimalField(max_digits=30, decimal_places=2, default=0, verbose_name='Сумма КП, KZT')
+    cost_price_kzt = models.DecimalField(max_digits=30, decimal_places=2, default=0, verbose_name='Себестоимость, KZT')
+    margin_kzt = models.DecimalField(max_digits=30, decimal_places=2, default=0, verbose_name='Маржа, KZT')
+    paid_amount_kzt = models.DecimalField(max_digits=30, decimal_places=2, default=0, verbose_name='Оплачено, KZT')
+    refreshed_at = models.DateTimeField(auto_now=True, verbose_name='Дата пересчета')
+
+    class Meta:
+        db_table = 'sales_daily_rollup'
+        verbose_name = 'Дневная сводка продаж'
+        verbose_name_plural = 'Дневные сводки продаж'
+        ordering = ['day']
+        indexes = [
+            models.Index(fields=['day', 'user_id'], name='sales_rollup_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.user_id} {self.proposal_status} {self.currency_ticket}"
+
+
+class SalesRollupDirtyDay(models.Model):
+    """
+    Days whose SalesDailyRollup rows are out of date (outbox of SalesRollupService):
+    written after proposal summaries are refreshed and when proposals are deleted,
+    consumed by the periodic rollup refresh.
+    """
+    dirty_day_id = models.AutoField(primary_key=True, verbose_name='ID записи')
+    day = models.DateField(unique=True, verbose_name='Дата КП')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        db_table = 'sales_rollup_dirty_day'
+        verbose_name = 'День к пересчету сводки продаж'
+        verbose_name_plural = 'Дни к пересчету сводки продаж'
+
+    def __str__(self):
+        return str(self.day)
+
 
 class ExchangeRate(models.Model):
     """ExchangeRate model for storing currency exchange rates with history."""
@@ -954,6 +1443,8 @@ class ExchangeRate(models.Model):
         indexes = [
             models.Index(fields=['currency_from', 'currency_to', 'rate_date', 'is_active']),
             models.Index(fields=['rate_date', 'is_active']),
+            # Keyset (?pagination=cursor) order
+            models.Index(fields=['-created_at', '-rate_id'], name='exchange_rate_created_idx'),
         ]
         # Уникальность: один курс для валютной пары на дату (если не корректировка для КП)
         # Для корректировок КП может быть несколько курсов
@@ -1128,6 +1619,8 @@ class ProposalTemplate(models.Model):
     layout_data = models.JSONField(default=list, verbose_name='Структура контента')
     header_data = models.JSONField(default=dict, blank=True, null=True, verbose_name='Данные заголовка')
     is_final = models.BooleanField(default=False, verbose_name='Зафиксировано')
+    # Увеличивается при каждом сохранении (проверка конфликтов при PATCH-сохранениях конструктора)
+    revision = models.PositiveIntegerField(default=0, verbose_name='Ревизия')
     last_edited_by = models.ForeignKey(
         User, 
         on_delete=models.SET_NULL, 
@@ -0,0 +1,103 @@
+"""
+Pagination classes for high-volume list endpoints.
+"""
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+
+
+class _ViewOrderedCursorPagination(CursorPagination):
+    """Keyset pagination ordered by the view's `cursor_ordering`."""
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def __init__(self, ordering, page_size):
+        self.ordering = ordering
+        self.page_size = page_size
+
+
+class OptInCursorPagination(PageNumberPagination):
+    """
+    Page-number pagination by default (same response as before).
+
+    Opt-in keyset mode: ?pagination=cursor (and the ?cursor=... links it returns).
+    Rows are fetched with WHERE <key> < last_seen instead of OFFSET, so deep pages cost
+    the same as the first one, and no COUNT(*) runs unless ?with_count=true.
+    Ordering comes from view.cursor_ordering. DRF positions the cursor on its first field
+    only, so it must be an immutable, (near-)unique key - creation time, then pk; ordering
+    by an editable or coarse field (a date) would skip / repeat rows or OFFSET over ties.
+    Query params listed in view.cursor_unsupported_params (e.g. ranked ?search=, whose
+    relevance order has no keyset) are rejected with 400 in cursor mode.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    mode_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+    count_query_param = 'with_count'
+
+    def _cursor_requested(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self._cursor_paginator = None
+        if not self._cursor_requested(request):
+            return super().paginate_queryset(queryset, request, view)
+
+        unsupported = [
+            param for param in getattr(view, 'cursor_unsupported_params', ())
+            if request.query_params.get(param, '').strip()
+        ]
+        if unsupported:
+            raise ValidationError({
+                self.mode_query_param: f'Cursor pagination cannot be combined with: {", ".join(unsupported)}'
+            })
+        self._cursor_paginator = _ViewOrderedCursorPagination(
+            ordering=getattr(view, 'cursor_ordering', ('-created_at',)),
+            page_size=self.get_page_size(request),
+        )
+        self._cursor_count = None
+        if request.query_params.get(self.count_query_param, '').lower() == 'true':
+            self._cursor_count = queryset.count()
+        return self._cursor_paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self._cursor_paginator is None:
+            return super().get_paginated_response(data)
+        payload = {
+            'next': self._cursor_paginator.get_next_link(),
+            'previous': self._cursor_paginator.get_previous_link(),
+            'results': data,
+        }
+        if self._cursor_count is not None:
+            payload['count'] = self._cursor_count
+        return Response(payload)
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters += [
+            {
+                'name': self.mode_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Set to "cursor" for keyset pagination (no COUNT, no OFFSET).',
+                'schema': {'type': 'string', 'enum': ['cursor']},
+            },
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Cursor from next/previous link (cursor mode).',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.count_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Cursor mode: include total count (runs COUNT query).',
+                'schema': {'type': 'boolean'},
+            },
+        ]
+        return parameters
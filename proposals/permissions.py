@@ -37,3 +37,24 @@ class IsSuperuser(permissions.BasePermission):
             return False
         return getattr(request.user, 'is_superuser', False)
 
+
+
+class HasCatalogFeedAccess(permissions.BasePermission):
+    """
+    Published catalog feed: any authenticated user, or a partner / website sync job
+    with a token from CATALOG_FEED_TOKENS (X-Feed-Token header or ?token=).
+    """
+
+    def has_permission(self, request, view):
+        import hmac
+        from django.conf import settings
+
+        if request.user and request.user.is_authenticated:
+            return True
+        token = request.headers.get('X-Feed-Token') or request.query_params.get('token') or ''
+        if not token:
+            return False
+        return any(
+            hmac.compare_digest(token, allowed)
+            for allowed in getattr(settings, 'CATALOG_FEED_TOKENS', []) if allowed
+        )
@@ -5,13 +5,14 @@ from .models import (
     EquipmentSpecification, EquipmentTechProcess, Equipment, PurchasePrice,
     Logistics, EquipmentDocument, EquipmentLine, EquipmentLineItem, AdditionalPrices,
     EquipmentList, EquipmentListLineItem, EquipmentListItem, PaymentLog, CrmDeal,
-    CommercialProposal, ExchangeRate, CostCalculation, ProposalTemplate, SectionTemplate
+    CommercialProposal, ExchangeRate, CostCalculation, ProposalTemplate, SectionTemplate,
+    EquipmentPhotoImport, ProposalSummary
 )
-from django.conf import settings
-from .services import LinkConverterService, CloudImageImportService
+from .services import LinkConverterService, CloudImageImportService, CategoryTreeService
+from .fieldsets import SparseFieldsetsMixin
 
 
-class UserRegistrationSerializer(serializers.ModelSerializer):
+class UserRegistrationSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for user registration."""
     password = serializers.CharField(write_only=True, required=True, min_length=8)
     password_confirm = serializers.CharField(write_only=True, required=True, min_length=8)
@@ -74,7 +75,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         return user
 
 
-class UserAdminUpdateSerializer(serializers.ModelSerializer):
+class UserAdminUpdateSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """
     Serializer for admin to update user's role and activation status.
     """
@@ -116,7 +117,7 @@ class UserLoginSerializer(serializers.Serializer):
         return attrs
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for user details (read-only for authenticated users)."""
     
     class Meta:
@@ -132,7 +133,7 @@ class UserSerializer(serializers.ModelSerializer):
         ]
 
 
-class ClientSerializer(serializers.ModelSerializer):
+class ClientSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for Client model."""
     
     class Meta:
@@ -146,7 +147,7 @@ class ClientSerializer(serializers.ModelSerializer):
         read_only_fields = ['client_id', 'created_at', 'updated_at']
 
 
-class CrmDealSerializer(serializers.ModelSerializer):
+class CrmDealSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for CrmDeal (Bitrix deal cached locally)."""
     client = ClientSerializer(read_only=True)
     commercial_proposal_ids = serializers.SerializerMethodField()
@@ -178,19 +179,25 @@ class CrmDealSerializer(serializers.ModelSerializer):
         return f"{base}/crm/deal/details/{obj.bitrix_deal_id}/"
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for Category model."""
     
     class Meta:
         model = Category
         fields = [
             'category_id', 'category_name', 'category_description',
-            'parent_category', 'created_at', 'updated_at'
+            'parent_category', 'path', 'depth', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['category_id', 'created_at', 'updated_at']
+        read_only_fields = ['category_id', 'path', 'depth', 'created_at', 'updated_at']
+
+    def validate_parent_category(self, value):
+        """A category can't be moved under itself or its own subcategory."""
+        if CategoryTreeService.would_create_cycle(self.instance, value):
+            raise serializers.ValidationError('Нельзя сделать категорию дочерней для самой себя или своей подкатегории')
+        return value
 
 
-class ManufacturerSerializer(serializers.ModelSerializer):
+class ManufacturerSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for Manufacturer model."""
     
     class Meta:
@@ -203,7 +210,7 @@ class ManufacturerSerializer(serializers.ModelSerializer):
         read_only_fields = ['manufacturer_id', 'created_at', 'updated_at']
 
 
-class EquipmentTypesSerializer(serializers.ModelSerializer):
+class EquipmentTypesSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for EquipmentTypes model."""
     
     class Meta:
@@ -214,31 +221,33 @@ class EquipmentTypesSerializer(serializers.ModelSerializer):
         read_only_fields = ['type_id', 'created_at', 'updated_at']
 
 
-class EquipmentDetailsSerializer(serializers.ModelSerializer):
+class EquipmentDetailsSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for EquipmentDetails model."""
     
     class Meta:
         model = EquipmentDetails
         fields = [
             'detail_id', 'equipment', 'detail_parameter_name', 'detail_parameter_value',
+            'parameter', 'value_numeric', 'value_unit',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['detail_id', 'created_at', 'updated_at']
+        read_only_fields = ['detail_id', 'parameter', 'value_numeric', 'value_unit', 'created_at', 'updated_at']
 
 
-class EquipmentSpecificationSerializer(serializers.ModelSerializer):
+class EquipmentSpecificationSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for EquipmentSpecification model."""
     
     class Meta:
         model = EquipmentSpecification
         fields = [
             'spec_id', 'equipment', 'spec_parameter_name', 'spec_parameter_value',
+            'parameter', 'value_numeric', 'value_unit',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['spec_id', 'created_at', 'updated_at']
+        read_only_fields = ['spec_id', 'parameter', 'value_numeric', 'value_unit', 'created_at', 'updated_at']
 
 
-class EquipmentTechProcessSerializer(serializers.ModelSerializer):
+class EquipmentTechProcessSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for EquipmentTechProcess model."""
     
     class Meta:
@@ -250,7 +259,7 @@ class EquipmentTechProcessSerializer(serializers.ModelSerializer):
         read_only_fields = ['tech_id', 'created_at', 'updated_at']
 
 
-class EquipmentSerializer(serializers.ModelSerializer):
+class EquipmentSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for Equipment model with all relationships."""
     # Many-to-many relationships
     categories = serializers.PrimaryKeyRelatedField(many=True, queryset=Category.objects.all(), required=False)
@@ -318,6 +327,19 @@ class EquipmentSerializer(serializers.ModelSerializer):
             for tp in tech_processes
         ]
     
+    @staticmethod
+    def annotate_actual_price(queryset):
+        """
+        Annotate latest saved EquipmentListItem price (one subquery instead of a query per row).
+        Served by the partial index eq_list_item_priced_idx.
+        """
+        from django.db.models import OuterRef, Subquery
+        latest_price = EquipmentListItem.objects.filter(
+            equipment=OuterRef('pk'),
+            price_per_unit__isnull=False
+        ).order_by('-created_at').values('price_per_unit')[:1]
+        return queryset.annotate(latest_list_price=Subquery(latest_price))
+
     def get_actual_price(self, obj):
         """
         Get the actual price: sale_price_kzt if set, otherwise latest price from EquipmentListItem.
@@ -326,7 +348,11 @@ class EquipmentSerializer(serializers.ModelSerializer):
         if obj.sale_price_kzt is not None:
             return float(obj.sale_price_kzt)
         
-        # Priority 2: Fallback to latest EquipmentListItem price
+        # Priority 2: annotated latest price (list/detail views, see annotate_actual_price)
+        if hasattr(obj, 'latest_list_price'):
+            return float(obj.latest_list_price) if obj.latest_list_price is not None else None
+        
+        # Fallback for instances without annotation (e.g. create/update response)
         from .models import EquipmentListItem
         from decimal import Decimal
         
@@ -377,7 +403,7 @@ class EquipmentSerializer(serializers.ModelSerializer):
     def _build_equipment_imagelinks_response(self, instance):
         """
         Build equipment_imagelinks for API: local photos first (from EquipmentPhoto),
-        then legacy external links from JSONB (normalized). Local URLs are stable for constructor/PDF.
+        then links queued for import (status 'pending'), then legacy external links from JSONB (normalized). Local URLs are stable for constructor/PDF.
         """
         result = []
         # Local photos: always return relative URL (/media/photos/...) so frontend
@@ -385,6 +411,14 @@ class EquipmentSerializer(serializers.ModelSerializer):
         for photo in instance.photos.all():
             url = (photo.image.url or '').strip()
             result.append({'name': photo.name or '', 'url': url})
+        # Cloud links still being imported in background
+        for photo_import in instance.photo_imports.all():
+            if photo_import.status in ('pending', 'processing'):
+                result.append({
+                    'name': photo_import.name or '',
+                    'url': LinkConverterService.get_direct_link(photo_import.source_url),
+                    'status': 'pending',
+                })
         # Legacy external links from JSONB (e.g. not yet migrated or failed to import)
         raw = instance.equipment_imagelinks or []
         if isinstance(raw, list):
@@ -410,7 +444,8 @@ class EquipmentSerializer(serializers.ModelSerializer):
         Local URLs (/media/photos/...) are stable for constructor and PDF.
         """
         data = super().to_representation(instance)
-        data['equipment_imagelinks'] = self._build_equipment_imagelinks_response(instance)
+        if 'equipment_imagelinks' in self.fields:
+            data['equipment_imagelinks'] = self._build_equipment_imagelinks_response(instance)
         return data
     
     def create(self, validated_data):
@@ -437,7 +472,8 @@ class EquipmentSerializer(serializers.ModelSerializer):
             with transaction.atomic():
                 equipment = Equipment.objects.create(**validated_data)
                 if imagelinks_in is not None:
-                    equipment.equipment_imagelinks = self._import_imagelinks_and_storage_failures(
+                    # Облачные ссылки импортируются в фоне (Celery), в JSONB только локальные/не-облако
+                    equipment.equipment_imagelinks = CloudImageImportService.queue_imports(
                         equipment, imagelinks_in
                     )
                     equipment.save(update_fields=['equipment_imagelinks'])
@@ -471,72 +507,63 @@ class EquipmentSerializer(serializers.ModelSerializer):
             logger.error(f"Validated data: {validated_data}")
             raise
     
-    def _import_imagelinks_and_storage_failures(self, equipment, imagelinks_in):
-        """
-        For each external URL (Google/Yandex), import and create EquipmentPhoto.
-        Return list for equipment_imagelinks JSONB: only failed external + non-cloud links (normalized).
-        """
-        stored = []
-        items = []
-        if isinstance(imagelinks_in, list):
-            items = [(i, x) for i, x in enumerate(imagelinks_in)]
-        elif isinstance(imagelinks_in, str):
-            items = [(i, link.strip()) for i, link in enumerate(imagelinks_in.split(',')) if link and link.strip()]
-        for idx, item in items:
-            name = ''
-            url = None
-            if isinstance(item, dict):
-                url = item.get('url')
-                name = item.get('name', '') or ''
-            elif isinstance(item, str):
-                url = item
-            if not url or not str(url).strip():
-                continue
-            url = str(url).strip()
-            # Already local
-            if url.startswith('/') or (settings.MEDIA_URL and url.startswith(settings.MEDIA_URL)):
-                stored.append({'name': name, 'url': url})
-                continue
-            if CloudImageImportService.detect_source(url):
-                photo = CloudImageImportService.import_and_save(equipment, url, name=name, sort_order=idx)
-                if not photo:
-                    stored.append({'name': name, 'url': LinkConverterService.get_direct_link(url)})
-            else:
-                stored.append({'name': name, 'url': LinkConverterService.get_direct_link(url)})
-        return stored
-
     def update(self, instance, validated_data):
         """Update equipment with Many-to-Many relationships."""
+        from django.db import transaction
+
         imagelinks_in = validated_data.pop('equipment_imagelinks', None)
-        if imagelinks_in is not None:
-            # Replace local photos: delete existing and re-import from list so order/set matches
-            instance.photos.all().delete()
-            instance.equipment_imagelinks = self._import_imagelinks_and_storage_failures(
-                instance, imagelinks_in
-            )
 
         # Извлекаем Many-to-Many данные
         categories = validated_data.pop('categories', None)
         manufacturers = validated_data.pop('manufacturers', None)
         equipment_types = validated_data.pop('equipment_types', None)
-        
-        # Обновляем основные поля
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
-        
-        # Обновляем Many-to-Many связи, если они переданы
-        if categories is not None:
-            instance.categories.set(categories)
-        if manufacturers is not None:
-            instance.manufacturers.set(manufacturers)
-        if equipment_types is not None:
-            instance.equipment_types.set(equipment_types)
-        
+
+        # В транзакции: задачи импорта ставятся после commit, когда instance.save() уже записал
+        # ссылки, иначе неудачный импорт дописал бы ссылку и save() затер бы ее старым списком
+        with transaction.atomic():
+            if imagelinks_in is not None:
+                # Photo set follows the list: listed local photos are kept, the rest deleted,
+                # cloud links re-queued (see CloudImageImportService.queue_imports)
+                instance.photo_imports.all().delete()
+                instance.equipment_imagelinks = CloudImageImportService.queue_imports(
+                    instance, imagelinks_in
+                )
+
+            # Обновляем основные поля
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            instance.save()
+
+            # Обновляем Many-to-Many связи, если они переданы
+            if categories is not None:
+                instance.categories.set(categories)
+            if manufacturers is not None:
+                instance.manufacturers.set(manufacturers)
+            if equipment_types is not None:
+                instance.equipment_types.set(equipment_types)
+
         return instance
 
 
-class PurchasePriceSerializer(serializers.ModelSerializer):
+class EquipmentPhotoImportSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
+    """Serializer for EquipmentPhotoImport (background photo import progress)."""
+    photo_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = EquipmentPhotoImport
+        fields = [
+            'import_id', 'source_url', 'name', 'sort_order', 'status', 'error',
+            'photo_url', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+    def get_photo_url(self, obj):
+        if obj.photo_id and obj.photo and obj.photo.image:
+            return obj.photo.image.url
+        return None
+
+
+class PurchasePriceSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for PurchasePrice model."""
     
     class Meta:
@@ -548,7 +575,7 @@ class PurchasePriceSerializer(serializers.ModelSerializer):
         read_only_fields = ['price_id', 'created_at', 'updated_at']
 
 
-class LogisticsSerializer(serializers.ModelSerializer):
+class LogisticsSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for Logistics model."""
     
     class Meta:
@@ -560,7 +587,7 @@ class LogisticsSerializer(serializers.ModelSerializer):
         read_only_fields = ['logistics_id', 'created_at', 'updated_at']
 
 
-class EquipmentDocumentSerializer(serializers.ModelSerializer):
+class EquipmentDocumentSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for EquipmentDocument model."""
     
     class Meta:
@@ -572,8 +599,27 @@ class EquipmentDocumentSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['document_id', 'created_at', 'updated_at']
 
+    def _store_file(self, validated_data):
+        """Route uploaded file through the content-addressed store (identical files are kept once)."""
+        from .services import MediaStoreService
+        upload = validated_data.get('file')
+        if upload and hasattr(upload, 'chunks'):
+            blob = MediaStoreService.store_upload(upload)
+            validated_data['file'] = blob.file.name
+            validated_data['content_hash'] = blob.sha256
+            validated_data['file_size'] = blob.size
+        elif 'file' in validated_data and not upload:
+            validated_data['content_hash'] = None
+        return validated_data
+
+    def create(self, validated_data):
+        return super().create(self._store_file(validated_data))
 
-class EquipmentLineItemSerializer(serializers.ModelSerializer):
+    def update(self, instance, validated_data):
+        return super().update(instance, self._store_file(validated_data))
+
+
+class EquipmentLineItemSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for EquipmentLineItem model."""
     
     class Meta:
@@ -584,7 +630,7 @@ class EquipmentLineItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at']
 
 
-class EquipmentLineSerializer(serializers.ModelSerializer):
+class EquipmentLineSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for EquipmentLine model."""
     line_items = serializers.SerializerMethodField()
     
@@ -612,7 +658,7 @@ class EquipmentLineSerializer(serializers.ModelSerializer):
         ]
 
 
-class AdditionalPricesSerializer(serializers.ModelSerializer):
+class AdditionalPricesSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for AdditionalPrices model."""
     
     class Meta:
@@ -624,7 +670,7 @@ class AdditionalPricesSerializer(serializers.ModelSerializer):
         read_only_fields = ['price_id', 'created_at', 'updated_at']
 
 
-class EquipmentListLineItemSerializer(serializers.ModelSerializer):
+class EquipmentListLineItemSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for EquipmentListLineItem model."""
     
     class Meta:
@@ -635,7 +681,7 @@ class EquipmentListLineItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at']
 
 
-class EquipmentListItemSerializer(serializers.ModelSerializer):
+class EquipmentListItemSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for EquipmentListItem model."""
     
     class Meta:
@@ -646,7 +692,7 @@ class EquipmentListItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at']
 
 
-class EquipmentListLineItemSerializer(serializers.ModelSerializer):
+class EquipmentListLineItemSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for EquipmentListLineItem model."""
     equipment_line_name = serializers.CharField(source='equipment_line.equipment_line_name', read_only=True)
     
@@ -658,7 +704,7 @@ class EquipmentListLineItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at']
 
 
-class EquipmentListItemSerializer(serializers.ModelSerializer):
+class EquipmentListItemSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for EquipmentListItem model."""
     equipment_name = serializers.CharField(source='equipment.equipment_name', read_only=True)
     
@@ -671,7 +717,7 @@ class EquipmentListItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at']
 
 
-class EquipmentListSerializer(serializers.ModelSerializer):
+class EquipmentListSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for EquipmentList model."""
     # Nested data for line items and equipment items
     line_items = serializers.SerializerMethodField()
@@ -738,7 +784,7 @@ class EquipmentListSerializer(serializers.ModelSerializer):
         return EquipmentListItemSerializer(equipment_items, many=True).data
 
 
-class PaymentLogSerializer(serializers.ModelSerializer):
+class PaymentLogSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for PaymentLog model."""
     
     user_name = serializers.CharField(source='user.user_name', read_only=True)
@@ -753,7 +799,7 @@ class PaymentLogSerializer(serializers.ModelSerializer):
         read_only_fields = ['payment_id', 'created_at', 'updated_at', 'user_name']
 
 
-class CommercialProposalSerializer(serializers.ModelSerializer):
+class CommercialProposalSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for CommercialProposal model with nested relationships."""
     
     # Nested serializers for read operations
@@ -833,7 +879,7 @@ class CommercialProposalSerializer(serializers.ModelSerializer):
             'currency_ticket', 'exchange_rate', 'exchange_rate_date',
             'total_price', 'cost_price', 'margin_percentage', 'margin_value',
             'proposal_date', 'valid_until', 'delivery_time', 'warranty',
-            'proposal_status', 'proposal_version', 'is_active',
+            'proposal_status', 'proposal_version', 'is_active', 'pricing_status',
 
             'parent_proposal', 'parent_proposal_id',
             'comments', 'bitrix_lead_link',
@@ -842,7 +888,7 @@ class CommercialProposalSerializer(serializers.ModelSerializer):
             'additional_price_ids', 'internal_exchange_rates', 'additional_services',
             'data_package', 'created_at', 'updated_at', 'updated_by', 'template_status'
         ]
-        read_only_fields = ['proposal_id', 'created_at', 'updated_at', 'updated_by', 'data_package']
+        read_only_fields = ['proposal_id', 'created_at', 'updated_at', 'updated_by', 'data_package', 'pricing_status']
     
     def get_data_package(self, obj):
         """Return data_package if exists, otherwise return None (will be generated on demand)."""
@@ -1177,7 +1223,56 @@ class CommercialProposalSerializer(serializers.ModelSerializer):
         return instance
 
 
-class ExchangeRateSerializer(serializers.ModelSerializer):
+class ProposalSummarySerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
+    """
+    Summary representation for the proposal list (read-only), served from the
+    ProposalSummary read model - one indexed table, no joins or aggregates per request.
+    The full nested form is returned by the detail endpoint (CommercialProposalSerializer).
+    """
+    proposal_id = serializers.IntegerField(read_only=True)
+    proposal_status_display = serializers.CharField(source='get_proposal_status_display', read_only=True)
+    # Same nested shape as CommercialProposalSerializer (the proposals grid reads row.client / row.updated_by)
+    client = serializers.SerializerMethodField()
+    user = serializers.SerializerMethodField()
+    updated_by = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ProposalSummary
+        fields = [
+            'proposal_id', 'proposal_name', 'outcoming_number',
+            'client', 'client_id', 'client_name', 'client_company_name', 'client_display_name', 'deal_id',
+            'user', 'user_id', 'user_name', 'updated_by', 'updated_by_id', 'updated_by_name',
+            'parent_proposal_id',
+            'currency_ticket', 'exchange_rate',
+            'total_price', 'total_price_kzt', 'cost_price', 'margin_percentage', 'margin_value',
+            'proposal_date', 'valid_until', 'proposal_status', 'proposal_status_display',
+            'proposal_version', 'is_active', 'pricing_status',
+            'item_count', 'paid_amount', 'payment_percentage', 'template_status',
+            'created_at', 'updated_at', 'last_exported_at'
+        ]
+        read_only_fields = fields
+
+    def get_client(self, obj):
+        if obj.client_id is None:
+            return None
+        return {
+            'client_id': obj.client_id,
+            'client_name': obj.client_name,
+            'client_company_name': obj.client_company_name,
+        }
+
+    def get_user(self, obj):
+        if obj.user_id is None:
+            return None
+        return {'user_id': obj.user_id, 'user_name': obj.user_name}
+
+    def get_updated_by(self, obj):
+        if obj.updated_by_id is None:
+            return None
+        return {'user_id': obj.updated_by_id, 'user_name': obj.updated_by_name}
+
+
+class ExchangeRateSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for ExchangeRate model."""
     
     # Nested serializers for read operations
@@ -1239,7 +1334,7 @@ class ExchangeRateSerializer(serializers.ModelSerializer):
         return data
 
 
-class CostCalculationSerializer(serializers.ModelSerializer):
+class CostCalculationSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for CostCalculation model."""
     
     # Nested serializers for read operations
@@ -1408,7 +1503,7 @@ def _save_prices_to_equipment_list_items(proposal, equipment_list_data):
             item.save(update_fields=['price_per_unit', 'total_price', 'calculated_data'])
 
 
-class ProposalTemplateSerializer(serializers.ModelSerializer):
+class ProposalTemplateSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for ProposalTemplate model."""
     data_package = serializers.SerializerMethodField()
     # Allow writing data_package to save it to proposal
@@ -1418,9 +1513,9 @@ class ProposalTemplateSerializer(serializers.ModelSerializer):
         model = ProposalTemplate
         fields = [
             'template_id', 'proposal', 'layout_data', 'header_data', 'data_package',
-            'data_package_to_save', 'is_final', 'last_edited_by', 'created_at', 'updated_at'
+            'data_package_to_save', 'is_final', 'last_edited_by', 'revision', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['template_id', 'created_at', 'updated_at', 'data_package']
+        read_only_fields = ['template_id', 'revision', 'created_at', 'updated_at', 'data_package']
 
     def get_data_package(self, obj):
         """Get data_package from proposal if exists, otherwise generate it."""
@@ -1473,6 +1568,8 @@ class ProposalTemplateSerializer(serializers.ModelSerializer):
         # Extract data_package_to_save if provided
         data_package_to_save = validated_data.pop('data_package_to_save', None)
         
+        # Full saves also move the revision used by PATCH saves (/proposal-templates/{id}/patch/)
+        validated_data['revision'] = instance.revision + 1
         template = super().update(instance, validated_data)
         
         # Save data_package to proposal if provided
@@ -1596,7 +1693,7 @@ class ProposalTemplateSerializer(serializers.ModelSerializer):
         
         return template
 
-class SectionTemplateSerializer(serializers.ModelSerializer):
+class SectionTemplateSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     """Serializer for SectionTemplate model."""
     
     class Meta:
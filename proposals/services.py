@@ -5,13 +5,15 @@ from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
 from django.utils import timezone
 from django.conf import settings
 from django.db import transaction
+from django.db.models import Lookup
 from .models import (
     Equipment, EquipmentPhoto, PurchasePrice, Logistics, AdditionalPrices, ExchangeRate,
-    CostCalculation, CommercialProposal, SystemSettings
+    CostCalculation, CommercialProposal, SystemSettings, MediaBlob, EquipmentDocument
 )
 import requests
 import re
 import os
+import threading
 from io import BytesIO
 from django.core.cache import cache
 from django.core.files.base import ContentFile
@@ -22,6 +24,11 @@ try:
 except ImportError:
     Image = None
 
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
 logger = logging.getLogger(__name__)
 
 
@@ -68,38 +75,319 @@ class LinkConverterService:
 
     @staticmethod
     def _convert_yandex_disk(url):
-        """Convert Yandex Disk link to direct download link with caching."""
-        cache_key = f"yandex_disk_link_{url}"
+        """
+        Return the persisted direct link for a Yandex Disk public URL.
+        Never calls the Yandex API inline: unknown links are registered and resolved
+        in the background (YandexDiskLinkService), meanwhile the public URL is returned.
+        """
+        return YandexDiskLinkService.get_stored(url) or url
+
+
+class YandexDiskLinkService:
+    """
+    Persisted resolution of Yandex Disk public links to direct download links (YandexDiskLink).
+    Direct links expire; refresh_due() re-resolves them ahead of expiry from Celery beat.
+    """
+
+    API_URL = "https://cloud-api.yandex.net/v1/disk/public/resources/download"
+    CACHE_KEY_PREFIX = 'yandex_disk_link_'
+
+    @staticmethod
+    def url_hash(url):
+        import hashlib
+        return hashlib.sha256(url.strip().encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def get_stored(url):
+        """
+        Read-path lookup: Redis cache, then DB (read only). Returns direct link or None.
+        Unknown links are registered and resolved by a background task (no writes or HTTP here).
+        """
+        from .models import YandexDiskLink
+        if not url:
+            return None
+        key = YandexDiskLinkService.url_hash(url)
+        cache_key = f"{YandexDiskLinkService.CACHE_KEY_PREFIX}{key}"
         cached_link = cache.get(cache_key)
-        
         if cached_link:
             return cached_link
-            
+        link = YandexDiskLink.objects.filter(url_hash=key).only(
+            'link_id', 'url_hash', 'direct_url', 'expires_at'
+        ).first()
+        if link is None:
+            # Регистрацию ставим в очередь один раз на несколько минут, а не на каждый запрос
+            if cache.add(f"{cache_key}_pending", 1, timeout=5 * 60):
+                YandexDiskLinkService._schedule_register([url.strip()])
+            return None
+        if link.is_fresh():
+            YandexDiskLinkService._cache_link(link)
+            return link.direct_url
+        return None
+
+    @staticmethod
+    def _cache_link(link):
+        timeout = int((link.expires_at - timezone.now()).total_seconds())
+        if timeout > 0:
+            cache.set(f"{YandexDiskLinkService.CACHE_KEY_PREFIX}{link.url_hash}", link.direct_url, timeout=timeout)
+
+    @staticmethod
+    def _schedule_register(urls):
         try:
-            api_url = "https://cloud-api.yandex.net/v1/disk/public/resources/download"
-            params = {'public_key': url}
-            
-            response = requests.get(api_url, params=params, timeout=5)
-            
+            from .tasks import register_yandex_links_task
+            transaction.on_commit(lambda: register_yandex_links_task.delay(urls))
+        except Exception as e:
+            # Broker down: the periodic refresh registers links from equipment
+            logger.warning("Could not schedule Yandex link registration %s: %s", urls, e)
+
+    @staticmethod
+    def register(urls):
+        """Create YandexDiskLink rows for these public URLs (existing ones are kept). Returns their ids."""
+        from .models import YandexDiskLink
+        links = {YandexDiskLinkService.url_hash(url): url.strip() for url in urls if url and url.strip()}
+        YandexDiskLink.objects.bulk_create(
+            [YandexDiskLink(url_hash=key, public_url=url) for key, url in links.items()], ignore_conflicts=True
+        )
+        return list(YandexDiskLink.objects.filter(url_hash__in=links).values_list('link_id', flat=True))
+
+    @staticmethod
+    def _parse_expiry(href):
+        """Yandex download hrefs carry ?expires=<unix ts>; fall back to YANDEX_DISK_LINK_TTL."""
+        from datetime import datetime, timedelta, timezone as dt_timezone
+        from urllib.parse import urlparse, parse_qs
+        try:
+            expires = parse_qs(urlparse(href).query).get('expires')
+            if expires:
+                return datetime.fromtimestamp(int(expires[0]), tz=dt_timezone.utc)
+        except (ValueError, OverflowError):
+            pass
+        ttl = int(getattr(settings, 'YANDEX_DISK_LINK_TTL', 3 * 60 * 60))
+        return timezone.now() + timedelta(seconds=ttl)
+
+    @staticmethod
+    def resolve(link):
+        """Call the Yandex API for one YandexDiskLink and persist the result. Returns True on success."""
+        try:
+            response = requests.get(
+                YandexDiskLinkService.API_URL, params={'public_key': link.public_url}, timeout=10
+            )
             if response.status_code == 200:
-                data = response.json()
-                href = data.get('href')
+                href = response.json().get('href')
                 if href:
-                    # Cache for 30 minutes (1800 seconds)
-                    cache.set(cache_key, href, timeout=1800)
-                    return href
-            else:
-                logger.warning(f"Yandex API returned {response.status_code} for {url}")
-                
+                    link.direct_url = href
+                    link.expires_at = YandexDiskLinkService._parse_expiry(href)
+                    link.resolved_at = timezone.now()
+                    link.last_error = None
+                    link.fail_count = 0
+                    link.save(update_fields=[
+                        'direct_url', 'expires_at', 'resolved_at', 'last_error', 'fail_count', 'updated_at'
+                    ])
+                    YandexDiskLinkService._cache_link(link)
+                    return True
+            error = f"Yandex API returned {response.status_code}"
         except Exception as e:
-            logger.warning(f"Failed to convert Yandex Disk link {url}: {e}")
-            
-        return url
+            error = str(e)
+        logger.warning("Failed to resolve Yandex Disk link %s: %s", link.public_url[:80], error)
+        link.last_error = error
+        link.fail_count += 1
+        link.save(update_fields=['last_error', 'fail_count', 'updated_at'])
+        return False
+
+    @staticmethod
+    def register_from_equipment():
+        """Register Yandex links found in Equipment.equipment_imagelinks that are not yet tracked."""
+        from .models import YandexDiskLink
+        known = set(YandexDiskLink.objects.values_list('url_hash', flat=True))
+        new_links = {}
+        for imagelinks in Equipment.objects.values_list('equipment_imagelinks', flat=True).iterator():
+            if isinstance(imagelinks, str):
+                imagelinks = imagelinks.split(',')
+            for item in imagelinks or []:
+                url = item.get('url') if isinstance(item, dict) else item
+                if not isinstance(url, str) or not url.strip():
+                    continue
+                url = url.strip()
+                if 'disk.yandex' not in url and 'yadi.sk' not in url:
+                    continue
+                key = YandexDiskLinkService.url_hash(url)
+                if key not in known and key not in new_links:
+                    new_links[key] = YandexDiskLink(url_hash=key, public_url=url)
+        YandexDiskLink.objects.bulk_create(new_links.values(), ignore_conflicts=True)
+        return len(new_links)
+
+    @staticmethod
+    def refresh_due(batch_size=200):
+        """
+        Resolve links that are unresolved or expire within YANDEX_DISK_LINK_REFRESH_AHEAD seconds.
+        Links that keep failing are retried less often (backoff by fail_count).
+        """
+        from datetime import timedelta
+        from django.db.models import DateTimeField, DurationField, ExpressionWrapper, F, Q, Value
+        from django.db.models.functions import Least
+        from .models import YandexDiskLink
+        now = timezone.now()
+        ahead = int(getattr(settings, 'YANDEX_DISK_LINK_REFRESH_AHEAD', 30 * 60))
+        # Backoff: after N failures wait N * 15 minutes (at most 24 h) before retrying
+        retry_at = ExpressionWrapper(
+            F('updated_at') + ExpressionWrapper(
+                Value(timedelta(minutes=15)) * Least(F('fail_count'), Value(96)), output_field=DurationField()
+            ),
+            output_field=DateTimeField()
+        )
+        due = YandexDiskLink.objects.filter(
+            Q(direct_url__isnull=True) | Q(expires_at__isnull=True) | Q(expires_at__lte=now + timedelta(seconds=ahead))
+        ).annotate(retry_at=retry_at).filter(
+            Q(fail_count=0) | Q(retry_at__lte=now)
+        ).order_by(F('expires_at').asc(nulls_first=True), 'link_id')
+        stats = {'resolved': 0, 'failed': 0}
+        for link in due[:batch_size]:
+            if YandexDiskLinkService.resolve(link):
+                stats['resolved'] += 1
+            else:
+                stats['failed'] += 1
+        return stats
+
+
+class MediaStoreService:
+    """
+    Content-addressed media store (MediaBlob): identical bytes are written once and shared
+    by EquipmentPhoto / EquipmentDocument rows via content_hash. ref_count is kept by
+    signals (proposals.signals); gc() deletes blobs nobody references.
+    """
+
+    @staticmethod
+    def hash_file(fileobj):
+        """sha256 of a binary file object (read in chunks, rewound afterwards)."""
+        import hashlib
+        digest = hashlib.sha256()
+        if hasattr(fileobj, 'chunks'):
+            for chunk in fileobj.chunks():
+                digest.update(chunk)
+        else:
+            for chunk in iter(lambda: fileobj.read(64 * 1024), b''):
+                digest.update(chunk)
+        fileobj.seek(0)
+        return digest.hexdigest()
+
+    @staticmethod
+    def find_by_source(source_sha256):
+        """Blob previously produced from the same original bytes (skip re-encoding)."""
+        if not source_sha256:
+            return None
+        return MediaBlob.objects.filter(source_sha256=source_sha256).order_by('blob_id').first()
+
+    @staticmethod
+    def _store(sha, content, filename, size, source_sha256=None):
+        from django.db import IntegrityError
+        existing = MediaBlob.objects.filter(sha256=sha).first()
+        if existing:
+            # updated_at - начало грейс-периода gc(): переиспользуемый blob с ref_count=0 не удаляем
+            touch = {'updated_at': timezone.now()}
+            if source_sha256 and not existing.source_sha256:
+                touch['source_sha256'] = source_sha256
+            MediaBlob.objects.filter(pk=existing.pk).update(**touch)
+            return existing
+        blob = MediaBlob(sha256=sha, size=size, source_sha256=source_sha256)
+        blob.file.save(filename, content, save=False)
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            # Same bytes stored concurrently by another worker: keep theirs
+            blob.file.storage.delete(blob.file.name)
+            return MediaBlob.objects.get(sha256=sha)
+        return blob
+
+    @staticmethod
+    def store_bytes(data, ext, source_sha256=None):
+        """Store bytes (or return the existing blob with the same content)."""
+        import hashlib
+        sha = hashlib.sha256(data).hexdigest()
+        return MediaStoreService._store(sha, ContentFile(data), f"{sha}.{ext}", len(data), source_sha256)
+
+    @staticmethod
+    def store_upload(uploaded_file):
+        """Store an uploaded file (UploadedFile / File) without reading it fully into memory."""
+        sha = MediaStoreService.hash_file(uploaded_file)
+        ext = os.path.splitext(getattr(uploaded_file, 'name', '') or '')[1].lower()[:10]
+        return MediaStoreService._store(sha, uploaded_file, f"{sha}{ext}", uploaded_file.size)
+
+    @staticmethod
+    def acquire(sha):
+        from django.db.models import F
+        if sha:
+            MediaBlob.objects.filter(sha256=sha).update(ref_count=F('ref_count') + 1, updated_at=timezone.now())
+
+    @staticmethod
+    def release(sha):
+        from django.db.models import F
+        if sha:
+            MediaBlob.objects.filter(sha256=sha, ref_count__gt=0).update(
+                ref_count=F('ref_count') - 1, updated_at=timezone.now()
+            )
+
+    @staticmethod
+    def reconcile_ref_counts():
+        """Recompute ref_count from EquipmentPhoto / EquipmentDocument rows. Returns number of fixed blobs."""
+        from collections import Counter
+        from django.db.models import Count
+        refs = Counter()
+        for model in (EquipmentPhoto, EquipmentDocument):
+            rows = model.objects.filter(content_hash__isnull=False).values('content_hash').annotate(n=Count('pk'))
+            for row in rows:
+                refs[row['content_hash']] += row['n']
+        fixed = 0
+        for blob in MediaBlob.objects.only('blob_id', 'sha256', 'ref_count').iterator(chunk_size=1000):
+            actual = refs.get(blob.sha256, 0)
+            if blob.ref_count != actual:
+                MediaBlob.objects.filter(pk=blob.pk).update(ref_count=actual)
+                fixed += 1
+        return fixed
+
+    @staticmethod
+    def gc(grace_minutes=60, dry_run=False):
+        """
+        Delete blobs with ref_count 0 not touched for grace_minutes (grace protects blobs
+        stored by an import that has not created its row yet). Returns (deleted, freed_bytes).
+        """
+        from datetime import timedelta
+        cutoff = timezone.now() - timedelta(minutes=grace_minutes)
+        deleted = 0
+        freed = 0
+        for blob in MediaBlob.objects.filter(ref_count=0, updated_at__lt=cutoff).iterator(chunk_size=500):
+            # Re-check references right before deleting
+            if (EquipmentPhoto.objects.filter(content_hash=blob.sha256).exists()
+                    or EquipmentDocument.objects.filter(content_hash=blob.sha256).exists()):
+                continue
+            deleted += 1
+            freed += blob.size
+            if dry_run:
+                continue
+            name = blob.file.name
+            blob.delete()
+            if name:
+                try:
+                    MediaBlob._meta.get_field('file').storage.delete(name)
+                except Exception as e:
+                    logger.warning("Could not delete blob file %s: %s", name, e)
+        return deleted, freed
+
+    @staticmethod
+    def attach_photo(equipment_id, blob, name='', sort_order=0):
+        """Create EquipmentPhoto pointing at an existing blob (no file write)."""
+        photo = EquipmentPhoto(
+            equipment_id=equipment_id, name=name or '', sort_order=sort_order,
+            content_hash=blob.sha256,
+        )
+        photo.image.name = blob.file.name
+        photo.save()
+        return photo
 
 
 # Max dimension for optimized equipment photos (saves SSD space)
 EQUIPMENT_PHOTO_MAX_PX = 1600
 EQUIPMENT_PHOTO_JPEG_QUALITY = 85
+# Hard cap for a single downloaded original (streamed, aborted when exceeded)
+EQUIPMENT_PHOTO_MAX_DOWNLOAD_BYTES = getattr(settings, 'EQUIPMENT_PHOTO_MAX_DOWNLOAD_BYTES', 50 * 1024 * 1024)
 
 
 class CloudImageImportService:
@@ -163,59 +451,117 @@ class CloudImageImportService:
         return url
 
     @staticmethod
-    def download_bytes(url, timeout=30):
-        """Download image bytes from URL. Returns bytes or None."""
+    def download_to_file(url, timeout=30, max_bytes=None):
+        """
+        Stream image from URL into a spooled temp file (RAM up to 1 MB, then disk).
+        Aborts when the body exceeds max_bytes (EQUIPMENT_PHOTO_MAX_DOWNLOAD_BYTES).
+        Returns file object positioned at 0, or None. Caller closes it.
+        """
+        import tempfile
         if not url:
             return None
+        if max_bytes is None:
+            max_bytes = EQUIPMENT_PHOTO_MAX_DOWNLOAD_BYTES
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (compatible; ProsnabDB/1.0)',
+        }
+        resp = None
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (compatible; ProsnabDB/1.0)',
-            }
             resp = requests.get(url, headers=headers, timeout=timeout, stream=True)
             resp.raise_for_status()
             # Google Drive may return HTML confirmation for large files; try to get direct link
             if 'drive.google.com' in url and 'text/html' in resp.headers.get('Content-Type', ''):
-                # Try to extract confirm token and re-request
-                match = re.search(r'confirm=([0-9A-Za-z_-]+)', resp.text)
-                if match:
-                    confirm = match.group(1)
-                    download_url = url if '?' in url else f"{url}&confirm={confirm}"
-                    resp = requests.get(download_url, headers=headers, timeout=timeout)
-                    resp.raise_for_status()
-            return resp.content
+                # Read only the head of the page to find the confirm token
+                head = resp.raw.read(256 * 1024, decode_content=True).decode('utf-8', 'ignore')
+                resp.close()
+                match = re.search(r'confirm=([0-9A-Za-z_-]+)', head)
+                if not match:
+                    return None
+                resp = requests.get(f"{url}&confirm={match.group(1)}", headers=headers, timeout=timeout, stream=True)
+                resp.raise_for_status()
+            declared = resp.headers.get('Content-Length')
+            if declared and declared.isdigit() and int(declared) > max_bytes:
+                logger.warning("Download too large (%s bytes) for %s", declared, url[:80])
+                return None
+            out = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+            size = 0
+            for chunk in resp.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+                if size > max_bytes:
+                    out.close()
+                    logger.warning("Download exceeded %s bytes for %s", max_bytes, url[:80])
+                    return None
+                out.write(chunk)
+            if not size:
+                out.close()
+                return None
+            out.seek(0)
+            return out
         except Exception as e:
             logger.warning("Download failed for %s: %s", url[:80], e)
             return None
+        finally:
+            if resp is not None:
+                resp.close()
+
+    @staticmethod
+    def download_bytes(url, timeout=30, max_bytes=None):
+        """Download image bytes from URL (streamed, size-capped). Returns bytes or None."""
+        fh = CloudImageImportService.download_to_file(url, timeout=timeout, max_bytes=max_bytes)
+        if fh is None:
+            return None
+        with fh:
+            return fh.read()
 
     @staticmethod
-    def optimize_image(raw_bytes):
+    def optimize_image(raw):
         """
-        Resize image so longest side is EQUIPMENT_PHOTO_MAX_PX and save as JPEG quality 85.
-        Returns JPEG bytes or None.
+        Downscale image so longest side is EQUIPMENT_PHOTO_MAX_PX and encode as
+        EQUIPMENT_PHOTO_FORMAT (JPEG quality 85 by default, WebP optional).
+        Accepts bytes or a binary file object. JPEGs are decoded in draft mode
+        (DCT scaling), so the full-size JPEG bitmap is never materialized.
+        Returns encoded bytes or None.
         """
-        if not Image or not raw_bytes:
-            return raw_bytes
+        if not Image or not raw:
+            return raw
+        fileobj = BytesIO(raw) if isinstance(raw, (bytes, bytearray)) else raw
         try:
-            img = Image.open(BytesIO(raw_bytes))
-            if img.mode in ('RGBA', 'P'):
+            img = Image.open(fileobj)
+            max_size = (EQUIPMENT_PHOTO_MAX_PX, EQUIPMENT_PHOTO_MAX_PX)
+            if img.format == 'JPEG':
+                # Let libjpeg decode at 1/2, 1/4 or 1/8 scale (still >= max_size)
+                img.draft('RGB', max_size)
+            # Конвертируем до thumbnail(): для режимов P и 1 Pillow подменяет LANCZOS на NEAREST
+            if img.mode != 'RGB':
                 img = img.convert('RGB')
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-            w, h = img.size
-            if w > EQUIPMENT_PHOTO_MAX_PX or h > EQUIPMENT_PHOTO_MAX_PX:
-                if w >= h:
-                    new_w = EQUIPMENT_PHOTO_MAX_PX
-                    new_h = int(h * EQUIPMENT_PHOTO_MAX_PX / w)
-                else:
-                    new_h = EQUIPMENT_PHOTO_MAX_PX
-                    new_w = int(w * EQUIPMENT_PHOTO_MAX_PX / h)
-                img = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
+            img.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
             out = BytesIO()
-            img.save(out, format='JPEG', quality=EQUIPMENT_PHOTO_JPEG_QUALITY, optimize=True)
+            if CloudImageImportService.output_format() == 'WEBP':
+                img.save(out, format='WEBP', quality=EQUIPMENT_PHOTO_JPEG_QUALITY, method=4)
+            else:
+                img.save(out, format='JPEG', quality=EQUIPMENT_PHOTO_JPEG_QUALITY, optimize=True)
             return out.getvalue()
         except Exception as e:
             logger.warning("Optimize image failed: %s", e)
-            return raw_bytes
+            # Keep previous behaviour for in-memory input: store original bytes
+            return raw if isinstance(raw, (bytes, bytearray)) else None
+
+    @staticmethod
+    def output_format():
+        """EQUIPMENT_PHOTO_FORMAT ('JPEG' or 'WEBP'); falls back to JPEG if Pillow lacks WebP."""
+        fmt = str(getattr(settings, 'EQUIPMENT_PHOTO_FORMAT', 'JPEG')).upper()
+        if fmt == 'WEBP':
+            from PIL import features
+            if features.check('webp'):
+                return 'WEBP'
+        return 'JPEG'
+
+    @staticmethod
+    def photo_extension(data):
+        """File extension for optimized photo bytes."""
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            return 'webp'
+        return 'jpg'
 
     @staticmethod
     def import_and_save(equipment, url, name='', sort_order=0):
@@ -230,112 +576,1933 @@ class CloudImageImportService:
         if not download_url:
             # Not a supported cloud link; could be already local /media/...
             return None
-        raw = CloudImageImportService.download_bytes(download_url)
-        if not raw:
+        raw = CloudImageImportService.download_to_file(download_url)
+        if raw is None:
             return None
-        jpeg_bytes = CloudImageImportService.optimize_image(raw)
+        with raw:
+            source_sha256 = MediaStoreService.hash_file(raw)
+            blob = MediaStoreService.find_by_source(source_sha256)
+            if blob is not None:
+                # Same original already imported (maybe for another equipment): reuse, no re-encode
+                try:
+                    return MediaStoreService.attach_photo(equipment.equipment_id, blob, name=name, sort_order=sort_order)
+                except Exception as e:
+                    logger.warning("Save EquipmentPhoto failed for equipment %s: %s", equipment.equipment_id, e)
+                    return None
+            jpeg_bytes = CloudImageImportService.optimize_image(raw)
+        return CloudImageImportService.save_photo(
+            equipment.equipment_id, jpeg_bytes, name=name, sort_order=sort_order, source_sha256=source_sha256
+        )
+
+    @staticmethod
+    def queue_imports(equipment, imagelinks_in):
+        """
+        Apply an image link list to the equipment photos.
+        Local URLs of existing photos keep them (name / order updated), local URLs of stored
+        MediaBlob files are attached as photos; photos missing from the list are deleted.
+        Cloud links (Google/Yandex) get EquipmentPhotoImport rows in 'pending' state and
+        import_equipment_photos_task is scheduled after commit.
+        Returns list for equipment_imagelinks JSONB: remaining local and non-cloud links only.
+        """
+        from urllib.parse import unquote
+        from .models import EquipmentPhotoImport
+        stored = []
+        queued = []
+        existing = {photo.image.name: photo for photo in equipment.photos.all()}
+        items = []
+        if isinstance(imagelinks_in, list):
+            items = list(enumerate(imagelinks_in))
+        elif isinstance(imagelinks_in, str):
+            items = [(i, link.strip()) for i, link in enumerate(imagelinks_in.split(',')) if link and link.strip()]
+        for idx, item in items:
+            name = ''
+            url = None
+            if isinstance(item, dict):
+                url = item.get('url')
+                name = item.get('name', '') or ''
+            elif isinstance(item, str):
+                url = item
+            if not url or not str(url).strip():
+                continue
+            url = str(url).strip()
+            # Already local
+            # sort_order - позиция во входном списке: неудачный импорт вставляется на свое место
+            if url.startswith('/') or (settings.MEDIA_URL and url.startswith(settings.MEDIA_URL)):
+                # Фронтенд возвращает URL фото из GET как есть: сохраняем фото, а не строку
+                # (строка не держит ссылку на MediaBlob, и gc удалил бы файл)
+                file_name = unquote(url[len(settings.MEDIA_URL):]) if settings.MEDIA_URL and url.startswith(settings.MEDIA_URL) else None
+                photo = existing.pop(file_name, None) if file_name else None
+                if photo is not None:
+                    if photo.name != name[:255] or photo.sort_order != idx:
+                        photo.name = name[:255]
+                        photo.sort_order = idx
+                        photo.save(update_fields=['name', 'sort_order'])
+                    continue
+                blob = MediaBlob.objects.filter(file=file_name).first() if file_name else None
+                if blob is not None:
+                    MediaStoreService.attach_photo(equipment.equipment_id, blob, name=name[:255], sort_order=idx)
+                    continue
+                stored.append({'name': name, 'url': url, 'sort_order': idx})
+                continue
+            if CloudImageImportService.detect_source(url):
+                queued.append(EquipmentPhotoImport(
+                    equipment=equipment, source_url=url, name=name[:255], sort_order=idx
+                ))
+            else:
+                # Store the public link as-is: direct links (Yandex) expire and are resolved on read
+                stored.append({'name': name, 'url': url, 'sort_order': idx})
+        if existing:
+            # Фото, которых нет в новом списке (ссылки на blob освобождаются сигналом)
+            equipment.photos.filter(pk__in=[photo.pk for photo in existing.values()]).delete()
+        if queued:
+            EquipmentPhotoImport.objects.bulk_create(queued)
+            equipment_id = equipment.equipment_id
+            transaction.on_commit(lambda: CloudImageImportService.enqueue(equipment_id))
+        return stored
+
+    @staticmethod
+    def enqueue(equipment_id):
+        """Queue import_equipment_photos_task; if the broker is down, import inline."""
+        from .tasks import import_equipment_photos_task
+        try:
+            import_equipment_photos_task.delay(equipment_id)
+        except Exception as e:
+            logger.error("Could not queue photo import for equipment %s, importing inline: %s", equipment_id, e)
+            import_equipment_photos_task(equipment_id)
+
+    @staticmethod
+    def requeue_stale():
+        """
+        Re-enqueue imports stuck longer than EQUIPMENT_PHOTO_IMPORT_STALE_SECONDS: 'pending'
+        rows whose task was lost and 'processing' rows of a worker that died (reset to 'pending').
+        Returns the number of equipment requeued.
+        """
+        from datetime import timedelta
+        from .models import EquipmentPhotoImport
+        stale_seconds = int(getattr(settings, 'EQUIPMENT_PHOTO_IMPORT_STALE_SECONDS', 15 * 60))
+        cutoff = timezone.now() - timedelta(seconds=stale_seconds)
+        EquipmentPhotoImport.objects.filter(status='processing', updated_at__lt=cutoff).update(
+            status='pending', updated_at=timezone.now()
+        )
+        stale = EquipmentPhotoImport.objects.filter(status='pending', updated_at__lt=cutoff)
+        equipment_ids = list(stale.order_by().values_list('equipment_id', flat=True).distinct())
+        # Обновляем updated_at, чтобы следующий запуск не ставил их в очередь повторно
+        stale.update(updated_at=timezone.now())
+        for equipment_id in equipment_ids:
+            CloudImageImportService.enqueue(equipment_id)
+        return len(equipment_ids)
+
+    @staticmethod
+    def process_import(photo_import):
+        """
+        Import one EquipmentPhotoImport. On failure the link is kept in equipment_imagelinks
+        (as the synchronous import did) so it is still displayed. Returns True on success.
+        """
+        from .models import EquipmentPhotoImport
+        claimed = EquipmentPhotoImport.objects.filter(
+            pk=photo_import.pk, status='pending'
+        ).update(status='processing', updated_at=timezone.now())
+        if not claimed:
+            return False
+        photo = None
+        error = None
+        try:
+            photo = CloudImageImportService.import_and_save(
+                photo_import.equipment, photo_import.source_url,
+                name=photo_import.name, sort_order=photo_import.sort_order
+            )
+            if not photo:
+                error = 'Link inactive or download error'
+        except Exception as e:
+            error = str(e)
+        with transaction.atomic():
+            if photo:
+                updated = EquipmentPhotoImport.objects.filter(pk=photo_import.pk).update(
+                    status='done', photo=photo, error=None, updated_at=timezone.now()
+                )
+                if not updated:
+                    # Import was cancelled (links replaced) while downloading
+                    photo.delete()
+                return bool(updated)
+            updated = EquipmentPhotoImport.objects.filter(pk=photo_import.pk).update(
+                status='failed', error=error, updated_at=timezone.now()
+            )
+            if updated:
+                equipment = Equipment.objects.select_for_update().get(pk=photo_import.equipment_id)
+                links = equipment.equipment_imagelinks if isinstance(equipment.equipment_imagelinks, list) else []
+                # На исходную позицию: перед первой ссылкой, которая стояла во входном списке позже
+                position = next(
+                    (i for i, link in enumerate(links)
+                     if isinstance(link, dict) and (link.get('sort_order') or 0) > photo_import.sort_order),
+                    len(links)
+                )
+                links.insert(position, {
+                    'name': photo_import.name, 'url': photo_import.source_url, 'sort_order': photo_import.sort_order
+                })
+                equipment.equipment_imagelinks = links
+                equipment.save(update_fields=['equipment_imagelinks', 'updated_at'])
+        logger.warning(
+            "Photo import failed: equipment_id=%s url=%s: %s",
+            photo_import.equipment_id, photo_import.source_url[:80], error,
+        )
+        return False
+
+    @staticmethod
+    def save_photo(equipment_id, jpeg_bytes, name='', sort_order=0, source_sha256=None):
+        """
+        Save optimized bytes as EquipmentPhoto backed by a MediaBlob (bytes already stored are not rewritten).
+        Returns EquipmentPhoto instance or None on failure.
+        """
         if not jpeg_bytes:
             return None
         try:
-            photo = EquipmentPhoto(equipment=equipment, name=name or '', sort_order=sort_order)
-            photo.image.save(
-                f"{__import__('uuid').uuid4().hex}.jpg",
-                ContentFile(jpeg_bytes),
-                save=True
+            blob = MediaStoreService.store_bytes(
+                jpeg_bytes, CloudImageImportService.photo_extension(jpeg_bytes), source_sha256=source_sha256
             )
-            return photo
+            return MediaStoreService.attach_photo(equipment_id, blob, name=name, sort_order=sort_order)
         except Exception as e:
-            logger.warning("Save EquipmentPhoto failed for equipment %s: %s", equipment.equipment_id, e)
+            logger.warning("Save EquipmentPhoto failed for equipment %s: %s", equipment_id, e)
             return None
 
 
-class CostCalculationService:
-    """Service for calculating equipment cost."""
-    
+IMAGE_PROXY_CHUNK_SIZE = 64 * 1024
+
+
+class ImageProxyCacheService:
+    """
+    Content-addressed disk cache for ImageProxyView.
+
+    Layout under IMAGE_PROXY_CACHE_DIR:
+        objects/<sha[:2]>/<sha>   - image bytes, named by sha256 of the content (also the ETag)
+        urls/<key[:2]>/<key>.json - per-URL index: {sha, content_type, size, fetched_at}
+    Identical images behind different links share one object. Concurrent misses for the
+    same URL are coalesced with a cache.add() lock so only one worker hits Google/Yandex.
+    """
+
     @staticmethod
-    def convert_currency(amount, from_currency, to_currency, date=None, proposal=None, manual_rate_value=None):
+    def _cache_dir():
+        return str(getattr(settings, 'IMAGE_PROXY_CACHE_DIR', os.path.join(settings.BASE_DIR, 'cache', 'image_proxy')))
+
+    @staticmethod
+    def _ttl():
+        return int(getattr(settings, 'IMAGE_PROXY_CACHE_TTL', 24 * 60 * 60))
+
+    @staticmethod
+    def url_key(url):
+        import hashlib
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def object_path(sha):
+        return os.path.join(ImageProxyCacheService._cache_dir(), 'objects', sha[:2], sha)
+
+    @staticmethod
+    def _index_path(key):
+        return os.path.join(ImageProxyCacheService._cache_dir(), 'urls', key[:2], f'{key}.json')
+
+    @staticmethod
+    def lookup(url):
+        """Return fresh index entry for url (dict with sha/content_type/size) or None."""
+        import json
+        import time
+        index_path = ImageProxyCacheService._index_path(ImageProxyCacheService.url_key(url))
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get('fetched_at', 0) > ImageProxyCacheService._ttl():
+            return None
+        sha = entry.get('sha')
+        if not sha or not ImageProxyCacheService._touch(ImageProxyCacheService.object_path(sha)):
+            return None
+        return entry
+
+    # Не чаще раза в 10 минут обновляем mtime объекта при попадании (mtime = последнее использование)
+    TOUCH_INTERVAL = 10 * 60
+    # Приблизительный размер objects/ (байты), поддерживается fetch() и enforce_size_cap()
+    SIZE_CACHE_KEY = 'image_proxy_cache_bytes'
+
+    @staticmethod
+    def _touch(path):
+        """Mark the object as recently used for LRU eviction; False if it is gone."""
+        import time
+        try:
+            if time.time() - os.stat(path).st_mtime > ImageProxyCacheService.TOUCH_INTERVAL:
+                os.utime(path, None)
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def _write_index(url, entry):
+        import json
+        index_path = ImageProxyCacheService._index_path(ImageProxyCacheService.url_key(url))
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        tmp_path = f'{index_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, index_path)
+
+    @staticmethod
+    def fetch(url, headers=None):
         """
-        Конвертировать сумму из одной валюты в другую.
-        
-        Args:
-            amount: Сумма для конвертации
-            from_currency: Валюта "из"
-            to_currency: Валюта "в"
-            date: Дата курса (если None, используется сегодня)
-            proposal: КП для получения корректировки курса
-            manual_rate_value: Ручное значение курса (если указано, используется вместо поиска в БД)
-        
-        Returns:
-            Decimal: Конвертированная сумма
+        Stream url to disk (chunked, size-capped), store it content-addressed and index it.
+        Returns index entry dict. Raises requests.RequestException / ValueError on failure.
         """
-        if from_currency == to_currency:
-            return Decimal(str(amount))
-        
-        # Использовать ручной курс, если указан
-        if manual_rate_value is not None:
-            rate_value = Decimal(str(manual_rate_value))
-        else:
-            # Получить курс валюты из БД
-            rate = ExchangeRate.get_latest_rate(
-                currency_from=from_currency,
-                currency_to=to_currency,
-                date=date,
-                proposal=proposal
-            )
-            
-            if not rate:
-                raise ValueError(
-                    f'Exchange rate not found for {from_currency}/{to_currency}'
-                    + (f' on {date}' if date else '')
-                    + '. Please provide exchange rate in the proposal or create it manually.'
-                )
-            
-            rate_value = rate.rate_value
-        
-        # Конвертировать
-        converted_amount = Decimal(str(amount)) * rate_value
-        return converted_amount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-    
+        import hashlib
+        import tempfile
+        import time
+        max_bytes = int(getattr(settings, 'IMAGE_PROXY_MAX_IMAGE_BYTES', 15 * 1024 * 1024))
+        tmp_dir = os.path.join(ImageProxyCacheService._cache_dir(), 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        with requests.get(url, headers=headers, timeout=(5, 20), stream=True) as r:
+            r.raise_for_status()
+            content_type = r.headers.get('Content-Type', 'application/octet-stream')
+            # Only allow image types
+            if 'image/' not in content_type and content_type not in ('application/octet-stream',):
+                raise ValueError('Not an image')
+            digest = hashlib.sha256()
+            size = 0
+            fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    for chunk in r.iter_content(chunk_size=IMAGE_PROXY_CHUNK_SIZE):
+                        if not chunk:
+                            continue
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise ValueError('Image too large')
+                        digest.update(chunk)
+                        out.write(chunk)
+                sha = digest.hexdigest()
+                obj_path = ImageProxyCacheService.object_path(sha)
+                os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+                created = not os.path.exists(obj_path)
+                if created:
+                    os.replace(tmp_path, obj_path)
+                else:
+                    os.remove(tmp_path)
+                    os.utime(obj_path, None)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        entry = {'sha': sha, 'content_type': content_type, 'size': size, 'fetched_at': time.time()}
+        ImageProxyCacheService._write_index(url, entry)
+        if created:
+            ImageProxyCacheService._account(size)
+        return entry
+
     @staticmethod
-    def calculate_equipment_cost(
-        equipment,
-        purchase_price_id=None,
-        logistics_id=None,
-        additional_prices_id=None,
-        exchange_rate_date=None,
-        proposal=None,
-        target_currency='KZT',
-        manual_overrides=None
-    ):
+    def _account(size):
+        """Add a new object to the tracked total; evict only when the cap is exceeded."""
+        max_total = int(getattr(settings, 'IMAGE_PROXY_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+        try:
+            total = cache.incr(ImageProxyCacheService.SIZE_CACHE_KEY, size)
+        except ValueError:
+            # Счетчика еще нет (или он вытеснен) - пересчитает enforce_size_cap
+            total = None
+        if total is None or total > max_total:
+            ImageProxyCacheService.enforce_size_cap()
+
+    @staticmethod
+    def get_or_fetch(url, headers=None):
         """
-        Рассчитать себестоимость оборудования по формуле:
-        Себестоимость в KZT = (закупочная цена + логистика + склад + производственные расходы + доп.расходы)
-        где все компоненты конвертируются в KZT через курс валюты из КП
-        
-        Args:
-            equipment: Equipment объект
-            purchase_price_id: ID конкретной цены закупки (если None, берется активная)
-            logistics_id: ID конкретной логистики (если None, берется активная)
-            additional_prices_id: ID дополнительных расходов (если None, не учитываются)
-            exchange_rate_date: Дата курса валюты (если None, используется сегодня)
-            proposal: CommercialProposal для получения корректировок курса
-            target_currency: Целевая валюта для результата (по умолчанию KZT)
-            manual_overrides: Словарь с ручными переопределениями значений
-        
-        Returns:
-            dict: Словарь с результатами расчета
+        Return index entry for url, downloading on miss. Concurrent misses are coalesced:
+        the worker that wins the lock downloads, the others wait for its result.
         """
-        if exchange_rate_date is None:
-            exchange_rate_date = timezone.now().date()
-        
-        manual_overrides = manual_overrides or {}
-        
-        # 1. Закупочная цена
-        purchase_price_value = Decimal('0')
-        purchase_price_currency = None
-        purchase_price_source = None
-        purchase_price_obj = None
-        
+        import time
+        entry = ImageProxyCacheService.lookup(url)
+        if entry:
+            return entry
+        lock_key = f'image_proxy_lock_{ImageProxyCacheService.url_key(url)}'
+        wait_seconds = int(getattr(settings, 'IMAGE_PROXY_LOCK_WAIT', 25))
+        if cache.add(lock_key, 1, timeout=wait_seconds + 5):
+            try:
+                return ImageProxyCacheService.fetch(url, headers=headers)
+            finally:
+                cache.delete(lock_key)
+        # Another worker is downloading this URL; poll for its result
+        deadline = time.monotonic() + wait_seconds
+        while time.monotonic() < deadline:
+            time.sleep(0.2)
+            entry = ImageProxyCacheService.lookup(url)
+            if entry:
+                return entry
+            if cache.get(lock_key) is None:
+                break
+        return ImageProxyCacheService.lookup(url) or ImageProxyCacheService.fetch(url, headers=headers)
+
+    @staticmethod
+    def enforce_size_cap():
+        """
+        Evict least recently used objects (mtime, see _touch) until the cache fits
+        IMAGE_PROXY_CACHE_MAX_BYTES and store the real total for _account().
+        Walks objects/, so it runs only when the tracked total is over the cap or
+        unknown, and from Celery Beat (prune_image_proxy_cache_task) to correct drift.
+        """
+        max_total = int(getattr(settings, 'IMAGE_PROXY_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+        objects_dir = os.path.join(ImageProxyCacheService._cache_dir(), 'objects')
+        files = []
+        total = 0
+        for root, _dirs, names in os.walk(objects_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        if total <= max_total:
+            cache.set(ImageProxyCacheService.SIZE_CACHE_KEY, total, timeout=None)
+            return 0
+        removed = 0
+        for _mtime, size, path in sorted(files):
+            if total <= max_total:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                continue
+        cache.set(ImageProxyCacheService.SIZE_CACHE_KEY, total, timeout=None)
+        # Index entries pointing at evicted objects are treated as misses by lookup()
+        logger.info("Image proxy cache: evicted %s objects", removed)
+        return removed
+
+
+class _ILikeContains(Lookup):
+    """
+    Plain `column ILIKE '%text%'` on the bare column. Django's icontains compiles to
+    UPPER(column::text) LIKE UPPER(...), which the gin_trgm_ops column indexes cannot serve.
+    """
+    lookup_name = 'ilike_contains'
+
+    def get_db_prep_lookup(self, value, connection):
+        return '%s', ['%%%s%%' % connection.ops.prep_for_like_query(value)]
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} ILIKE {rhs}', [*lhs_params, *rhs_params]
+
+
+class EquipmentSearchService:
+    """
+    Catalog search on PostgreSQL: ranked full-text match on Equipment.search_vector
+    (name, articule, short description, specification values) plus trigram similarity
+    on name / articule for typos and partial article codes (GIN indexes, see 0048).
+    """
+
+    @staticmethod
+    def _config():
+        return getattr(settings, 'EQUIPMENT_SEARCH_CONFIG', 'russian')
+
+    @staticmethod
+    def build_vector():
+        from django.contrib.postgres.aggregates import StringAgg
+        from django.contrib.postgres.search import SearchVector
+        from django.db.models import OuterRef, Subquery
+        from .models import EquipmentSpecification
+        config = EquipmentSearchService._config()
+        spec_values = (
+            EquipmentSpecification.objects.filter(equipment_id=OuterRef('pk'))
+            .values('equipment_id')
+            .annotate(text=StringAgg('spec_parameter_value', delimiter=' '))
+            .values('text')
+        )
+        return (
+            SearchVector('equipment_name', weight='A', config=config)
+            + SearchVector('equipment_articule', weight='A', config='simple')
+            + SearchVector('equipment_short_description', weight='B', config=config)
+            + SearchVector(Subquery(spec_values), weight='C', config=config)
+        )
+
+    @staticmethod
+    def update_search_vector(equipment_ids):
+        """Recompute search_vector for given equipment (queryset update, no signals)."""
+        ids = [pk for pk in set(equipment_ids) if pk]
+        if ids:
+            Equipment.objects.filter(pk__in=ids).update(search_vector=EquipmentSearchService.build_vector())
+
+    @staticmethod
+    def _set_trigram_threshold(using):
+        """
+        pg_trgm.similarity_threshold for the % operator (trigram_similar) of this connection.
+        Set once per connection: the GUC is session-level.
+        """
+        from django.db import connections
+        connection = connections[using]
+        threshold = float(getattr(settings, 'EQUIPMENT_SEARCH_TRIGRAM_THRESHOLD', 0.3))
+        connection.ensure_connection()
+        # Ключ - сама DB-сессия: после переподключения порог выставляется заново
+        state = (id(connection.connection), threshold)
+        if getattr(connection, '_trigram_threshold', None) == state:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, false)", [str(threshold)])
+        connection._trigram_threshold = state
+
+    @staticmethod
+    def search(queryset, text):
+        """
+        Filter queryset by text and annotate search_rank / search_similarity for ordering.
+        Every filter branch is index-backed: search_vector (GIN), % and ILIKE on name /
+        articule (trigram GIN); similarity() is only computed for ranking of matched rows.
+        """
+        from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+        from django.db.models import F, Q
+        from django.db.models.functions import Coalesce, Greatest
+        from django.db.models import FloatField, Value
+        text = text.strip()
+        query = SearchQuery(text, search_type='websearch', config=EquipmentSearchService._config())
+        EquipmentSearchService._set_trigram_threshold(queryset.db)
+        return queryset.filter(
+            Q(search_vector=query)
+            | Q(equipment_name__trigram_similar=text)
+            | Q(equipment_articule__trigram_similar=text)
+            # Partial article codes: ILIKE on the bare column is served by the trigram GIN indexes
+            | Q(_ILikeContains(F('equipment_articule'), text))
+            | Q(_ILikeContains(F('equipment_name'), text))
+        ).annotate(
+            search_rank=SearchRank(F('search_vector'), query),
+            search_similarity=Greatest(
+                Coalesce(TrigramSimilarity('equipment_name', text), Value(0.0), output_field=FloatField()),
+                Coalesce(TrigramSimilarity('equipment_articule', text), Value(0.0), output_field=FloatField()),
+            ),
+        )
+
+
+class SpecParameterService:
+    """
+    Parameter dictionary (SpecParameter) and typed values for EquipmentSpecification /
+    EquipmentDetails: "0,55 кВт" -> value_numeric=0.55, value_unit="квт". Values are converted
+    to a canonical unit where the unit is known (Вт -> кВт, г/т -> кг, ...), so range filters
+    compare like with like. Single saves go through the pre_save signal; bulk paths call prepare().
+    """
+
+    # normalized unit -> (canonical unit, factor)
+    UNIT_ALIASES = {
+        'вт': ('квт', Decimal('0.001')), 'w': ('квт', Decimal('0.001')),
+        'квт': ('квт', Decimal('1')), 'kw': ('квт', Decimal('1')),
+        'мвт': ('квт', Decimal('1000')), 'mw': ('квт', Decimal('1000')),
+        'г': ('кг', Decimal('0.001')), 'g': ('кг', Decimal('0.001')),
+        'кг': ('кг', Decimal('1')), 'kg': ('кг', Decimal('1')),
+        'т': ('кг', Decimal('1000')), 't': ('кг', Decimal('1000')),
+        'мм': ('мм', Decimal('1')), 'mm': ('мм', Decimal('1')),
+        'см': ('мм', Decimal('10')), 'cm': ('мм', Decimal('10')),
+        'м': ('мм', Decimal('1000')), 'm': ('мм', Decimal('1000')),
+        'кг/ч': ('кг/ч', Decimal('1')), 'кг/час': ('кг/ч', Decimal('1')), 'kg/h': ('кг/ч', Decimal('1')),
+        'т/ч': ('кг/ч', Decimal('1000')), 'т/час': ('кг/ч', Decimal('1000')), 't/h': ('кг/ч', Decimal('1000')),
+        'л': ('л', Decimal('1')), 'l': ('л', Decimal('1')),
+        'м3': ('л', Decimal('1000')), 'м³': ('л', Decimal('1000')),
+        'в': ('в', Decimal('1')), 'v': ('в', Decimal('1')),
+        'об/мин': ('об/мин', Decimal('1')), 'rpm': ('об/мин', Decimal('1')),
+    }
+    _NUMBER_RE = re.compile(
+        r'^\s*(?:[<>≤≥~≈]=?|до|от|не более|не менее|max|min)?\s*(-?\d[\d\s\xa0]*(?:[.,]\d+)?)\s*(.*)$',
+        re.IGNORECASE
+    )
+    _RANGE_TAIL_RE = re.compile(r'^[-–—]\s*\d[\d\s\xa0]*(?:[.,]\d+)?\s*')
+    MAX_ABS_VALUE = Decimal('1e14')
+
+    @staticmethod
+    def normalize_unit(unit):
+        unit = re.sub(r'\s+', '', (unit or '').strip().lower()).rstrip('.')
+        return unit[:32] or None
+
+    @staticmethod
+    def parse_value(text):
+        """Return (Decimal or None, unit or None) for a raw parameter value."""
+        if text is None:
+            return None, None
+        match = SpecParameterService._NUMBER_RE.match(str(text))
+        if not match:
+            return None, None
+        number = re.sub(r'[\s\xa0]', '', match.group(1)).replace(',', '.')
+        try:
+            value = Decimal(number)
+        except InvalidOperation:
+            return None, None
+        # "500-700 кг/ч": the lower bound is kept, the unit follows the range
+        unit = SpecParameterService.normalize_unit(SpecParameterService._RANGE_TAIL_RE.sub('', match.group(2)))
+        if unit in SpecParameterService.UNIT_ALIASES:
+            unit, factor = SpecParameterService.UNIT_ALIASES[unit]
+            value = value * factor
+        if abs(value) >= SpecParameterService.MAX_ABS_VALUE:
+            return None, unit
+        return value.quantize(Decimal('0.000001')), unit
+
+    @staticmethod
+    def _lookup(names):
+        """Parameter names -> (id, unit); missing names are added to the dictionary (two queries at most + insert)."""
+        from .models import SpecParameter
+        names = {name.strip() for name in names if name and name.strip()}
+        if not names:
+            return {}
+        found = {
+            name: (parameter_id, unit) for name, parameter_id, unit in
+            SpecParameter.objects.filter(parameter_name__in=names).values_list('parameter_name', 'parameter_id', 'unit')
+        }
+        missing = names - set(found)
+        if missing:
+            SpecParameter.objects.bulk_create(
+                [SpecParameter(parameter_name=name) for name in sorted(missing)], ignore_conflicts=True
+            )
+            found.update(
+                (name, (parameter_id, unit)) for name, parameter_id, unit in
+                SpecParameter.objects.filter(parameter_name__in=missing).values_list('parameter_name', 'parameter_id', 'unit')
+            )
+        return found
+
+    @staticmethod
+    def resolve(names):
+        """Parameter names -> ids; missing names are added to the dictionary."""
+        return {name: parameter_id for name, (parameter_id, _unit) in SpecParameterService._lookup(names).items()}
+
+    @staticmethod
+    def prepare(objs, name_field, value_field):
+        """
+        Fill parameter / value_numeric / value_unit of unsaved or loaded rows in bulk.
+        Parameters without a unit (new ones) get the most frequent unit of these values,
+        so range filters work without waiting for refresh_units().
+        """
+        from collections import Counter
+        from .models import SpecParameter
+        found = SpecParameterService._lookup(getattr(obj, name_field) for obj in objs)
+        unitless = {}
+        for obj in objs:
+            parameter_id, unit = found.get((getattr(obj, name_field) or '').strip(), (None, None))
+            obj.parameter_id = parameter_id
+            obj.value_numeric, obj.value_unit = SpecParameterService.parse_value(getattr(obj, value_field))
+            if parameter_id and unit is None and obj.value_numeric is not None and obj.value_unit:
+                unitless.setdefault(parameter_id, Counter())[obj.value_unit] += 1
+        for parameter_id, units in unitless.items():
+            SpecParameter.objects.filter(pk=parameter_id, unit__isnull=True).update(
+                unit=units.most_common(1)[0][0], updated_at=timezone.now()
+            )
+        return objs
+
+    @staticmethod
+    def _unit_filter(parameter_unit):
+        """Values in the parameter's unit only ("5 л.с." or "1200x800x600 мм" are not comparable)."""
+        from django.db.models import Q
+        if parameter_unit is None:
+            return Q(value_unit__isnull=True)
+        return Q(value_unit=parameter_unit)
+
+    @staticmethod
+    def range_filter(queryset, spec_ranges):
+        """
+        Filter Equipment by "<parameter_id>:<min>:<max>" strings (either bound may be empty,
+        bounds in the parameter's canonical unit). Each range is a semi-join on
+        (parameter, value_numeric) of specifications or details, limited to values in that unit.
+        """
+        from django.db.models import Q
+        from .models import EquipmentDetails, EquipmentSpecification, SpecParameter
+        ranges = []
+        for spec_range in spec_ranges:
+            parts = str(spec_range).split(':')
+            if len(parts) != 3 or not parts[0].strip().isdigit():
+                raise ValueError(f'spec_range: expected "<parameter_id>:<min>:<max>", got {spec_range!r}')
+            bounds = {'parameter_id': int(parts[0])}
+            for lookup, raw in (('value_numeric__gte', parts[1]), ('value_numeric__lte', parts[2])):
+                raw = raw.strip().replace(',', '.')
+                if raw:
+                    try:
+                        bounds[lookup] = Decimal(raw)
+                    except InvalidOperation:
+                        raise ValueError(f'spec_range: not a number: {raw!r}')
+            if len(bounds) == 1:
+                bounds['value_numeric__isnull'] = False
+            ranges.append(bounds)
+        units = dict(
+            SpecParameter.objects.filter(pk__in={bounds['parameter_id'] for bounds in ranges}).values_list('pk', 'unit')
+        )
+        for bounds in ranges:
+            same_unit = SpecParameterService._unit_filter(units.get(bounds['parameter_id']))
+            queryset = queryset.filter(
+                Q(pk__in=EquipmentSpecification.objects.filter(same_unit, **bounds).values('equipment_id'))
+                | Q(pk__in=EquipmentDetails.objects.filter(same_unit, **bounds).values('equipment_id'))
+            )
+        return queryset
+
+    @staticmethod
+    def refresh_units(parameter_ids=None):
+        """Set SpecParameter.unit to the most frequent value_unit of its values."""
+        from collections import Counter
+        from django.db.models import Count
+        from .models import EquipmentDetails, EquipmentSpecification, SpecParameter
+        counts = {}
+        for model in (EquipmentSpecification, EquipmentDetails):
+            rows = model.objects.filter(parameter__isnull=False, value_unit__isnull=False)
+            if parameter_ids is not None:
+                rows = rows.filter(parameter_id__in=parameter_ids)
+            for row in rows.values('parameter_id', 'value_unit').annotate(n=Count('pk')).order_by():
+                counts.setdefault(row['parameter_id'], Counter())[row['value_unit']] += row['n']
+        parameters = list(SpecParameter.objects.filter(pk__in=counts))
+        for parameter in parameters:
+            parameter.unit = counts[parameter.pk].most_common(1)[0][0]
+        SpecParameter.objects.bulk_update(parameters, ['unit'], batch_size=1000)
+        return len(parameters)
+
+    @staticmethod
+    def parameter_stats(search=None):
+        """Dictionary with value counts and numeric min/max (for building range filters)."""
+        from django.db.models import Count, F, Max, Min, Q
+        from .models import EquipmentDetails, EquipmentSpecification, SpecParameter
+        parameters = SpecParameter.objects.order_by('parameter_name')
+        if search:
+            parameters = parameters.filter(parameter_name__icontains=search)
+        stats = {}
+        for model in (EquipmentSpecification, EquipmentDetails):
+            rows = model.objects.filter(parameter__isnull=False)
+            if search:
+                rows = rows.filter(parameter__parameter_name__icontains=search)
+            # min / max only over values in the parameter's unit, as range_filter compares them
+            same_unit = Q(value_unit=F('parameter__unit')) | Q(value_unit__isnull=True, parameter__unit__isnull=True)
+            for row in rows.values('parameter_id').annotate(
+                n=Count('pk'),
+                numeric=Count('value_numeric', filter=same_unit),
+                low=Min('value_numeric', filter=same_unit),
+                high=Max('value_numeric', filter=same_unit),
+            ).order_by():
+                item = stats.setdefault(row['parameter_id'], {'count': 0, 'numeric_count': 0, 'min': None, 'max': None})
+                item['count'] += row['n']
+                item['numeric_count'] += row['numeric']
+                if row['low'] is not None:
+                    item['min'] = row['low'] if item['min'] is None else min(item['min'], row['low'])
+                    item['max'] = row['high'] if item['max'] is None else max(item['max'], row['high'])
+        result = []
+        for parameter in parameters.values('parameter_id', 'parameter_name', 'unit'):
+            item = stats.get(parameter['parameter_id'], {'count': 0, 'numeric_count': 0, 'min': None, 'max': None})
+            result.append({**parameter, **item})
+        return result
+
+
+class CategoryTreeService:
+    """
+    Category tree as a materialized path: Category.path = "/<root_id>/.../<category_id>/".
+    Paths are maintained on save/delete (signals); a subtree is one index-backed
+    LIKE 'prefix%' lookup (category_path_idx), the whole tree is one query.
+    """
+
+    @staticmethod
+    def _depth(path):
+        return max(path.count('/') - 2, 0)
+
+    @staticmethod
+    def would_create_cycle(category, parent):
+        """True if parent is the category itself or one of its descendants."""
+        if parent is None or category is None or category.pk is None:
+            return False
+        if parent.pk == category.pk:
+            return True
+        return bool(category.path) and parent.path.startswith(category.path)
+
+    @staticmethod
+    def _move_descendants(old_prefix, new_prefix, depth_delta):
+        """Rewrite the path prefix of all descendants in one UPDATE."""
+        from django.db.models import F, Value
+        from django.db.models.functions import Concat, Substr
+        from .models import Category
+        Category.objects.filter(path__startswith=old_prefix).exclude(path=old_prefix).update(
+            path=Concat(Value(new_prefix), Substr('path', len(old_prefix) + 1)),
+            depth=F('depth') + depth_delta,
+        )
+
+    @staticmethod
+    def sync_path(category):
+        """Recompute path of a saved category and move its subtree if the parent changed."""
+        from .models import Category
+        parent_path = None
+        if category.parent_category_id:
+            parent_path = Category.objects.filter(pk=category.parent_category_id).values_list('path', flat=True).first()
+        new_path = (parent_path or '/') + f'{category.pk}/'
+        old_path = category.path
+        if new_path == old_path:
+            return
+        new_depth = CategoryTreeService._depth(new_path)
+        with transaction.atomic():
+            Category.objects.filter(pk=category.pk).update(path=new_path, depth=new_depth)
+            if old_path:
+                CategoryTreeService._move_descendants(old_path, new_path, new_depth - category.depth)
+        category.path, category.depth = new_path, new_depth
+
+    @staticmethod
+    def detach_subtree(category):
+        """After delete: children were set to parent NULL (SET_NULL), so their subtrees become roots."""
+        if category.path:
+            CategoryTreeService._move_descendants(category.path, '/', -(category.depth + 1))
+
+    @staticmethod
+    def fill_missing_paths():
+        """Set paths of root categories created without signals (bulk_create)."""
+        from django.db.models import CharField, Value
+        from django.db.models.functions import Cast, Concat
+        from .models import Category
+        return Category.objects.filter(path='', parent_category__isnull=True).update(
+            path=Concat(Value('/'), Cast('category_id', CharField()), Value('/')), depth=0
+        )
+
+    @staticmethod
+    def subtree_path(category_id):
+        """Path prefix of the category's subtree, or None if the category doesn't exist."""
+        from .models import Category
+        return Category.objects.filter(pk=category_id).values_list('path', flat=True).first()
+
+    @staticmethod
+    def tree():
+        """Whole tree with direct equipment counts, nested by parent (one query)."""
+        from django.db.models import Count
+        from .models import Category
+        rows = (
+            Category.objects.annotate(equipment_count=Count('equipment'))
+            .order_by('depth', 'category_name')
+            .values(
+                'category_id', 'category_name', 'category_description', 'parent_category',
+                'path', 'depth', 'equipment_count'
+            )
+        )
+        nodes = {}
+        roots = []
+        for row in rows:
+            row['children'] = []
+            nodes[row['category_id']] = row
+        for row in nodes.values():
+            parent = nodes.get(row['parent_category'])
+            if parent is not None:
+                parent['children'].append(row)
+            else:
+                roots.append(row)
+        return roots
+
+
+class EquipmentFacetService:
+    """
+    Catalog facet counts (category / manufacturer / type / published) for the current
+    search + filter state, in one SQL statement: UNION ALL of GROUP BYs over the M2M through
+    tables. Each facet ignores its own filter, so the client sees counts of the other options.
+    Results are cached by filter signature; any equipment change bumps the cache version.
+    """
+
+    CACHE_KEY_PREFIX = 'equipment_facets:'
+    VERSION_KEY = 'equipment_facets:version'
+    FILTER_PARAMS = (
+        'search', 'category_id', 'include_subcategories', 'manufacturer_id', 'equipment_type_id', 'is_published'
+    )
+    # facet name -> (Equipment M2M field, query param, pk field, name field of the related model)
+    M2M_FACETS = {
+        'categories': ('categories', 'category_id', 'category_id', 'category_name'),
+        'manufacturers': ('manufacturers', 'manufacturer_id', 'manufacturer_id', 'manufacturer_name'),
+        'equipment_types': ('equipment_types', 'equipment_type_id', 'type_id', 'type_name'),
+    }
+
+    @staticmethod
+    def filter_queryset(queryset, params, skip=()):
+        """
+        Catalog filters shared by EquipmentListView and the facets: ?search=, ?category_id=,
+        ?manufacturer_id=, ?equipment_type_id=, ?is_published=, ?spec_range= (repeatable).
+        Params named in skip are ignored. category_id includes subcategories unless
+        ?include_subcategories=false. Raises ValueError for a malformed spec_range.
+        """
+        search = params.get('search', None)
+        if 'search' not in skip and search and search.strip():
+            queryset = EquipmentSearchService.search(queryset, search)
+        for _facet, (field_name, param, pk_field, _name) in EquipmentFacetService.M2M_FACETS.items():
+            value = params.get(param, None)
+            if param not in skip and value:
+                if param == 'category_id' and params.get('include_subcategories', 'true').lower() != 'false':
+                    # Subtree by materialized path (category_path_idx)
+                    path = CategoryTreeService.subtree_path(value) if str(value).isdigit() else None
+                    if path is None:
+                        queryset = queryset.none()
+                    else:
+                        queryset = queryset.filter(categories__path__startswith=path).distinct()
+                    continue
+                queryset = queryset.filter(**{f'{field_name}__{pk_field}': value}).distinct()
+        is_published = params.get('is_published', None)
+        if 'is_published' not in skip and is_published is not None:
+            queryset = queryset.filter(is_published=is_published.lower() == 'true')
+        spec_ranges = EquipmentFacetService._getlist(params, 'spec_range')
+        if 'spec_range' not in skip and spec_ranges:
+            queryset = SpecParameterService.range_filter(queryset, spec_ranges)
+        return queryset
+
+    @staticmethod
+    def _getlist(params, name):
+        if hasattr(params, 'getlist'):
+            return [value for value in params.getlist(name) if value]
+        value = params.get(name)
+        if not value:
+            return []
+        return list(value) if isinstance(value, (list, tuple)) else [value]
+
+    @staticmethod
+    def _version():
+        import uuid
+        version = cache.get(EquipmentFacetService.VERSION_KEY)
+        if version is None:
+            cache.add(EquipmentFacetService.VERSION_KEY, uuid.uuid4().hex, timeout=None)
+            version = cache.get(EquipmentFacetService.VERSION_KEY)
+        return version
+
+    @staticmethod
+    def invalidate():
+        """Drop all cached facets (new version; old entries expire by TTL). Runs after commit."""
+        import uuid
+
+        def bump():
+            cache.set(EquipmentFacetService.VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        transaction.on_commit(bump)
+
+    @staticmethod
+    def cache_key(params):
+        import hashlib
+        import json
+        signature = {
+            name: str(params.get(name)).strip()
+            for name in EquipmentFacetService.FILTER_PARAMS
+            if params.get(name) not in (None, '')
+        }
+        spec_ranges = EquipmentFacetService._getlist(params, 'spec_range')
+        if spec_ranges:
+            signature['spec_range'] = sorted(spec_ranges)
+        digest = hashlib.md5(json.dumps(signature, sort_keys=True).encode('utf-8')).hexdigest()
+        return f"{EquipmentFacetService.CACHE_KEY_PREFIX}{EquipmentFacetService._version()}:{digest}"
+
+    @staticmethod
+    def compute(params):
+        """Run the facet query (no cache)."""
+        from django.db.models import CharField, Count, F, IntegerField, Value
+        from django.db.models.functions import Cast
+
+        def equipment_ids(skip):
+            base = Equipment.objects.all()
+            return EquipmentFacetService.filter_queryset(base, params, skip=skip).values('pk')
+
+        parts = []
+        for facet, (field_name, param, _pk_field, name_field) in EquipmentFacetService.M2M_FACETS.items():
+            field = Equipment._meta.get_field(field_name)
+            through = field.remote_field.through
+            source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+            parts.append(
+                through.objects.filter(**{f'{source}_id__in': equipment_ids(skip=(param,))})
+                .annotate(
+                    facet=Value(facet, output_field=CharField()),
+                    ref=F(f'{target}_id'),
+                    label=F(f'{target}__{name_field}'),
+                )
+                .values('facet', 'ref', 'label')
+                .annotate(count=Count('pk'))
+                .order_by()
+            )
+        parts.append(
+            Equipment.objects.filter(pk__in=equipment_ids(skip=('is_published',)))
+            .annotate(
+                facet=Value('is_published', output_field=CharField()),
+                ref=Cast('is_published', IntegerField()),
+                label=Value('', output_field=CharField()),
+            )
+            .values('facet', 'ref', 'label')
+            .annotate(count=Count('pk'))
+            .order_by()
+        )
+        # Total for the full filter state (ref/label are constants)
+        parts.append(
+            Equipment.objects.filter(pk__in=equipment_ids(skip=()))
+            .annotate(
+                facet=Value('total', output_field=CharField()),
+                ref=Value(0, output_field=IntegerField()),
+                label=Value('', output_field=CharField()),
+            )
+            .values('facet', 'ref', 'label')
+            .annotate(count=Count('pk'))
+            .order_by()
+        )
+
+        result = {'total': 0, 'is_published': {'true': 0, 'false': 0}}
+        for facet in EquipmentFacetService.M2M_FACETS:
+            result[facet] = []
+        for row in parts[0].union(*parts[1:], all=True):
+            facet = row['facet']
+            if facet == 'total':
+                result['total'] = row['count']
+            elif facet == 'is_published':
+                result['is_published']['true' if row['ref'] else 'false'] = row['count']
+            else:
+                _field, _param, pk_field, name_field = EquipmentFacetService.M2M_FACETS[facet]
+                result[facet].append({pk_field: row['ref'], name_field: row['label'], 'count': row['count']})
+        for facet in EquipmentFacetService.M2M_FACETS:
+            result[facet].sort(key=lambda item: -item['count'])
+        return result
+
+    @staticmethod
+    def get_facets(params):
+        """Cached facets for request params (EQUIPMENT_FACETS_CACHE_TTL seconds)."""
+        key = EquipmentFacetService.cache_key(params)
+        result = cache.get(key)
+        if result is None:
+            result = EquipmentFacetService.compute(params)
+            cache.set(key, result, timeout=getattr(settings, 'EQUIPMENT_FACETS_CACHE_TTL', 600))
+        return result
+
+
+class EquipmentFeedService:
+    """
+    Published catalog feed for the website / partner sync (CatalogFeedView).
+
+    Items are published equipment ordered by (updated_at, equipment_id); the opaque since-cursor
+    points after the last row a client has seen. Unpublished / deleted equipment comes as
+    tombstones (CatalogTombstone). Equipment.updated_at is bumped ("touched") when feed-visible
+    related data changes (specs, photos, categories ...), so deltas include such changes.
+    Rows newer than CATALOG_FEED_LAG_SECONDS are held back, so a transaction that commits late
+    with an older updated_at is not skipped by a cursor that already moved past it.
+    """
+
+    @staticmethod
+    def touch(equipment_ids):
+        """Bump updated_at of equipment (queryset update, no signals)."""
+        ids = [pk for pk in set(equipment_ids) if pk]
+        if ids:
+            Equipment.objects.filter(pk__in=ids).update(updated_at=timezone.now())
+
+    @staticmethod
+    def touch_queryset(queryset):
+        """Bump updated_at of all equipment in a queryset (one UPDATE)."""
+        return queryset.update(updated_at=timezone.now())
+
+    @staticmethod
+    def record_removed(equipment_ids, reason):
+        from .models import CatalogTombstone
+        ids = [pk for pk in set(equipment_ids) if pk]
+        if ids:
+            CatalogTombstone.objects.bulk_create(
+                [CatalogTombstone(equipment_id=pk, reason=reason) for pk in ids]
+            )
+
+    @staticmethod
+    def clear_removed(equipment_ids):
+        """Equipment published again: its tombstones no longer apply."""
+        from .models import CatalogTombstone
+        ids = [pk for pk in set(equipment_ids) if pk]
+        if ids:
+            CatalogTombstone.objects.filter(equipment_id__in=ids).delete()
+
+    @staticmethod
+    def encode_cursor(timestamp, equipment_id=None):
+        import base64
+        raw = f"{timestamp.isoformat()}|{equipment_id or ''}"
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(value):
+        """Cursor from encode_cursor() or a plain ISO datetime -> (datetime, equipment_id or None)."""
+        import base64
+        import binascii
+        from django.utils.dateparse import parse_datetime
+        value = (value or '').strip()
+        equipment_id = None
+        try:
+            timestamp = parse_datetime(value)
+            if timestamp is None:
+                raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode('utf-8')
+                stamp, _, pk = raw.partition('|')
+                timestamp = parse_datetime(stamp)
+                equipment_id = int(pk) if pk else None
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            timestamp = None
+        if timestamp is None:
+            raise ValueError('since: invalid cursor')
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+        return timestamp, equipment_id
+
+    @staticmethod
+    def queryset():
+        from django.db.models import Prefetch
+        from .models import EquipmentSpecification
+        return (
+            Equipment.objects.filter(is_published=True)
+            .defer('search_vector', 'equipment_imagelinks', 'equipment_manufacture_price')
+            .prefetch_related(
+                'categories', 'manufacturers', 'equipment_types', 'photos',
+                Prefetch('specifications', queryset=EquipmentSpecification.objects.order_by('spec_parameter_name')),
+            )
+        )
+
+    @staticmethod
+    def item_payload(equipment):
+        return {
+            'equipment_id': equipment.equipment_id,
+            'equipment_name': equipment.equipment_name,
+            'equipment_articule': equipment.equipment_articule,
+            'equipment_uom': equipment.equipment_uom,
+            'equipment_short_description': equipment.equipment_short_description,
+            'equipment_warranty': equipment.equipment_warranty,
+            'equipment_madein_country': equipment.equipment_madein_country,
+            'equipment_videolinks': equipment.equipment_videolinks,
+            'sale_price_kzt': equipment.sale_price_kzt,
+            'categories': [
+                {'category_id': c.category_id, 'category_name': c.category_name, 'path': c.path}
+                for c in equipment.categories.all()
+            ],
+            'manufacturers': [
+                {'manufacturer_id': m.manufacturer_id, 'manufacturer_name': m.manufacturer_name}
+                for m in equipment.manufacturers.all()
+            ],
+            'equipment_types': [
+                {'type_id': t.type_id, 'type_name': t.type_name} for t in equipment.equipment_types.all()
+            ],
+            'specifications': [
+                {
+                    'name': s.spec_parameter_name, 'value': s.spec_parameter_value,
+                    'parameter_id': s.parameter_id, 'value_numeric': s.value_numeric, 'value_unit': s.value_unit,
+                }
+                for s in equipment.specifications.all()
+            ],
+            'photos': [{'name': p.name, 'url': p.image.url} for p in equipment.photos.all() if p.image],
+            'updated_at': equipment.updated_at,
+        }
+
+    @staticmethod
+    def page(since=None, limit=None):
+        """
+        One feed page: {'items', 'deleted', 'next_since', 'has_more'}.
+        Without since: full snapshot (paged), no tombstones. Raises ValueError for a bad cursor.
+        Unchanged data gives a byte-identical page (next_since doesn't depend on request time).
+        """
+        from datetime import timedelta
+        from django.db.models import Q
+        from .models import CatalogTombstone
+        default_limit = int(getattr(settings, 'CATALOG_FEED_PAGE_SIZE', 500))
+        limit = max(1, min(int(limit or default_limit), 2000))
+        until = timezone.now() - timedelta(seconds=int(getattr(settings, 'CATALOG_FEED_LAG_SECONDS', 5)))
+
+        cursor_ts, cursor_id = EquipmentFeedService.decode_cursor(since) if since else (None, None)
+        items = EquipmentFeedService.queryset().filter(updated_at__lte=until)
+        if cursor_ts is not None:
+            after = Q(updated_at__gt=cursor_ts)
+            if cursor_id is not None:
+                after |= Q(updated_at=cursor_ts, equipment_id__gt=cursor_id)
+            items = items.filter(after)
+        rows = list(items.order_by('updated_at', 'equipment_id')[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        deleted = []
+        if cursor_ts is not None:
+            # Tombstones up to the end of this page (the next page continues after it)
+            page_end = rows[-1].updated_at if has_more else until
+            deleted = list(
+                CatalogTombstone.objects.filter(removed_at__gt=cursor_ts, removed_at__lte=page_end)
+                .order_by('removed_at', 'tombstone_id')
+                .values('equipment_id', 'reason', 'removed_at')
+            )
+
+        # Next cursor: the last row actually returned (unchanged feed -> same cursor -> same ETag)
+        next_ts, next_id = cursor_ts, cursor_id
+        if rows:
+            next_ts, next_id = rows[-1].updated_at, rows[-1].equipment_id
+        if deleted and not has_more and (next_ts is None or deleted[-1]['removed_at'] > next_ts):
+            next_ts, next_id = deleted[-1]['removed_at'], None
+        return {
+            'items': [EquipmentFeedService.item_payload(equipment) for equipment in rows],
+            'deleted': deleted,
+            'next_since': EquipmentFeedService.encode_cursor(next_ts, next_id) if next_ts else since,
+            'has_more': has_more,
+        }
+
+
+class EquipmentParameterBulkService:
+    """
+    Set-based upsert of per-equipment key/value rows (details, specifications, tech processes).
+    Rows are unique on (equipment, parameter name), so the whole payload is written with one
+    INSERT ... ON CONFLICT DO UPDATE (bulk_create update_conflicts), plus one DELETE for keys
+    absent from the payload when replace=True. Statement count doesn't depend on payload size.
+    """
+
+    # kind -> model, key column, {value column: accepted payload keys}
+    KINDS = {
+        'details': {
+            'model': 'EquipmentDetails',
+            'key_field': 'detail_parameter_name',
+            'key_aliases': ('key', 'detail_parameter_name'),
+            'value_fields': {'detail_parameter_value': ('value', 'detail_parameter_value')},
+            'typed': True,
+        },
+        'specifications': {
+            'model': 'EquipmentSpecification',
+            'key_field': 'spec_parameter_name',
+            'key_aliases': ('key', 'spec_parameter_name'),
+            'value_fields': {'spec_parameter_value': ('value', 'spec_parameter_value')},
+            'typed': True,
+        },
+        'tech_processes': {
+            'model': 'EquipmentTechProcess',
+            'key_field': 'tech_name',
+            'key_aliases': ('key', 'name', 'tech_name'),
+            'value_fields': {
+                'tech_value': ('value', 'tech_value'),
+                'tech_desc': ('desc', 'description', 'tech_desc'),
+            },
+        },
+    }
+
+    @staticmethod
+    def _clean(value):
+        if value is None:
+            return None
+        value = value.strip() if isinstance(value, str) else str(value).strip()
+        return value or None
+
+    @staticmethod
+    def parse_items(kind, items):
+        """
+        Normalize payload [{"key": ..., "value": ...}, ...] to an ordered {key: {column: value}}.
+        Items without a key are skipped; a repeated key keeps the last value.
+        """
+        spec = EquipmentParameterBulkService.KINDS[kind]
+        rows = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            key = next((item.get(alias) for alias in spec['key_aliases'] if item.get(alias)), '')
+            key = EquipmentParameterBulkService._clean(key)
+            if not key:
+                continue
+            values = {}
+            for column, aliases in spec['value_fields'].items():
+                raw = next((item.get(alias) for alias in aliases if item.get(alias) not in (None, '')), None)
+                values[column] = EquipmentParameterBulkService._clean(raw)
+            rows.pop(key, None)
+            rows[key] = values
+        return rows
+
+    @staticmethod
+    def upsert(kind, equipment_id, items, replace=False):
+        """
+        Upsert parameters of one equipment. With replace=True parameters missing from
+        items are deleted. Returns {'created', 'updated', 'deleted', 'total'}.
+        Raises Equipment.DoesNotExist if equipment is missing.
+        """
+        from django.apps import apps
+        from django.db import transaction
+        spec = EquipmentParameterBulkService.KINDS[kind]
+        model = apps.get_model('proposals', spec['model'])
+        key_field = spec['key_field']
+        rows = EquipmentParameterBulkService.parse_items(kind, items)
+
+        with transaction.atomic():
+            # Lock the equipment row: concurrent bulk saves of the same equipment are serialized
+            Equipment.objects.select_for_update().only('pk').get(pk=equipment_id)
+            existing = set(
+                model.objects.filter(equipment_id=equipment_id).values_list(key_field, flat=True)
+            )
+            if rows:
+                objs = [model(equipment_id=equipment_id, **{key_field: key}, **values) for key, values in rows.items()]
+                update_fields = list(spec['value_fields']) + ['updated_at']
+                if spec.get('typed'):
+                    # bulk_create skips the pre_save signal that fills the typed columns
+                    SpecParameterService.prepare(objs, key_field, next(iter(spec['value_fields'])))
+                    update_fields += ['parameter', 'value_numeric', 'value_unit']
+                model.objects.bulk_create(
+                    objs,
+                    update_conflicts=True,
+                    unique_fields=['equipment', key_field],
+                    update_fields=update_fields,
+                )
+            deleted = 0
+            if replace:
+                stale = existing - set(rows)
+                if stale:
+                    # Single DELETE: nothing references these rows, and .delete() would load them
+                    # and fire post_delete per row (search_vector is refreshed once below instead)
+                    from django.db import connection
+                    opts = model._meta
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            f'DELETE FROM {connection.ops.quote_name(opts.db_table)} '
+                            f'WHERE {connection.ops.quote_name(opts.get_field("equipment").column)} = %s '
+                            f'AND {connection.ops.quote_name(opts.get_field(key_field).column)} = ANY(%s)',
+                            [equipment_id, list(stale)]
+                        )
+                        deleted = cursor.rowcount
+            if kind == 'specifications':
+                # bulk_create / raw delete bypass the post_save/post_delete signals
+                EquipmentSearchService.update_search_vector([equipment_id])
+            if spec.get('typed'):
+                # Typed values feed the ?spec_range= facet counts
+                EquipmentFacetService.invalidate()
+            EquipmentFeedService.touch([equipment_id])
+
+        updated = len(existing.intersection(rows))
+        created = len(rows) - updated
+        return {'created': created, 'updated': updated, 'deleted': deleted, 'total': len(rows)}
+
+
+class CatalogImportService:
+    """
+    Batched catalog import from CSV / XLSX (management command import_catalog, CatalogImportView).
+
+    One row = one Equipment. Columns (all optional except equipment_name for new rows):
+      equipment_id, equipment_articule - match existing equipment (id first, then articule);
+      other Equipment fields by name (equipment_name, sale_price_kzt, is_published, ...);
+      categories / manufacturers / equipment_types - names separated by ';' (replace the set);
+      price:<source_type>     - "1200.50 USD" (purchase price, e.g. price:china);
+      logistics:<route_type>  - "300 USD 25" (cost, currency, estimated days);
+      spec:<name>             - specification value (upsert by name).
+    An empty scalar cell clears the field; empty price/logistics/spec cells are ignored.
+
+    Each batch is one transaction: references are resolved with one query per kind, equipment
+    is written with bulk_create / bulk_update, M2M through-rows, prices and specs in bulk.
+    Invalid rows are reported and skipped; a failed batch reports all of its rows.
+    """
+
+    LIST_SEPARATOR = ';'
+    MAX_REPORTED_ERRORS = 1000
+
+    SCALAR_FIELDS = {
+        'equipment_name': 'str',
+        'equipment_articule': 'str',
+        'equipment_uom': 'str',
+        'equipment_short_description': 'str',
+        'equipment_warranty': 'str',
+        'equipment_madein_country': 'str',
+        'equipment_price_currency_type': 'str',
+        'equipment_videolinks': 'str',
+        'equipment_manufacture_price': 'decimal',
+        'sale_price_kzt': 'decimal',
+        'is_published': 'bool',
+    }
+    # column -> (Equipment M2M field, name column of the related model)
+    M2M_COLUMNS = {
+        'categories': ('categories', 'category_name'),
+        'manufacturers': ('manufacturers', 'manufacturer_name'),
+        'equipment_types': ('equipment_types', 'type_name'),
+    }
+    PRICE_PREFIX = 'price:'
+    LOGISTICS_PREFIX = 'logistics:'
+    SPEC_PREFIX = 'spec:'
+
+    def __init__(self, batch_size=500, create_missing_refs=True, dry_run=False):
+        self.batch_size = max(1, int(batch_size))
+        self.create_missing_refs = create_missing_refs
+        self.dry_run = dry_run
+        self.processed = 0
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    # --- reading ---
+
+    @staticmethod
+    def iter_rows(fileobj, filename=''):
+        """Yield (row_number, {column: value}) from a CSV or XLSX file object without loading it whole."""
+        if str(filename).lower().endswith(('.xlsx', '.xlsm')):
+            yield from CatalogImportService._iter_xlsx(fileobj)
+        else:
+            yield from CatalogImportService._iter_csv(fileobj)
+
+    @staticmethod
+    def _iter_csv(fileobj):
+        import csv
+        import io
+        if isinstance(fileobj, io.TextIOBase):
+            text = fileobj
+        else:
+            # utf-8-sig: Excel puts a BOM in front of CSV exports
+            text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+        sample = text.read(4096)
+        text.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(text, dialect=dialect)
+        # Header is line 1, so the first data row is 2 (as shown in a spreadsheet)
+        for row_number, row in enumerate(reader, start=2):
+            yield row_number, {(key or '').strip(): value for key, value in row.items() if key}
+
+    @staticmethod
+    def _iter_xlsx(fileobj):
+        if openpyxl is None:
+            raise ImportError('XLSX import requires openpyxl (pip install openpyxl)')
+        workbook = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if not header:
+                return
+            columns = [str(name).strip() if name is not None else '' for name in header]
+            for row_number, values in enumerate(rows, start=2):
+                if values is None or all(value is None for value in values):
+                    continue
+                yield row_number, {
+                    column: value for column, value in zip(columns, values) if column
+                }
+        finally:
+            workbook.close()
+
+    # --- parsing ---
+
+    @staticmethod
+    def _text(value):
+        if value is None:
+            return ''
+        return value.strip() if isinstance(value, str) else str(value).strip()
+
+    @staticmethod
+    def _decimal(value, column):
+        text = CatalogImportService._text(value).replace('\xa0', '').replace(' ', '').replace(',', '.')
+        if not text:
+            return None
+        try:
+            return Decimal(text)
+        except InvalidOperation:
+            raise ValueError(f'{column}: not a number: {value!r}')
+
+    @staticmethod
+    def _bool(value, column):
+        text = CatalogImportService._text(value).lower()
+        if text in ('', '0', 'false', 'no', 'нет'):
+            return False
+        if text in ('1', 'true', 'yes', 'да'):
+            return True
+        raise ValueError(f'{column}: expected true/false: {value!r}')
+
+    @staticmethod
+    def _amount(value, column, with_days=False):
+        """Parse "<amount> <currency>[ <days>]"."""
+        parts = CatalogImportService._text(value).split()
+        if len(parts) < 2 or len(parts) > (3 if with_days else 2):
+            expected = '"<amount> <currency> [<days>]"' if with_days else '"<amount> <currency>"'
+            raise ValueError(f'{column}: expected {expected}, got {value!r}')
+        amount = CatalogImportService._decimal(parts[0], column)
+        currency = parts[1].upper()[:10]
+        if not with_days:
+            return amount, currency
+        days = None
+        if len(parts) == 3:
+            if not parts[2].isdigit():
+                raise ValueError(f'{column}: days must be an integer: {parts[2]!r}')
+            days = int(parts[2])
+        return amount, currency, days
+
+    @classmethod
+    def parse_row(cls, raw):
+        """Parse a raw row into a dict of field / relation values. Raises ValueError with all problems."""
+        from .models import Logistics
+        parsed = {'equipment_id': None, 'fields': {}, 'm2m': {}, 'prices': {}, 'logistics': {}, 'specs': {}}
+        problems = []
+        price_sources = {choice for choice, _ in PurchasePrice._meta.get_field('source_type').choices}
+        routes = {choice for choice, _ in Logistics._meta.get_field('route_type').choices}
+
+        for column, value in raw.items():
+            try:
+                if column == 'equipment_id':
+                    text = cls._text(value)
+                    if text:
+                        if not text.split('.')[0].isdigit():
+                            raise ValueError(f'equipment_id: not an integer: {value!r}')
+                        parsed['equipment_id'] = int(text.split('.')[0])
+                elif column in cls.SCALAR_FIELDS:
+                    kind = cls.SCALAR_FIELDS[column]
+                    if kind == 'decimal':
+                        parsed['fields'][column] = cls._decimal(value, column)
+                    elif kind == 'bool':
+                        parsed['fields'][column] = cls._bool(value, column)
+                    else:
+                        parsed['fields'][column] = cls._text(value) or None
+                elif column in cls.M2M_COLUMNS:
+                    parsed['m2m'][column] = [
+                        name.strip() for name in cls._text(value).split(cls.LIST_SEPARATOR) if name.strip()
+                    ]
+                elif column.startswith(cls.PRICE_PREFIX):
+                    source = column[len(cls.PRICE_PREFIX):].strip()
+                    if source not in price_sources:
+                        raise ValueError(f'{column}: unknown source type (use one of {", ".join(sorted(price_sources))})')
+                    if cls._text(value):
+                        parsed['prices'][source] = cls._amount(value, column)
+                elif column.startswith(cls.LOGISTICS_PREFIX):
+                    route = column[len(cls.LOGISTICS_PREFIX):].strip()
+                    if route not in routes:
+                        raise ValueError(f'{column}: unknown route type (use one of {", ".join(sorted(routes))})')
+                    if cls._text(value):
+                        parsed['logistics'][route] = cls._amount(value, column, with_days=True)
+                elif column.startswith(cls.SPEC_PREFIX):
+                    name = column[len(cls.SPEC_PREFIX):].strip()
+                    text = cls._text(value)
+                    if name and text:
+                        parsed['specs'][name] = text
+                # Unknown columns are ignored (e.g. notes added in the spreadsheet)
+            except ValueError as e:
+                problems.append(str(e))
+
+        if 'equipment_name' in parsed['fields'] and not parsed['fields']['equipment_name']:
+            problems.append('equipment_name: must not be empty')
+        if problems:
+            raise ValueError('; '.join(problems))
+        return parsed
+
+    # --- writing ---
+
+    def run(self, rows, progress=None):
+        """Import rows from iter_rows(); progress(summary) is called after every batch."""
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._process_batch(batch)
+                batch = []
+                if progress:
+                    progress(self.summary())
+        if batch:
+            self._process_batch(batch)
+            if progress:
+                progress(self.summary())
+        return self.summary()
+
+    def summary(self):
+        return {
+            'processed': self.processed,
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'dry_run': self.dry_run,
+            'errors': self.errors,
+        }
+
+    def _error(self, row_number, message):
+        self.failed += 1
+        if len(self.errors) < self.MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'error': message})
+
+    def _process_batch(self, batch):
+        self.processed += len(batch)
+        parsed = []
+        for row_number, raw in batch:
+            try:
+                parsed.append((row_number, self.parse_row(raw)))
+            except ValueError as e:
+                self._error(row_number, str(e))
+        if not parsed:
+            return
+        failed, reported = self.failed, len(self.errors)
+        try:
+            with transaction.atomic():
+                created, updated = self._write_batch(parsed)
+                if self.dry_run:
+                    transaction.set_rollback(True)
+        except Exception as e:
+            logger.exception('Catalog import: batch starting at row %s failed', parsed[0][0])
+            # Whole batch rolled back: report every row once, replacing row errors of this batch
+            self.failed, self.errors = failed, self.errors[:reported]
+            for row_number, _ in parsed:
+                self._error(row_number, f'batch failed: {e}')
+            return
+        self.created += created
+        self.updated += updated
+
+    def _match_equipment(self, parsed):
+        """
+        Group rows by target equipment (one query). Rows hitting the same equipment are merged,
+        later values win. Returns list of targets: {'obj', 'is_new', 'rows', 'fields', 'm2m', ...}.
+        """
+        from django.db.models import Q
+        ids = {p['equipment_id'] for _, p in parsed if p['equipment_id']}
+        articules = {
+            p['fields'].get('equipment_articule') for _, p in parsed
+            if not p['equipment_id'] and p['fields'].get('equipment_articule')
+        }
+        by_id, by_articule = {}, {}
+        if ids or articules:
+            for equipment in Equipment.objects.filter(
+                Q(pk__in=ids) | Q(equipment_articule__in=articules)
+            ).defer('search_vector'):
+                by_id[equipment.pk] = equipment
+                by_articule.setdefault(equipment.equipment_articule, []).append(equipment)
+
+        targets = {}
+        for row_number, p in parsed:
+            articule = p['fields'].get('equipment_articule')
+            if p['equipment_id']:
+                equipment = by_id.get(p['equipment_id'])
+                if equipment is None:
+                    self._error(row_number, f'equipment_id {p["equipment_id"]} not found')
+                    continue
+                key = ('id', equipment.pk)
+            elif articule and articule in by_articule:
+                if len(by_articule[articule]) > 1:
+                    self._error(row_number, f'equipment_articule {articule!r} matches several equipment, use equipment_id')
+                    continue
+                equipment = by_articule[articule][0]
+                key = ('id', equipment.pk)
+            elif articule:
+                equipment, key = None, ('new', articule)
+            else:
+                equipment, key = None, ('row', row_number)
+
+            target = targets.get(key)
+            if target is None:
+                if equipment is None and not p['fields'].get('equipment_name'):
+                    self._error(row_number, 'equipment_name is required for new equipment')
+                    continue
+                target = targets[key] = {
+                    'obj': equipment or Equipment(), 'is_new': equipment is None, 'rows': [],
+                    'fields': {}, 'm2m': {}, 'prices': {}, 'logistics': {}, 'specs': {},
+                }
+            target['rows'].append(row_number)
+            for part in ('fields', 'm2m', 'prices', 'logistics', 'specs'):
+                target[part].update(p[part])
+        return list(targets.values())
+
+    def _resolve_refs(self, targets):
+        """Names -> ids for categories / manufacturers / types: one SELECT per kind (+ insert of missing)."""
+        resolved = {}
+        for column, (field_name, name_field) in self.M2M_COLUMNS.items():
+            names = {name for t in targets for name in t['m2m'].get(column, [])}
+            if not names:
+                continue
+            model = Equipment._meta.get_field(field_name).related_model
+            pk_name = model._meta.pk.name
+            ids = dict(model.objects.filter(**{f'{name_field}__in': names}).values_list(name_field, pk_name))
+            missing = names - set(ids)
+            if missing and self.create_missing_refs:
+                model.objects.bulk_create(
+                    [model(**{name_field: name}) for name in sorted(missing)], ignore_conflicts=True
+                )
+                if column == 'categories':
+                    # New categories are roots; bulk_create skips the signal that sets the tree path
+                    CategoryTreeService.fill_missing_paths()
+                ids.update(model.objects.filter(**{f'{name_field}__in': missing}).values_list(name_field, pk_name))
+            resolved[column] = ids
+
+        valid = []
+        for target in targets:
+            unknown = [
+                f'{column}: {name!r}'
+                for column, names in target['m2m'].items()
+                for name in names if name not in resolved.get(column, {})
+            ]
+            if unknown:
+                for row_number in target['rows']:
+                    self._error(row_number, 'unknown references: ' + ', '.join(unknown))
+                continue
+            valid.append(target)
+        return valid, resolved
+
+    def _write_batch(self, parsed):
+        from .models import EquipmentSpecification, Logistics
+        targets = self._match_equipment(parsed)
+        targets, resolved = self._resolve_refs(targets)
+        if not targets:
+            return 0, 0
+
+        # Equipment rows
+        now = timezone.now()
+        new_objs, update_objs, update_fields = [], [], set()
+        unpublished, republished = [], []
+        for target in targets:
+            obj = target['obj']
+            if not target['is_new'] and 'is_published' in target['fields']:
+                if obj.is_published and not target['fields']['is_published']:
+                    unpublished.append(obj.pk)
+                elif not obj.is_published and target['fields']['is_published']:
+                    republished.append(obj.pk)
+            for name, value in target['fields'].items():
+                setattr(obj, name, value)
+            if target['is_new']:
+                new_objs.append(obj)
+            else:
+                obj.updated_at = now
+                update_objs.append(obj)
+                update_fields.update(target['fields'])
+        if new_objs:
+            Equipment.objects.bulk_create(new_objs)
+        if update_objs and update_fields:
+            Equipment.objects.bulk_update(update_objs, sorted(update_fields) + ['updated_at'])
+        equipment_ids = [t['obj'].pk for t in targets]
+
+        # M2M: replace the set for equipment that has the column
+        for column, (field_name, _) in self.M2M_COLUMNS.items():
+            affected = [t for t in targets if column in t['m2m']]
+            if not affected:
+                continue
+            field = Equipment._meta.get_field(field_name)
+            through = field.remote_field.through
+            source, target_fk = field.m2m_field_name(), field.m2m_reverse_field_name()
+            through.objects.filter(**{f'{source}__in': [t['obj'].pk for t in affected]}).delete()
+            through.objects.bulk_create([
+                through(**{f'{source}_id': t['obj'].pk, f'{target_fk}_id': resolved[column][name]})
+                for t in affected for name in dict.fromkeys(t['m2m'][column])
+            ], ignore_conflicts=True)
+
+        self._write_costs(
+            targets, PurchasePrice, 'prices', 'source_type',
+            lambda row: (row.price, row.currency),
+            lambda equipment_id, key, value: PurchasePrice(
+                equipment_id=equipment_id, source_type=key, price=value[0], currency=value[1]
+            ),
+        )
+        self._write_costs(
+            targets, Logistics, 'logistics', 'route_type',
+            lambda row: (row.cost, row.currency, row.estimated_days),
+            lambda equipment_id, key, value: Logistics(
+                equipment_id=equipment_id, route_type=key, cost=value[0], currency=value[1],
+                estimated_days=value[2]
+            ),
+        )
+
+        specs = [
+            EquipmentSpecification(equipment_id=t['obj'].pk, spec_parameter_name=name, spec_parameter_value=value)
+            for t in targets for name, value in t['specs'].items()
+        ]
+        if specs:
+            SpecParameterService.prepare(specs, 'spec_parameter_name', 'spec_parameter_value')
+            EquipmentSpecification.objects.bulk_create(
+                specs,
+                update_conflicts=True,
+                unique_fields=['equipment', 'spec_parameter_name'],
+                update_fields=['spec_parameter_value', 'parameter', 'value_numeric', 'value_unit', 'updated_at'],
+            )
+
+        # bulk_create / bulk_update bypass the post_save signals (search_vector, facets, catalog feed)
+        EquipmentSearchService.update_search_vector(equipment_ids)
+        EquipmentFacetService.invalidate()
+        EquipmentFeedService.touch(equipment_ids)
+        EquipmentFeedService.record_removed(unpublished, 'unpublished')
+        EquipmentFeedService.clear_removed(republished)
+        return len(new_objs), len(targets) - len(new_objs)
+
+    @staticmethod
+    def _write_costs(targets, model, part, key_field, current_value, build):
+        """
+        Purchase prices / logistics: the imported value becomes the active row per
+        (equipment, key). Unchanged values are left alone, changed ones deactivate the old rows.
+        """
+        pairs = {(t['obj'].pk, key): value for t in targets for key, value in t[part].items()}
+        if not pairs:
+            return
+        active = {}
+        for row in model.objects.filter(
+            equipment_id__in={equipment_id for equipment_id, _ in pairs},
+            **{f'{key_field}__in': {key for _, key in pairs}},
+            is_active=True,
+        ):
+            active.setdefault((row.equipment_id, getattr(row, key_field)), []).append(row)
+
+        deactivate, create = [], []
+        for (equipment_id, key), value in pairs.items():
+            rows = active.get((equipment_id, key), [])
+            if len(rows) == 1 and current_value(rows[0]) == tuple(value):
+                continue
+            deactivate.extend(row.pk for row in rows)
+            create.append(build(equipment_id, key, value))
+        if deactivate:
+            model.objects.filter(pk__in=deactivate).update(is_active=False, updated_at=timezone.now())
+        if create:
+            model.objects.bulk_create(create)
+
+
+class CatalogExportService:
+    """
+    Catalog export in the CatalogImportService column format (export -> edit -> import round trip).
+    Equipment is streamed with iterator(chunk_size) and prefetches per chunk, so memory stays flat.
+    """
+
+    @staticmethod
+    def header():
+        """Column list: Equipment fields, M2M names, price/logistics per source, one column per spec name."""
+        from .models import EquipmentSpecification, Logistics
+        columns = ['equipment_id'] + list(CatalogImportService.SCALAR_FIELDS) + list(CatalogImportService.M2M_COLUMNS)
+        columns += [
+            CatalogImportService.PRICE_PREFIX + choice
+            for choice, _ in PurchasePrice._meta.get_field('source_type').choices
+        ]
+        columns += [
+            CatalogImportService.LOGISTICS_PREFIX + choice
+            for choice, _ in Logistics._meta.get_field('route_type').choices
+        ]
+        spec_names = (
+            EquipmentSpecification.objects.filter(equipment__isnull=False)
+            .order_by('spec_parameter_name').values_list('spec_parameter_name', flat=True).distinct()
+        )
+        columns += [CatalogImportService.SPEC_PREFIX + name for name in spec_names]
+        return columns
+
+    @staticmethod
+    def queryset():
+        from django.db.models import Prefetch
+        from .models import EquipmentSpecification, Logistics
+        return (
+            Equipment.objects.defer('search_vector', 'equipment_imagelinks').order_by('equipment_id')
+            .prefetch_related(
+                'categories', 'manufacturers', 'equipment_types',
+                Prefetch('purchase_prices', queryset=PurchasePrice.objects.filter(is_active=True).order_by('-updated_at')),
+                Prefetch('logistics', queryset=Logistics.objects.filter(is_active=True).order_by('-updated_at')),
+                Prefetch('specifications', queryset=EquipmentSpecification.objects.only(
+                    'spec_id', 'equipment_id', 'spec_parameter_name', 'spec_parameter_value'
+                )),
+            )
+        )
+
+    @staticmethod
+    def _format(value):
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        return str(value)
+
+    @staticmethod
+    def iter_rows(header, chunk_size=1000):
+        """Yield one list of cell values per equipment, in header order."""
+        fmt = CatalogExportService._format
+        separator = CatalogImportService.LIST_SEPARATOR + ' '
+        for equipment in CatalogExportService.queryset().iterator(chunk_size=chunk_size):
+            row = {'equipment_id': equipment.pk}
+            for name in CatalogImportService.SCALAR_FIELDS:
+                row[name] = fmt(getattr(equipment, name))
+            row['categories'] = separator.join(c.category_name for c in equipment.categories.all())
+            row['manufacturers'] = separator.join(m.manufacturer_name for m in equipment.manufacturers.all())
+            row['equipment_types'] = separator.join(t.type_name for t in equipment.equipment_types.all())
+            # Latest active row per source / route (the import keeps one active row per key)
+            for price in reversed(list(equipment.purchase_prices.all())):
+                row[CatalogImportService.PRICE_PREFIX + price.source_type] = f'{price.price} {price.currency}'
+            for item in reversed(list(equipment.logistics.all())):
+                value = f'{item.cost} {item.currency}'
+                if item.estimated_days is not None:
+                    value += f' {item.estimated_days}'
+                row[CatalogImportService.LOGISTICS_PREFIX + item.route_type] = value
+            for spec in equipment.specifications.all():
+                row[CatalogImportService.SPEC_PREFIX + spec.spec_parameter_name] = fmt(spec.spec_parameter_value)
+            yield [row.get(column, '') for column in header]
+
+    @staticmethod
+    def iter_csv(chunk_size=1000):
+        """Yield CSV text chunks (header first) - for StreamingHttpResponse or writing to a file."""
+        import csv
+        import io
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        header = CatalogExportService.header()
+        # BOM so Excel opens UTF-8 (Cyrillic) correctly
+        buffer.write('\ufeff')
+        writer.writerow(header)
+        for row in CatalogExportService.iter_rows(header, chunk_size=chunk_size):
+            writer.writerow(row)
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+
+    @staticmethod
+    def write_xlsx(fileobj, chunk_size=1000):
+        """Write XLSX with openpyxl write-only mode (rows are flushed, not kept in memory)."""
+        if openpyxl is None:
+            raise ImportError('XLSX export requires openpyxl (pip install openpyxl)')
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet('equipment')
+        header = CatalogExportService.header()
+        sheet.append(header)
+        for row in CatalogExportService.iter_rows(header, chunk_size=chunk_size):
+            sheet.append(row)
+        workbook.save(fileobj)
+
+
+class CostCalculationService:
+    """Service for calculating equipment cost."""
+    
+    @staticmethod
+    def convert_currency(amount, from_currency, to_currency, date=None, proposal=None, manual_rate_value=None):
+        """
+        Конвертировать сумму из одной валюты в другую.
+        
+        Args:
+            amount: Сумма для конвертации
+            from_currency: Валюта "из"
+            to_currency: Валюта "в"
+            date: Дата курса (если None, используется сегодня)
+            proposal: КП для получения корректировки курса
+            manual_rate_value: Ручное значение курса (если указано, используется вместо поиска в БД)
+        
+        Returns:
+            Decimal: Конвертированная сумма
+        """
+        if from_currency == to_currency:
+            return Decimal(str(amount))
+        
+        # Использовать ручной курс, если указан
+        if manual_rate_value is not None:
+            rate_value = Decimal(str(manual_rate_value))
+        else:
+            # Получить курс валюты из БД
+            rate = ExchangeRate.get_latest_rate(
+                currency_from=from_currency,
+                currency_to=to_currency,
+                date=date,
+                proposal=proposal
+            )
+            
+            if not rate:
+                raise ValueError(
+                    f'Exchange rate not found for {from_currency}/{to_currency}'
+                    + (f' on {date}' if date else '')
+                    + '. Please provide exchange rate in the proposal or create it manually.'
+                )
+            
+            rate_value = rate.rate_value
+        
+        # Конвертировать
+        converted_amount = Decimal(str(amount)) * rate_value
+        return converted_amount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    
+    @staticmethod
+    def calculate_equipment_cost(
+        equipment,
+        purchase_price_id=None,
+        logistics_id=None,
+        additional_prices_id=None,
+        exchange_rate_date=None,
+        proposal=None,
+        target_currency='KZT',
+        manual_overrides=None
+    ):
+        """
+        Рассчитать себестоимость оборудования по формуле:
+        Себестоимость в KZT = (закупочная цена + логистика + склад + производственные расходы + доп.расходы)
+        где все компоненты конвертируются в KZT через курс валюты из КП
+        
+        Args:
+            equipment: Equipment объект
+            purchase_price_id: ID конкретной цены закупки (если None, берется активная)
+            logistics_id: ID конкретной логистики (если None, берется активная)
+            additional_prices_id: ID дополнительных расходов (если None, не учитываются)
+            exchange_rate_date: Дата курса валюты (если None, используется сегодня)
+            proposal: CommercialProposal для получения корректировок курса
+            target_currency: Целевая валюта для результата (по умолчанию KZT)
+            manual_overrides: Словарь с ручными переопределениями значений
+        
+        Returns:
+            dict: Словарь с результатами расчета
+        """
+        if exchange_rate_date is None:
+            exchange_rate_date = timezone.now().date()
+        
+        manual_overrides = manual_overrides or {}
+        
+        # 1. Закупочная цена
+        purchase_price_value = Decimal('0')
+        purchase_price_currency = None
+        purchase_price_source = None
+        purchase_price_obj = None
+        
         if purchase_price_id:
             try:
                 purchase_price_obj = PurchasePrice.objects.get(
@@ -352,1083 +2519,2330 @@ class CostCalculationService:
                 is_active=True
             ).order_by('-created_at').first()
         
-        if purchase_price_obj:
-            purchase_price_value = Decimal(str(purchase_price_obj.price))
-            purchase_price_currency = purchase_price_obj.currency
-            purchase_price_source = purchase_price_obj.source_type
+        if purchase_price_obj:
+            purchase_price_value = Decimal(str(purchase_price_obj.price))
+            purchase_price_currency = purchase_price_obj.currency
+            purchase_price_source = purchase_price_obj.source_type
+        
+        # Ручное переопределение
+        if 'purchase_price' in manual_overrides:
+            purchase_price_value = Decimal(str(manual_overrides['purchase_price']))
+            if 'purchase_price_currency' in manual_overrides:
+                purchase_price_currency = manual_overrides['purchase_price_currency']
+        
+        # 2. Логистика - суммируем все активные логистики (кроме склада kz_warehouse)
+        logistics_cost = Decimal('0')
+        logistics_currency = None
+        logistics_route = None
+        logistics_obj = None
+        
+        if logistics_id:
+            try:
+                logistics_obj = Logistics.objects.get(
+                    logistics_id=logistics_id,
+                    equipment=equipment,
+                    is_active=True
+                )
+                logistics_cost = Decimal(str(logistics_obj.cost))
+                logistics_currency = logistics_obj.currency
+                logistics_route = logistics_obj.route_type
+            except Logistics.DoesNotExist:
+                raise ValueError(f'Logistics with ID {logistics_id} not found')
+        else:
+            # Суммируем все активные логистики (кроме склада kz_warehouse)
+            active_logistics = Logistics.objects.filter(
+                equipment=equipment,
+                is_active=True
+            ).exclude(route_type='kz_warehouse').order_by('-created_at')
+            
+            if active_logistics.exists():
+                # Берем первую для route_type (для обратной совместимости)
+                logistics_obj = active_logistics.first()
+                logistics_route = logistics_obj.route_type
+                logistics_currency = logistics_obj.currency
+                # Суммируем логистики в основной валюте (конвертация всех в KZT будет позже)
+                logistics_cost = sum(Decimal(str(l.cost)) for l in active_logistics if l.currency == logistics_currency)
+        
+        # Ручное переопределение
+        if 'logistics_cost' in manual_overrides:
+            logistics_cost = Decimal(str(manual_overrides['logistics_cost']))
+            if 'logistics_currency' in manual_overrides:
+                logistics_currency = manual_overrides['logistics_currency']
+        
+        # 3. Склад (из логистики с маршрутом kz_warehouse)
+        warehouse_cost = Decimal('0')
+        warehouse_currency = None
+        
+        warehouse_logistics = Logistics.objects.filter(
+            equipment=equipment,
+            route_type='kz_warehouse',
+            is_active=True
+        ).first()
+        
+        if warehouse_logistics:
+            warehouse_cost = Decimal(str(warehouse_logistics.cost))
+            warehouse_currency = warehouse_logistics.currency
+        
+        # Ручное переопределение
+        if 'warehouse_cost' in manual_overrides:
+            warehouse_cost = Decimal(str(manual_overrides['warehouse_cost']))
+            if 'warehouse_currency' in manual_overrides:
+                warehouse_currency = manual_overrides['warehouse_currency']
+        
+        # 4. Производственные расходы
+        production_cost = Decimal('0')
+        production_currency = None
+        
+        if equipment.equipment_manufacture_price:
+            production_cost = Decimal(str(equipment.equipment_manufacture_price))
+            production_currency = equipment.equipment_price_currency_type or 'KZT'
+        
+        # Ручное переопределение
+        if 'production_cost' in manual_overrides:
+            production_cost = Decimal(str(manual_overrides['production_cost']))
+            if 'production_currency' in manual_overrides:
+                production_currency = manual_overrides['production_currency']
+        
+        # 5. Дополнительные расходы (AdditionalPrices) - будут рассчитаны после базовой себестоимости
+        # Сначала собираем информацию о доп.расходах
+        additional_prices_list = []
+        
+        # Если есть proposal, проверяем EquipmentList для этого оборудования
+        if proposal:
+            from .models import EquipmentList, EquipmentListItem
+            # Ищем EquipmentList в этом КП, который содержит это оборудование
+            equipment_lists = EquipmentList.objects.filter(
+                proposal=proposal
+            ).prefetch_related('equipment_items_relation', 'additional_prices')
+            
+            for eq_list in equipment_lists:
+                # Проверяем, есть ли это оборудование в списке
+                if eq_list.equipment_items_relation.filter(equipment=equipment).exists():
+                    # Собираем все дополнительные расходы
+                    if eq_list.additional_prices.exists():
+                        additional_prices_list.extend(eq_list.additional_prices.all())
+                    # Поддержка старого поля для обратной совместимости
+                    elif eq_list.additional_price:
+                        additional_prices_list.append(eq_list.additional_price)
+                    break
+        
+        # Если указан конкретный additional_prices_id
+        if additional_prices_id:
+            try:
+                additional_prices_obj = AdditionalPrices.objects.get(price_id=additional_prices_id)
+                additional_prices_list.append(additional_prices_obj)
+            except AdditionalPrices.DoesNotExist:
+                pass
+        
+        # Ручное переопределение - если указано, используем его вместо расчетных
+        manual_additional_costs = None
+        if 'additional_costs' in manual_overrides:
+            manual_additional_costs = Decimal(str(manual_overrides['additional_costs']))
+        
+        # 6. Конвертация всех сумм в базовую валюту (KZT) через курс валюты
+        service = CostCalculationService()
+        
+        # Получаем ручной курс валюты, если указан
+        manual_rate_value = manual_overrides.get('exchange_rate_value')
+        # Если курс не указан вручную, но есть proposal с курсом, используем его
+        if not manual_rate_value and proposal and proposal.exchange_rate:
+            manual_rate_value = proposal.exchange_rate
+        
+        # Определяем базовую валюту для расчета (валюта закупочной цены или KZT)
+        base_currency = purchase_price_currency or 'KZT'
+        
+        # Конвертируем все компоненты в базовую валюту (KZT)
+        # 1. Закупочная цена
+        purchase_price_base = purchase_price_value
+        if purchase_price_currency and purchase_price_currency != 'KZT':
+            try:
+                purchase_price_base = service.convert_currency(
+                    purchase_price_value,
+                    purchase_price_currency,
+                    'KZT',
+                    date=exchange_rate_date,
+                    proposal=proposal,
+                    manual_rate_value=manual_rate_value
+                )
+            except ValueError as e:
+                # Если не удалось конвертировать, используем исходное значение
+                import logging
+                logger = logging.getLogger(__name__)
+                logger.warning(f'Failed to convert purchase price from {purchase_price_currency} to KZT: {e}')
+                purchase_price_base = purchase_price_value
+        
+        # 2. Логистика - суммируем все активные логистики, конвертируя каждую в KZT
+        logistics_base = Decimal('0')
+        if not logistics_id:
+            # Берем все активные логистики (кроме склада)
+            active_logistics = Logistics.objects.filter(
+                equipment=equipment,
+                is_active=True
+            ).exclude(route_type='kz_warehouse')
+            
+            for log in active_logistics:
+                log_cost = Decimal(str(log.cost))
+                if log.currency == 'KZT':
+                    logistics_base += log_cost
+                else:
+                    try:
+                        # Конвертируем в KZT через курс из КП
+                        log_cost_kzt = service.convert_currency(
+                            log_cost,
+                            log.currency,
+                            'KZT',
+                            date=exchange_rate_date,
+                            proposal=proposal,
+                            manual_rate_value=manual_rate_value
+                        )
+                        logistics_base += log_cost_kzt
+                    except ValueError as e:
+                        import logging
+                        logger = logging.getLogger(__name__)
+                        logger.warning(f'Failed to convert logistics from {log.currency} to KZT: {e}')
+                        # Если не удалось конвертировать, пропускаем эту логистику
+        elif logistics_cost > 0:
+            # Если указана конкретная логистика или есть ручное переопределение
+            if logistics_currency and logistics_currency != 'KZT':
+                try:
+                    logistics_base = service.convert_currency(
+                        logistics_cost,
+                        logistics_currency,
+                        'KZT',
+                        date=exchange_rate_date,
+                        proposal=proposal,
+                        manual_rate_value=manual_rate_value
+                    )
+                except ValueError as e:
+                    import logging
+                    logger = logging.getLogger(__name__)
+                    logger.warning(f'Failed to convert logistics from {logistics_currency} to KZT: {e}')
+                    logistics_base = logistics_cost
+            else:
+                logistics_base = logistics_cost
+        
+        # 3. Склад
+        warehouse_base = warehouse_cost
+        if warehouse_currency and warehouse_currency != 'KZT':
+            try:
+                warehouse_base = service.convert_currency(
+                    warehouse_cost,
+                    warehouse_currency,
+                    'KZT',
+                    date=exchange_rate_date,
+                    proposal=proposal,
+                    manual_rate_value=manual_rate_value
+                )
+            except ValueError as e:
+                import logging
+                logger = logging.getLogger(__name__)
+                logger.warning(f'Failed to convert warehouse cost from {warehouse_currency} to KZT: {e}')
+                warehouse_base = warehouse_cost
+        
+        # 4. Производственные расходы
+        production_base = production_cost
+        if production_currency and production_currency != 'KZT':
+            try:
+                production_base = service.convert_currency(
+                    production_cost,
+                    production_currency,
+                    'KZT',
+                    date=exchange_rate_date,
+                    proposal=proposal,
+                    manual_rate_value=manual_rate_value
+                )
+            except ValueError as e:
+                import logging
+                logger = logging.getLogger(__name__)
+                logger.warning(f'Failed to convert production cost from {production_currency} to KZT: {e}')
+                production_base = production_cost
+        
+        # 6. Рассчитываем базовую себестоимость (без доп.расходов)
+        base_cost_kzt = (
+            purchase_price_base +
+            logistics_base +
+            warehouse_base +
+            production_base
+        )
         
-        # Ручное переопределение
-        if 'purchase_price' in manual_overrides:
-            purchase_price_value = Decimal(str(manual_overrides['purchase_price']))
-            if 'purchase_price_currency' in manual_overrides:
-                purchase_price_currency = manual_overrides['purchase_price_currency']
+        # 7. Рассчитываем дополнительные расходы на основе базовой себестоимости
+        additional_base = Decimal('0')
         
-        # 2. Логистика - суммируем все активные логистики (кроме склада kz_warehouse)
-        logistics_cost = Decimal('0')
-        logistics_currency = None
-        logistics_route = None
-        logistics_obj = None
+        # Если есть ручное переопределение, используем его
+        if manual_additional_costs is not None:
+            additional_base = manual_additional_costs
+        else:
+            # Рассчитываем дополнительные расходы по их типам
+            for additional_price in additional_prices_list:
+                value = Decimal(str(additional_price.price_parameter_value))
+                
+                if additional_price.value_type == 'percentage':
+                    # Процент от базовой себестоимости
+                    additional_base += base_cost_kzt * (value / Decimal('100'))
+                elif additional_price.value_type == 'fixed':
+                    # Фиксированная сумма
+                    additional_base += value
+                elif additional_price.value_type == 'coefficient':
+                    # Коэффициент умножения базовой себестоимости
+                    additional_base += base_cost_kzt * value
         
-        if logistics_id:
+        # 8. Итоговая себестоимость в KZT (сумма всех компонентов)
+        # Формула: Себестоимость = (закупочная цена + логистика + склад + производство) + доп.расходы
+        total_cost_kzt = base_cost_kzt + additional_base
+        
+        # 8. Конвертация в целевую валюту (если не KZT)
+        # Если целевая валюта не KZT, конвертируем через курс
+        total_cost_target = total_cost_kzt
+        if target_currency != 'KZT':
             try:
-                logistics_obj = Logistics.objects.get(
-                    logistics_id=logistics_id,
-                    equipment=equipment,
-                    is_active=True
+                # Для конвертации из KZT в целевую валюту
+                # Если есть manual_rate_value из proposal, это курс из целевой валюты в KZT
+                # Например, если proposal.currency_ticket = RUB, manual_rate_value = курс RUB/KZT
+                # То для конвертации KZT -> RUB нужен обратный курс: 1 / manual_rate_value
+                reverse_rate_value = None
+                if manual_rate_value and proposal and proposal.currency_ticket == target_currency:
+                    # Если целевая валюта совпадает с валютой КП, используем обратный курс
+                    reverse_rate_value = Decimal('1') / Decimal(str(manual_rate_value))
+                
+                total_cost_target = service.convert_currency(
+                    total_cost_kzt,
+                    'KZT',
+                    target_currency,
+                    date=exchange_rate_date,
+                    proposal=proposal,
+                    manual_rate_value=reverse_rate_value
                 )
-                logistics_cost = Decimal(str(logistics_obj.cost))
-                logistics_currency = logistics_obj.currency
-                logistics_route = logistics_obj.route_type
-            except Logistics.DoesNotExist:
-                raise ValueError(f'Logistics with ID {logistics_id} not found')
+            except ValueError as e:
+                import logging
+                logger = logging.getLogger(__name__)
+                logger.warning(f'Failed to convert total cost from KZT to {target_currency}: {e}')
+                # Если не удалось конвертировать, оставляем в KZT
+                total_cost_target = total_cost_kzt
+        
+        # 9. Получить курс валюты для сохранения
+        exchange_rate = ExchangeRate.get_latest_rate(
+            currency_from=purchase_price_currency or 'KZT',
+            currency_to='KZT',
+            date=exchange_rate_date,
+            proposal=proposal
+        )
+        
+        # 10. Формируем результат
+        result = {
+            'equipment_id': equipment.equipment_id,
+            'equipment_name': equipment.equipment_name,
+            'purchase_price': {
+                'id': purchase_price_obj.price_id if purchase_price_obj else None,
+                'value': float(purchase_price_value),
+                'currency': purchase_price_currency,
+                'source': purchase_price_source,
+                'value_kzt': float(purchase_price_base),
+            },
+            'logistics': {
+                'id': logistics_obj.logistics_id if logistics_obj else None,
+                'cost': float(logistics_cost),
+                'currency': logistics_currency,
+                'route': logistics_route,
+                'cost_kzt': float(logistics_base),
+            },
+            'warehouse': {
+                'cost': float(warehouse_cost),
+                'currency': warehouse_currency,
+                'cost_kzt': float(warehouse_base),
+            },
+            'production': {
+                'cost': float(production_cost),
+                'currency': production_currency,
+                'cost_kzt': float(production_base),
+            },
+            'additional_costs': {
+                'id': additional_prices_id,
+                'cost': float(additional_base),  # Используем рассчитанное значение в KZT
+                'currency': 'KZT',  # Дополнительные расходы всегда в KZT после расчета
+                'cost_kzt': float(additional_base),
+            },
+            'exchange_rate': {
+                'id': exchange_rate.rate_id if exchange_rate else None,
+                'value': float(exchange_rate.rate_value) if exchange_rate else 1.0,
+                'from_currency': exchange_rate.currency_from if exchange_rate else 'KZT',
+                'to_currency': exchange_rate.currency_to if exchange_rate else 'KZT',
+                'date': str(exchange_rate.rate_date) if exchange_rate else str(exchange_rate_date),
+            },
+            'total_cost_kzt': float(total_cost_kzt),
+            'total_cost_target_currency': float(total_cost_target),
+            'target_currency': target_currency,
+            'calculation_date': str(exchange_rate_date),
+        }
+        
+        return result
+    
+    @staticmethod
+    @transaction.atomic
+    def save_calculation(
+        equipment,
+        calculation_result,
+        proposal=None,
+        created_by=None,
+        is_manual_adjustment=False,
+        notes=None
+    ):
+        """
+        Сохранить расчет себестоимости в базу данных.
+        
+        Args:
+            equipment: Equipment объект
+            calculation_result: Результат расчета из calculate_equipment_cost
+            proposal: CommercialProposal (опционально)
+            created_by: User (опционально)
+            is_manual_adjustment: Флаг ручной корректировки
+            notes: Примечания
+        
+        Returns:
+            CostCalculation: Созданный объект расчета
+        """
+        # Определить версию расчета
+        if proposal:
+            last_version = CostCalculation.objects.filter(
+                equipment=equipment,
+                proposal=proposal
+            ).order_by('-calculation_version').first()
         else:
-            # Суммируем все активные логистики (кроме склада kz_warehouse)
-            active_logistics = Logistics.objects.filter(
+            last_version = CostCalculation.objects.filter(
                 equipment=equipment,
-                is_active=True
-            ).exclude(route_type='kz_warehouse').order_by('-created_at')
-            
-            if active_logistics.exists():
-                # Берем первую для route_type (для обратной совместимости)
-                logistics_obj = active_logistics.first()
-                logistics_route = logistics_obj.route_type
-                logistics_currency = logistics_obj.currency
-                # Суммируем логистики в основной валюте (конвертация всех в KZT будет позже)
-                logistics_cost = sum(Decimal(str(l.cost)) for l in active_logistics if l.currency == logistics_currency)
-        
-        # Ручное переопределение
-        if 'logistics_cost' in manual_overrides:
-            logistics_cost = Decimal(str(manual_overrides['logistics_cost']))
-            if 'logistics_currency' in manual_overrides:
-                logistics_currency = manual_overrides['logistics_currency']
+                proposal__isnull=True
+            ).order_by('-calculation_version').first()
         
-        # 3. Склад (из логистики с маршрутом kz_warehouse)
-        warehouse_cost = Decimal('0')
-        warehouse_currency = None
+        next_version = (last_version.calculation_version + 1) if last_version else 1
         
-        warehouse_logistics = Logistics.objects.filter(
+        # Создать запись расчета
+        calculation = CostCalculation.objects.create(
             equipment=equipment,
-            route_type='kz_warehouse',
-            is_active=True
-        ).first()
+            proposal=proposal,
+            calculation_version=next_version,
+            purchase_price_id=calculation_result['purchase_price']['id'],
+            purchase_price_value=calculation_result['purchase_price']['value'],
+            purchase_price_currency=calculation_result['purchase_price']['currency'],
+            purchase_price_source=calculation_result['purchase_price']['source'],
+            logistics_id=calculation_result['logistics']['id'],
+            logistics_cost=calculation_result['logistics']['cost'],
+            logistics_currency=calculation_result['logistics']['currency'],
+            logistics_route=calculation_result['logistics']['route'],
+            warehouse_cost=calculation_result['warehouse']['cost'],
+            warehouse_currency=calculation_result['warehouse']['currency'],
+            production_cost=calculation_result['production']['cost'],
+            production_currency=calculation_result['production']['currency'],
+            additional_costs=calculation_result['additional_costs']['cost'],
+            additional_costs_currency=calculation_result['additional_costs']['currency'] or 'KZT',
+            exchange_rate_id=calculation_result['exchange_rate']['id'],
+            exchange_rate_value=calculation_result['exchange_rate']['value'],
+            exchange_rate_from=calculation_result['exchange_rate']['from_currency'],
+            exchange_rate_to=calculation_result['exchange_rate']['to_currency'],
+            exchange_rate_date=calculation_result['exchange_rate']['date'],
+            total_cost_base_currency=calculation_result['total_cost_kzt'],
+            total_cost_kzt=calculation_result['total_cost_kzt'],
+            calculation_details=calculation_result,
+            is_manual_adjustment=is_manual_adjustment,
+            notes=notes,
+            created_by=created_by,
+        )
         
-        if warehouse_logistics:
-            warehouse_cost = Decimal(str(warehouse_logistics.cost))
-            warehouse_currency = warehouse_logistics.currency
+        return calculation
+    
+    @staticmethod
+    def calculate_proposal_total_price(cost_price, margin_percentage=None):
+        """
+        Рассчитать итоговую цену КП на основе себестоимости и маржи.
         
-        # Ручное переопределение
-        if 'warehouse_cost' in manual_overrides:
-            warehouse_cost = Decimal(str(manual_overrides['warehouse_cost']))
-            if 'warehouse_currency' in manual_overrides:
-                warehouse_currency = manual_overrides['warehouse_currency']
+        Формула: total_price = cost_price * (1 + margin_percentage / 100)
+        
+        Args:
+            cost_price: Себестоимость (сумма всех себестоимостей оборудования)
+            margin_percentage: Процент маржи (если None, маржа не добавляется)
+        
+        Returns:
+            Decimal: Итоговая цена
+        """
+        cost_price_decimal = Decimal(str(cost_price))
+        
+        if margin_percentage is None or margin_percentage == 0:
+            return cost_price_decimal
         
-        # 4. Производственные расходы
-        production_cost = Decimal('0')
-        production_currency = None
+        margin_decimal = Decimal(str(margin_percentage))
+        total_price = cost_price_decimal * (Decimal('1') + margin_decimal / Decimal('100'))
         
-        if equipment.equipment_manufacture_price:
-            production_cost = Decimal(str(equipment.equipment_manufacture_price))
-            production_currency = equipment.equipment_price_currency_type or 'KZT'
+        return total_price.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    
+    @staticmethod
+    def calculate_proposal_cost_price(proposal):
+        """
+        Рассчитать общую себестоимость КП на основе всех оборудования в EquipmentList.
         
-        # Ручное переопределение
-        if 'production_cost' in manual_overrides:
-            production_cost = Decimal(str(manual_overrides['production_cost']))
-            if 'production_currency' in manual_overrides:
-                production_currency = manual_overrides['production_currency']
+        Args:
+            proposal: CommercialProposal объект
         
-        # 5. Дополнительные расходы (AdditionalPrices) - будут рассчитаны после базовой себестоимости
-        # Сначала собираем информацию о доп.расходах
-        additional_prices_list = []
+        Returns:
+            Decimal: Общая себестоимость
+        """
+        from .models import EquipmentListItem
         
-        # Если есть proposal, проверяем EquipmentList для этого оборудования
-        if proposal:
-            from .models import EquipmentList, EquipmentListItem
-            # Ищем EquipmentList в этом КП, который содержит это оборудование
-            equipment_lists = EquipmentList.objects.filter(
-                proposal=proposal
-            ).prefetch_related('equipment_items_relation', 'additional_prices')
-            
-            for eq_list in equipment_lists:
-                # Проверяем, есть ли это оборудование в списке
-                if eq_list.equipment_items_relation.filter(equipment=equipment).exists():
-                    # Собираем все дополнительные расходы
-                    if eq_list.additional_prices.exists():
-                        additional_prices_list.extend(eq_list.additional_prices.all())
-                    # Поддержка старого поля для обратной совместимости
-                    elif eq_list.additional_price:
-                        additional_prices_list.append(eq_list.additional_price)
-                    break
+        total_cost = Decimal('0')
         
-        # Если указан конкретный additional_prices_id
-        if additional_prices_id:
-            try:
-                additional_prices_obj = AdditionalPrices.objects.get(price_id=additional_prices_id)
-                additional_prices_list.append(additional_prices_obj)
-            except AdditionalPrices.DoesNotExist:
-                pass
+        # Проходим по всем EquipmentList в КП
+        for equipment_list in proposal.equipment_lists.all():
+            # Проходим по всем EquipmentListItem
+            for item in equipment_list.equipment_items_relation.all():
+                equipment = item.equipment
+                quantity = item.quantity
+                
+                # Рассчитываем себестоимость для этого оборудования
+                try:
+                    calculation_result = CostCalculationService.calculate_equipment_cost(
+                        equipment=equipment,
+                        exchange_rate_date=proposal.exchange_rate_date or None,
+                        proposal=proposal,
+                        target_currency=proposal.currency_ticket,
+                        manual_overrides={'exchange_rate_value': proposal.exchange_rate} if proposal.exchange_rate else None
+                    )
+                    
+                    # Себестоимость единицы оборудования в целевой валюте
+                    unit_cost = Decimal(str(calculation_result['total_cost_target_currency']))
+                    
+                    # Учитываем количество
+                    item_total_cost = unit_cost * quantity
+                    total_cost += item_total_cost
+                    
+                except Exception as e:
+                    # Если не удалось рассчитать, пропускаем это оборудование
+                    import logging
+                    logger = logging.getLogger(__name__)
+                    logger.warning(f'Failed to calculate cost for equipment {equipment.equipment_id}: {str(e)}')
+                    continue
         
-        # Ручное переопределение - если указано, используем его вместо расчетных
-        manual_additional_costs = None
-        if 'additional_costs' in manual_overrides:
-            manual_additional_costs = Decimal(str(manual_overrides['additional_costs']))
+        return total_cost.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+class DataAggregatorService:
+    """
+    Service for preparing data for the Proposal Constructor (Frontend & PDF).
+    Aggregates data from various models and calculates final prices using the 'dissolution' method.
+    Enforces security by sanitizing internal costs and margins.
+    """
+
+    def __init__(self, proposal):
+        self.proposal = proposal
+        self.currency = proposal.currency_ticket
+        # Transform internal_exchange_rates list to dict for faster lookup
+        # Expected format: [{'currency_from': 'USD', 'rate_value': 450.0, ...}, ...]
+        # Mapping: currency_code -> rate to KZT
+        self.rates_map = {}
+        if self.proposal.internal_exchange_rates:
+            for rate in self.proposal.internal_exchange_rates:
+                if isinstance(rate, dict):
+                    # Try different keys that might be used
+                    curr = rate.get('currency_from') or rate.get('currency')
+                    val = rate.get('rate_value') or rate.get('value')
+                    if curr and val:
+                        self.rates_map[curr] = Decimal(str(val))
         
-        # 6. Конвертация всех сумм в базовую валюту (KZT) через курс валюты
-        service = CostCalculationService()
+        # Ensure proposal exchange rate is also available
+        if self.proposal.exchange_rate:
+             # This is the rate of proposal.currency_ticket to KZT
+             self.rates_map[self.proposal.currency_ticket] = Decimal(str(self.proposal.exchange_rate))
         
-        # Получаем ручной курс валюты, если указан
-        manual_rate_value = manual_overrides.get('exchange_rate_value')
-        # Если курс не указан вручную, но есть proposal с курсом, используем его
-        if not manual_rate_value and proposal and proposal.exchange_rate:
-            manual_rate_value = proposal.exchange_rate
+        # Add pivot currency
+        self.rates_map['KZT'] = Decimal('1.0')
+
+    def get_full_data_package(self):
+        """
+        Main entry point. Returns a dictionary with all necessary data.
+        """
+        # Calculate equipment list first as it drives the core pricing
+        equipment_list_data = self._calculate_and_build_equipment_list()
         
-        # Определяем базовую валюту для расчета (валюта закупочной цены или KZT)
-        base_currency = purchase_price_currency or 'KZT'
+        # Calculate total margin from all equipment items
+        total_margin_kzt = Decimal('0')
+        total_base_cost_kzt = Decimal('0')
+        for item in equipment_list_data:
+            if 'margin_kzt_total' in item:
+                total_margin_kzt += Decimal(str(item['margin_kzt_total']))
+            if 'base_cost_kzt' in item and 'quantity' in item:
+                total_base_cost_kzt += Decimal(str(item['base_cost_kzt'])) * Decimal(str(item['quantity']))
         
-        # Конвертируем все компоненты в базовую валюту (KZT)
-        # 1. Закупочная цена
-        purchase_price_base = purchase_price_value
-        if purchase_price_currency and purchase_price_currency != 'KZT':
-            try:
-                purchase_price_base = service.convert_currency(
-                    purchase_price_value,
-                    purchase_price_currency,
-                    'KZT',
-                    date=exchange_rate_date,
-                    proposal=proposal,
-                    manual_rate_value=manual_rate_value
-                )
-            except ValueError as e:
-                # Если не удалось конвертировать, используем исходное значение
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.warning(f'Failed to convert purchase price from {purchase_price_currency} to KZT: {e}')
-                purchase_price_base = purchase_price_value
+        # Calculate total margin percentage
+        total_margin_percentage = Decimal('0')
+        if total_base_cost_kzt > 0:
+            total_margin_percentage = (total_margin_kzt / total_base_cost_kzt) * Decimal('100')
+
+        # Clamp and quantize margin values to fit model fields (max_digits=5, decimal_places=2)
+        # Avoid InvalidOperation when serializing
+        try:
+            total_margin_kzt = total_margin_kzt.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        except Exception:
+            total_margin_kzt = Decimal('0')
+
+        try:
+            # Max value that fits in DecimalField(max_digits=5, decimal_places=2) = 999.99
+            max_margin_percentage = Decimal('999.99')
+            if total_margin_percentage > max_margin_percentage:
+                total_margin_percentage = max_margin_percentage
+            total_margin_percentage = total_margin_percentage.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        except Exception:
+            total_margin_percentage = Decimal('0')
         
-        # 2. Логистика - суммируем все активные логистики, конвертируя каждую в KZT
-        logistics_base = Decimal('0')
-        if not logistics_id:
-            # Берем все активные логистики (кроме склада)
-            active_logistics = Logistics.objects.filter(
-                equipment=equipment,
-                is_active=True
-            ).exclude(route_type='kz_warehouse')
-            
-            for log in active_logistics:
-                log_cost = Decimal(str(log.cost))
-                if log.currency == 'KZT':
-                    logistics_base += log_cost
-                else:
-                    try:
-                        # Конвертируем в KZT через курс из КП
-                        log_cost_kzt = service.convert_currency(
-                            log_cost,
-                            log.currency,
-                            'KZT',
-                            date=exchange_rate_date,
-                            proposal=proposal,
-                            manual_rate_value=manual_rate_value
-                        )
-                        logistics_base += log_cost_kzt
-                    except ValueError as e:
-                        import logging
-                        logger = logging.getLogger(__name__)
-                        logger.warning(f'Failed to convert logistics from {log.currency} to KZT: {e}')
-                        # Если не удалось конвертировать, пропускаем эту логистику
-        elif logistics_cost > 0:
-            # Если указана конкретная логистика или есть ручное переопределение
-            if logistics_currency and logistics_currency != 'KZT':
+        # Update proposal margin values
+        self.proposal.margin_value = total_margin_kzt
+        self.proposal.margin_percentage = total_margin_percentage
+        self.proposal.save(update_fields=['margin_value', 'margin_percentage'])
+
+        return {
+            "proposal": self._get_proposal_metadata(),
+            "client": self._get_client_data(),
+            "user": self._get_user_data(),
+            "equipment_list": equipment_list_data,
+            "equipment_details": self._get_equipment_details(),
+            "equipment_specifications": self._get_equipment_specifications(),
+            "tech_processes": self._get_tech_processes(),
+            "additional_services": self.proposal.additional_services,
+            "company_logo_url": self._get_company_logo_url(),
+            "schema_version": ProposalDataPackageService.SCHEMA_VERSION,
+        }
+
+    def _get_company_logo_url(self):
+        sys_settings = SystemSettings.get_settings()
+        if sys_settings.company_logo:
+             return sys_settings.company_logo.url
+        return "/static/assets/prosnab_logo.png"
+
+    def _get_proposal_metadata(self):
+        # Convert dates to strings for JSON serialization
+        from datetime import datetime, date
+        
+        proposal_date_str = None
+        if self.proposal.proposal_date:
+            if isinstance(self.proposal.proposal_date, str):
+                # Try to parse and reformat if it's in ISO format or other formats
+                try:
+                    # Try ISO format first (e.g., "2026-01-19" or "2026-01-19T20:12:50Z")
+                    date_str = self.proposal.proposal_date.replace('Z', '+00:00')
+                    if 'T' in date_str:
+                        dt = datetime.fromisoformat(date_str)
+                    else:
+                        # Just date part (e.g., "2026-01-19")
+                        dt = datetime.strptime(date_str.split('T')[0].split('+')[0], '%Y-%m-%d')
+                    proposal_date_str = dt.strftime('%d.%m.%Y')
+                except (ValueError, AttributeError):
+                    # If parsing fails, check if it's already in d.m.Y format
+                    try:
+                        # Try to parse as d.m.Y to validate
+                        datetime.strptime(self.proposal.proposal_date, '%d.%m.%Y')
+                        proposal_date_str = self.proposal.proposal_date
+                    except (ValueError, AttributeError):
+                        # If all parsing fails, use as-is (might be in another format)
+                        proposal_date_str = self.proposal.proposal_date
+            elif isinstance(self.proposal.proposal_date, (date, datetime)):
+                # Format as d.m.Y for template compatibility
+                if isinstance(self.proposal.proposal_date, datetime):
+                    proposal_date_str = self.proposal.proposal_date.strftime('%d.%m.%Y')
+                else:
+                    proposal_date_str = self.proposal.proposal_date.strftime('%d.%m.%Y')
+            else:
+                proposal_date_str = str(self.proposal.proposal_date) if self.proposal.proposal_date else None
+        
+        valid_until_str = None
+        if self.proposal.valid_until:
+            if isinstance(self.proposal.valid_until, str):
+                # Try to parse and reformat if it's in ISO format
                 try:
-                    logistics_base = service.convert_currency(
-                        logistics_cost,
-                        logistics_currency,
-                        'KZT',
-                        date=exchange_rate_date,
-                        proposal=proposal,
-                        manual_rate_value=manual_rate_value
-                    )
-                except ValueError as e:
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.warning(f'Failed to convert logistics from {logistics_currency} to KZT: {e}')
-                    logistics_base = logistics_cost
+                    dt = datetime.fromisoformat(self.proposal.valid_until.replace('Z', '+00:00'))
+                    valid_until_str = dt.strftime('%d.%m.%Y')
+                except (ValueError, AttributeError):
+                    valid_until_str = self.proposal.valid_until
+            elif isinstance(self.proposal.valid_until, (date, datetime)):
+                # Format as d.m.Y for template compatibility
+                valid_until_str = self.proposal.valid_until.strftime('%d.%m.%Y')
             else:
-                logistics_base = logistics_cost
+                valid_until_str = str(self.proposal.valid_until)
         
-        # 3. Склад
-        warehouse_base = warehouse_cost
-        if warehouse_currency and warehouse_currency != 'KZT':
-            try:
-                warehouse_base = service.convert_currency(
-                    warehouse_cost,
-                    warehouse_currency,
-                    'KZT',
-                    date=exchange_rate_date,
-                    proposal=proposal,
-                    manual_rate_value=manual_rate_value
-                )
-            except ValueError as e:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.warning(f'Failed to convert warehouse cost from {warehouse_currency} to KZT: {e}')
-                warehouse_base = warehouse_cost
+        return {
+            "id": self.proposal.proposal_id,
+            "number": self.proposal.outcoming_number,
+            "date": proposal_date_str,
+            "valid_until": valid_until_str,
+            "header": self.proposal.proposal_name,
+            "currency": self.currency,
+            "delivery_time": self.proposal.delivery_time,
+            "warranty": self.proposal.warranty,
+            "margin_value": float(self.proposal.margin_value) if self.proposal.margin_value else None,
+            "total_price": float(self.proposal.total_price) if self.proposal.total_price else 0,
+        }
+
+    def _get_client_data(self):
+        client = self.proposal.client
+        if not client:
+            return {}
+        return {
+            "name": client.client_name,
+            "company": client.client_company_name,
+            "address": client.client_address,
+            "phone": client.client_phone,
+            "email": client.client_email,
+        }
+
+    def _get_user_data(self):
+        user = self.proposal.user
+        if not user:
+            return {}
+        return {
+            "name": user.user_name,
+            "email": user.user_email,
+            "phone": user.user_phone,
+            "role": user.user_role,
+        }
+
+    def _calculate_and_build_equipment_list(self):
+        """
+        New pricing method: Fixed sale price per unit with margin calculation.
+        Step 1: Get sale_price_kzt from Equipment (fixed selling price).
+        Step 2: Calculate Base Cost for each item (Purchase + Row Expenses).
+        Step 3: Calculate Global Overhead (Total Proposal Price - Sum(Sale Prices)).
+        Step 4: Distribute Global Overhead proportionally to Base Costs.
+        Step 5: Calculate margin for each line: margin_kzt = sale_price_kzt - (base_cost + allocated_overhead_per_unit).
+        Step 6: Build final list with sale_price_kzt as price_per_unit and calculated margins.
+        """
+        items_meta = []
+        total_base_cost_sum = Decimal('0')
+        total_sale_price_sum = Decimal('0')
         
-        # 4. Производственные расходы
-        production_base = production_cost
-        if production_currency and production_currency != 'KZT':
-            try:
-                production_base = service.convert_currency(
-                    production_cost,
-                    production_currency,
-                    'KZT',
-                    date=exchange_rate_date,
-                    proposal=proposal,
-                    manual_rate_value=manual_rate_value
+        # Step 1: Collect all equipment items and calculate base costs
+        for eq_list in self.proposal.equipment_lists.all():
+            for item in eq_list.equipment_items_relation.select_related('equipment').prefetch_related('equipment__photos').all().order_by('order', 'created_at'):
+                equipment = item.equipment
+                quantity = Decimal(item.quantity)
+                
+                # Check if we have saved calculated_data
+                saved_calculated_data = item.calculated_data or {}
+                has_saved_data = (
+                    saved_calculated_data.get('purchase_price_kzt') is not None or
+                    saved_calculated_data.get('base_cost_kzt') is not None or
+                    saved_calculated_data.get('margin_kzt') is not None
                 )
-            except ValueError as e:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.warning(f'Failed to convert production cost from {production_currency} to KZT: {e}')
-                production_base = production_cost
+                
+                # Get sale_price_kzt (fixed selling price)
+                sale_price_kzt = None
+                if equipment.sale_price_kzt:
+                    sale_price_kzt = Decimal(str(equipment.sale_price_kzt))
+                # Also check saved price_per_unit as fallback
+                if sale_price_kzt is None and item.price_per_unit:
+                    sale_price_kzt = Decimal(str(item.price_per_unit))
+                
+                # If no sale_price_kzt, fallback to old method (for backward compatibility)
+                if sale_price_kzt is None:
+                    # Use old calculation method
+                    purchase_price_obj = equipment.purchase_prices.filter(is_active=True).order_by('-created_at').first()
+                    base_unit_cost = Decimal('0')
+                    
+                    if purchase_price_obj and purchase_price_obj.price:
+                        price_val = Decimal(str(purchase_price_obj.price))
+                        price_curr = purchase_price_obj.currency
+                        base_unit_cost = self._convert_currency(price_val, price_curr, self.currency)
+                    elif equipment.equipment_manufacture_price:
+                        price_val = Decimal(str(equipment.equipment_manufacture_price))
+                        price_curr = equipment.equipment_price_currency_type or 'KZT'
+                        base_unit_cost = self._convert_currency(price_val, price_curr, self.currency)
+                    
+                    # Add row expenses
+                    row_expenses_sum = Decimal('0')
+                    if item.row_expenses and isinstance(item.row_expenses, list):
+                        for exp in item.row_expenses:
+                            val = exp.get('value')
+                            curr = exp.get('currency', 'KZT')
+                            if val:
+                                row_expenses_sum += self._convert_currency(Decimal(str(val)), curr, self.currency)
+                    
+                    if quantity > 0:
+                        base_unit_cost += (row_expenses_sum / quantity)
+                    
+                    # Use calculated price as sale price (old behavior)
+                    sale_price_kzt = base_unit_cost
+                
+                # Use saved calculated_data if available, otherwise calculate
+                if has_saved_data:
+                    # Use saved values from calculated_data (safely convert to Decimal)
+                    try:
+                        purchase_price_val = saved_calculated_data.get('purchase_price_kzt', 0)
+                        if purchase_price_val is None:
+                            purchase_price_kzt_for_save = Decimal('0')
+                        else:
+                            purchase_price_kzt_for_save = Decimal(str(purchase_price_val))
+                    except (ValueError, TypeError, InvalidOperation):
+                        purchase_price_kzt_for_save = Decimal('0')
+                    
+                    try:
+                        base_cost_val = saved_calculated_data.get('base_cost_kzt', 0)
+                        if base_cost_val is None:
+                            base_unit_cost_kzt = Decimal('0')
+                        else:
+                            base_unit_cost_kzt = Decimal(str(base_cost_val))
+                    except (ValueError, TypeError, InvalidOperation):
+                        base_unit_cost_kzt = Decimal('0')
+                else:
+                    # Calculate base cost (purchase price + row expenses)
+                    purchase_price_obj = equipment.purchase_prices.filter(is_active=True).order_by('-created_at').first()
+                    base_unit_cost_kzt = Decimal('0')
+                    
+                    if purchase_price_obj and purchase_price_obj.price:
+                        price_val = Decimal(str(purchase_price_obj.price))
+                        price_curr = purchase_price_obj.currency
+                        base_unit_cost_kzt = self._convert_currency(price_val, price_curr, 'KZT')
+                    elif equipment.equipment_manufacture_price:
+                        price_val = Decimal(str(equipment.equipment_manufacture_price))
+                        price_curr = equipment.equipment_price_currency_type or 'KZT'
+                        base_unit_cost_kzt = self._convert_currency(price_val, price_curr, 'KZT')
+                    
+                    # Add row expenses per unit
+                    row_expenses_sum_kzt = Decimal('0')
+                    if item.row_expenses and isinstance(item.row_expenses, list):
+                        for exp in item.row_expenses:
+                            val = exp.get('value')
+                            curr = exp.get('currency', 'KZT')
+                            if val:
+                                row_expenses_sum_kzt += self._convert_currency(Decimal(str(val)), curr, 'KZT')
+                    
+                    if quantity > 0:
+                        base_unit_cost_kzt += (row_expenses_sum_kzt / quantity)
+                    
+                    # Calculate purchase_price_kzt (before row expenses) for saving
+                    purchase_price_kzt_for_save = Decimal('0')
+                    if purchase_price_obj and purchase_price_obj.price:
+                        price_val = Decimal(str(purchase_price_obj.price))
+                        price_curr = purchase_price_obj.currency
+                        purchase_price_kzt_for_save = self._convert_currency(price_val, price_curr, 'KZT')
+                    elif equipment.equipment_manufacture_price:
+                        price_val = Decimal(str(equipment.equipment_manufacture_price))
+                        price_curr = equipment.equipment_price_currency_type or 'KZT'
+                        purchase_price_kzt_for_save = self._convert_currency(price_val, price_curr, 'KZT')
+                
+                line_base_total = base_unit_cost_kzt * quantity
+                line_sale_total = sale_price_kzt * quantity
+                
+                total_base_cost_sum += line_base_total
+                total_sale_price_sum += line_sale_total
+                
+                items_meta.append({
+                    'item': item,
+                    'equipment': equipment,
+                    'quantity': quantity,
+                    'base_unit_cost_kzt': base_unit_cost_kzt,
+                    'line_base_total': line_base_total,
+                    'sale_price_kzt': sale_price_kzt,
+                    'line_sale_total': line_sale_total,
+                    'purchase_price_kzt': purchase_price_kzt_for_save,  # Save purchase price in KZT
+                    'saved_calculated_data': saved_calculated_data,  # Pass saved data for later use
+                })
+        
+        # Step 2: Calculate Global Overhead from EquipmentList
+        # Get global expenses (tax, delivery, additional_prices) from EquipmentList
+        global_overhead = Decimal('0')
+        for eq_list in self.proposal.equipment_lists.all():
+            # Tax
+            if eq_list.tax_price:
+                global_overhead += Decimal(str(eq_list.tax_price))
+            # Delivery
+            if eq_list.delivery_price:
+                global_overhead += Decimal(str(eq_list.delivery_price))
+            # Additional prices (if any)
+            for add_price in eq_list.additional_prices.all():
+                if add_price.value_type == 'fixed':
+                    global_overhead += Decimal(str(add_price.price_parameter_value))
+                elif add_price.value_type == 'percentage':
+                    # Calculate percentage of base cost sum
+                    if total_base_cost_sum > 0:
+                        percentage_value = (Decimal(str(add_price.price_parameter_value)) / Decimal('100')) * total_base_cost_sum
+                        global_overhead += percentage_value
         
-        # 6. Рассчитываем базовую себестоимость (без доп.расходов)
-        base_cost_kzt = (
-            purchase_price_base +
-            logistics_base +
-            warehouse_base +
-            production_base
-        )
+        # Calculate services sum (additional_services are separate, not part of overhead)
+        services_sum = Decimal('0')
+        if self.proposal.additional_services:
+            for svc in self.proposal.additional_services:
+                price = svc.get('price')
+                if price:
+                    services_sum += Decimal(str(price))
         
-        # 7. Рассчитываем дополнительные расходы на основе базовой себестоимости
-        additional_base = Decimal('0')
+        # Calculate total price: sum of sale prices + services
+        # (overhead is already included in margin calculation, not in total price)
+        calculated_total = total_sale_price_sum + services_sum
         
-        # Если есть ручное переопределение, используем его
-        if manual_additional_costs is not None:
-            additional_base = manual_additional_costs
+        # If proposal.total_price is set, use it; otherwise calculate from sale prices
+        if self.proposal.total_price:
+            target_total = Decimal(str(self.proposal.total_price))
         else:
-            # Рассчитываем дополнительные расходы по их типам
-            for additional_price in additional_prices_list:
-                value = Decimal(str(additional_price.price_parameter_value))
-                
-                if additional_price.value_type == 'percentage':
-                    # Процент от базовой себестоимости
-                    additional_base += base_cost_kzt * (value / Decimal('100'))
-                elif additional_price.value_type == 'fixed':
-                    # Фиксированная сумма
-                    additional_base += value
-                elif additional_price.value_type == 'coefficient':
-                    # Коэффициент умножения базовой себестоимости
-                    additional_base += base_cost_kzt * value
+            target_total = calculated_total
+            # Update proposal total_price
+            self.proposal.total_price = target_total
         
-        # 8. Итоговая себестоимость в KZT (сумма всех компонентов)
-        # Формула: Себестоимость = (закупочная цена + логистика + склад + производство) + доп.расходы
-        total_cost_kzt = base_cost_kzt + additional_base
+        # Step 3: Distribute Overhead and Calculate Margins
+        final_items = []
+        total_quantity = sum(meta['quantity'] for meta in items_meta) if items_meta else Decimal('1')
         
-        # 8. Конвертация в целевую валюту (если не KZT)
-        # Если целевая валюта не KZT, конвертируем через курс
-        total_cost_target = total_cost_kzt
-        if target_currency != 'KZT':
-            try:
-                # Для конвертации из KZT в целевую валюту
-                # Если есть manual_rate_value из proposal, это курс из целевой валюты в KZT
-                # Например, если proposal.currency_ticket = RUB, manual_rate_value = курс RUB/KZT
-                # То для конвертации KZT -> RUB нужен обратный курс: 1 / manual_rate_value
-                reverse_rate_value = None
-                if manual_rate_value and proposal and proposal.currency_ticket == target_currency:
-                    # Если целевая валюта совпадает с валютой КП, используем обратный курс
-                    reverse_rate_value = Decimal('1') / Decimal(str(manual_rate_value))
+        for meta in items_meta:
+            equipment = meta['equipment']
+            quantity = meta['quantity']
+            base_unit_cost_kzt = meta['base_unit_cost_kzt']
+            sale_price_kzt = meta['sale_price_kzt']
+            purchase_price_kzt = meta.get('purchase_price_kzt', Decimal('0'))  # Get from meta (already in KZT)
+            saved_calculated_data = meta.get('saved_calculated_data', {})
+            
+            # Check if we should use saved calculated_data
+            has_saved_margin = (
+                saved_calculated_data and isinstance(saved_calculated_data, dict) and
+                (saved_calculated_data.get('margin_kzt') is not None or
+                 saved_calculated_data.get('margin_percentage') is not None)
+            )
+            
+            if has_saved_margin:
+                # Use saved values from calculated_data (safely convert to Decimal)
+                try:
+                    allocated_overhead_val = saved_calculated_data.get('allocated_overhead_per_unit', 0)
+                    if allocated_overhead_val is None:
+                        allocated_overhead_per_unit = Decimal('0')
+                    else:
+                        allocated_overhead_per_unit = Decimal(str(allocated_overhead_val))
+                except (ValueError, TypeError, InvalidOperation):
+                    allocated_overhead_per_unit = Decimal('0')
                 
-                total_cost_target = service.convert_currency(
-                    total_cost_kzt,
-                    'KZT',
-                    target_currency,
-                    date=exchange_rate_date,
-                    proposal=proposal,
-                    manual_rate_value=reverse_rate_value
-                )
-            except ValueError as e:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.warning(f'Failed to convert total cost from KZT to {target_currency}: {e}')
-                # Если не удалось конвертировать, оставляем в KZT
-                total_cost_target = total_cost_kzt
-        
-        # 9. Получить курс валюты для сохранения
-        exchange_rate = ExchangeRate.get_latest_rate(
-            currency_from=purchase_price_currency or 'KZT',
-            currency_to='KZT',
-            date=exchange_rate_date,
-            proposal=proposal
-        )
-        
-        # 10. Формируем результат
-        result = {
-            'equipment_id': equipment.equipment_id,
-            'equipment_name': equipment.equipment_name,
-            'purchase_price': {
-                'id': purchase_price_obj.price_id if purchase_price_obj else None,
-                'value': float(purchase_price_value),
-                'currency': purchase_price_currency,
-                'source': purchase_price_source,
-                'value_kzt': float(purchase_price_base),
-            },
-            'logistics': {
-                'id': logistics_obj.logistics_id if logistics_obj else None,
-                'cost': float(logistics_cost),
-                'currency': logistics_currency,
-                'route': logistics_route,
-                'cost_kzt': float(logistics_base),
-            },
-            'warehouse': {
-                'cost': float(warehouse_cost),
-                'currency': warehouse_currency,
-                'cost_kzt': float(warehouse_base),
-            },
-            'production': {
-                'cost': float(production_cost),
-                'currency': production_currency,
-                'cost_kzt': float(production_base),
-            },
-            'additional_costs': {
-                'id': additional_prices_id,
-                'cost': float(additional_base),  # Используем рассчитанное значение в KZT
-                'currency': 'KZT',  # Дополнительные расходы всегда в KZT после расчета
-                'cost_kzt': float(additional_base),
-            },
-            'exchange_rate': {
-                'id': exchange_rate.rate_id if exchange_rate else None,
-                'value': float(exchange_rate.rate_value) if exchange_rate else 1.0,
-                'from_currency': exchange_rate.currency_from if exchange_rate else 'KZT',
-                'to_currency': exchange_rate.currency_to if exchange_rate else 'KZT',
-                'date': str(exchange_rate.rate_date) if exchange_rate else str(exchange_rate_date),
-            },
-            'total_cost_kzt': float(total_cost_kzt),
-            'total_cost_target_currency': float(total_cost_target),
-            'target_currency': target_currency,
-            'calculation_date': str(exchange_rate_date),
-        }
-        
-        return result
-    
-    @staticmethod
-    @transaction.atomic
-    def save_calculation(
-        equipment,
-        calculation_result,
-        proposal=None,
-        created_by=None,
-        is_manual_adjustment=False,
-        notes=None
-    ):
-        """
-        Сохранить расчет себестоимости в базу данных.
+                try:
+                    margin_kzt_val = saved_calculated_data.get('margin_kzt', 0)
+                    if margin_kzt_val is None:
+                        margin_kzt_per_unit = Decimal('0')
+                    else:
+                        margin_kzt_per_unit = Decimal(str(margin_kzt_val))
+                except (ValueError, TypeError, InvalidOperation):
+                    margin_kzt_per_unit = Decimal('0')
+                
+                try:
+                    margin_perc_val = saved_calculated_data.get('margin_percentage', 0)
+                    if margin_perc_val is None:
+                        margin_percentage = Decimal('0')
+                    else:
+                        margin_percentage = Decimal(str(margin_perc_val))
+                except (ValueError, TypeError, InvalidOperation):
+                    margin_percentage = Decimal('0')
+            else:
+                # Distribute overhead proportionally to base costs
+                weight = Decimal('0')
+                if total_base_cost_sum > 0:
+                    weight = meta['line_base_total'] / total_base_cost_sum
+                elif total_quantity > 0:
+                    weight = quantity / total_quantity
+                
+                # Allocated overhead per unit
+                allocated_overhead_total = global_overhead * weight
+                allocated_overhead_per_unit = Decimal('0')
+                if quantity > 0:
+                    allocated_overhead_per_unit = allocated_overhead_total / quantity
+                
+                # Calculate margin: sale_price - (base_cost + overhead)
+                # Margin KZT per unit
+                margin_kzt_per_unit = sale_price_kzt - (base_unit_cost_kzt + allocated_overhead_per_unit)
+                
+                # Margin percentage
+                margin_percentage = Decimal('0')
+                if base_unit_cost_kzt > 0:
+                    margin_percentage = (margin_kzt_per_unit / base_unit_cost_kzt) * Decimal('100')
+            
+            # Total margin for the line
+            margin_kzt_total = margin_kzt_per_unit * quantity
+            
+            # Final prices (sale_price_kzt is fixed, used as price_per_unit)
+            # All values are already in KZT at this point
+            final_items.append({
+                "equipment_id": equipment.equipment_id,
+                "name": equipment.equipment_name,
+                "description": equipment.equipment_short_description,
+                "article": equipment.equipment_articule,
+                "quantity": int(quantity),
+                "unit": equipment.equipment_uom or 'шт',
+                "price_per_unit": float(sale_price_kzt),  # Fixed sale price (in KZT)
+                "total_price": float(sale_price_kzt * quantity),  # Fixed sale price * quantity (in KZT)
+                "base_cost_kzt": float(base_unit_cost_kzt),  # Purchase price + row expenses (in KZT)
+                "allocated_overhead_per_unit": float(allocated_overhead_per_unit),  # Distributed overhead (in KZT) or saved value
+                "margin_kzt": float(margin_kzt_per_unit),  # Margin per unit (in KZT) or saved value
+                "margin_percentage": float(margin_percentage),  # Margin percentage or saved value
+                "margin_kzt_total": float(margin_kzt_total),  # Total margin for line (in KZT)
+                "purchase_price_kzt": float(purchase_price_kzt),  # Purchase price in KZT (before row expenses)
+                "images": self._process_images_for_equipment(equipment)
+            })
         
-        Args:
-            equipment: Equipment объект
-            calculation_result: Результат расчета из calculate_equipment_cost
-            proposal: CommercialProposal (опционально)
-            created_by: User (опционально)
-            is_manual_adjustment: Флаг ручной корректировки
-            notes: Примечания
+        return final_items
+
+    def _convert_currency(self, amount, from_curr, to_curr):
+        if from_curr == to_curr:
+            return amount
+            
+        # Convert to KZT first (Base)
+        rate_from = self.rates_map.get(from_curr)
+        rate_to = self.rates_map.get(to_curr)
         
-        Returns:
-            CostCalculation: Созданный объект расчета
-        """
-        # Определить версию расчета
-        if proposal:
-            last_version = CostCalculation.objects.filter(
-                equipment=equipment,
-                proposal=proposal
-            ).order_by('-calculation_version').first()
-        else:
-            last_version = CostCalculation.objects.filter(
-                equipment=equipment,
-                proposal__isnull=True
-            ).order_by('-calculation_version').first()
+        if not rate_from:
+             # Fallback: try to find in DB if not in internal map (sanity check, though map should have it)
+             # Ideally validation should happen before
+             # For now assume 1.0 or log error? Better to assume 1.0 to avoid crash
+             rate_from = Decimal('1.0')
         
-        next_version = (last_version.calculation_version + 1) if last_version else 1
+        if not rate_to:
+             rate_to = Decimal('1.0')
+             
+        # Amount (From) * Rate (From->KZT) = KZT
+        amount_kzt = amount * rate_from
         
-        # Создать запись расчета
-        calculation = CostCalculation.objects.create(
-            equipment=equipment,
-            proposal=proposal,
-            calculation_version=next_version,
-            purchase_price_id=calculation_result['purchase_price']['id'],
-            purchase_price_value=calculation_result['purchase_price']['value'],
-            purchase_price_currency=calculation_result['purchase_price']['currency'],
-            purchase_price_source=calculation_result['purchase_price']['source'],
-            logistics_id=calculation_result['logistics']['id'],
-            logistics_cost=calculation_result['logistics']['cost'],
-            logistics_currency=calculation_result['logistics']['currency'],
-            logistics_route=calculation_result['logistics']['route'],
-            warehouse_cost=calculation_result['warehouse']['cost'],
-            warehouse_currency=calculation_result['warehouse']['currency'],
-            production_cost=calculation_result['production']['cost'],
-            production_currency=calculation_result['production']['currency'],
-            additional_costs=calculation_result['additional_costs']['cost'],
-            additional_costs_currency=calculation_result['additional_costs']['currency'] or 'KZT',
-            exchange_rate_id=calculation_result['exchange_rate']['id'],
-            exchange_rate_value=calculation_result['exchange_rate']['value'],
-            exchange_rate_from=calculation_result['exchange_rate']['from_currency'],
-            exchange_rate_to=calculation_result['exchange_rate']['to_currency'],
-            exchange_rate_date=calculation_result['exchange_rate']['date'],
-            total_cost_base_currency=calculation_result['total_cost_kzt'],
-            total_cost_kzt=calculation_result['total_cost_kzt'],
-            calculation_details=calculation_result,
-            is_manual_adjustment=is_manual_adjustment,
-            notes=notes,
-            created_by=created_by,
+        # KZT / Rate (To->KZT) = Amount (To)
+        amount_target = amount_kzt / rate_to
+        return amount_target
+
+    def _get_equipment_details(self):
+        """Get equipment details for ALL equipment in proposal, even if empty."""
+        data = {}
+        for eq_list in self.proposal.equipment_lists.all():
+            for item in eq_list.equipment_items_relation.select_related('equipment').prefetch_related('equipment__photos').all().order_by('order', 'created_at'):
+                equipment = item.equipment
+                details = equipment.details.all()
+                # Always include equipment, even if no details (empty list)
+                data[equipment.equipment_id] = [
+                    {'name': d.detail_parameter_name, 'value': d.detail_parameter_value} 
+                    for d in details
+                ]
+        return data
+
+    def _get_equipment_specifications(self):
+        """Get equipment specifications for ALL equipment in proposal, even if empty."""
+        data = {}
+        for eq_list in self.proposal.equipment_lists.all():
+            for item in eq_list.equipment_items_relation.select_related('equipment').prefetch_related('equipment__photos').all().order_by('order', 'created_at'):
+                equipment = item.equipment
+                specs = equipment.specifications.all()
+                # Always include equipment, even if no specs (empty list)
+                data[equipment.equipment_id] = [
+                    {'name': s.spec_parameter_name, 'value': s.spec_parameter_value} 
+                    for s in specs
+                ]
+        return data
+
+    def _get_tech_processes(self):
+        """Get tech processes for ALL equipment in proposal, even if empty."""
+        data = {}
+        for eq_list in self.proposal.equipment_lists.all():
+            for item in eq_list.equipment_items_relation.select_related('equipment').prefetch_related('equipment__photos').all().order_by('order', 'created_at'):
+                equipment = item.equipment
+                procs = equipment.tech_processes.all()
+                # Always include equipment, even if no processes (empty list)
+                data[equipment.equipment_id] = [
+                    {'title': p.tech_name, 'value': p.tech_value, 'desc': p.tech_desc} 
+                    for p in procs
+                ]
+        return data
+
+    def _process_images_for_equipment(self, equipment):
+        """
+        Build images list for equipment: local EquipmentPhoto first (stable /media/photos/ URLs),
+        then legacy equipment_imagelinks (external, direct link). Used in data_package and PDF/DOCX.
+        """
+        result = []
+        for photo in equipment.photos.all().order_by('sort_order', 'pk'):
+            url = photo.image.url if photo.image else ''
+            if url:
+                result.append({'name': photo.name or '', 'url': url})
+        imagelinks = equipment.equipment_imagelinks
+        if not imagelinks:
+            return result
+        if isinstance(imagelinks, list):
+            for item in imagelinks:
+                if isinstance(item, dict):
+                    name = item.get('name', '')
+                    url = item.get('url')
+                    if url:
+                        direct_url = LinkConverterService.get_direct_link(url)
+                        result.append({'name': name, 'url': direct_url})
+                elif isinstance(item, str):
+                    direct_url = LinkConverterService.get_direct_link(item)
+                    result.append({'name': '', 'url': direct_url})
+        elif isinstance(imagelinks, str):
+            links = [link.strip() for link in imagelinks.split(',') if link.strip()]
+            for link in links:
+                direct_url = LinkConverterService.get_direct_link(link)
+                result.append({'name': '', 'url': direct_url})
+        return result
+
+    def _process_images(self, imagelinks):
+        """
+        Parses image links field. Returns list of dicts with 'name' and 'url'.
+        Kept for backward compatibility when equipment is not available.
+        """
+        if not imagelinks:
+            return []
+        result = []
+        if isinstance(imagelinks, list):
+            for item in imagelinks:
+                if isinstance(item, dict):
+                    name = item.get('name', '')
+                    url = item.get('url')
+                    if url:
+                        direct_url = LinkConverterService.get_direct_link(url)
+                        result.append({'name': name, 'url': direct_url})
+                elif isinstance(item, str):
+                    direct_url = LinkConverterService.get_direct_link(item)
+                    result.append({'name': '', 'url': direct_url})
+        elif isinstance(imagelinks, str):
+            links = [link.strip() for link in imagelinks.split(',') if link.strip()]
+            for link in links:
+                direct_url = LinkConverterService.get_direct_link(link)
+                result.append({'name': '', 'url': direct_url})
+        return result
+
+
+class ProposalDataPackageService:
+    """
+    Load / store CommercialProposal.data_package in ProposalDataPackage (compressed
+    skeleton) + EquipmentDataSection (shared per-equipment sections), see datapackage.py.
+
+    Packages carry `schema_version`; older ones are upgraded once (UPGRADE_STEPS) when
+    read or stored and persisted, so readers can rely on the current shape.
+    """
+
+    # Текущая версия формата пакета (пакеты без schema_version считаются версией 0)
+    SCHEMA_VERSION = 3
+    # (версия после шага, метод шага)
+    UPGRADE_STEPS = (
+        (1, '_upgrade_proposal_dates'),
+        (2, '_upgrade_units'),
+        (3, '_upgrade_sections'),
+    )
+
+    @staticmethod
+    def _format_date(value):
+        """ISO date / datetime string -> d.m.Y; other values unchanged."""
+        from datetime import datetime
+
+        if not isinstance(value, str) or not value:
+            return value
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).strftime('%d.%m.%Y')
+        except ValueError:
+            return value
+
+    @staticmethod
+    def _upgrade_proposal_dates(package, proposal):
+        """v1: proposal date / valid_until in d.m.Y (early packages stored ISO dates)."""
+        meta = package.get('proposal')
+        if isinstance(meta, dict):
+            for key in ('date', 'valid_until'):
+                meta[key] = ProposalDataPackageService._format_date(meta.get(key))
+
+    @staticmethod
+    def _upgrade_units(package, proposal):
+        """v2: every equipment_list item has a unit (equipment_uom, default 'шт')."""
+        items = [item for item in package.get('equipment_list') or [] if isinstance(item, dict)]
+        missing = [item for item in items if not item.get('unit')]
+        if not missing:
+            return
+        uoms = dict(
+            Equipment.objects.filter(
+                pk__in={item.get('equipment_id') for item in missing if item.get('equipment_id')}
+            ).values_list('equipment_id', 'equipment_uom')
         )
-        
-        return calculation
-    
+        for item in missing:
+            item['unit'] = uoms.get(item.get('equipment_id')) or 'шт'
+
     @staticmethod
-    def calculate_proposal_total_price(cost_price, margin_percentage=None):
+    def _upgrade_sections(package, proposal):
+        """v3: equipment details / specifications / tech processes present."""
+        aggregator = None
+        for key, getter in (
+            ('equipment_details', '_get_equipment_details'),
+            ('equipment_specifications', '_get_equipment_specifications'),
+            ('tech_processes', '_get_tech_processes'),
+        ):
+            if not package.get(key):
+                aggregator = aggregator or DataAggregatorService(proposal)
+                package[key] = getattr(aggregator, getter)()
+
+    @staticmethod
+    def upgrade(package, proposal):
+        """Run the pending upgrade steps on a copy; returns (package, upgraded)."""
+        import copy
+
+        version = package.get('schema_version') or 0
+        if version >= ProposalDataPackageService.SCHEMA_VERSION:
+            return package, False
+        package = copy.deepcopy(package)
+        for step_version, step in ProposalDataPackageService.UPGRADE_STEPS:
+            if version < step_version:
+                getattr(ProposalDataPackageService, step)(package, proposal)
+                version = step_version
+        package['schema_version'] = version
+        return package, True
+
+    @staticmethod
+    def load(proposal_id, proposal=None):
         """
-        Рассчитать итоговую цену КП на основе себестоимости и маржи.
-        
-        Формула: total_price = cost_price * (1 + margin_percentage / 100)
-        
-        Args:
-            cost_price: Себестоимость (сумма всех себестоимостей оборудования)
-            margin_percentage: Процент маржи (если None, маржа не добавляется)
-        
-        Returns:
-            Decimal: Итоговая цена
+        Assembled package of a proposal ({} when it has none). Two queries; an outdated
+        package is upgraded and written back once.
         """
-        cost_price_decimal = Decimal(str(cost_price))
-        
-        if margin_percentage is None or margin_percentage == 0:
-            return cost_price_decimal
-        
-        margin_decimal = Decimal(str(margin_percentage))
-        total_price = cost_price_decimal * (Decimal('1') + margin_decimal / Decimal('100'))
-        
-        return total_price.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-    
+        from . import datapackage
+        from .models import EquipmentDataSection, ProposalDataPackage
+
+        payload = ProposalDataPackage.objects.filter(
+            proposal_id=proposal_id
+        ).values_list('payload', flat=True).first()
+        if payload is None:
+            return {}
+        skeleton = datapackage.decompress(payload)
+        hashes = set((skeleton.get(datapackage.SECTIONS_REF_KEY) or {}).values())
+        sections = {}
+        if hashes:
+            sections = {
+                section_hash: datapackage.decompress(section_payload)
+                for section_hash, section_payload in EquipmentDataSection.objects.filter(
+                    section_hash__in=hashes
+                ).values_list('section_hash', 'payload')
+            }
+        package = datapackage.join(skeleton, sections)
+        if (package.get('schema_version') or 0) < ProposalDataPackageService.SCHEMA_VERSION:
+            proposal = proposal or CommercialProposal.objects.get(pk=proposal_id)
+            package = ProposalDataPackageService.store(proposal, package)
+        return package
+
     @staticmethod
-    def calculate_proposal_cost_price(proposal):
+    def store(proposal, package):
         """
-        Рассчитать общую себестоимость КП на основе всех оборудования в EquipmentList.
-        
-        Args:
-            proposal: CommercialProposal объект
-        
-        Returns:
-            Decimal: Общая себестоимость
+        Write a package (upgraded to SCHEMA_VERSION first): new sections are inserted
+        (existing ones reused), the skeleton upserted. Returns the stored package.
+        """
+        from . import datapackage
+        from .models import EquipmentDataSection, ProposalDataPackage
+
+        if not package:
+            ProposalDataPackage.objects.filter(proposal_id=proposal.pk).delete()
+            return package
+        package, upgraded = ProposalDataPackageService.upgrade(package, proposal)
+        if upgraded:
+            logger.info(f'Data package of proposal {proposal.pk} upgraded to schema {package["schema_version"]}')
+        skeleton, sections = datapackage.split(package)
+        raw_size = 0
+        if sections:
+            from datetime import timedelta
+            # Секции, записанные недавно, prune_sections не тронет; остальные (новые и
+            # давно не используемые) upsert'ятся с новым created_at, в т.ч. если prune
+            # удалил секцию между проверкой и записью
+            grace = ProposalDataPackageService._prune_grace_seconds()
+            fresh = set(
+                EquipmentDataSection.objects.filter(
+                    section_hash__in=sections, created_at__gte=timezone.now() - timedelta(seconds=grace // 2)
+                ).values_list('section_hash', flat=True)
+            )
+            upserts = []
+            for section_hash, section in sections.items():
+                payload, size = datapackage.compress(section)
+                raw_size += size
+                if section_hash not in fresh:
+                    upserts.append(EquipmentDataSection(section_hash=section_hash, payload=payload))
+            if upserts:
+                EquipmentDataSection.objects.bulk_create(
+                    upserts, update_conflicts=True, unique_fields=['section_hash'], update_fields=['created_at']
+                )
+        payload, size = datapackage.compress(skeleton)
+        ProposalDataPackage.objects.update_or_create(
+            proposal_id=proposal.pk,
+            defaults={
+                'payload': payload, 'raw_size': raw_size + size, 'stored_size': len(payload),
+                'schema_version': package['schema_version'],
+            },
+        )
+        return package
+
+    @staticmethod
+    def copy(source_proposal_id, target_proposal_ids):
+        """Same stored package for other proposals (skeleton copied, sections shared)."""
+        from .models import ProposalDataPackage
+
+        source = ProposalDataPackage.objects.filter(proposal_id=source_proposal_id).first()
+        if source is None or not target_proposal_ids:
+            return
+        ProposalDataPackage.objects.bulk_create([
+            ProposalDataPackage(
+                proposal_id=proposal_id, payload=source.payload, raw_size=source.raw_size,
+                stored_size=source.stored_size, schema_version=source.schema_version,
+            )
+            for proposal_id in target_proposal_ids
+        ])
+
+    @staticmethod
+    def _prune_grace_seconds():
+        return int(getattr(settings, 'DATA_PACKAGE_SECTION_PRUNE_GRACE_SECONDS', 24 * 60 * 60))
+
+    @staticmethod
+    def prune_sections(grace_seconds=None):
+        """
+        Delete sections no stored package references. Only sections not written for
+        grace_seconds (default DATA_PACKAGE_SECTION_PRUNE_GRACE_SECONDS) are deleted:
+        store() refreshes created_at of the sections it reuses, so a package saved while
+        the references are being scanned keeps its sections. Returns the number deleted.
+        """
+        from datetime import timedelta
+        from . import datapackage
+        from .models import EquipmentDataSection, ProposalDataPackage
+
+        if grace_seconds is None:
+            grace_seconds = ProposalDataPackageService._prune_grace_seconds()
+        cutoff = timezone.now() - timedelta(seconds=grace_seconds)
+        referenced = set()
+        for payload in ProposalDataPackage.objects.values_list('payload', flat=True).iterator(chunk_size=200):
+            skeleton = datapackage.decompress(payload)
+            referenced.update((skeleton.get(datapackage.SECTIONS_REF_KEY) or {}).values())
+        deleted, _ = EquipmentDataSection.objects.filter(created_at__lt=cutoff).exclude(
+            section_hash__in=referenced
+        ).delete()
+        return deleted
+
+
+class ProposalSummaryService:
+    """
+    Maintains ProposalSummary rows (read model of the proposals grid / dashboard).
+
+    mark_dirty(ids) writes the ids to the ProposalSummaryDirty outbox inside the
+    surrounding transaction and drains them after it commits (immediately in autocommit),
+    so a burst of signals inside one transaction costs one refresh. Outbox rows are
+    deleted in the transaction that refreshes the summary; whatever a failed or lost
+    refresh leaves behind is drained by drain_proposal_summaries_task. refresh(ids)
+    recomputes the rows with one annotated query and upserts them.
+    """
+
+    _pending = threading.local()
+
+    # Колонки сводки, которые пересчитываются из КП (last_exported_at ведется отдельно)
+    REFRESH_FIELDS = (
+        'proposal_name', 'outcoming_number', 'client_id', 'client_name', 'client_company_name',
+        'client_display_name', 'deal_id', 'user_id', 'user_name', 'updated_by_id', 'updated_by_name',
+        'parent_proposal_id',
+        'currency_ticket', 'exchange_rate', 'total_price', 'total_price_kzt', 'cost_price',
+        'margin_percentage', 'margin_value', 'paid_amount', 'payment_percentage', 'item_count',
+        'template_status', 'proposal_status', 'pricing_status', 'proposal_version', 'is_active',
+        'proposal_date', 'valid_until', 'created_at', 'updated_at', 'refreshed_at',
+    )
+
+    DRAIN_BATCH_SIZE = 500
+
+    @staticmethod
+    def mark_dirty(proposal_ids):
+        from .models import ProposalSummaryDirty
+
+        ids = {int(proposal_id) for proposal_id in proposal_ids if proposal_id}
+        if not ids:
+            return
+        # ON CONFLICT DO UPDATE (not DO NOTHING) locks an existing row until commit,
+        # so a concurrent drain skips it instead of deleting it before this change is visible
+        ProposalSummaryDirty.objects.bulk_create(
+            [ProposalSummaryDirty(proposal_id=proposal_id) for proposal_id in sorted(ids)],
+            update_conflicts=True,
+            unique_fields=['proposal_id'],
+            update_fields=['marked_at'],
+        )
+        pending = getattr(ProposalSummaryService._pending, 'ids', None)
+        if pending is None:
+            pending = ProposalSummaryService._pending.ids = set()
+        pending.update(ids)
+        # Every call registers a flush; the first one after commit takes all pending ids.
+        # Ids of a rolled back transaction have no outbox rows, their drain is a no-op.
+        transaction.on_commit(ProposalSummaryService._flush)
+
+    @staticmethod
+    def _flush():
+        ids = getattr(ProposalSummaryService._pending, 'ids', None)
+        if not ids:
+            return
+        ProposalSummaryService._pending.ids = set()
+        try:
+            ProposalSummaryService.drain(ids)
+        except Exception as e:
+            # Outbox rows stay, drain_proposal_summaries_task retries them
+            logger.error(f'Proposal summary refresh failed for {sorted(ids)[:20]}: {e}', exc_info=True)
+
+    @staticmethod
+    def _claim_and_refresh(proposal_ids):
+        """Delete the unlocked outbox rows of these proposals and refresh them, in one transaction."""
+        from .models import ProposalSummaryDirty
+
+        with transaction.atomic():
+            claimed = list(
+                ProposalSummaryDirty.objects.select_for_update(skip_locked=True)
+                .filter(proposal_id__in=proposal_ids).values_list('pk', 'proposal_id')
+            )
+            if not claimed:
+                return 0
+            ProposalSummaryDirty.objects.filter(pk__in=[pk for pk, _ in claimed]).delete()
+            ProposalSummaryService.refresh([proposal_id for _, proposal_id in claimed])
+        return len(claimed)
+
+    @staticmethod
+    def drain(proposal_ids=None):
         """
-        from .models import EquipmentListItem
-        
-        total_cost = Decimal('0')
-        
-        # Проходим по всем EquipmentList в КП
-        for equipment_list in proposal.equipment_lists.all():
-            # Проходим по всем EquipmentListItem
-            for item in equipment_list.equipment_items_relation.all():
-                equipment = item.equipment
-                quantity = item.quantity
-                
-                # Рассчитываем себестоимость для этого оборудования
+        Refresh the summaries queued in the outbox (only these proposals if given).
+        A failed batch is retried one proposal at a time; proposals that still fail keep
+        their outbox row (attempts + 1) for the next run. Returns the number refreshed.
+        """
+        from django.db.models import F
+        from .models import ProposalSummaryDirty
+
+        refreshed = 0
+        last_id = 0
+        while True:
+            queue = ProposalSummaryDirty.objects.filter(pk__gt=last_id)
+            if proposal_ids is not None:
+                queue = queue.filter(proposal_id__in=proposal_ids)
+            batch = list(
+                queue.order_by('pk').values_list('pk', 'proposal_id')[:ProposalSummaryService.DRAIN_BATCH_SIZE]
+            )
+            if not batch:
+                return refreshed
+            last_id = batch[-1][0]
+            ids = [proposal_id for _, proposal_id in batch]
+            try:
+                refreshed += ProposalSummaryService._claim_and_refresh(ids)
+                continue
+            except Exception as e:
+                logger.warning(f'Proposal summary batch refresh failed, retrying one by one: {e}')
+            for proposal_id in ids:
                 try:
-                    calculation_result = CostCalculationService.calculate_equipment_cost(
-                        equipment=equipment,
-                        exchange_rate_date=proposal.exchange_rate_date or None,
-                        proposal=proposal,
-                        target_currency=proposal.currency_ticket,
-                        manual_overrides={'exchange_rate_value': proposal.exchange_rate} if proposal.exchange_rate else None
-                    )
-                    
-                    # Себестоимость единицы оборудования в целевой валюте
-                    unit_cost = Decimal(str(calculation_result['total_cost_target_currency']))
-                    
-                    # Учитываем количество
-                    item_total_cost = unit_cost * quantity
-                    total_cost += item_total_cost
-                    
+                    refreshed += ProposalSummaryService._claim_and_refresh([proposal_id])
                 except Exception as e:
-                    # Если не удалось рассчитать, пропускаем это оборудование
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.warning(f'Failed to calculate cost for equipment {equipment.equipment_id}: {str(e)}')
-                    continue
-        
-        return total_cost.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+                    ProposalSummaryDirty.objects.filter(proposal_id=proposal_id).update(attempts=F('attempts') + 1)
+                    logger.error(f'Proposal summary refresh failed for {proposal_id}: {e}', exc_info=True)
+
+    @staticmethod
+    def _rows(proposal_ids):
+        """Source values of the summary (one query, counts / sums as correlated subqueries)."""
+        from django.db.models import Count, DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value
+        from django.db.models.functions import Coalesce
+        from .models import EquipmentListItem, PaymentLog
 
+        item_count = EquipmentListItem.objects.filter(
+            equipment_list__proposal=OuterRef('pk')
+        ).order_by().values('equipment_list__proposal').annotate(c=Count('pk')).values('c')
+        paid_amount = PaymentLog.objects.filter(
+            commercial_proposals=OuterRef('pk')
+        ).order_by().values('commercial_proposals').annotate(s=Sum('payment_value')).values('s')
+        money = DecimalField(max_digits=25, decimal_places=2)
 
-class DataAggregatorService:
+        return CommercialProposal.objects.filter(pk__in=proposal_ids).values(
+            'proposal_id', 'proposal_name', 'outcoming_number', 'client_id', 'deal_id', 'user_id',
+            'updated_by_id', 'parent_proposal_id', 'currency_ticket', 'exchange_rate', 'total_price', 'cost_price',
+            'margin_percentage', 'margin_value', 'proposal_status', 'pricing_status',
+            'proposal_version', 'is_active', 'proposal_date', 'valid_until', 'created_at', 'updated_at',
+        ).annotate(
+            client_name_value=F('client__client_name'),
+            client_company_name_value=F('client__client_company_name'),
+            user_name_value=F('user__user_name'),
+            updated_by_name_value=F('updated_by__user_name'),
+            # NULL when the proposal has no template (LEFT JOIN on the reverse one-to-one)
+            template_is_final=F('template__is_final'),
+            item_count=Coalesce(Subquery(item_count, output_field=IntegerField()), Value(0)),
+            paid_amount=Coalesce(Subquery(paid_amount, output_field=money), Value(Decimal('0')), output_field=money),
+        )
+
+    @staticmethod
+    def build(values):
+        """ProposalSummary for one row of _rows()."""
+        from .models import ProposalSummary
+
+        total_price = Decimal(str(values['total_price'] or 0))
+        # Итог в KZT: для других валют по курсу КП
+        if values['currency_ticket'] != 'KZT':
+            total_price_kzt = total_price * Decimal(str(values['exchange_rate'] or 0))
+        else:
+            total_price_kzt = total_price
+        total_price_kzt = total_price_kzt.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        paid_amount = Decimal(str(values['paid_amount'] or 0))
+        payment_percentage = Decimal('0')
+        if total_price_kzt > 0:
+            payment_percentage = min(paid_amount / total_price_kzt * 100, Decimal('100'))
+        if values['template_is_final'] is None:
+            template_status = 'Not Created'
+        else:
+            template_status = 'Ready' if values['template_is_final'] else 'Draft'
+        client_name = values['client_name_value'] or ''
+        client_company_name = values['client_company_name_value'] or ''
+
+        return ProposalSummary(
+            proposal_id=values['proposal_id'],
+            client_name=client_name,
+            client_company_name=client_company_name,
+            client_display_name=client_company_name or client_name,
+            user_name=values['user_name_value'] or '',
+            updated_by_name=values['updated_by_name_value'] or '',
+            total_price_kzt=total_price_kzt,
+            paid_amount=paid_amount,
+            payment_percentage=payment_percentage.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP),
+            template_status=template_status,
+            **{
+                name: values[name] for name in (
+                    'proposal_name', 'outcoming_number', 'client_id', 'deal_id', 'user_id', 'updated_by_id',
+                    'parent_proposal_id', 'currency_ticket', 'exchange_rate', 'total_price', 'cost_price',
+                    'margin_percentage', 'margin_value', 'item_count', 'proposal_status', 'pricing_status',
+                    'proposal_version', 'is_active', 'proposal_date', 'valid_until', 'created_at', 'updated_at',
+                )
+            },
+        )
+
+    @staticmethod
+    def refresh(proposal_ids):
+        """Recompute and upsert the summaries of these proposals. Returns the number written."""
+        from .models import ProposalSummary
+
+        summaries = [ProposalSummaryService.build(values) for values in ProposalSummaryService._rows(proposal_ids)]
+        # Дни сводки продаж: прежняя дата КП (если ее изменили) и текущая
+        days = set(ProposalSummary.objects.filter(pk__in=proposal_ids).values_list('proposal_date', flat=True))
+        days.update(summary.proposal_date for summary in summaries)
+        if summaries:
+            ProposalSummary.objects.bulk_create(
+                summaries,
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=['proposal'],
+                update_fields=list(ProposalSummaryService.REFRESH_FIELDS),
+            )
+        SalesRollupService.mark_days(days)
+        return len(summaries)
+
+    @staticmethod
+    def rebuild_all(batch_size=500, progress=None):
+        """Refresh the summaries of all proposals in id batches. Returns the number written."""
+        total = 0
+        last_id = 0
+        while True:
+            ids = list(
+                CommercialProposal.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                return total
+            last_id = ids[-1]
+            total += ProposalSummaryService.refresh(ids)
+            if progress:
+                progress(total)
+
+    @staticmethod
+    def record_export(proposal_id):
+        """Last successful PDF / DOCX export of the proposal."""
+        from .models import ProposalSummary
+
+        ProposalSummary.objects.filter(proposal_id=proposal_id).update(last_exported_at=timezone.now())
+
+
+class SalesRollupService:
     """
-    Service for preparing data for the Proposal Constructor (Frontend & PDF).
-    Aggregates data from various models and calculates final prices using the 'dissolution' method.
-    Enforces security by sanitizing internal costs and margins.
+    Daily sales rollups (SalesDailyRollup) and the analytics queries served from them.
+
+    Changed days are queued in SalesRollupDirtyDay (mark_days, called after proposal
+    summaries are refreshed and on proposal delete); refresh() recomputes the queued
+    days from CommercialProposal / PaymentLog, so each run only touches what changed.
+    Payments are attributed to the proposal date of the proposals they are linked to.
     """
 
-    def __init__(self, proposal):
-        self.proposal = proposal
-        self.currency = proposal.currency_ticket
-        # Transform internal_exchange_rates list to dict for faster lookup
-        # Expected format: [{'currency_from': 'USD', 'rate_value': 450.0, ...}, ...]
-        # Mapping: currency_code -> rate to KZT
-        self.rates_map = {}
-        if self.proposal.internal_exchange_rates:
-            for rate in self.proposal.internal_exchange_rates:
-                if isinstance(rate, dict):
-                    # Try different keys that might be used
-                    curr = rate.get('currency_from') or rate.get('currency')
-                    val = rate.get('rate_value') or rate.get('value')
-                    if curr and val:
-                        self.rates_map[curr] = Decimal(str(val))
-        
-        # Ensure proposal exchange rate is also available
-        if self.proposal.exchange_rate:
-             # This is the rate of proposal.currency_ticket to KZT
-             self.rates_map[self.proposal.currency_ticket] = Decimal(str(self.proposal.exchange_rate))
-        
-        # Add pivot currency
-        self.rates_map['KZT'] = Decimal('1.0')
+    # Статусы, которые считаются выигранными для конверсии
+    WON_STATUSES = ('accepted', 'completed')
+    GROUP_BY_CHOICES = ('day', 'month', 'year', 'user', 'status', 'currency')
+    DAYS_PER_TRANSACTION = 200
 
-    def get_full_data_package(self):
+    @staticmethod
+    def mark_days(days):
+        from .models import SalesRollupDirtyDay
+
+        days = {day for day in days if day}
+        if days:
+            SalesRollupDirtyDay.objects.bulk_create(
+                [SalesRollupDirtyDay(day=day) for day in days], ignore_conflicts=True
+            )
+
+    @staticmethod
+    def refresh():
+        """Recompute all queued days. Returns the number of days processed."""
+        from .models import SalesRollupDirtyDay
+
+        processed = 0
+        while True:
+            with transaction.atomic():
+                # Удаляем метки до пересчета: дни, отмеченные во время пересчета, попадут в следующий запуск
+                queued = list(
+                    SalesRollupDirtyDay.objects.select_for_update(skip_locked=True)
+                    .order_by('day').values_list('pk', 'day')[:SalesRollupService.DAYS_PER_TRANSACTION]
+                )
+                if not queued:
+                    return processed
+                SalesRollupDirtyDay.objects.filter(pk__in=[pk for pk, _ in queued]).delete()
+                SalesRollupService.recompute([day for _, day in queued])
+            processed += len(queued)
+
+    @staticmethod
+    def recompute(days):
+        """Replace the rollup rows of these days (active proposals only)."""
+        from django.db.models import Case, Count, DecimalField, F, Sum, Value, When
+        from django.db.models.functions import Coalesce
+        from .models import PaymentLog, SalesDailyRollup
+
+        amount = DecimalField(max_digits=40, decimal_places=8)
+        rate = Case(When(currency_ticket='KZT', then=Value(Decimal('1'))), default=F('exchange_rate'), output_field=amount)
+        zero = Value(Decimal('0'), output_field=amount)
+        keys = ('proposal_date', 'user_id', 'proposal_status', 'currency_ticket')
+
+        groups = CommercialProposal.objects.filter(is_active=True, proposal_date__in=days).order_by().values(
+            *keys
+        ).annotate(
+            proposal_count=Count('pk'),
+            total_price_sum=Coalesce(Sum('total_price', output_field=amount), zero),
+            total_price_kzt=Coalesce(Sum(F('total_price') * rate, output_field=amount), zero),
+            cost_price_kzt=Coalesce(Sum(Coalesce(F('cost_price'), zero) * rate, output_field=amount), zero),
+            # margin_value хранится в KZT (DataAggregatorService)
+            margin_kzt=Coalesce(Sum('margin_value', output_field=amount), zero),
+        )
+        # Платежи через связь M2M: платеж учитывается в каждом КП, к которому привязан
+        payments = PaymentLog.objects.filter(
+            commercial_proposals__is_active=True, commercial_proposals__proposal_date__in=days
+        ).order_by().values(
+            *('commercial_proposals__' + key for key in keys)
+        ).annotate(paid=Sum('payment_value'))
+        paid = {
+            tuple(row['commercial_proposals__' + key] for key in keys): row['paid']
+            for row in payments
+        }
+
+        def money(value):
+            return Decimal(str(value or 0)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+        rollups = [
+            SalesDailyRollup(
+                day=row['proposal_date'],
+                user_id=row['user_id'],
+                proposal_status=row['proposal_status'],
+                currency_ticket=row['currency_ticket'],
+                proposal_count=row['proposal_count'],
+                total_price=money(row['total_price_sum']),
+                total_price_kzt=money(row['total_price_kzt']),
+                cost_price_kzt=money(row['cost_price_kzt']),
+                margin_kzt=money(row['margin_kzt']),
+                paid_amount_kzt=money(paid.get(tuple(row[key] for key in keys))),
+            )
+            for row in groups
+        ]
+        SalesDailyRollup.objects.filter(day__in=days).delete()
+        SalesDailyRollup.objects.bulk_create(rollups, batch_size=500)
+        return len(rollups)
+
+    @staticmethod
+    def rebuild_all():
+        """Queue every day that has proposals or rollup rows, then refresh."""
+        from .models import SalesDailyRollup
+
+        days = set(CommercialProposal.objects.order_by().values_list('proposal_date', flat=True).distinct())
+        days.update(SalesDailyRollup.objects.order_by().values_list('day', flat=True).distinct())
+        SalesRollupService.mark_days(days)
+        return SalesRollupService.refresh()
+
+    @staticmethod
+    def parse_group_by(value):
+        """'month,user' -> ['month', 'user']; raises ValueError on unknown or conflicting keys."""
+        group_by = []
+        for key in (value or '').split(','):
+            key = key.strip()
+            if not key or key in group_by:
+                continue
+            if key not in SalesRollupService.GROUP_BY_CHOICES:
+                raise ValueError(
+                    f"Unknown group_by '{key}'. Allowed: {', '.join(SalesRollupService.GROUP_BY_CHOICES)}"
+                )
+            group_by.append(key)
+        if len([key for key in group_by if key in ('day', 'month', 'year')]) > 1:
+            raise ValueError('Use only one of day, month, year in group_by')
+        return group_by
+
+    @staticmethod
+    def report(date_from=None, date_to=None, group_by=(), user_ids=None, statuses=None, currencies=None):
         """
-        Main entry point. Returns a dictionary with all necessary data.
+        Aggregate rollups over a date range, grouped by period / manager / status / currency.
+        Returns {'results': [...], 'totals': {...}}; amounts are decimals rounded to 0.01,
+        conversion_rate is the share (%) of won proposals (WON_STATUSES).
         """
-        # Calculate equipment list first as it drives the core pricing
-        equipment_list_data = self._calculate_and_build_equipment_list()
-        
-        # Calculate total margin from all equipment items
-        total_margin_kzt = Decimal('0')
-        total_base_cost_kzt = Decimal('0')
-        for item in equipment_list_data:
-            if 'margin_kzt_total' in item:
-                total_margin_kzt += Decimal(str(item['margin_kzt_total']))
-            if 'base_cost_kzt' in item and 'quantity' in item:
-                total_base_cost_kzt += Decimal(str(item['base_cost_kzt'])) * Decimal(str(item['quantity']))
-        
-        # Calculate total margin percentage
-        total_margin_percentage = Decimal('0')
-        if total_base_cost_kzt > 0:
-            total_margin_percentage = (total_margin_kzt / total_base_cost_kzt) * Decimal('100')
+        from django.db.models import Case, IntegerField, Sum, When
+        from django.db.models.functions import TruncMonth, TruncYear
+        from .models import SalesDailyRollup
 
-        # Clamp and quantize margin values to fit model fields (max_digits=5, decimal_places=2)
-        # Avoid InvalidOperation when serializing
-        try:
-            total_margin_kzt = total_margin_kzt.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        except Exception:
-            total_margin_kzt = Decimal('0')
+        queryset = SalesDailyRollup.objects.order_by()
+        if date_from:
+            queryset = queryset.filter(day__gte=date_from)
+        if date_to:
+            queryset = queryset.filter(day__lte=date_to)
+        if user_ids:
+            queryset = queryset.filter(user_id__in=user_ids)
+        if statuses:
+            queryset = queryset.filter(proposal_status__in=statuses)
+        if currencies:
+            queryset = queryset.filter(currency_ticket__in=currencies)
 
-        try:
-            # Max value that fits in DecimalField(max_digits=5, decimal_places=2) = 999.99
-            max_margin_percentage = Decimal('999.99')
-            if total_margin_percentage > max_margin_percentage:
-                total_margin_percentage = max_margin_percentage
-            total_margin_percentage = total_margin_percentage.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        except Exception:
-            total_margin_percentage = Decimal('0')
-        
-        # Update proposal margin values
-        self.proposal.margin_value = total_margin_kzt
-        self.proposal.margin_percentage = total_margin_percentage
-        self.proposal.save(update_fields=['margin_value', 'margin_percentage'])
+        period = {'day': 'day', 'month': TruncMonth('day'), 'year': TruncYear('day')}
+        columns = {'user': 'user_id', 'status': 'proposal_status', 'currency': 'currency_ticket'}
+        annotations = {key: period[key] for key in group_by if key in ('month', 'year')}
+        if annotations:
+            queryset = queryset.annotate(**{f'{key}_period': value for key, value in annotations.items()})
+        values = [
+            f'{key}_period' if key in annotations else ('day' if key == 'day' else columns[key])
+            for key in group_by
+        ]
 
-        return {
-            "proposal": self._get_proposal_metadata(),
-            "client": self._get_client_data(),
-            "user": self._get_user_data(),
-            "equipment_list": equipment_list_data,
-            "equipment_details": self._get_equipment_details(),
-            "equipment_specifications": self._get_equipment_specifications(),
-            "tech_processes": self._get_tech_processes(),
-            "additional_services": self.proposal.additional_services,
-            "company_logo_url": self._get_company_logo_url(),
+        metrics = {
+            'proposal_count': Sum('proposal_count'),
+            'won_count': Sum(Case(
+                When(proposal_status__in=SalesRollupService.WON_STATUSES, then='proposal_count'),
+                default=0, output_field=IntegerField()
+            )),
+            'total_price_kzt': Sum('total_price_kzt'),
+            'cost_price_kzt': Sum('cost_price_kzt'),
+            'margin_kzt': Sum('margin_kzt'),
+            'paid_amount_kzt': Sum('paid_amount_kzt'),
         }
+        if 'currency' in group_by:
+            # Сумма в валюте КП имеет смысл только в разрезе валюты
+            metrics['total_price'] = Sum('total_price')
 
-    def _get_company_logo_url(self):
-        sys_settings = SystemSettings.get_settings()
-        if sys_settings.company_logo:
-             return sys_settings.company_logo.url
-        return "/static/assets/prosnab_logo.png"
+        def finish(row):
+            result = {name: row.get(name) or 0 for name in metrics}
+            for name in metrics:
+                if name not in ('proposal_count', 'won_count'):
+                    result[name] = Decimal(str(result[name])).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            count = result['proposal_count']
+            result['conversion_rate'] = round(result['won_count'] * 100 / count, 2) if count else 0.0
+            cost = result['cost_price_kzt']
+            result['margin_percentage'] = (
+                (result['margin_kzt'] / cost * 100).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) if cost else None
+            )
+            return result
 
-    def _get_proposal_metadata(self):
-        # Convert dates to strings for JSON serialization
-        from datetime import datetime, date
-        
-        proposal_date_str = None
-        if self.proposal.proposal_date:
-            if isinstance(self.proposal.proposal_date, str):
-                # Try to parse and reformat if it's in ISO format or other formats
-                try:
-                    # Try ISO format first (e.g., "2026-01-19" or "2026-01-19T20:12:50Z")
-                    date_str = self.proposal.proposal_date.replace('Z', '+00:00')
-                    if 'T' in date_str:
-                        dt = datetime.fromisoformat(date_str)
-                    else:
-                        # Just date part (e.g., "2026-01-19")
-                        dt = datetime.strptime(date_str.split('T')[0].split('+')[0], '%Y-%m-%d')
-                    proposal_date_str = dt.strftime('%d.%m.%Y')
-                except (ValueError, AttributeError):
-                    # If parsing fails, check if it's already in d.m.Y format
-                    try:
-                        # Try to parse as d.m.Y to validate
-                        datetime.strptime(self.proposal.proposal_date, '%d.%m.%Y')
-                        proposal_date_str = self.proposal.proposal_date
-                    except (ValueError, AttributeError):
-                        # If all parsing fails, use as-is (might be in another format)
-                        proposal_date_str = self.proposal.proposal_date
-            elif isinstance(self.proposal.proposal_date, (date, datetime)):
-                # Format as d.m.Y for template compatibility
-                if isinstance(self.proposal.proposal_date, datetime):
-                    proposal_date_str = self.proposal.proposal_date.strftime('%d.%m.%Y')
-                else:
-                    proposal_date_str = self.proposal.proposal_date.strftime('%d.%m.%Y')
-            else:
-                proposal_date_str = str(self.proposal.proposal_date) if self.proposal.proposal_date else None
-        
-        valid_until_str = None
-        if self.proposal.valid_until:
-            if isinstance(self.proposal.valid_until, str):
-                # Try to parse and reformat if it's in ISO format
-                try:
-                    dt = datetime.fromisoformat(self.proposal.valid_until.replace('Z', '+00:00'))
-                    valid_until_str = dt.strftime('%d.%m.%Y')
-                except (ValueError, AttributeError):
-                    valid_until_str = self.proposal.valid_until
-            elif isinstance(self.proposal.valid_until, (date, datetime)):
-                # Format as d.m.Y for template compatibility
-                valid_until_str = self.proposal.valid_until.strftime('%d.%m.%Y')
-            else:
-                valid_until_str = str(self.proposal.valid_until)
-        
-        return {
-            "id": self.proposal.proposal_id,
-            "number": self.proposal.outcoming_number,
-            "date": proposal_date_str,
-            "valid_until": valid_until_str,
-            "header": self.proposal.proposal_name,
-            "currency": self.currency,
-            "delivery_time": self.proposal.delivery_time,
-            "warranty": self.proposal.warranty,
-            "margin_value": float(self.proposal.margin_value) if self.proposal.margin_value else None,
-            "total_price": float(self.proposal.total_price) if self.proposal.total_price else 0,
-        }
+        totals = finish(queryset.aggregate(**metrics))
+        if not group_by:
+            return {'results': [], 'totals': totals}
+
+        results = []
+        for row in queryset.values(*values).annotate(**metrics).order_by(*values):
+            item = {}
+            for key, column in zip(group_by, values):
+                value = row[column]
+                if key in ('day', 'month', 'year'):
+                    value = value.isoformat() if value else None
+                item[key] = value
+            item.update(finish(row))
+            results.append(item)
+        return {'results': results, 'totals': totals}
+
+
+class ProposalEquipmentService:
+    """
+    Server-side operations on proposal equipment (EquipmentList / EquipmentListItem)
+    followed by one price recalculation.
+    """
+
+    @staticmethod
+    def recalculate(proposal):
+        """
+        Recalculate cost price, total price / margin and per-item final prices
+        (CostCalculationService + DataAggregatorService), as after proposal create/update.
+        """
+        from .serializers import _save_prices_to_equipment_list_items
+        try:
+            proposal.cost_price = CostCalculationService.calculate_proposal_cost_price(proposal)
+            CommercialProposal.objects.filter(pk=proposal.pk).update(cost_price=proposal.cost_price)
+
+            # total_price и margin_value/margin_percentage обновляются в get_full_data_package
+            data_pkg = DataAggregatorService(proposal).get_full_data_package()
+            proposal.refresh_from_db()
+
+            # Сохранить итоговые цены в EquipmentListItem
+            if 'equipment_list' in data_pkg:
+                _save_prices_to_equipment_list_items(proposal, data_pkg['equipment_list'])
+        except Exception as e:
+            # Если не удалось рассчитать, оставляем значения как есть
+            logger.warning(f'Failed to auto-calculate prices for proposal {proposal.proposal_id}: {str(e)}')
+            return False
+        return True
+
+    @staticmethod
+    def _recalc_key(proposal_id):
+        return f'proposal_recalc:{proposal_id}'
+
+    @staticmethod
+    def schedule_recalculation(proposal):
+        """
+        Mark proposal prices stale and queue recalculate_proposal_task after commit.
 
-    def _get_client_data(self):
-        client = self.proposal.client
-        if not client:
-            return {}
-        return {
-            "name": client.client_name,
-            "company": client.client_company_name,
-            "address": client.client_address,
-            "phone": client.client_phone,
-            "email": client.client_email,
-        }
+        Debounce: every call stores a new token in the cache and queues the task with
+        PROPOSAL_RECALC_DEBOUNCE_SECONDS countdown; a task whose token is no longer the
+        latest exits, so a burst of saves is recalculated once, after the last one.
+        If the broker is unavailable the recalculation runs synchronously.
+        """
+        import uuid
+        proposal_id = proposal.pk
+        CommercialProposal.objects.filter(pk=proposal_id).update(
+            pricing_status='stale', pricing_status_changed_at=timezone.now()
+        )
+        proposal.pricing_status = 'stale'
+        ProposalSummaryService.mark_dirty([proposal_id])
+        token = uuid.uuid4().hex
+        countdown = getattr(settings, 'PROPOSAL_RECALC_DEBOUNCE_SECONDS', 2)
 
-    def _get_user_data(self):
-        user = self.proposal.user
-        if not user:
-            return {}
-        return {
-            "name": user.user_name,
-            "email": user.user_email,
-            "phone": user.user_phone,
-            "role": user.user_role,
-        }
+        def enqueue():
+            from .tasks import recalculate_proposal_task
+            cache.set(ProposalEquipmentService._recalc_key(proposal_id), token, timeout=86400)
+            try:
+                recalculate_proposal_task.apply_async((proposal_id, token), countdown=countdown)
+            except Exception as e:
+                logger.warning(f'Could not queue recalculation for proposal {proposal_id}, running inline: {e}')
+                ProposalEquipmentService.run_scheduled_recalculation(proposal_id, token)
 
-    def _calculate_and_build_equipment_list(self):
+        transaction.on_commit(enqueue)
+
+    @staticmethod
+    def run_scheduled_recalculation(proposal_id, token):
         """
-        New pricing method: Fixed sale price per unit with margin calculation.
-        Step 1: Get sale_price_kzt from Equipment (fixed selling price).
-        Step 2: Calculate Base Cost for each item (Purchase + Row Expenses).
-        Step 3: Calculate Global Overhead (Total Proposal Price - Sum(Sale Prices)).
-        Step 4: Distribute Global Overhead proportionally to Base Costs.
-        Step 5: Calculate margin for each line: margin_kzt = sale_price_kzt - (base_cost + allocated_overhead_per_unit).
-        Step 6: Build final list with sale_price_kzt as price_per_unit and calculated margins.
+        Body of recalculate_proposal_task: stale -> computing -> fresh.
+        Returns 'superseded' (a newer save queued its own run), 'missing', 'fresh' or 'failed'.
         """
-        items_meta = []
-        total_base_cost_sum = Decimal('0')
-        total_sale_price_sum = Decimal('0')
-        
-        # Step 1: Collect all equipment items and calculate base costs
-        for eq_list in self.proposal.equipment_lists.all():
-            for item in eq_list.equipment_items_relation.select_related('equipment').prefetch_related('equipment__photos').all().order_by('order', 'created_at'):
-                equipment = item.equipment
-                quantity = Decimal(item.quantity)
-                
-                # Check if we have saved calculated_data
-                saved_calculated_data = item.calculated_data or {}
-                has_saved_data = (
-                    saved_calculated_data.get('purchase_price_kzt') is not None or
-                    saved_calculated_data.get('base_cost_kzt') is not None or
-                    saved_calculated_data.get('margin_kzt') is not None
-                )
-                
-                # Get sale_price_kzt (fixed selling price)
-                sale_price_kzt = None
-                if equipment.sale_price_kzt:
-                    sale_price_kzt = Decimal(str(equipment.sale_price_kzt))
-                # Also check saved price_per_unit as fallback
-                if sale_price_kzt is None and item.price_per_unit:
-                    sale_price_kzt = Decimal(str(item.price_per_unit))
-                
-                # If no sale_price_kzt, fallback to old method (for backward compatibility)
-                if sale_price_kzt is None:
-                    # Use old calculation method
-                    purchase_price_obj = equipment.purchase_prices.filter(is_active=True).order_by('-created_at').first()
-                    base_unit_cost = Decimal('0')
-                    
-                    if purchase_price_obj and purchase_price_obj.price:
-                        price_val = Decimal(str(purchase_price_obj.price))
-                        price_curr = purchase_price_obj.currency
-                        base_unit_cost = self._convert_currency(price_val, price_curr, self.currency)
-                    elif equipment.equipment_manufacture_price:
-                        price_val = Decimal(str(equipment.equipment_manufacture_price))
-                        price_curr = equipment.equipment_price_currency_type or 'KZT'
-                        base_unit_cost = self._convert_currency(price_val, price_curr, self.currency)
-                    
-                    # Add row expenses
-                    row_expenses_sum = Decimal('0')
-                    if item.row_expenses and isinstance(item.row_expenses, list):
-                        for exp in item.row_expenses:
-                            val = exp.get('value')
-                            curr = exp.get('currency', 'KZT')
-                            if val:
-                                row_expenses_sum += self._convert_currency(Decimal(str(val)), curr, self.currency)
-                    
-                    if quantity > 0:
-                        base_unit_cost += (row_expenses_sum / quantity)
-                    
-                    # Use calculated price as sale price (old behavior)
-                    sale_price_kzt = base_unit_cost
-                
-                # Use saved calculated_data if available, otherwise calculate
-                if has_saved_data:
-                    # Use saved values from calculated_data (safely convert to Decimal)
-                    try:
-                        purchase_price_val = saved_calculated_data.get('purchase_price_kzt', 0)
-                        if purchase_price_val is None:
-                            purchase_price_kzt_for_save = Decimal('0')
-                        else:
-                            purchase_price_kzt_for_save = Decimal(str(purchase_price_val))
-                    except (ValueError, TypeError, InvalidOperation):
-                        purchase_price_kzt_for_save = Decimal('0')
-                    
-                    try:
-                        base_cost_val = saved_calculated_data.get('base_cost_kzt', 0)
-                        if base_cost_val is None:
-                            base_unit_cost_kzt = Decimal('0')
-                        else:
-                            base_unit_cost_kzt = Decimal(str(base_cost_val))
-                    except (ValueError, TypeError, InvalidOperation):
-                        base_unit_cost_kzt = Decimal('0')
-                else:
-                    # Calculate base cost (purchase price + row expenses)
-                    purchase_price_obj = equipment.purchase_prices.filter(is_active=True).order_by('-created_at').first()
-                    base_unit_cost_kzt = Decimal('0')
-                    
-                    if purchase_price_obj and purchase_price_obj.price:
-                        price_val = Decimal(str(purchase_price_obj.price))
-                        price_curr = purchase_price_obj.currency
-                        base_unit_cost_kzt = self._convert_currency(price_val, price_curr, 'KZT')
-                    elif equipment.equipment_manufacture_price:
-                        price_val = Decimal(str(equipment.equipment_manufacture_price))
-                        price_curr = equipment.equipment_price_currency_type or 'KZT'
-                        base_unit_cost_kzt = self._convert_currency(price_val, price_curr, 'KZT')
-                    
-                    # Add row expenses per unit
-                    row_expenses_sum_kzt = Decimal('0')
-                    if item.row_expenses and isinstance(item.row_expenses, list):
-                        for exp in item.row_expenses:
-                            val = exp.get('value')
-                            curr = exp.get('currency', 'KZT')
-                            if val:
-                                row_expenses_sum_kzt += self._convert_currency(Decimal(str(val)), curr, 'KZT')
-                    
-                    if quantity > 0:
-                        base_unit_cost_kzt += (row_expenses_sum_kzt / quantity)
-                    
-                    # Calculate purchase_price_kzt (before row expenses) for saving
-                    purchase_price_kzt_for_save = Decimal('0')
-                    if purchase_price_obj and purchase_price_obj.price:
-                        price_val = Decimal(str(purchase_price_obj.price))
-                        price_curr = purchase_price_obj.currency
-                        purchase_price_kzt_for_save = self._convert_currency(price_val, price_curr, 'KZT')
-                    elif equipment.equipment_manufacture_price:
-                        price_val = Decimal(str(equipment.equipment_manufacture_price))
-                        price_curr = equipment.equipment_price_currency_type or 'KZT'
-                        purchase_price_kzt_for_save = self._convert_currency(price_val, price_curr, 'KZT')
-                
-                line_base_total = base_unit_cost_kzt * quantity
-                line_sale_total = sale_price_kzt * quantity
-                
-                total_base_cost_sum += line_base_total
-                total_sale_price_sum += line_sale_total
-                
-                items_meta.append({
-                    'item': item,
-                    'equipment': equipment,
-                    'quantity': quantity,
-                    'base_unit_cost_kzt': base_unit_cost_kzt,
-                    'line_base_total': line_base_total,
-                    'sale_price_kzt': sale_price_kzt,
-                    'line_sale_total': line_sale_total,
-                    'purchase_price_kzt': purchase_price_kzt_for_save,  # Save purchase price in KZT
-                    'saved_calculated_data': saved_calculated_data,  # Pass saved data for later use
-                })
-        
-        # Step 2: Calculate Global Overhead from EquipmentList
-        # Get global expenses (tax, delivery, additional_prices) from EquipmentList
-        global_overhead = Decimal('0')
-        for eq_list in self.proposal.equipment_lists.all():
-            # Tax
-            if eq_list.tax_price:
-                global_overhead += Decimal(str(eq_list.tax_price))
-            # Delivery
-            if eq_list.delivery_price:
-                global_overhead += Decimal(str(eq_list.delivery_price))
-            # Additional prices (if any)
-            for add_price in eq_list.additional_prices.all():
-                if add_price.value_type == 'fixed':
-                    global_overhead += Decimal(str(add_price.price_parameter_value))
-                elif add_price.value_type == 'percentage':
-                    # Calculate percentage of base cost sum
-                    if total_base_cost_sum > 0:
-                        percentage_value = (Decimal(str(add_price.price_parameter_value)) / Decimal('100')) * total_base_cost_sum
-                        global_overhead += percentage_value
-        
-        # Calculate services sum (additional_services are separate, not part of overhead)
-        services_sum = Decimal('0')
-        if self.proposal.additional_services:
-            for svc in self.proposal.additional_services:
-                price = svc.get('price')
-                if price:
-                    services_sum += Decimal(str(price))
-        
-        # Calculate total price: sum of sale prices + services
-        # (overhead is already included in margin calculation, not in total price)
-        calculated_total = total_sale_price_sum + services_sum
-        
-        # If proposal.total_price is set, use it; otherwise calculate from sale prices
-        if self.proposal.total_price:
-            target_total = Decimal(str(self.proposal.total_price))
-        else:
-            target_total = calculated_total
-            # Update proposal total_price
-            self.proposal.total_price = target_total
-        
-        # Step 3: Distribute Overhead and Calculate Margins
-        final_items = []
-        total_quantity = sum(meta['quantity'] for meta in items_meta) if items_meta else Decimal('1')
-        
-        for meta in items_meta:
-            equipment = meta['equipment']
-            quantity = meta['quantity']
-            base_unit_cost_kzt = meta['base_unit_cost_kzt']
-            sale_price_kzt = meta['sale_price_kzt']
-            purchase_price_kzt = meta.get('purchase_price_kzt', Decimal('0'))  # Get from meta (already in KZT)
-            saved_calculated_data = meta.get('saved_calculated_data', {})
-            
-            # Check if we should use saved calculated_data
-            has_saved_margin = (
-                saved_calculated_data and isinstance(saved_calculated_data, dict) and
-                (saved_calculated_data.get('margin_kzt') is not None or
-                 saved_calculated_data.get('margin_percentage') is not None)
-            )
-            
-            if has_saved_margin:
-                # Use saved values from calculated_data (safely convert to Decimal)
-                try:
-                    allocated_overhead_val = saved_calculated_data.get('allocated_overhead_per_unit', 0)
-                    if allocated_overhead_val is None:
-                        allocated_overhead_per_unit = Decimal('0')
-                    else:
-                        allocated_overhead_per_unit = Decimal(str(allocated_overhead_val))
-                except (ValueError, TypeError, InvalidOperation):
-                    allocated_overhead_per_unit = Decimal('0')
-                
-                try:
-                    margin_kzt_val = saved_calculated_data.get('margin_kzt', 0)
-                    if margin_kzt_val is None:
-                        margin_kzt_per_unit = Decimal('0')
-                    else:
-                        margin_kzt_per_unit = Decimal(str(margin_kzt_val))
-                except (ValueError, TypeError, InvalidOperation):
-                    margin_kzt_per_unit = Decimal('0')
-                
+        current = cache.get(ProposalEquipmentService._recalc_key(proposal_id))
+        # Token evicted from cache: run anyway rather than leave the proposal stale
+        if current is not None and current != token:
+            return 'superseded'
+        if not CommercialProposal.objects.filter(pk=proposal_id).update(
+            pricing_status='computing', pricing_status_changed_at=timezone.now()
+        ):
+            return 'missing'
+        ProposalSummaryService.mark_dirty([proposal_id])
+        proposal = CommercialProposal.objects.get(pk=proposal_id)
+        ok = ProposalEquipmentService.recalculate(proposal)
+        # A save during the run has set 'stale' again and queued the next run - keep it
+        CommercialProposal.objects.filter(pk=proposal_id, pricing_status='computing').update(
+            pricing_status='fresh' if ok else 'stale', pricing_status_changed_at=timezone.now()
+        )
+        ProposalSummaryService.mark_dirty([proposal_id])
+        return 'fresh' if ok else 'failed'
+
+    @staticmethod
+    def requeue_stuck_recalculations(limit=200):
+        """
+        Reschedule proposals left 'computing' (worker died) or 'stale' (task lost) for longer
+        than PROPOSAL_RECALC_STUCK_SECONDS. Returns the number of proposals rescheduled.
+        """
+        from datetime import timedelta
+        from django.db.models import Q
+        stuck_seconds = int(getattr(settings, 'PROPOSAL_RECALC_STUCK_SECONDS', 10 * 60))
+        cutoff = timezone.now() - timedelta(seconds=stuck_seconds)
+        proposal_ids = list(
+            CommercialProposal.objects.filter(pricing_status__in=('stale', 'computing')).filter(
+                Q(pricing_status_changed_at__lt=cutoff) | Q(pricing_status_changed_at__isnull=True)
+            ).order_by('pricing_status_changed_at').values_list('pk', flat=True)[:limit]
+        )
+        for proposal_id in proposal_ids:
+            # computing -> stale и новая задача (новый токен вытесняет зависший запуск)
+            ProposalEquipmentService.schedule_recalculation(CommercialProposal(pk=proposal_id))
+        return len(proposal_ids)
+
+    @staticmethod
+    def add_lines(proposal_id, lines):
+        """
+        Expand equipment lines into the proposal's EquipmentList.
+
+        lines: [{"equipment_line_id": 1, "multiplier": 2}, ...] ("quantity" is accepted for multiplier).
+        Line items are multiplied and merged per equipment; quantities of equipment already in the
+        list are increased (upsert on the (list, equipment) unique key), new equipment is appended
+        after the current items in line order. Runs in one transaction with a fixed number of
+        statements and queues one (debounced) price recalculation. Raises ValueError for bad input,
+        CommercialProposal.DoesNotExist for a missing proposal.
+        """
+        from django.db.models import Max
+        from .models import EquipmentLine, EquipmentLineItem, EquipmentList, EquipmentListItem, EquipmentListLineItem
+
+        multipliers = {}
+        for line in lines or []:
+            if not isinstance(line, dict):
+                raise ValueError('Each line must be an object with equipment_line_id and multiplier')
+            try:
+                line_id = int(line.get('equipment_line_id'))
+                multiplier = int(line.get('multiplier', line.get('quantity', 1)))
+            except (TypeError, ValueError):
+                raise ValueError('equipment_line_id and multiplier must be integers')
+            if multiplier < 1:
+                raise ValueError(f'multiplier must be positive (line {line_id})')
+            # The same line twice in one request adds up
+            multipliers[line_id] = multipliers.get(line_id, 0) + multiplier
+        if not multipliers:
+            raise ValueError('No lines given')
+
+        with transaction.atomic():
+            # Serializes concurrent edits of the same proposal's equipment
+            proposal = CommercialProposal.objects.select_for_update().get(pk=proposal_id)
+
+            found = set(EquipmentLine.objects.filter(pk__in=multipliers).values_list('pk', flat=True))
+            missing = sorted(set(multipliers) - found)
+            if missing:
+                raise ValueError(f'Equipment lines not found: {missing}')
+
+            equipment_list = proposal.equipment_lists.order_by('list_id').first()
+            if equipment_list is None:
+                equipment_list = EquipmentList.objects.create(proposal=proposal)
+
+            # Expand: equipment_id -> added quantity, in line order
+            added = {}
+            line_items = EquipmentLineItem.objects.filter(
+                equipment_line_id__in=multipliers
+            ).order_by('equipment_line_id', 'order').values_list('equipment_line_id', 'equipment_id', 'quantity')
+            for line_id, equipment_id, quantity in line_items:
+                added[equipment_id] = added.get(equipment_id, 0) + quantity * multipliers[line_id]
+
+            existing = dict(
+                EquipmentListItem.objects.filter(
+                    equipment_list=equipment_list, equipment_id__in=added
+                ).values_list('equipment_id', 'quantity')
+            )
+            next_order = (
+                EquipmentListItem.objects.filter(equipment_list=equipment_list).aggregate(m=Max('order'))['m'] or 0
+            ) + 1
+            rows = []
+            for equipment_id, quantity in added.items():
+                if equipment_id in existing:
+                    rows.append(EquipmentListItem(
+                        equipment_list=equipment_list, equipment_id=equipment_id,
+                        quantity=existing[equipment_id] + quantity, order=0,
+                    ))
+                else:
+                    rows.append(EquipmentListItem(
+                        equipment_list=equipment_list, equipment_id=equipment_id,
+                        quantity=quantity, order=next_order,
+                    ))
+                    next_order += 1
+            if rows:
+                # Existing rows only get the new quantity; order / prices / row_expenses stay
+                EquipmentListItem.objects.bulk_create(
+                    rows,
+                    update_conflicts=True,
+                    unique_fields=['equipment_list', 'equipment'],
+                    update_fields=['quantity'],
+                )
+
+            # Remember which lines were added (EquipmentListLineItem), summing multipliers
+            line_existing = dict(
+                EquipmentListLineItem.objects.filter(
+                    equipment_list=equipment_list, equipment_line_id__in=multipliers
+                ).values_list('equipment_line_id', 'quantity')
+            )
+            EquipmentListLineItem.objects.bulk_create(
+                [
+                    EquipmentListLineItem(
+                        equipment_list=equipment_list, equipment_line_id=line_id,
+                        quantity=line_existing.get(line_id, 0) + multiplier,
+                    )
+                    for line_id, multiplier in multipliers.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['equipment_list', 'equipment_line'],
+                update_fields=['quantity'],
+            )
+
+        ProposalEquipmentService.schedule_recalculation(proposal)
+        return {
+            'proposal_id': proposal.proposal_id,
+            'added': len(added) - len(existing),
+            'merged': len(existing),
+            'items': [{'equipment_id': row.equipment_id, 'quantity': row.quantity} for row in rows],
+            'pricing_status': proposal.pricing_status,
+        }
+
+
+class ProposalCloneService:
+    """
+    Copy a proposal graph (proposal, payment logs, equipment lists with their additional
+    prices, line items and equipment items) with one bulk_create per table, optionally
+    as several variants at once (e.g. one per currency).
+    """
+
+    # Поля КП, которые можно переопределить в варианте копии
+    VARIANT_FIELDS = ('proposal_name', 'currency_ticket', 'exchange_rate', 'exchange_rate_date')
+    # Изменение этих полей требует пересчета цен варианта
+    PRICING_FIELDS = ('currency_ticket', 'exchange_rate', 'exchange_rate_date')
+
+    @staticmethod
+    def _copy(obj, **overrides):
+        """Unsaved copy of a model instance: concrete fields except pk and timestamps."""
+        model = type(obj)
+        new = model()
+        for field in model._meta.concrete_fields:
+            if field.primary_key or field.name in ('created_at', 'updated_at'):
+                continue
+            setattr(new, field.attname, getattr(obj, field.attname))
+        for name, value in overrides.items():
+            setattr(new, name, value)
+        return new
+
+    @staticmethod
+    def _through(model, field_name):
+        """(through model, source fk attname, target fk attname) of a ManyToManyField."""
+        field = model._meta.get_field(field_name)
+        return (
+            field.remote_field.through,
+            f'{field.m2m_field_name()}_id',
+            f'{field.m2m_reverse_field_name()}_id',
+        )
+
+    @staticmethod
+    def allocate_numbers(base, count):
+        """
+        `count` free outcoming numbers "<base> (copy)", "<base> (copy 1)", ... found with
+        one query (same naming as the former probing loop).
+        """
+        taken = set(
+            CommercialProposal.objects.filter(
+                outcoming_number__startswith=f'{base} (copy'
+            ).values_list('outcoming_number', flat=True)
+        )
+        numbers = []
+        counter = 0
+        while len(numbers) < count:
+            candidate = f'{base} (copy)' if counter == 0 else f'{base} (copy {counter})'
+            if candidate not in taken:
+                numbers.append(candidate)
+            counter += 1
+        return numbers
+
+    @staticmethod
+    def parse_variants(variants):
+        """Validate variant overrides; None / [] means a single plain copy. Raises ValueError."""
+        if not variants:
+            return [{}]
+        if not isinstance(variants, list):
+            raise ValueError('variants must be a list')
+        if len(variants) > getattr(settings, 'PROPOSAL_CLONE_MAX_VARIANTS', 20):
+            raise ValueError('Too many variants')
+        parsed = []
+        for variant in variants:
+            if not isinstance(variant, dict):
+                raise ValueError('Each variant must be an object')
+            unknown = set(variant) - set(ProposalCloneService.VARIANT_FIELDS)
+            if unknown:
+                raise ValueError(f'Unsupported variant fields: {sorted(unknown)}')
+            if 'currency_ticket' in variant and 'exchange_rate' not in variant:
+                raise ValueError('exchange_rate is required when currency_ticket is set')
+            overrides = dict(variant)
+            if 'exchange_rate' in overrides:
                 try:
-                    margin_perc_val = saved_calculated_data.get('margin_percentage', 0)
-                    if margin_perc_val is None:
-                        margin_percentage = Decimal('0')
-                    else:
-                        margin_percentage = Decimal(str(margin_perc_val))
-                except (ValueError, TypeError, InvalidOperation):
-                    margin_percentage = Decimal('0')
-            else:
-                # Distribute overhead proportionally to base costs
-                weight = Decimal('0')
-                if total_base_cost_sum > 0:
-                    weight = meta['line_base_total'] / total_base_cost_sum
-                elif total_quantity > 0:
-                    weight = quantity / total_quantity
-                
-                # Allocated overhead per unit
-                allocated_overhead_total = global_overhead * weight
-                allocated_overhead_per_unit = Decimal('0')
-                if quantity > 0:
-                    allocated_overhead_per_unit = allocated_overhead_total / quantity
-                
-                # Calculate margin: sale_price - (base_cost + overhead)
-                # Margin KZT per unit
-                margin_kzt_per_unit = sale_price_kzt - (base_unit_cost_kzt + allocated_overhead_per_unit)
-                
-                # Margin percentage
-                margin_percentage = Decimal('0')
-                if base_unit_cost_kzt > 0:
-                    margin_percentage = (margin_kzt_per_unit / base_unit_cost_kzt) * Decimal('100')
-            
-            # Total margin for the line
-            margin_kzt_total = margin_kzt_per_unit * quantity
-            
-            # Final prices (sale_price_kzt is fixed, used as price_per_unit)
-            # All values are already in KZT at this point
-            final_items.append({
-                "equipment_id": equipment.equipment_id,
-                "name": equipment.equipment_name,
-                "description": equipment.equipment_short_description,
-                "article": equipment.equipment_articule,
-                "quantity": int(quantity),
-                "unit": equipment.equipment_uom or 'шт',
-                "price_per_unit": float(sale_price_kzt),  # Fixed sale price (in KZT)
-                "total_price": float(sale_price_kzt * quantity),  # Fixed sale price * quantity (in KZT)
-                "base_cost_kzt": float(base_unit_cost_kzt),  # Purchase price + row expenses (in KZT)
-                "allocated_overhead_per_unit": float(allocated_overhead_per_unit),  # Distributed overhead (in KZT) or saved value
-                "margin_kzt": float(margin_kzt_per_unit),  # Margin per unit (in KZT) or saved value
-                "margin_percentage": float(margin_percentage),  # Margin percentage or saved value
-                "margin_kzt_total": float(margin_kzt_total),  # Total margin for line (in KZT)
-                "purchase_price_kzt": float(purchase_price_kzt),  # Purchase price in KZT (before row expenses)
-                "images": self._process_images_for_equipment(equipment)
-            })
-        
-        return final_items
+                    overrides['exchange_rate'] = Decimal(str(overrides['exchange_rate']))
+                except (InvalidOperation, ValueError):
+                    raise ValueError('exchange_rate must be a number')
+            parsed.append(overrides)
+        return parsed
 
-    def _convert_currency(self, amount, from_curr, to_curr):
-        if from_curr == to_curr:
-            return amount
-            
-        # Convert to KZT first (Base)
-        rate_from = self.rates_map.get(from_curr)
-        rate_to = self.rates_map.get(to_curr)
-        
-        if not rate_from:
-             # Fallback: try to find in DB if not in internal map (sanity check, though map should have it)
-             # Ideally validation should happen before
-             # For now assume 1.0 or log error? Better to assume 1.0 to avoid crash
-             rate_from = Decimal('1.0')
-        
-        if not rate_to:
-             rate_to = Decimal('1.0')
-             
-        # Amount (From) * Rate (From->KZT) = KZT
-        amount_kzt = amount * rate_from
-        
-        # KZT / Rate (To->KZT) = Amount (To)
-        amount_target = amount_kzt / rate_to
-        return amount_target
+    @staticmethod
+    def clone(proposal, user=None, variants=None):
+        """
+        Copy `proposal` once per variant (overrides of VARIANT_FIELDS). Copies are drafts
+        owned by `user`; variants with changed currency / rate get a price recalculation
+        queued. Returns the new proposals in variant order.
+        """
+        from .models import EquipmentList, EquipmentListItem, EquipmentListLineItem, PaymentLog
 
-    def _get_equipment_details(self):
-        """Get equipment details for ALL equipment in proposal, even if empty."""
-        data = {}
-        for eq_list in self.proposal.equipment_lists.all():
-            for item in eq_list.equipment_items_relation.select_related('equipment').prefetch_related('equipment__photos').all().order_by('order', 'created_at'):
-                equipment = item.equipment
-                details = equipment.details.all()
-                # Always include equipment, even if no details (empty list)
-                data[equipment.equipment_id] = [
-                    {'name': d.detail_parameter_name, 'value': d.detail_parameter_value} 
-                    for d in details
-                ]
-        return data
+        variants = ProposalCloneService.parse_variants(variants)
 
-    def _get_equipment_specifications(self):
-        """Get equipment specifications for ALL equipment in proposal, even if empty."""
-        data = {}
-        for eq_list in self.proposal.equipment_lists.all():
-            for item in eq_list.equipment_items_relation.select_related('equipment').prefetch_related('equipment__photos').all().order_by('order', 'created_at'):
-                equipment = item.equipment
-                specs = equipment.specifications.all()
-                # Always include equipment, even if no specs (empty list)
-                data[equipment.equipment_id] = [
-                    {'name': s.spec_parameter_name, 'value': s.spec_parameter_value} 
-                    for s in specs
+        with transaction.atomic():
+            numbers = ProposalCloneService.allocate_numbers(proposal.outcoming_number, len(variants))
+            new_proposals = []
+            for overrides, number in zip(variants, numbers):
+                name = overrides.get('proposal_name')
+                if not name:
+                    currency = overrides.get('currency_ticket')
+                    suffix = f'Копия, {currency}' if currency and currency != proposal.currency_ticket else 'Копия'
+                    name = f'{proposal.proposal_name} ({suffix})'
+                new_proposals.append(ProposalCloneService._copy(
+                    proposal,
+                    **{**overrides, 'proposal_name': name},
+                    outcoming_number=number,
+                    proposal_status='draft',
+                    user=user,
+                    updated_by=user,
+                ))
+            CommercialProposal.objects.bulk_create(new_proposals)
+            # bulk_create sends no post_save: summaries of the copies are written explicitly
+            ProposalSummaryService.mark_dirty([new_proposal.pk for new_proposal in new_proposals])
+
+            # data_package is not a column: copy the stored package row (sections are shared)
+            ProposalDataPackageService.copy(proposal.pk, [new_proposal.pk for new_proposal in new_proposals])
+
+            # Payment logs: copied per variant and linked through the M2M table
+            payments = list(proposal.payment_logs.all())
+            if payments:
+                new_payments = [
+                    ProposalCloneService._copy(payment) for _ in new_proposals for payment in payments
                 ]
-        return data
+                PaymentLog.objects.bulk_create(new_payments)
+                through, src, dst = ProposalCloneService._through(CommercialProposal, 'payment_logs')
+                through.objects.bulk_create([
+                    through(**{src: new_proposal.pk, dst: new_payments[i * len(payments) + j].pk})
+                    for i, new_proposal in enumerate(new_proposals)
+                    for j in range(len(payments))
+                ])
 
-    def _get_tech_processes(self):
-        """Get tech processes for ALL equipment in proposal, even if empty."""
-        data = {}
-        for eq_list in self.proposal.equipment_lists.all():
-            for item in eq_list.equipment_items_relation.select_related('equipment').prefetch_related('equipment__photos').all().order_by('order', 'created_at'):
-                equipment = item.equipment
-                procs = equipment.tech_processes.all()
-                # Always include equipment, even if no processes (empty list)
-                data[equipment.equipment_id] = [
-                    {'title': p.tech_name, 'value': p.tech_value, 'desc': p.tech_desc} 
-                    for p in procs
+            lists = list(EquipmentList.objects.filter(proposal=proposal).order_by('list_id'))
+            if lists:
+                new_lists = [
+                    ProposalCloneService._copy(eq_list, proposal_id=new_proposal.pk)
+                    for new_proposal in new_proposals for eq_list in lists
                 ]
-        return data
+                EquipmentList.objects.bulk_create(new_lists)
+                # old list_id -> new list ids, one per variant
+                list_map = {
+                    eq_list.list_id: [new_lists[i * len(lists) + j].pk for i in range(len(new_proposals))]
+                    for j, eq_list in enumerate(lists)
+                }
 
-    def _process_images_for_equipment(self, equipment):
-        """
-        Build images list for equipment: local EquipmentPhoto first (stable /media/photos/ URLs),
-        then legacy equipment_imagelinks (external, direct link). Used in data_package and PDF/DOCX.
-        """
-        result = []
-        for photo in equipment.photos.all().order_by('sort_order', 'pk'):
-            url = photo.image.url if photo.image else ''
-            if url:
-                result.append({'name': photo.name or '', 'url': url})
-        imagelinks = equipment.equipment_imagelinks
-        if not imagelinks:
-            return result
-        if isinstance(imagelinks, list):
-            for item in imagelinks:
-                if isinstance(item, dict):
-                    name = item.get('name', '')
-                    url = item.get('url')
-                    if url:
-                        direct_url = LinkConverterService.get_direct_link(url)
-                        result.append({'name': name, 'url': direct_url})
-                elif isinstance(item, str):
-                    direct_url = LinkConverterService.get_direct_link(item)
-                    result.append({'name': '', 'url': direct_url})
-        elif isinstance(imagelinks, str):
-            links = [link.strip() for link in imagelinks.split(',') if link.strip()]
-            for link in links:
-                direct_url = LinkConverterService.get_direct_link(link)
-                result.append({'name': '', 'url': direct_url})
-        return result
+                through, src, dst = ProposalCloneService._through(EquipmentList, 'additional_prices')
+                links = through.objects.filter(**{f'{src}__in': list_map}).values_list(src, dst)
+                through.objects.bulk_create([
+                    through(**{src: new_list_id, dst: price_id})
+                    for list_id, price_id in links
+                    for new_list_id in list_map[list_id]
+                ])
 
-    def _process_images(self, imagelinks):
+                for model in (EquipmentListLineItem, EquipmentListItem):
+                    items = model.objects.filter(equipment_list_id__in=list_map)
+                    model.objects.bulk_create(
+                        [
+                            ProposalCloneService._copy(item, equipment_list_id=new_list_id)
+                            for item in items
+                            for new_list_id in list_map[item.equipment_list_id]
+                        ],
+                        batch_size=1000,
+                    )
+
+            for overrides, new_proposal in zip(variants, new_proposals):
+                if any(
+                    name in overrides and overrides[name] != getattr(proposal, name)
+                    for name in ProposalCloneService.PRICING_FIELDS
+                ):
+                    ProposalEquipmentService.schedule_recalculation(new_proposal)
+
+        return new_proposals
+
+
+class TemplateRevisionConflict(ValueError):
+    """The template was changed since the revision the client patched against."""
+
+
+class TemplateRevisionRequired(ValueError):
+    """A patch addressing array elements by index was sent without the expected revision."""
+
+
+class ProposalTemplatePatchService:
+    """
+    Delta saves of the proposal constructor: RFC 6902 operations against
+
+        /layout_data, /header_data     - ProposalTemplate columns
+        /equipment_order               - equipment_ids in EquipmentListItem.order
+        /additional_services           - CommercialProposal.additional_services (affects pricing)
+
+    instead of resending and re-merging the whole data_package on every autosave.
+    Only the touched roots are loaded, validated and written; prices are recalculated
+    (debounced, see ProposalEquipmentService.schedule_recalculation) only when a
+    pricing-relevant root changed.
+    """
+
+    ROOTS = ('layout_data', 'header_data', 'equipment_order', 'additional_services')
+    PRICING_ROOTS = ('additional_services',)
+
+    @staticmethod
+    def _roots(operations):
+        """Top-level roots referenced by `path` / `from` of the operations."""
+        from .jsonpatch import JSONPatchError, parse_pointer
+
+        if not isinstance(operations, list) or not operations:
+            raise JSONPatchError('Patch must be a non-empty list of operations')
+        roots = set()
+        for operation in operations:
+            if not isinstance(operation, dict):
+                raise JSONPatchError(f'Unknown operation: {operation!r}')
+            pointers = [operation.get('path')]
+            if operation.get('op') in ('move', 'copy'):
+                pointers.append(operation.get('from'))
+            for pointer in pointers:
+                tokens = parse_pointer(pointer)
+                if not tokens or tokens[0] not in ProposalTemplatePatchService.ROOTS:
+                    raise JSONPatchError(
+                        f'Path {pointer!r} is outside {", ".join("/" + r for r in ProposalTemplatePatchService.ROOTS)}'
+                    )
+                roots.add(tokens[0])
+        return roots
+
+    @staticmethod
+    def _uses_array_index(operations):
+        """True if a `path` / `from` addresses an element by position (/layout_data/2/...)."""
+        from .jsonpatch import parse_pointer
+
+        for operation in operations:
+            pointers = [operation.get('path')]
+            if operation.get('op') in ('move', 'copy'):
+                pointers.append(operation.get('from'))
+            for pointer in pointers:
+                if any(token.isdigit() for token in parse_pointer(pointer)[1:]):
+                    return True
+        return False
+
+    @staticmethod
+    def _touched_indexes(value, tokens):
+        """List indexes touched by a pointer: all for the root, one for /root/<i> or /root/-."""
+        if len(tokens) == 1:
+            return range(len(value))
+        if tokens[1] == '-':
+            return [len(value) - 1] if value else []
+        if tokens[1].isdigit() and int(tokens[1]) < len(value):
+            return [int(tokens[1])]
+        return []
+
+    @staticmethod
+    def _validate(document, touched, equipment_ids):
+        """Validate only the touched parts of the patched document."""
+        from .jsonpatch import JSONPatchError
+
+        for tokens in touched:
+            root = tokens[0]
+            value = document.get(root)
+            if root == 'layout_data':
+                if not isinstance(value, list):
+                    raise JSONPatchError('layout_data must be a list of blocks')
+                indexes = ProposalTemplatePatchService._touched_indexes(value, tokens)
+                for index in indexes:
+                    block = value[index]
+                    if not isinstance(block, dict):
+                        raise JSONPatchError(f'layout_data/{index} must be an object')
+                    for key in ('title', 'content'):
+                        if block.get(key) is not None and not isinstance(block[key], str):
+                            raise JSONPatchError(f'layout_data/{index}/{key} must be a string')
+            elif root == 'header_data':
+                if not isinstance(value, dict):
+                    raise JSONPatchError('header_data must be an object')
+            elif root == 'equipment_order':
+                if not isinstance(value, list) or not all(isinstance(v, int) for v in value):
+                    raise JSONPatchError('equipment_order must be a list of equipment ids')
+                if sorted(value) != sorted(equipment_ids):
+                    raise JSONPatchError('equipment_order must contain exactly the proposal equipment')
+            elif root == 'additional_services':
+                if not isinstance(value, list):
+                    raise JSONPatchError('additional_services must be a list')
+                indexes = ProposalTemplatePatchService._touched_indexes(value, tokens)
+                for index in indexes:
+                    service = value[index]
+                    if not isinstance(service, dict):
+                        raise JSONPatchError(f'additional_services/{index} must be an object')
+                    if service.get('price') not in (None, ''):
+                        try:
+                            Decimal(str(service['price']))
+                        except (InvalidOperation, ValueError):
+                            raise JSONPatchError(f'additional_services/{index}/price must be a number')
+
+    @staticmethod
+    def apply(template_id, operations, user=None, revision=None):
         """
-        Parses image links field. Returns list of dicts with 'name' and 'url'.
-        Kept for backward compatibility when equipment is not available.
+        Apply a patch under a row lock. `revision` must match the template's current
+        revision, otherwise TemplateRevisionConflict. It may be omitted only when no path
+        contains an array index: an index is meaningless once another save shifted the
+        list, so such patches raise TemplateRevisionRequired without it.
+        Raises JSONPatchError for invalid operations / values and ProposalTemplate.DoesNotExist.
+        Returns {'revision', 'updated': [...roots], 'pricing_status'}.
         """
-        if not imagelinks:
-            return []
-        result = []
-        if isinstance(imagelinks, list):
-            for item in imagelinks:
-                if isinstance(item, dict):
-                    name = item.get('name', '')
-                    url = item.get('url')
-                    if url:
-                        direct_url = LinkConverterService.get_direct_link(url)
-                        result.append({'name': name, 'url': direct_url})
-                elif isinstance(item, str):
-                    direct_url = LinkConverterService.get_direct_link(item)
-                    result.append({'name': '', 'url': direct_url})
-        elif isinstance(imagelinks, str):
-            links = [link.strip() for link in imagelinks.split(',') if link.strip()]
-            for link in links:
-                direct_url = LinkConverterService.get_direct_link(link)
-                result.append({'name': '', 'url': direct_url})
-        return result
+        from .jsonpatch import apply_patch
+        from .models import EquipmentListItem, ProposalTemplate
+
+        roots = ProposalTemplatePatchService._roots(operations)
+        if revision is None and ProposalTemplatePatchService._uses_array_index(operations):
+            raise TemplateRevisionRequired(
+                'Patches with array indexes require "revision" or an If-Match header'
+            )
+
+        with transaction.atomic():
+            template = ProposalTemplate.objects.select_for_update().select_related('proposal').get(pk=template_id)
+            if revision is not None and int(revision) != template.revision:
+                raise TemplateRevisionConflict(
+                    f'Template revision is {template.revision}, patch was made against {revision}'
+                )
+            proposal = template.proposal
+
+            document = {}
+            items = []
+            if 'layout_data' in roots:
+                document['layout_data'] = template.layout_data if template.layout_data is not None else []
+            if 'header_data' in roots:
+                document['header_data'] = template.header_data or {}
+            if 'equipment_order' in roots:
+                items = list(
+                    EquipmentListItem.objects.filter(equipment_list__proposal=proposal)
+                    .order_by('order', 'created_at').only('pk', 'equipment_id', 'order')
+                )
+                document['equipment_order'] = [item.equipment_id for item in items]
+            if 'additional_services' in roots:
+                document['additional_services'] = proposal.additional_services or []
+
+            patched, touched = apply_patch(document, operations)
+            ProposalTemplatePatchService._validate(
+                patched, touched, document.get('equipment_order', [])
+            )
+            # 'test'-only patches and no-op changes write nothing
+            changed = {root for root in roots if patched.get(root) != document.get(root)}
+
+            if changed:
+                template.revision += 1
+                if user is not None:
+                    template.last_edited_by = user
+                update_fields = ['revision', 'last_edited_by', 'updated_at']
+                for root in ('layout_data', 'header_data'):
+                    if root in changed:
+                        setattr(template, root, patched[root])
+                        update_fields.append(root)
+                template.save(update_fields=update_fields)
+
+            package = None
+            if 'equipment_order' in changed:
+                position = {}
+                for index, equipment_id in enumerate(patched['equipment_order']):
+                    position.setdefault(equipment_id, index + 1)
+                for item in items:
+                    item.order = position[item.equipment_id]
+                EquipmentListItem.objects.bulk_update(items, ['order'], batch_size=1000)
+                package = proposal.data_package
+                if package.get('equipment_list'):
+                    # Same order in the saved package, without rebuilding it
+                    package = {**package, 'equipment_list': sorted(
+                        package['equipment_list'],
+                        key=lambda row: position.get(row.get('equipment_id'), len(position) + 1),
+                    )}
+            if 'additional_services' in changed:
+                proposal.additional_services = patched['additional_services']
+                CommercialProposal.objects.filter(pk=proposal.pk).update(
+                    additional_services=proposal.additional_services
+                )
+                package = package if package is not None else proposal.data_package
+                if package:
+                    package = {**package, 'additional_services': proposal.additional_services}
+            if package:
+                proposal.data_package = package
+                proposal.save(update_fields=['data_package'])
+
+            if changed & set(ProposalTemplatePatchService.PRICING_ROOTS):
+                ProposalEquipmentService.schedule_recalculation(proposal)
+
+        return {
+            'template_id': template.template_id,
+            'revision': template.revision,
+            'updated': sorted(changed),
+            'pricing_status': proposal.pricing_status,
+        }
 
 
 class ExportService:
@@ -1478,14 +4892,9 @@ class ExportService:
                         # Always refresh images from fresh data so new photos appear in exports
                         if 'images' in fresh_map[eq_id]:
                             merged_item['images'] = fresh_map[eq_id]['images']
-                        # Ensure unit field is present
-                        if 'unit' not in merged_item or not merged_item.get('unit'):
-                            merged_item['unit'] = fresh_map[eq_id].get('unit', 'шт')
                         merged_list.append(merged_item)
                     else:
-                        # If not in fresh, keep saved item as-is but ensure unit field
-                        if 'unit' not in saved_item or not saved_item.get('unit'):
-                            saved_item['unit'] = 'шт'
+                        # If not in fresh, keep saved item as-is
                         merged_list.append(saved_item)
                 
                 self.data_pkg['equipment_list'] = merged_list
@@ -1495,23 +4904,9 @@ class ExportService:
         else:
             self.data_pkg = fresh_data_pkg
         
-        # Ensure all required data is present, especially equipment_specifications
-        # If data_package exists but is missing some fields, regenerate them
-        if not self.data_pkg.get('equipment_specifications'):
-            self.data_pkg['equipment_specifications'] = aggregator._get_equipment_specifications()
-        if not self.data_pkg.get('equipment_details'):
-            self.data_pkg['equipment_details'] = aggregator._get_equipment_details()
-        if not self.data_pkg.get('tech_processes'):
-            self.data_pkg['tech_processes'] = aggregator._get_tech_processes()
-        
-        # Always update proposal metadata to ensure date is in correct format (d.m.Y)
-        # This fixes issues with old data_packages that have dates in ISO format
-        self.data_pkg['proposal'] = aggregator._get_proposal_metadata()
-        
-        # Double-check: Ensure equipment_list items have 'unit' field
-        for item in self.data_pkg.get('equipment_list', []):
-            if 'unit' not in item or not item.get('unit'):
-                item['unit'] = 'шт'
+        # Saved packages are already in the current schema (dates, units, sections - see
+        # ProposalDataPackageService.upgrade); proposal metadata follows the proposal edits
+        self.data_pkg['proposal'] = fresh_data_pkg['proposal']
         
         self.header_data = template.header_data or {}
         self.layout_data = template.layout_data or []
@@ -1640,19 +5035,6 @@ class ExportService:
         items = self.data_pkg.get('equipment_list', [])
         currency = self.proposal.currency_ticket
         
-        # Ensure items have 'unit' field - double check
-        for item in items:
-            if 'unit' not in item or not item.get('unit'):
-                # Try to get from fresh data
-                aggregator = DataAggregatorService(self.proposal)
-                fresh_list = aggregator._calculate_and_build_equipment_list()
-                fresh_map = {eq_item['equipment_id']: eq_item for eq_item in fresh_list}
-                eq_id = item.get('equipment_id')
-                if eq_id in fresh_map:
-                    item['unit'] = fresh_map[eq_id].get('unit', 'шт')
-                else:
-                    item['unit'] = 'шт'
-        
         # We assume col_widths.name exists if resized, otherwise default
         name_width = col_widths.get('name', 300)
         
@@ -1666,7 +5048,7 @@ class ExportService:
             description = escape(str(item.get('description', ''))) if item.get('description') else ''
             article = escape(str(item.get('article', ''))) if item.get('article') else ''
             quantity = item.get('quantity', 0)
-            unit = escape(str(item.get('unit', 'шт')))
+            unit = escape(str(item.get('unit') or 'шт'))
             price_per_unit = float(item.get('price_per_unit', 0))
             total_price = Decimal(str(item.get('total_price', 0)))
             total_sum += total_price
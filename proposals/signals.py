@@ -0,0 +1,282 @@
+"""
+Signal handlers:
+- keep MediaBlob.ref_count in sync with EquipmentPhoto / EquipmentDocument rows;
+- keep Equipment.search_vector in sync with equipment text fields and specification values;
+- invalidate cached catalog facets when equipment, its M2M links or facet names change;
+- keep Category.path (materialized tree path) in sync with parent_category;
+- fill parameter / value_numeric / value_unit of specifications and details;
+- published catalog feed: tombstones on unpublish / delete, updated_at bump on related changes;
+- refresh ProposalSummary rows when proposals, their items, payments, clients, users or templates change;
+- queue sales rollup days of deleted proposals.
+"""
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import (
+    Category, Client, CommercialProposal, Equipment, EquipmentDetails, EquipmentDocument, EquipmentListItem,
+    EquipmentPhoto, EquipmentSpecification, EquipmentTypes, Manufacturer, PaymentLog, ProposalTemplate, User
+)
+
+# Marker for instances loaded with content_hash deferred (only()/defer())
+_DEFERRED = object()
+
+
+@receiver(post_init, sender=EquipmentPhoto)
+@receiver(post_init, sender=EquipmentDocument)
+def remember_content_hash(sender, instance, **kwargs):
+    instance._original_content_hash = instance.__dict__.get('content_hash', _DEFERRED)
+
+
+@receiver(post_save, sender=EquipmentPhoto)
+@receiver(post_save, sender=EquipmentDocument)
+def acquire_media_blob(sender, instance, created, **kwargs):
+    from .services import MediaStoreService
+
+    previous = None if created else getattr(instance, '_original_content_hash', None)
+    if previous is _DEFERRED or 'content_hash' not in instance.__dict__:
+        return
+    if instance.content_hash != previous:
+        MediaStoreService.release(previous)
+        MediaStoreService.acquire(instance.content_hash)
+    instance._original_content_hash = instance.content_hash
+
+
+@receiver(post_delete, sender=EquipmentPhoto)
+@receiver(post_delete, sender=EquipmentDocument)
+def release_media_blob(sender, instance, **kwargs):
+    from .services import MediaStoreService
+
+    # Deferred field on a deleted row can't be loaded; gc_media_blobs reconciles such cases
+    MediaStoreService.release(instance.__dict__.get('content_hash'))
+
+
+@receiver(post_save, sender=Equipment)
+def refresh_equipment_search_vector(sender, instance, update_fields=None, **kwargs):
+    from .services import EquipmentSearchService
+
+    searchable = {'equipment_name', 'equipment_articule', 'equipment_short_description'}
+    if update_fields is not None and not searchable.intersection(update_fields):
+        return
+    EquipmentSearchService.update_search_vector([instance.pk])
+
+
+@receiver(post_save, sender=EquipmentSpecification)
+@receiver(post_delete, sender=EquipmentSpecification)
+def refresh_search_vector_on_spec_change(sender, instance, **kwargs):
+    from .services import EquipmentSearchService
+
+    EquipmentSearchService.update_search_vector([instance.equipment_id])
+
+
+@receiver(post_save, sender=Equipment)
+@receiver(post_delete, sender=Equipment)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Manufacturer)
+@receiver(post_delete, sender=Manufacturer)
+@receiver(post_save, sender=EquipmentTypes)
+@receiver(post_delete, sender=EquipmentTypes)
+# Typed spec / detail values feed the ?spec_range= facet filter
+@receiver(post_save, sender=EquipmentSpecification)
+@receiver(post_delete, sender=EquipmentSpecification)
+@receiver(post_save, sender=EquipmentDetails)
+@receiver(post_delete, sender=EquipmentDetails)
+def invalidate_equipment_facets(sender, **kwargs):
+    from .services import EquipmentFacetService
+
+    EquipmentFacetService.invalidate()
+
+
+@receiver(m2m_changed, sender=Equipment.categories.through)
+@receiver(m2m_changed, sender=Equipment.manufacturers.through)
+@receiver(m2m_changed, sender=Equipment.equipment_types.through)
+def invalidate_equipment_facets_on_links(sender, action, **kwargs):
+    from .services import EquipmentFacetService
+
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        EquipmentFacetService.invalidate()
+
+
+@receiver(post_save, sender=Category)
+def sync_category_path(sender, instance, raw=False, **kwargs):
+    from .services import CategoryTreeService
+
+    if not raw:
+        CategoryTreeService.sync_path(instance)
+
+
+@receiver(post_delete, sender=Category)
+def detach_category_subtree(sender, instance, **kwargs):
+    from .services import CategoryTreeService
+
+    CategoryTreeService.detach_subtree(instance)
+
+
+@receiver(pre_save, sender=EquipmentSpecification)
+def type_specification_value(sender, instance, raw=False, **kwargs):
+    from .services import SpecParameterService
+
+    if not raw:
+        SpecParameterService.prepare([instance], 'spec_parameter_name', 'spec_parameter_value')
+
+
+@receiver(pre_save, sender=EquipmentDetails)
+def type_detail_value(sender, instance, raw=False, **kwargs):
+    from .services import SpecParameterService
+
+    if not raw:
+        SpecParameterService.prepare([instance], 'detail_parameter_name', 'detail_parameter_value')
+
+
+@receiver(post_init, sender=Equipment)
+def remember_is_published(sender, instance, **kwargs):
+    instance._original_is_published = instance.__dict__.get('is_published', _DEFERRED)
+
+
+@receiver(post_save, sender=Equipment)
+def track_catalog_publication(sender, instance, created, **kwargs):
+    from .services import EquipmentFeedService
+
+    previous = getattr(instance, '_original_is_published', _DEFERRED)
+    current = instance.__dict__.get('is_published', _DEFERRED)
+    if created or previous is _DEFERRED or current is _DEFERRED or previous == current:
+        instance._original_is_published = current
+        return
+    if current:
+        EquipmentFeedService.clear_removed([instance.pk])
+    else:
+        EquipmentFeedService.record_removed([instance.pk], 'unpublished')
+    instance._original_is_published = current
+
+
+@receiver(post_delete, sender=Equipment)
+def record_catalog_deletion(sender, instance, **kwargs):
+    from .services import EquipmentFeedService
+
+    if instance.__dict__.get('is_published') or getattr(instance, '_original_is_published', None) is True:
+        EquipmentFeedService.record_removed([instance.pk], 'deleted')
+
+
+@receiver(post_save, sender=EquipmentSpecification)
+@receiver(post_delete, sender=EquipmentSpecification)
+@receiver(post_save, sender=EquipmentPhoto)
+@receiver(post_delete, sender=EquipmentPhoto)
+def touch_equipment_for_feed(sender, instance, **kwargs):
+    from .services import EquipmentFeedService
+
+    EquipmentFeedService.touch([instance.equipment_id])
+
+
+@receiver(m2m_changed, sender=Equipment.categories.through)
+@receiver(m2m_changed, sender=Equipment.manufacturers.through)
+@receiver(m2m_changed, sender=Equipment.equipment_types.through)
+def touch_equipment_on_links(sender, instance, action, reverse, pk_set, **kwargs):
+    from .services import EquipmentFeedService
+
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        EquipmentFeedService.touch([instance.pk])
+    elif pk_set:
+        # Changed from the category / manufacturer / type side: pk_set holds equipment ids
+        EquipmentFeedService.touch(pk_set)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Manufacturer)
+@receiver(post_save, sender=EquipmentTypes)
+def touch_equipment_on_rename(sender, instance, created, **kwargs):
+    from .services import EquipmentFeedService
+
+    # Names are part of feed items; new rows have no equipment yet
+    if not created:
+        EquipmentFeedService.touch_queryset(Equipment.objects.filter(pk__in=instance.equipment.values('pk')))
+
+
+@receiver(post_save, sender=CommercialProposal)
+def refresh_proposal_summary(sender, instance, raw=False, **kwargs):
+    from .services import ProposalSummaryService
+
+    if not raw:
+        ProposalSummaryService.mark_dirty([instance.pk])
+
+
+@receiver(post_save, sender=EquipmentListItem)
+@receiver(post_delete, sender=EquipmentListItem)
+def refresh_summary_item_count(sender, instance, created=True, raw=False, **kwargs):
+    from .services import ProposalSummaryService
+
+    # Price write-backs (created=False) don't change the item count
+    if created and not raw:
+        ProposalSummaryService.mark_dirty([instance.equipment_list.proposal_id])
+
+
+@receiver(post_save, sender=PaymentLog)
+@receiver(pre_delete, sender=PaymentLog)
+def refresh_summary_payments(sender, instance, raw=False, **kwargs):
+    from .services import ProposalSummaryService
+
+    # pre_delete: the M2M links are gone by post_delete
+    if not raw and instance.pk:
+        ProposalSummaryService.mark_dirty(instance.commercial_proposals.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=CommercialProposal.payment_logs.through)
+def refresh_summary_payment_links(sender, instance, action, reverse, pk_set, **kwargs):
+    from .services import ProposalSummaryService
+
+    if action == 'pre_clear' and reverse:
+        # Cleared from the payment side: remember the proposals before the links go
+        instance._summary_proposal_ids = list(instance.commercial_proposals.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        ProposalSummaryService.mark_dirty([instance.pk])
+    elif action == 'post_clear':
+        ProposalSummaryService.mark_dirty(getattr(instance, '_summary_proposal_ids', []))
+    elif pk_set:
+        ProposalSummaryService.mark_dirty(pk_set)
+
+
+@receiver(post_init, sender=Client)
+@receiver(post_init, sender=User)
+def remember_summary_names(sender, instance, **kwargs):
+    fields = ('client_name', 'client_company_name') if sender is Client else ('user_name',)
+    instance._summary_names = tuple(instance.__dict__.get(name) for name in fields)
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=User)
+def refresh_summary_names(sender, instance, created, raw=False, **kwargs):
+    from .services import ProposalSummaryService
+
+    fields = ('client_name', 'client_company_name') if sender is Client else ('user_name',)
+    names = tuple(instance.__dict__.get(name) for name in fields)
+    # Logins etc. also save users: only name changes matter for the summaries
+    if created or raw or names == getattr(instance, '_summary_names', None):
+        return
+    instance._summary_names = names
+    if sender is Client:
+        proposals = instance.commercial_proposals.all()
+    else:
+        proposals = CommercialProposal.objects.filter(Q(user=instance) | Q(updated_by=instance))
+    ProposalSummaryService.mark_dirty(proposals.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=ProposalTemplate)
+@receiver(post_delete, sender=ProposalTemplate)
+def refresh_summary_template_status(sender, instance, raw=False, **kwargs):
+    from .services import ProposalSummaryService
+
+    if not raw:
+        ProposalSummaryService.mark_dirty([instance.proposal_id])
+
+
+@receiver(post_delete, sender=CommercialProposal)
+def refresh_sales_rollup_on_delete(sender, instance, **kwargs):
+    # Сводка КП удаляется каскадом, поэтому день сводки продаж отмечаем здесь
+    from .services import SalesRollupService
+
+    SalesRollupService.mark_days([instance.proposal_date])
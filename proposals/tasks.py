@@ -13,7 +13,7 @@ logger = logging.getLogger(__name__)
 def generate_pdf_task(template_id):
     """Generates PDF for a given ProposalTemplate."""
     from .models import ProposalTemplate
-    from .services import ExportService
+    from .services import ExportService, ProposalSummaryService
     from weasyprint import HTML
     import uuid
     
@@ -33,6 +33,7 @@ def generate_pdf_task(template_id):
         HTML(string=html_content, base_url=str(settings.BASE_DIR)).write_pdf(filepath)
         
         url = f"{settings.MEDIA_URL}exports/{filename}"
+        ProposalSummaryService.record_export(template.proposal_id)
         return {'status': 'SUCCESS', 'url': url}
         
     except Exception as e:
@@ -44,7 +45,7 @@ def generate_pdf_task(template_id):
 def generate_docx_task(template_id):
     """Generates DOCX for a given ProposalTemplate."""
     from .models import ProposalTemplate
-    from .services import ExportService
+    from .services import ExportService, ProposalSummaryService
     import uuid
     import io
     
@@ -64,6 +65,7 @@ def generate_docx_task(template_id):
             f.write(stream.getbuffer())
         
         url = f"{settings.MEDIA_URL}exports/{filename}"
+        ProposalSummaryService.record_export(template.proposal_id)
         return {'status': 'SUCCESS', 'url': url}
         
     except Exception as e:
@@ -82,3 +84,159 @@ def sync_exchange_rates_task():
     deleted = ExchangeRateService.prune_old_rates(days=31)
     logger.info(f"Exchange rates sync: {stats}, pruned: {deleted}")
     return {'stats': stats, 'pruned': deleted}
+
+
+@shared_task
+def resolve_yandex_links_task(link_ids):
+    """Resolve newly registered Yandex Disk links (scheduled from read paths, no inline HTTP there)."""
+    from .models import YandexDiskLink
+    from .services import YandexDiskLinkService
+
+    resolved = 0
+    for link in YandexDiskLink.objects.filter(link_id__in=link_ids):
+        if not link.is_fresh() and YandexDiskLinkService.resolve(link):
+            resolved += 1
+    return {'resolved': resolved}
+
+
+@shared_task
+def register_yandex_links_task(urls):
+    """Register Yandex Disk links first seen on read paths and resolve them."""
+    from .services import YandexDiskLinkService
+
+    return resolve_yandex_links_task(YandexDiskLinkService.register(urls))
+
+
+@shared_task
+def refresh_yandex_links_task():
+    """
+    Register Yandex Disk links from equipment and refresh direct links ahead of expiry.
+    Runs via Celery Beat.
+    """
+    from .services import YandexDiskLinkService
+
+    registered = YandexDiskLinkService.register_from_equipment()
+    stats = YandexDiskLinkService.refresh_due()
+    logger.info(f"Yandex Disk links refresh: registered={registered}, {stats}")
+    return {'registered': registered, **stats}
+
+
+@shared_task
+def prune_image_proxy_cache_task():
+    """Recount the image proxy disk cache and evict LRU objects over the cap. Runs via Celery Beat."""
+    from .services import ImageProxyCacheService
+
+    removed = ImageProxyCacheService.enforce_size_cap()
+    return {'removed': removed}
+
+
+@shared_task
+def import_equipment_photos_task(equipment_id):
+    """Import pending cloud image links of one equipment into EquipmentPhoto."""
+    from .models import EquipmentPhotoImport
+    from .services import CloudImageImportService
+
+    done = 0
+    failed = 0
+    pending = EquipmentPhotoImport.objects.filter(
+        equipment_id=equipment_id, status='pending'
+    ).select_related('equipment').order_by('sort_order', 'pk')
+    for photo_import in pending:
+        if CloudImageImportService.process_import(photo_import):
+            done += 1
+        else:
+            failed += 1
+    logger.info(f"Photo import for equipment {equipment_id}: done={done}, failed={failed}")
+    return {'equipment_id': equipment_id, 'done': done, 'failed': failed}
+
+
+@shared_task
+def requeue_photo_imports_task():
+    """Re-enqueue photo imports stuck in pending / processing. Runs via Celery Beat."""
+    from .services import CloudImageImportService
+
+    requeued = CloudImageImportService.requeue_stale()
+    if requeued:
+        logger.warning(f"Requeued stale photo imports for {requeued} equipment")
+    return {'requeued': requeued}
+
+
+@shared_task(bind=True)
+def import_catalog_task(self, path, filename, batch_size=500, create_missing_refs=True, dry_run=False):
+    """
+    Import an uploaded catalog file (CSV / XLSX) saved by CatalogImportView.
+    Progress is published as PROGRESS state meta (see /api/celery-task-status/<id>/).
+    """
+    from .services import CatalogImportService
+
+    service = CatalogImportService(
+        batch_size=batch_size, create_missing_refs=create_missing_refs, dry_run=dry_run
+    )
+    try:
+        with open(path, 'rb') as f:
+            summary = service.run(
+                CatalogImportService.iter_rows(f, filename),
+                progress=lambda data: self.update_state(
+                    state='PROGRESS', meta={key: value for key, value in data.items() if key != 'errors'}
+                ),
+            )
+    except Exception as e:
+        logger.error(f"Catalog import {filename} failed: {e}", exc_info=True)
+        return {'status': 'FAILURE', 'error': str(e), **service.summary()}
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    logger.info(
+        f"Catalog import {filename}: processed={summary['processed']} created={summary['created']} "
+        f"updated={summary['updated']} failed={summary['failed']}"
+    )
+    return {'status': 'SUCCESS', **summary}
+
+
+@shared_task
+def recalculate_proposal_task(proposal_id, token):
+    """
+    Debounced price recalculation queued by ProposalEquipmentService.schedule_recalculation
+    (cost price, total price / margin, per-item prices). Superseded runs exit immediately.
+    """
+    from .services import ProposalEquipmentService
+
+    result = ProposalEquipmentService.run_scheduled_recalculation(proposal_id, token)
+    if result == 'failed':
+        logger.error(f"Price recalculation failed for proposal {proposal_id}")
+    return {'proposal_id': proposal_id, 'status': result}
+
+
+@shared_task
+def drain_proposal_summaries_task():
+    """Refresh proposal summaries left in the outbox by failed / lost refreshes. Runs via Celery Beat."""
+    from .services import ProposalSummaryService
+
+    refreshed = ProposalSummaryService.drain()
+    if refreshed:
+        logger.info(f"Proposal summaries refreshed from outbox: {refreshed}")
+    return {'refreshed': refreshed}
+
+
+@shared_task
+def refresh_sales_rollups_task():
+    """Recompute daily sales rollups of the days changed since the last run. Runs via Celery Beat."""
+    from .services import SalesRollupService
+
+    days = SalesRollupService.refresh()
+    if days:
+        logger.info(f"Sales rollups refreshed: days={days}")
+    return {'days': days}
+
+
+@shared_task
+def requeue_stuck_recalculations_task():
+    """Reschedule price recalculations stuck in stale / computing. Runs via Celery Beat."""
+    from .services import ProposalEquipmentService
+
+    requeued = ProposalEquipmentService.requeue_stuck_recalculations()
+    if requeued:
+        logger.warning(f"Rescheduled stuck price recalculations: {requeued}")
+    return {'requeued': requeued}
@@ -30,6 +30,7 @@ urlpatterns = [
     
     # Category CRUD endpoints
     path('categories/', views.CategoryListView.as_view(), name='category-list'),
+    path('categories/tree/', views.CategoryTreeView.as_view(), name='category-tree'),
     path('categories/<int:category_id>/', views.CategoryDetailView.as_view(), name='category-detail'),
     
     # Manufacturer CRUD endpoints
@@ -50,13 +51,21 @@ urlpatterns = [
     path('equipment-specifications/<int:spec_id>/', views.EquipmentSpecificationDetailView.as_view(), name='equipment-specification-detail'),
     path('equipment/<int:equipment_id>/specifications/bulk/', views.EquipmentSpecificationBulkView.as_view(), name='equipment-specifications-bulk'),
     
+    path('spec-parameters/', views.SpecParameterListView.as_view(), name='spec-parameter-list'),
+    
     # Equipment Tech Process CRUD endpoints
     path('equipment-tech-processes/', views.EquipmentTechProcessListView.as_view(), name='equipment-tech-process-list'),
     path('equipment-tech-processes/<int:tech_id>/', views.EquipmentTechProcessDetailView.as_view(), name='equipment-tech-process-detail'),
+    path('equipment/<int:equipment_id>/tech-processes/bulk/', views.EquipmentTechProcessBulkView.as_view(), name='equipment-tech-processes-bulk'),
     
     # Equipment CRUD endpoints
     path('equipment/', views.EquipmentListView.as_view(), name='equipment-list'),
+    path('equipment/facets/', views.EquipmentFacetsView.as_view(), name='equipment-facets'),
+    path('catalog/feed/', views.CatalogFeedView.as_view(), name='catalog-feed'),
+    path('equipment/import/', views.CatalogImportView.as_view(), name='equipment-catalog-import'),
+    path('equipment/export/', views.CatalogExportView.as_view(), name='equipment-catalog-export'),
     path('equipment/<int:equipment_id>/', views.EquipmentDetailView.as_view(), name='equipment-detail'),
+    path('equipment/<int:equipment_id>/photo-imports/', views.EquipmentPhotoImportStatusView.as_view(), name='equipment-photo-imports'),
     
     # Purchase Price CRUD endpoints
     path('purchase-prices/', views.PurchasePriceListView.as_view(), name='purchase-price-list'),
@@ -103,6 +112,7 @@ urlpatterns = [
     path('commercial-proposals/<int:proposal_id>/', views.CommercialProposalDetailView.as_view(), name='commercial-proposal-detail'),
     path('commercial-proposals/<int:proposal_id>/refresh-data-package/', views.CommercialProposalRefreshDataPackageView.as_view(), name='commercial-proposal-refresh-data-package'),
     path('celery-task-status/<str:task_id>/', views.CeleryTaskStatusView.as_view(), name='celery-task-status'),
+    path('commercial-proposals/<int:proposal_id>/add-lines/', views.CommercialProposalAddLinesView.as_view(), name='commercial-proposal-add-lines'),
     path('commercial-proposals/<int:proposal_id>/copy/', views.CommercialProposalCopyView.as_view(), name='commercial-proposal-copy'),
     
     # Exchange Rate CRUD endpoints
@@ -133,5 +143,8 @@ urlpatterns = [
     # Dashboard stats endpoint
     path('dashboard/stats/', views.DashboardStatsView.as_view(), name='dashboard-stats'),
     path('dashboard/active-proposals/', views.DashboardActiveProposalsView.as_view(), name='dashboard-active-proposals'),
+
+    # Sales analytics (daily rollups)
+    path('analytics/sales/', views.SalesAnalyticsView.as_view(), name='sales-analytics'),
 ]
 
@@ -2,8 +2,9 @@ import logging
 from rest_framework import status, generics, permissions, serializers, viewsets
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified, FileResponse
 from rest_framework.views import APIView
+from rest_framework.parsers import JSONParser
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -35,7 +36,8 @@ from .models import (
     EquipmentSpecification, EquipmentTechProcess, Equipment, PurchasePrice,
     Logistics, EquipmentDocument, EquipmentLine, EquipmentLineItem, AdditionalPrices,
     EquipmentList, EquipmentListLineItem, EquipmentListItem, PaymentLog, CrmDeal,
-    CommercialProposal, ExchangeRate, CostCalculation, ProposalTemplate, SectionTemplate, SystemSettings
+    CommercialProposal, ExchangeRate, CostCalculation, ProposalTemplate, SectionTemplate, SystemSettings,
+    EquipmentPhotoImport, ProposalSummary
 )
 from .serializers import (
     UserRegistrationSerializer, UserLoginSerializer, UserSerializer, UserAdminUpdateSerializer,
@@ -46,12 +48,19 @@ from .serializers import (
     EquipmentDocumentSerializer, EquipmentLineSerializer, EquipmentLineItemSerializer,
     AdditionalPricesSerializer, EquipmentListSerializer, EquipmentListLineItemSerializer,
     EquipmentListItemSerializer, PaymentLogSerializer, CommercialProposalSerializer,
+    ProposalSummarySerializer,
     ExchangeRateSerializer, CostCalculationSerializer, CostCalculationRequestSerializer, ProposalTemplateSerializer,
-    SectionTemplateSerializer, CrmDealSerializer
+    SectionTemplateSerializer, CrmDealSerializer, EquipmentPhotoImportSerializer
+)
+from .services import (
+    CostCalculationService, DataAggregatorService, ImageProxyCacheService,
+    EquipmentParameterBulkService, EquipmentFacetService, CategoryTreeService, SpecParameterService,
+    EquipmentFeedService, ProposalEquipmentService, ProposalSummaryService, SalesRollupService
 )
-from .services import CostCalculationService, DataAggregatorService
 from core.services.exchange_rate_service import ExchangeRateService
-from .permissions import IsManagerOrAdmin, IsAdmin, IsSuperuser
+from .permissions import IsManagerOrAdmin, IsAdmin, IsSuperuser, HasCatalogFeedAccess
+from .pagination import OptInCursorPagination
+from .fieldsets import SparseFieldsetsViewMixin
 from .tasks import generate_pdf_task
 from celery.result import AsyncResult
 import requests
@@ -269,9 +278,29 @@ class CategoryListView(generics.ListCreateAPIView):
         if root_only and root_only.lower() == 'true':
             queryset = queryset.filter(parent_category__isnull=True)
         
+        # Optional filter by ancestor: all descendants at any depth (materialized path)
+        ancestor_id = self.request.query_params.get('ancestor_id', None)
+        if ancestor_id:
+            path = CategoryTreeService.subtree_path(ancestor_id) if ancestor_id.isdigit() else None
+            if path is None:
+                return queryset.none()
+            queryset = queryset.filter(path__startswith=path).exclude(pk=ancestor_id)
+        
         return queryset.order_by('category_name')
 
 
+class CategoryTreeView(APIView):
+    """
+    Whole category tree in one request (one query), nested via "children".
+    
+    GET /api/categories/tree/
+    """
+    permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
+
+    def get(self, request):
+        return Response(CategoryTreeService.tree(), status=status.HTTP_200_OK)
+
+
 class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
     """
     Endpoint for retrieving, updating, and deleting a specific category.
@@ -421,12 +450,14 @@ class EquipmentDetailsDetailView(generics.RetrieveUpdateDestroyAPIView):
     lookup_field = 'detail_id'
 
 
-class EquipmentDetailsBulkView(APIView):
+class EquipmentParameterBulkView(APIView):
     """
-    Bulk import/update equipment details. Accepts [{"key": "Вес", "value": "10кг"}, ...].
-    Uses update_or_create by (equipment_id, detail_parameter_name): existing params are updated, new ones created.
+    Base for bulk import of equipment key/value parameters (see EquipmentParameterBulkService).
+    Accepts [{"key": ..., "value": ...}, ...]; existing keys are updated, new ones created in one
+    upsert. ?replace=true also deletes parameters of the equipment that are absent from the payload.
     """
     permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
+    parameter_kind = None
 
     def post(self, request, equipment_id):
         items = request.data
@@ -435,34 +466,22 @@ class EquipmentDetailsBulkView(APIView):
                 {'error': 'Expected a list of objects with "key" and "value".'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        Equipment.objects.get(pk=equipment_id)  # 404 if not found
-        created_count = 0
-        updated_count = 0
-        for item in items:
-            key = (item.get('key') or item.get('detail_parameter_name') or '').strip()
-            value = (item.get('value') or item.get('detail_parameter_value') or '')
-            if not key:
-                continue
-            value_str = value.strip() if isinstance(value, str) else str(value).strip()
-            obj = EquipmentDetails.objects.filter(
-                equipment_id=equipment_id, detail_parameter_name=key
-            ).first()
-            if obj:
-                obj.detail_parameter_value = value_str or None
-                obj.save()
-                updated_count += 1
-            else:
-                EquipmentDetails.objects.create(
-                    equipment_id=equipment_id,
-                    detail_parameter_name=key,
-                    detail_parameter_value=value_str or None
-                )
-                created_count += 1
-        return Response({
-            'created': created_count,
-            'updated': updated_count,
-            'total': created_count + updated_count
-        }, status=status.HTTP_200_OK)
+        replace = str(request.query_params.get('replace', '')).lower() in ('1', 'true', 'yes')
+        try:
+            result = EquipmentParameterBulkService.upsert(
+                self.parameter_kind, equipment_id, items, replace=replace
+            )
+        except Equipment.DoesNotExist:
+            return Response({'error': 'Equipment not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class EquipmentDetailsBulkView(EquipmentParameterBulkView):
+    """
+    Bulk import/update equipment details. Accepts [{"key": "Вес", "value": "10кг"}, ...].
+    Upsert by (equipment_id, detail_parameter_name); ?replace=true drops details missing from the payload.
+    """
+    parameter_kind = 'details'
 
 
 class EquipmentSpecificationListView(generics.ListCreateAPIView):
@@ -507,48 +526,12 @@ class EquipmentSpecificationDetailView(generics.RetrieveUpdateDestroyAPIView):
     lookup_field = 'spec_id'
 
 
-class EquipmentSpecificationBulkView(APIView):
+class EquipmentSpecificationBulkView(EquipmentParameterBulkView):
     """
     Bulk import/update equipment specifications. Accepts [{"key": "Мощность", "value": "0,55 кВт"}, ...].
-    Uses update_or_create by (equipment_id, spec_parameter_name): existing params are updated, new ones created.
+    Upsert by (equipment_id, spec_parameter_name); ?replace=true drops specs missing from the payload.
     """
-    permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
-
-    def post(self, request, equipment_id):
-        items = request.data
-        if not isinstance(items, list):
-            return Response(
-                {'error': 'Expected a list of objects with "key" and "value".'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        Equipment.objects.get(pk=equipment_id)  # 404 if not found
-        created_count = 0
-        updated_count = 0
-        for item in items:
-            key = (item.get('key') or item.get('spec_parameter_name') or '').strip()
-            value = (item.get('value') or item.get('spec_parameter_value') or '')
-            if not key:
-                continue
-            value_str = value.strip() if isinstance(value, str) else str(value).strip()
-            obj = EquipmentSpecification.objects.filter(
-                equipment_id=equipment_id, spec_parameter_name=key
-            ).first()
-            if obj:
-                obj.spec_parameter_value = value_str or None
-                obj.save()
-                updated_count += 1
-            else:
-                EquipmentSpecification.objects.create(
-                    equipment_id=equipment_id,
-                    spec_parameter_name=key,
-                    spec_parameter_value=value_str or None
-                )
-                created_count += 1
-        return Response({
-            'created': created_count,
-            'updated': updated_count,
-            'total': created_count + updated_count
-        }, status=status.HTTP_200_OK)
+    parameter_kind = 'specifications'
 
 
 class EquipmentTechProcessListView(generics.ListCreateAPIView):
@@ -595,7 +578,106 @@ class EquipmentTechProcessDetailView(generics.RetrieveUpdateDestroyAPIView):
     lookup_field = 'tech_id'
 
 
-class EquipmentListView(generics.ListCreateAPIView):
+class CatalogImportView(APIView):
+    """
+    Bulk catalog import from CSV / XLSX (column format: CatalogImportService).
+
+    POST /api/equipment/import/ - multipart "file"; runs in Celery, returns task_id
+        (progress and result: /api/celery-task-status/{task_id}/). ?sync=true imports inline.
+        Options: ?dry_run=true, ?batch_size=500, ?create_refs=false
+    """
+    permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
+
+    def post(self, request):
+        import os
+        import uuid
+        from .services import CatalogImportService
+
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
+        if not upload.name.lower().endswith(('.csv', '.xlsx', '.xlsm')):
+            return Response({'error': 'Expected a .csv or .xlsx file'}, status=status.HTTP_400_BAD_REQUEST)
+
+        params = request.query_params
+        try:
+            batch_size = int(params.get('batch_size', 500))
+        except (TypeError, ValueError):
+            return Response({'error': 'batch_size must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        options = {
+            'batch_size': max(1, min(batch_size, 5000)),
+            'create_missing_refs': params.get('create_refs', 'true').lower() != 'false',
+            'dry_run': params.get('dry_run', 'false').lower() == 'true',
+        }
+
+        if params.get('sync', 'false').lower() == 'true':
+            service = CatalogImportService(**options)
+            try:
+                summary = service.run(CatalogImportService.iter_rows(upload, upload.name))
+            except ImportError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(summary, status=status.HTTP_200_OK)
+
+        # Worker reads the file from shared media storage (same as PDF/DOCX exports)
+        import_dir = os.path.join(settings.MEDIA_ROOT, 'imports')
+        os.makedirs(import_dir, exist_ok=True)
+        path = os.path.join(import_dir, f'{uuid.uuid4().hex}_{os.path.basename(upload.name)}')
+        with open(path, 'wb') as f:
+            for chunk in upload.chunks():
+                f.write(chunk)
+
+        from .tasks import import_catalog_task
+        task = import_catalog_task.delay(path, upload.name, **options)
+        return Response({'task_id': task.id}, status=status.HTTP_202_ACCEPTED)
+
+
+class CatalogExportView(APIView):
+    """
+    Streaming catalog export (same columns as the import).
+
+    GET /api/equipment/export/?file_format=csv|xlsx
+    """
+    permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
+
+    def get(self, request):
+        from django.http import StreamingHttpResponse
+        from .services import CatalogExportService
+
+        stamp = timezone.now().strftime('%Y%m%d_%H%M')
+        file_format = request.query_params.get('file_format', 'csv').lower()
+        if file_format == 'xlsx':
+            import tempfile
+            # openpyxl needs a seekable target; rows are flushed to disk, not held in memory
+            tmp = tempfile.TemporaryFile()
+            try:
+                CatalogExportService.write_xlsx(tmp)
+            except ImportError as e:
+                tmp.close()
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            tmp.seek(0)
+            return FileResponse(
+                tmp,
+                as_attachment=True,
+                filename=f'catalog_{stamp}.xlsx',
+                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            )
+        if file_format != 'csv':
+            return Response({'error': 'file_format must be csv or xlsx'}, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(CatalogExportService.iter_csv(), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="catalog_{stamp}.csv"'
+        return response
+
+
+class EquipmentTechProcessBulkView(EquipmentParameterBulkView):
+    """
+    Bulk import/update equipment tech processes.
+    Accepts [{"key": "Нарезка", "value": "до 120 шт/мин", "desc": "..."}, ...].
+    Upsert by (equipment_id, tech_name); ?replace=true drops processes missing from the payload.
+    """
+    parameter_kind = 'tech_processes'
+
+
+class EquipmentListView(SparseFieldsetsViewMixin, generics.ListCreateAPIView):
     """
     Endpoint for listing all equipment and creating new equipment.
     
@@ -605,6 +687,24 @@ class EquipmentListView(generics.ListCreateAPIView):
     queryset = Equipment.objects.all()
     serializer_class = EquipmentSerializer
     permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
+    # Opt-in keyset pagination (?pagination=cursor), keyed on the list ordering;
+    # ?search= results are ordered by relevance, which a cursor can't position on (400)
+    pagination_class = OptInCursorPagination
+    cursor_ordering = ('-created_at', '-equipment_id')
+    cursor_unsupported_params = ('search',)
+    # ?fields= / ?omit=: skip prefetches and columns of fields that are not requested
+    sparse_prefetch_map = {
+        'categories': ['categories'],
+        'manufacturers': ['manufacturers'],
+        'equipment_types': ['equipment_types'],
+        'details': ['details'],
+        'specifications': ['specifications'],
+        'tech_processes': ['tech_processes'],
+        'equipment_imagelinks': ['photos', 'photo_imports'],
+    }
+    sparse_requires = {
+        'actual_price': ['sale_price_kzt'],
+    }
     
     def create(self, request, *args, **kwargs):
         """Override create to add logging and ensure equipment is saved."""
@@ -641,43 +741,100 @@ class EquipmentListView(generics.ListCreateAPIView):
         """Return all equipment, optionally filtered by search or filters."""
         queryset = Equipment.objects.prefetch_related(
             'categories', 'manufacturers', 'equipment_types',
-            'details', 'specifications', 'tech_processes', 'photos'
-        ).all()
-        
-        # Optional search by equipment name or articule
+            'details', 'specifications', 'tech_processes', 'photos', 'photo_imports'
+        ).defer('search_vector')
+        if self.sparse_field_wanted('actual_price'):
+            queryset = EquipmentSerializer.annotate_actual_price(queryset)
+        queryset = self.apply_sparse_fieldsets(queryset)
+        
+        # Ranked search (full-text + trigram) and category / manufacturer / type / published filters;
+        # the same filters feed EquipmentFacetsView
+        # ?spec_range=<parameter_id>:<min>:<max> (repeatable) - typed spec values, see SpecParameterService
         search = self.request.query_params.get('search', None)
-        if search:
-            queryset = queryset.filter(
-                equipment_name__icontains=search
-            ) | queryset.filter(
-                equipment_articule__icontains=search
-            )
-        
-        # Optional filter by category (many-to-many)
-        category_id = self.request.query_params.get('category_id', None)
-        if category_id:
-            queryset = queryset.filter(categories__category_id=category_id).distinct()
-        
-        # Optional filter by manufacturer (many-to-many)
-        manufacturer_id = self.request.query_params.get('manufacturer_id', None)
-        if manufacturer_id:
-            queryset = queryset.filter(manufacturers__manufacturer_id=manufacturer_id).distinct()
-        
-        # Optional filter by equipment type (many-to-many)
-        equipment_type_id = self.request.query_params.get('equipment_type_id', None)
-        if equipment_type_id:
-            queryset = queryset.filter(equipment_types__type_id=equipment_type_id).distinct()
-        
-        # Optional filter by published status
-        is_published = self.request.query_params.get('is_published', None)
-        if is_published is not None:
-            is_published_bool = is_published.lower() == 'true'
-            queryset = queryset.filter(is_published=is_published_bool)
+        try:
+            queryset = EquipmentFacetService.filter_queryset(queryset, self.request.query_params)
+        except ValueError as e:
+            raise ValidationError({'spec_range': str(e)})
         
+        if search and search.strip():
+            # Most relevant first
+            return queryset.order_by('-search_rank', '-search_similarity', '-created_at')
         return queryset.order_by('-created_at')
 
 
-class EquipmentDetailView(generics.RetrieveUpdateDestroyAPIView):
+class EquipmentFacetsView(APIView):
+    """
+    Facet counts for the catalog filters, for the current search / filter state.
+
+    GET /api/equipment/facets/?search=&category_id=&manufacturer_id=&equipment_type_id=&is_published=&spec_range=
+    Same params as GET /api/equipment/. Each facet is counted without its own filter.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
+
+    def get(self, request):
+        try:
+            facets = EquipmentFacetService.get_facets(request.query_params)
+        except ValueError as e:
+            return Response({'spec_range': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(facets, status=status.HTTP_200_OK)
+
+
+class SpecParameterListView(APIView):
+    """
+    Parameter dictionary for specification / detail range filters.
+
+    GET /api/spec-parameters/?search= - parameters with canonical unit, value count and numeric min/max
+    Use parameter_id in GET /api/equipment/?spec_range=<parameter_id>:<min>:<max>.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
+
+    def get(self, request):
+        search = request.query_params.get('search', None)
+        return Response(SpecParameterService.parameter_stats(search=search), status=status.HTTP_200_OK)
+
+
+class CatalogFeedView(APIView):
+    """
+    Published catalog feed for the website and partner sync jobs.
+
+    GET /api/catalog/feed/                      - full snapshot of published equipment (paged)
+    GET /api/catalog/feed/?since=<next_since>   - only changes after the cursor:
+        "items" (new / updated) and "deleted" (unpublished or deleted equipment ids)
+    ?limit= (default CATALOG_FEED_PAGE_SIZE, max 2000); follow next_since while has_more.
+    Strong ETag: unchanged feed -> 304 on If-None-Match. Auth: JWT or X-Feed-Token / ?token=.
+    """
+    permission_classes = [HasCatalogFeedAccess]
+
+    def get(self, request):
+        import hashlib
+        import json
+        from django.core.serializers.json import DjangoJSONEncoder
+
+        try:
+            page = EquipmentFeedService.page(
+                since=request.query_params.get('since') or None,
+                limit=request.query_params.get('limit') or None,
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        body = json.dumps(page, cls=DjangoJSONEncoder, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        etag = '"%s"' % hashlib.sha256(body).hexdigest()[:40]
+        max_age = int(getattr(settings, 'CATALOG_FEED_MAX_AGE', 60))
+        # Token (query string) requests are the same for every caller -> shared caches (nginx) may store them
+        cache_control = f'public, max-age={max_age}' if not request.user.is_authenticated else f'private, max-age={max_age}'
+
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type='application/json; charset=utf-8')
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        response['Vary'] = 'Authorization, X-Feed-Token'
+        return response
+
+
+class EquipmentDetailView(SparseFieldsetsViewMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Endpoint for retrieving, updating, and deleting a specific equipment.
     
@@ -686,13 +843,55 @@ class EquipmentDetailView(generics.RetrieveUpdateDestroyAPIView):
     PATCH /api/equipment/{id}/ - Update equipment (partial update)
     DELETE /api/equipment/{id}/ - Delete equipment
     """
-    queryset = Equipment.objects.prefetch_related(
+    queryset = EquipmentSerializer.annotate_actual_price(Equipment.objects.prefetch_related(
         'categories', 'manufacturers', 'equipment_types',
-        'details', 'specifications', 'tech_processes', 'photos'
-    ).all()
+        'details', 'specifications', 'tech_processes', 'photos', 'photo_imports'
+    ).defer('search_vector'))
     serializer_class = EquipmentSerializer
     permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
     lookup_field = 'equipment_id'
+    # ?fields= / ?omit=: skip prefetches and columns of fields that are not requested
+    sparse_prefetch_map = {
+        'categories': ['categories'],
+        'manufacturers': ['manufacturers'],
+        'equipment_types': ['equipment_types'],
+        'details': ['details'],
+        'specifications': ['specifications'],
+        'tech_processes': ['tech_processes'],
+        'equipment_imagelinks': ['photos', 'photo_imports'],
+    }
+    sparse_requires = {
+        'actual_price': ['sale_price_kzt'],
+    }
+
+    def get_queryset(self):
+        return self.apply_sparse_fieldsets(super().get_queryset())
+
+
+class EquipmentPhotoImportStatusView(APIView):
+    """
+    Progress of background photo import for equipment (links queued on create/update).
+
+    GET /api/equipment/{id}/photo-imports/ - Per-photo status and summary
+    """
+    permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
+
+    def get(self, request, equipment_id):
+        if not Equipment.objects.filter(pk=equipment_id).exists():
+            return Response({'error': 'Equipment not found'}, status=status.HTTP_404_NOT_FOUND)
+        imports = list(
+            EquipmentPhotoImport.objects.filter(equipment_id=equipment_id).select_related('photo')
+        )
+        summary = {key: 0 for key, _label in EquipmentPhotoImport.STATUS_CHOICES}
+        for photo_import in imports:
+            summary[photo_import.status] = summary.get(photo_import.status, 0) + 1
+        return Response({
+            'equipment_id': equipment_id,
+            'summary': summary,
+            'total': len(imports),
+            'is_complete': summary['pending'] == 0 and summary['processing'] == 0,
+            'imports': EquipmentPhotoImportSerializer(imports, many=True).data,
+        })
 
 
 class PurchasePriceListView(generics.ListCreateAPIView):
@@ -1173,6 +1372,10 @@ class PaymentLogListView(generics.ListCreateAPIView):
     queryset = PaymentLog.objects.select_related('user').all()
     serializer_class = PaymentLogSerializer
     permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
+    # Opt-in keyset pagination (?pagination=cursor): keyed on the immutable creation time + pk
+    # (payment_date is editable and not unique, so it can't position a cursor)
+    pagination_class = OptInCursorPagination
+    cursor_ordering = ('-created_at', '-payment_id')
     
     def perform_create(self, serializer):
         """Set the user to the current user when creating a payment log."""
@@ -1223,57 +1426,48 @@ class PaymentLogDetailView(generics.RetrieveUpdateDestroyAPIView):
         serializer.save(user=self.request.user)
 
 
-class CommercialProposalListView(generics.ListCreateAPIView):
+class CommercialProposalListView(SparseFieldsetsViewMixin, generics.ListCreateAPIView):
     """
     Endpoint for listing all commercial proposals and creating new proposals.
     
-    GET /api/commercial-proposals/ - List all commercial proposals
+    GET /api/commercial-proposals/ - List commercial proposals (ProposalSummary read model, see ProposalSummarySerializer)
     POST /api/commercial-proposals/ - Create a new commercial proposal
+    
+    The full nested representation is returned by GET /api/commercial-proposals/{id}/.
     """
-    queryset = CommercialProposal.objects.select_related(
-        'client', 'deal', 'user', 'updated_by', 'parent_proposal'
-    ).prefetch_related(
-        'payment_logs', 'equipment_lists'
-    ).all()
+    queryset = CommercialProposal.objects.all()
     serializer_class = CommercialProposalSerializer
     permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
+    # Opt-in keyset pagination (?pagination=cursor): keyed on the immutable creation time + pk
+    # (proposal_date is editable and not unique, so it can't position a cursor)
+    pagination_class = OptInCursorPagination
+    cursor_ordering = ('-created_at', '-proposal_id')
+    # ?fields= / ?omit= on the summary
+    sparse_requires = {
+        'proposal_status_display': ['proposal_status'],
+        'client': ['client_id', 'client_name', 'client_company_name'],
+        'user': ['user_id', 'user_name'],
+        'updated_by': ['updated_by_id', 'updated_by_name'],
+    }
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return ProposalSummarySerializer
+        return CommercialProposalSerializer
     
     def perform_create(self, serializer):
-        """Create proposal and automatically calculate cost_price, total_price, and margin."""
+        """Create proposal and queue the cost_price / total_price / margin recalculation."""
         proposal = serializer.save(user=self.request.user, updated_by=self.request.user)
         
-        # Автоматически рассчитываем себестоимость, итоговую цену и маржу
-        try:
-            cost_price = CostCalculationService.calculate_proposal_cost_price(proposal)
-            proposal.cost_price = cost_price
-            
-            # Рассчитываем итоговую цену и маржу через DataAggregatorService
-            # (использует sale_price_kzt для расчета)
-            from .services import DataAggregatorService
-            from .serializers import _save_prices_to_equipment_list_items
-            
-            service = DataAggregatorService(proposal)
-            data_pkg = service.get_full_data_package()
-            
-            # total_price и margin_value/margin_percentage уже обновлены в get_full_data_package
-            proposal.refresh_from_db()
-            
-            # Сохранить итоговые цены в EquipmentListItem
-            if 'equipment_list' in data_pkg:
-                _save_prices_to_equipment_list_items(proposal, data_pkg['equipment_list'])
-        except Exception as e:
-            # Если не удалось рассчитать, оставляем значения как есть
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f'Failed to auto-calculate prices for proposal {proposal.proposal_id}: {str(e)}')
+        # Себестоимость, итоговая цена и маржа пересчитываются в фоне (pricing_status: stale -> fresh)
+        ProposalEquipmentService.schedule_recalculation(proposal)
     
     def get_queryset(self):
         """Return all commercial proposals, optionally filtered by search or filters."""
-        queryset = CommercialProposal.objects.select_related(
-            'client', 'deal', 'user', 'updated_by', 'parent_proposal'
-        ).prefetch_related(
-            'payment_logs', 'equipment_lists'
-        ).all()
+        if self.request.method != 'GET':
+            return super().get_queryset()
+        # Single-table read of the denormalized summary (proposal_summary_list_idx)
+        queryset = self.apply_sparse_fieldsets(ProposalSummary.objects.all())
         
         # Soft delete filtering
         include_inactive = self.request.query_params.get('include_inactive', None)
@@ -1288,8 +1482,8 @@ class CommercialProposalListView(generics.ListCreateAPIView):
             queryset = queryset.filter(
                 Q(proposal_name__icontains=search) |
                 Q(outcoming_number__icontains=search) |
-                Q(client__client_name__icontains=search) |
-                Q(client__client_company_name__icontains=search)
+                Q(client_name__icontains=search) |
+                Q(client_company_name__icontains=search)
             )
         
         # Optional filter by client
@@ -1334,7 +1528,7 @@ class CommercialProposalListView(generics.ListCreateAPIView):
         return queryset.order_by('-proposal_date', '-created_at')
 
 
-class CommercialProposalDetailView(generics.RetrieveUpdateDestroyAPIView):
+class CommercialProposalDetailView(SparseFieldsetsViewMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Endpoint for retrieving, updating, and deleting a specific commercial proposal.
     
@@ -1351,34 +1545,29 @@ class CommercialProposalDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = CommercialProposalSerializer
     permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
     lookup_field = 'proposal_id'
+    # ?fields= / ?omit=: skip joins, prefetches and columns that are not requested (data_package loads on access)
+    sparse_select_map = {
+        'client': ['client'],
+        'deal': ['deal'],
+        'user': ['user'],
+        'updated_by': ['updated_by'],
+        'parent_proposal': ['parent_proposal'],
+        'template_status': ['template'],
+    }
+    sparse_prefetch_map = {
+        'payment_logs': ['payment_logs'],
+        'equipment_lists': ['equipment_lists'],
+    }
+
+    def get_queryset(self):
+        return self.apply_sparse_fieldsets(super().get_queryset())
     
     def perform_update(self, serializer):
-        """Update proposal and automatically recalculate cost_price and total_price if equipment changed."""
+        """Update proposal and queue the cost_price / total_price / margin recalculation."""
         proposal = serializer.save(updated_by=self.request.user)
         
-        # Автоматически пересчитываем себестоимость, итоговую цену и маржу
-        try:
-            cost_price = CostCalculationService.calculate_proposal_cost_price(proposal)
-            proposal.cost_price = cost_price
-            
-            # Рассчитываем итоговую цену и маржу через DataAggregatorService
-            # (использует sale_price_kzt для расчета)
-            from .services import DataAggregatorService
-            from .serializers import _save_prices_to_equipment_list_items
-            
-            service = DataAggregatorService(proposal)
-            data_pkg = service.get_full_data_package()
-            
-            # total_price и margin_value/margin_percentage уже обновлены в get_full_data_package
-            proposal.refresh_from_db()
-            
-            # Сохранить итоговые цены в EquipmentListItem
-            if 'equipment_list' in data_pkg:
-                _save_prices_to_equipment_list_items(proposal, data_pkg['equipment_list'])
-        except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f'Failed to auto-calculate prices for proposal {proposal.proposal_id}: {str(e)}')
+        # Себестоимость, итоговая цена и маржа пересчитываются в фоне (pricing_status: stale -> fresh)
+        ProposalEquipmentService.schedule_recalculation(proposal)
 
     def perform_destroy(self, instance):
         """Soft delete the proposal."""
@@ -1462,11 +1651,37 @@ class CommercialProposalRefreshDataPackageView(APIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class CommercialProposalAddLinesView(APIView):
+    """
+    Add equipment lines to a proposal in one operation.
+
+    POST /api/commercial-proposals/{id}/add-lines/
+    Body: {"lines": [{"equipment_line_id": 1, "multiplier": 2}, ...]}
+    Line items are expanded into EquipmentListItem rows (quantities merged with existing
+    equipment); prices are recalculated in the background (pricing_status).
+    """
+    permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
+
+    def post(self, request, proposal_id):
+        lines = request.data.get('lines')
+        if not isinstance(lines, list):
+            return Response({'error': 'lines must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            result = ProposalEquipmentService.add_lines(proposal_id, lines)
+        except CommercialProposal.DoesNotExist:
+            return Response({'error': 'Proposal not found'}, status=status.HTTP_404_NOT_FOUND)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_200_OK)
+
+
 class CommercialProposalCopyView(generics.CreateAPIView):
     """
     Endpoint for copying a commercial proposal.
     
     POST /api/commercial-proposals/{id}/copy/
+    Optional body: {"variants": [{"currency_ticket": "USD", "exchange_rate": "470.5"}, ...]}
+    creates one copy per variant and returns a list; without variants a single copy is returned.
     """
     queryset = CommercialProposal.objects.all()
     serializer_class = CommercialProposalSerializer
@@ -1474,85 +1689,31 @@ class CommercialProposalCopyView(generics.CreateAPIView):
     lookup_field = 'proposal_id'
     
     def post(self, request, *args, **kwargs):
-        from django.db import transaction
-        
+        from .services import ProposalCloneService
+
+        variants = request.data.get('variants')
         try:
             original_proposal = self.get_object()
-            
-            with transaction.atomic():
-                # 1. Create copy of proposal
-                new_proposal = CommercialProposal.objects.get(pk=original_proposal.pk)
-                new_proposal.pk = None
-                new_proposal.proposal_id = None
-                
-                # Update fields
-                new_proposal.proposal_status = 'draft'
-                new_proposal.outcoming_number = f"{original_proposal.outcoming_number} (copy)"
-                # Ensure uniqueness of outcoming_number
-                counter = 1
-                while CommercialProposal.objects.filter(outcoming_number=new_proposal.outcoming_number).exists():
-                    new_proposal.outcoming_number = f"{original_proposal.outcoming_number} (copy {counter})"
-                    counter += 1
-                
-                new_proposal.proposal_name = f"{original_proposal.proposal_name} (Копия)"
-                new_proposal.created_at = None
-                new_proposal.updated_at = None
-                new_proposal.user = request.user
-                new_proposal.updated_by = request.user
-                new_proposal.save()
-                
-                # 2. Copy PaymentLogs
-                for payment in original_proposal.payment_logs.all():
-                    new_payment = PaymentLog.objects.get(pk=payment.pk)
-                    new_payment.pk = None
-                    new_payment.payment_id = None
-                    new_payment.created_at = None
-                    new_payment.updated_at = None
-                    new_payment.save()
-                    new_proposal.payment_logs.add(new_payment)
-                
-                # 3. Copy EquipmentLists and items
-                for eq_list in original_proposal.equipment_lists.all():
-                    new_eq_list = EquipmentList.objects.get(pk=eq_list.pk)
-                    new_eq_list.pk = None
-                    new_eq_list.list_id = None
-                    new_eq_list.proposal = new_proposal
-                    new_eq_list.created_at = None
-                    new_eq_list.updated_at = None
-                    new_eq_list.save()
-                    
-                    # Copy many-to-many additional_prices
-                    new_eq_list.additional_prices.set(eq_list.additional_prices.all())
-                    
-                    # Copy EquipmentListLineItems
-                    for item in eq_list.line_items.all():
-                        new_item = EquipmentListLineItem.objects.get(pk=item.pk)
-                        new_item.pk = None
-                        new_item.id = None  # Django auto id
-                        new_item.equipment_list = new_eq_list
-                        new_item.created_at = None
-                        new_item.save()
-
-                    # Copy EquipmentListItems
-                    for item in eq_list.equipment_items_relation.all():
-                        new_item = EquipmentListItem.objects.get(pk=item.pk)
-                        new_item.pk = None
-                        new_item.id = None # Django auto id
-                        new_item.equipment_list = new_eq_list
-                        new_item.created_at = None
-                        new_item.save()
-                
-                return Response(
-                    CommercialProposalSerializer(new_proposal).data,
-                    status=status.HTTP_201_CREATED
-                )
-                
+            new_proposals = ProposalCloneService.clone(original_proposal, user=request.user, variants=variants)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response(
                 {'error': str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        context = self.get_serializer_context()
+        if variants:
+            return Response(
+                CommercialProposalSerializer(new_proposals, many=True, context=context).data,
+                status=status.HTTP_201_CREATED
+            )
+        return Response(
+            CommercialProposalSerializer(new_proposals[0], context=context).data,
+            status=status.HTTP_201_CREATED
+        )
+
 # Removed CommercialProposalPDFView_Old
     
     def retrieve(self, request, *args, **kwargs):
@@ -1877,6 +2038,10 @@ class ExchangeRateListView(generics.ListCreateAPIView):
     ).all()
     serializer_class = ExchangeRateSerializer
     permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
+    # Opt-in keyset pagination (?pagination=cursor): keyed on the immutable creation time + pk
+    # (rate_date is editable and not unique, so it can't position a cursor)
+    pagination_class = OptInCursorPagination
+    cursor_ordering = ('-created_at', '-rate_id')
     
     def get_queryset(self):
         """Return all exchange rates, optionally filtered by search or filters."""
@@ -2279,6 +2444,9 @@ class CostCalculationListView(generics.ListAPIView):
     ).all()
     serializer_class = CostCalculationSerializer
     permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
+    # Opt-in keyset pagination (?pagination=cursor): keyed on the immutable creation time + pk
+    pagination_class = OptInCursorPagination
+    cursor_ordering = ('-created_at', '-calculation_id')
     
     def get_queryset(self):
         """Return all cost calculations, optionally filtered."""
@@ -2370,6 +2538,11 @@ from rest_framework.decorators import action
 from django.http import HttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 
+class JSONPatchParser(JSONParser):
+    """Accepts RFC 6902 bodies sent as application/json-patch+json."""
+    media_type = 'application/json-patch+json'
+
+
 class ProposalTemplateViewSet(viewsets.ModelViewSet):
     """
     ViewSet for ProposalTemplate.
@@ -2380,6 +2553,52 @@ class ProposalTemplateViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['proposal']
 
+    @action(detail=True, methods=['patch'], url_path='patch', parser_classes=[JSONPatchParser, JSONParser])
+    def patch_document(self, request, pk=None):
+        """
+        Delta save of the constructor (RFC 6902).
+
+        PATCH /api/proposal-templates/{id}/patch/
+        Body: [{"op": "replace", "path": "/layout_data/2/content", "value": "..."}, ...]
+              or {"operations": [...], "revision": 5}
+        Paths: /layout_data, /header_data, /equipment_order, /additional_services.
+        The expected revision may also be sent as If-Match: "5"; a mismatch returns 412.
+        Paths with array indexes (/layout_data/2/...) require the revision, otherwise 428.
+        """
+        from .jsonpatch import JSONPatchError
+        from .services import (
+            ProposalTemplatePatchService, TemplateRevisionConflict, TemplateRevisionRequired
+        )
+
+        template = self.get_object()
+        operations, revision = request.data, None
+        if isinstance(request.data, dict):
+            operations = request.data.get('operations')
+            revision = request.data.get('revision')
+        if revision is None and request.headers.get('If-Match'):
+            revision = request.headers['If-Match'].replace('W/', '').strip().strip('"')
+        try:
+            if revision is not None:
+                revision = int(revision)
+            result = ProposalTemplatePatchService.apply(
+                template.template_id, operations, user=request.user, revision=revision
+            )
+        except TemplateRevisionConflict as e:
+            return Response(
+                {'error': str(e), 'revision': template.revision},
+                status=status.HTTP_412_PRECONDITION_FAILED
+            )
+        except TemplateRevisionRequired as e:
+            return Response(
+                {'error': str(e), 'revision': template.revision},
+                status=status.HTTP_428_PRECONDITION_REQUIRED
+            )
+        except (JSONPatchError, ValueError, TypeError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        response = Response(result, status=status.HTTP_200_OK)
+        response['ETag'] = '"%s"' % result['revision']
+        return response
+
     @action(detail=True, methods=['get'], url_path='export-pdf')
     def export_pdf(self, request, pk=None):
         """Generate PDF synchronously or asynchronously based on query param."""
@@ -2423,6 +2642,7 @@ class ProposalTemplateViewSet(viewsets.ModelViewSet):
                 safe_number = str(template.proposal.outcoming_number).replace('/', '_').replace(' ', '_')
                 filename = f"proposal_{safe_number}.pdf"
                 response['Content-Disposition'] = f'attachment; filename="{filename}"'
+                ProposalSummaryService.record_export(template.proposal_id)
                 return response
                 
             except Exception as e:
@@ -2733,6 +2953,7 @@ class ProposalTemplateViewSet(viewsets.ModelViewSet):
                 safe_number = str(template.proposal.outcoming_number).replace('/', '_').replace(' ', '_')
                 filename = f"proposal_{safe_number}.docx"
                 response['Content-Disposition'] = f'attachment; filename="{filename}"'
+                ProposalSummaryService.record_export(template.proposal_id)
                 return response
                 
             except Exception as e:
@@ -3376,6 +3597,8 @@ class ImageProxyView(APIView):
     """
     Proxy for external images (Google Drive, Yandex Disk) to avoid 403 when
     loading in <img> from our frontend (Google blocks by Referer).
+    Served from a content-addressed disk cache (ImageProxyCacheService), streamed
+    in chunks, with ETag / Cache-Control and If-None-Match -> 304.
     GET /api/proxy-image/?url=ENCODED_IMAGE_URL
     AllowAny so <img src> works without sending JWT (allowlist restricts hosts).
     """
@@ -3399,16 +3622,29 @@ class ImageProxyView(APIView):
             'Referer': 'https://drive.google.com/',
         }
         try:
-            r = requests.get(url, headers=headers, timeout=25, stream=True)
-            r.raise_for_status()
-            content_type = r.headers.get('Content-Type', 'application/octet-stream')
-            # Only allow image types
-            if 'image/' not in content_type and content_type not in ('application/octet-stream',):
-                return Response({'error': 'Not an image'}, status=status.HTTP_400_BAD_REQUEST)
-            return HttpResponse(r.content, content_type=content_type)
+            entry = ImageProxyCacheService.get_or_fetch(url, headers=headers)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except requests.RequestException as e:
             return Response({'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
 
+        etag = f'"{entry["sha"]}"'
+        cache_control = f'public, max-age={getattr(settings, "IMAGE_PROXY_CACHE_TTL", 86400)}'
+        if_none_match = request.headers.get('If-None-Match', '')
+        if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+            response = HttpResponseNotModified()
+        else:
+            try:
+                fh = open(ImageProxyCacheService.object_path(entry['sha']), 'rb')
+            except OSError:
+                # Evicted between lookup and open
+                return Response({'error': 'Image unavailable, retry'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response = FileResponse(fh, content_type=entry['content_type'])
+            response['Content-Length'] = entry['size']
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        return response
+
 
 class DashboardStatsView(APIView):
     """
@@ -3438,9 +3674,9 @@ class DashboardStatsView(APIView):
         # 1. Equipment total count (all equipment, not just published)
         equipment_total = Equipment.objects.count()
         
-        # 2. Proposals stats by status (only active proposals)
+        # 2. Proposals stats by status (only active proposals, from the summary read model)
         proposals_stats = (
-            CommercialProposal.objects
+            ProposalSummary.objects
             .filter(is_active=True)
             .values('proposal_status')
             .annotate(count=Count('proposal_id'))
@@ -3522,8 +3758,6 @@ class DashboardActiveProposalsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request, *args, **kwargs):
-        from decimal import Decimal
-        
         # Get date range from query params (default to current month)
         date_from = request.query_params.get('date_from', None)
         date_to = request.query_params.get('date_to', None)
@@ -3557,17 +3791,18 @@ class DashboardActiveProposalsView(APIView):
         
         # Get active proposals filtered by created_at date range
         # Exclude closed/archived proposals (is_active=False or status='completed')
-        queryset = CommercialProposal.objects.filter(
+        # KZT total, paid amount and percentage are precomputed in ProposalSummary (proposal_summary_dash_idx)
+        queryset = ProposalSummary.objects.filter(
             is_active=True
         ).exclude(
             proposal_status='completed'
         ).filter(
             created_at__gte=date_from,
             created_at__lte=date_to
-        ).select_related(
-            'client'
-        ).prefetch_related(
-            'payment_logs'
+        ).only(
+            'proposal_id', 'outcoming_number', 'proposal_name',
+            'client_id', 'client_name', 'client_company_name',
+            'proposal_status', 'total_price_kzt', 'paid_amount', 'payment_percentage', 'created_at'
         ).order_by('-created_at')
         
         # Status labels mapping
@@ -3581,49 +3816,100 @@ class DashboardActiveProposalsView(APIView):
         }
         
         proposals_list = []
-        for proposal in queryset:
-            # Calculate total sum in KZT
-            # If currency is not KZT, convert using exchange_rate
-            total_price = Decimal(str(proposal.total_price))
-            if proposal.currency_ticket != 'KZT':
-                exchange_rate = Decimal(str(proposal.exchange_rate))
-                total_sum_kzt = total_price * exchange_rate
-            else:
-                total_sum_kzt = total_price
-            
-            # Calculate paid amount from payment logs
-            # For ManyToMany with prefetch_related, we can iterate directly
-            paid_amount = Decimal('0')
-            # prefetch_related loads the related objects, so we can iterate without additional query
-            for payment in proposal.payment_logs.all():
-                paid_amount += Decimal(str(payment.payment_value))
-            
-            # Calculate payment percentage
-            if total_sum_kzt > 0:
-                payment_percentage = float((paid_amount / total_sum_kzt) * 100)
-                # Cap at 100%
-                payment_percentage = min(payment_percentage, 100.0)
-            else:
-                payment_percentage = 0.0
-            
-            # client может быть None (null=True в модели)
-            client = proposal.client
-            client_data = {
-                'client_id': client.client_id if client else None,
-                'client_name': client.client_name if client else '',
-                'client_company_name': (client.client_company_name or '') if client else '',
-            }
+        for summary in queryset:
             proposals_list.append({
-                'proposal_id': proposal.proposal_id,
-                'outcoming_number': proposal.outcoming_number,
-                'proposal_name': proposal.proposal_name,
-                'client': client_data,
-                'proposal_status': proposal.proposal_status,
-                'proposal_status_label': status_labels.get(proposal.proposal_status, proposal.proposal_status),
-                'total_sum': str(total_sum_kzt),
-                'paid_amount': str(paid_amount),
-                'payment_percentage': round(payment_percentage, 2),
-                'created_at': proposal.created_at.isoformat() if proposal.created_at else None,
+                'proposal_id': summary.proposal_id,
+                'outcoming_number': summary.outcoming_number,
+                'proposal_name': summary.proposal_name,
+                'client': {
+                    'client_id': summary.client_id,
+                    'client_name': summary.client_name,
+                    'client_company_name': summary.client_company_name,
+                },
+                'proposal_status': summary.proposal_status,
+                'proposal_status_label': status_labels.get(summary.proposal_status, summary.proposal_status),
+                'total_sum': str(summary.total_price_kzt),
+                'paid_amount': str(summary.paid_amount),
+                'payment_percentage': float(summary.payment_percentage),
+                'created_at': summary.created_at.isoformat() if summary.created_at else None,
             })
         
         return Response(proposals_list, status=status.HTTP_200_OK)
+
+
+class SalesAnalyticsView(APIView):
+    """
+    Sales analytics (revenue, margin, payments, conversion) served from the daily rollups
+    (SalesDailyRollup), without reading proposals or data packages.
+    
+    GET /api/analytics/sales/?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD&group_by=month,user
+    Optional filters (comma-separated): user_id, status, currency.
+    group_by: any of day | month | year (one), user, status, currency.
+    Returns:
+    {
+        "date_from": str | null,
+        "date_to": str | null,
+        "group_by": [str],
+        "results": [
+            {
+                "month": "2026-01-01",  # period start / "user", "user_name" / "status" / "currency"
+                "proposal_count": int,
+                "won_count": int,  # accepted + completed
+                "conversion_rate": float,  # won_count / proposal_count, %
+                "total_price_kzt": str,
+                "cost_price_kzt": str,
+                "margin_kzt": str,
+                "margin_percentage": str | null,  # margin / cost price, %
+                "paid_amount_kzt": str,
+                "total_price": str  # proposal currency, only with group_by=currency
+            },
+            ...
+        ],
+        "totals": {... same metrics ...}
+    }
+    Rollups are refreshed by Celery Beat every few minutes.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsManagerOrAdmin]
+    
+    def get(self, request, *args, **kwargs):
+        from decimal import Decimal
+        
+        params = request.query_params
+        try:
+            date_from = datetime.strptime(params['date_from'], '%Y-%m-%d').date() if params.get('date_from') else None
+            date_to = datetime.strptime(params['date_to'], '%Y-%m-%d').date() if params.get('date_to') else None
+        except ValueError:
+            return Response(
+                {'error': 'Invalid date format. Use YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            group_by = SalesRollupService.parse_group_by(params.get('group_by'))
+            user_ids = [int(value) for value in params.get('user_id', '').split(',') if value.strip()]
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        statuses = [value.strip() for value in params.get('status', '').split(',') if value.strip()]
+        currencies = [value.strip().upper() for value in params.get('currency', '').split(',') if value.strip()]
+        
+        report = SalesRollupService.report(
+            date_from=date_from, date_to=date_to, group_by=group_by,
+            user_ids=user_ids, statuses=statuses, currencies=currencies
+        )
+        
+        if 'user' in group_by:
+            names = dict(User.objects.filter(
+                pk__in={row['user'] for row in report['results'] if row['user']}
+            ).values_list('pk', 'user_name'))
+            for row in report['results']:
+                row['user_name'] = names.get(row['user'], '')
+        
+        def render(row):
+            return {key: str(value) if isinstance(value, Decimal) else value for key, value in row.items()}
+        
+        return Response({
+            'date_from': date_from.isoformat() if date_from else None,
+            'date_to': date_to.isoformat() if date_to else None,
+            'group_by': group_by,
+            'results': [render(row) for row in report['results']],
+            'totals': render(report['totals']),
+        }, status=status.HTTP_200_OK)
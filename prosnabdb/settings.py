@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'rest_framework_simplejwt.token_blacklist',
@@ -135,6 +136,43 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Image proxy disk cache (ImageProxyView): content-addressed, TTL + total size cap
+IMAGE_PROXY_CACHE_DIR = config('IMAGE_PROXY_CACHE_DIR', default=str(BASE_DIR / 'cache' / 'image_proxy'))
+IMAGE_PROXY_CACHE_TTL = config('IMAGE_PROXY_CACHE_TTL', cast=int, default=24 * 60 * 60)
+IMAGE_PROXY_CACHE_MAX_BYTES = config('IMAGE_PROXY_CACHE_MAX_BYTES', cast=int, default=1024 * 1024 * 1024)
+IMAGE_PROXY_MAX_IMAGE_BYTES = config('IMAGE_PROXY_MAX_IMAGE_BYTES', cast=int, default=15 * 1024 * 1024)
+IMAGE_PROXY_LOCK_WAIT = config('IMAGE_PROXY_LOCK_WAIT', cast=int, default=25)
+
+# Text search configuration for Equipment.search_vector (PostgreSQL regconfig)
+EQUIPMENT_SEARCH_CONFIG = config('EQUIPMENT_SEARCH_CONFIG', default='russian')
+# Minimum trigram similarity (pg_trgm.similarity_threshold) for fuzzy name / article matches
+EQUIPMENT_SEARCH_TRIGRAM_THRESHOLD = config('EQUIPMENT_SEARCH_TRIGRAM_THRESHOLD', cast=float, default=0.3)
+
+# Proposal price recalculation after save runs in Celery, debounced per proposal (seconds)
+PROPOSAL_RECALC_DEBOUNCE_SECONDS = config('PROPOSAL_RECALC_DEBOUNCE_SECONDS', cast=int, default=2)
+# Recalculations stale / computing longer than this are rescheduled by Celery Beat (seconds)
+PROPOSAL_RECALC_STUCK_SECONDS = config('PROPOSAL_RECALC_STUCK_SECONDS', cast=int, default=10 * 60)
+# Max variants per proposal copy request (/api/commercial-proposals/<id>/copy/)
+PROPOSAL_CLONE_MAX_VARIANTS = config('PROPOSAL_CLONE_MAX_VARIANTS', cast=int, default=20)
+# Unreferenced data package sections younger than this are kept by prune_sections (seconds)
+DATA_PACKAGE_SECTION_PRUNE_GRACE_SECONDS = config('DATA_PACKAGE_SECTION_PRUNE_GRACE_SECONDS', cast=int, default=24 * 60 * 60)
+
+# Catalog facet counts cache (EquipmentFacetService), seconds; invalidated on equipment changes
+EQUIPMENT_FACETS_CACHE_TTL = config('EQUIPMENT_FACETS_CACHE_TTL', cast=int, default=600)
+
+# Published catalog feed (/api/catalog/feed/): partner tokens, page size, cache max-age,
+# lag that holds back rows younger than N seconds (late commits are not skipped by cursors)
+CATALOG_FEED_TOKENS = config('CATALOG_FEED_TOKENS', cast=Csv(), default='')
+CATALOG_FEED_PAGE_SIZE = config('CATALOG_FEED_PAGE_SIZE', cast=int, default=500)
+CATALOG_FEED_MAX_AGE = config('CATALOG_FEED_MAX_AGE', cast=int, default=60)
+CATALOG_FEED_LAG_SECONDS = config('CATALOG_FEED_LAG_SECONDS', cast=int, default=5)
+
+# Equipment photo import (CloudImageImportService): output format JPEG or WEBP, download cap
+EQUIPMENT_PHOTO_FORMAT = config('EQUIPMENT_PHOTO_FORMAT', default='JPEG')
+EQUIPMENT_PHOTO_MAX_DOWNLOAD_BYTES = config('EQUIPMENT_PHOTO_MAX_DOWNLOAD_BYTES', cast=int, default=50 * 1024 * 1024)
+# Imports pending / processing longer than this are requeued by Celery Beat (requeue_photo_imports_task)
+EQUIPMENT_PHOTO_IMPORT_STALE_SECONDS = config('EQUIPMENT_PHOTO_IMPORT_STALE_SECONDS', cast=int, default=15 * 60)
+
 # drf-spectacular settings for Swagger/OpenAPI documentation
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Commercial Proposal Automation System API',
@@ -268,8 +306,42 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'proposals.tasks.sync_exchange_rates_task',
         'schedule': crontab(hour=16, minute=30),
     },
+    # Yandex Disk direct links expire; refresh them before read paths need them
+    'refresh-yandex-disk-links': {
+        'task': 'proposals.tasks.refresh_yandex_links_task',
+        'schedule': crontab(minute='*/10'),
+    },
+    # Photo imports whose task was lost (broker down) or whose worker died
+    'requeue-photo-imports': {
+        'task': 'proposals.tasks.requeue_photo_imports_task',
+        'schedule': crontab(minute='*/10'),
+    },
+    # Image proxy disk cache: recount its size and evict least recently used objects
+    'prune-image-proxy-cache': {
+        'task': 'proposals.tasks.prune_image_proxy_cache_task',
+        'schedule': crontab(minute=15),
+    },
+    # Price recalculations whose task was lost or whose worker died
+    'requeue-stuck-recalculations': {
+        'task': 'proposals.tasks.requeue_stuck_recalculations_task',
+        'schedule': crontab(minute='*/5'),
+    },
+    # Proposal summaries whose refresh after commit failed or was lost
+    'drain-proposal-summaries': {
+        'task': 'proposals.tasks.drain_proposal_summaries_task',
+        'schedule': crontab(minute='*'),
+    },
+    # Sales analytics: recompute rollups of the days changed since the last run
+    'refresh-sales-rollups': {
+        'task': 'proposals.tasks.refresh_sales_rollups_task',
+        'schedule': crontab(minute='*/5'),
+    },
 }
 
+# Yandex Disk direct links (YandexDiskLink): fallback lifetime and refresh margin, seconds
+YANDEX_DISK_LINK_TTL = config('YANDEX_DISK_LINK_TTL', cast=int, default=3 * 60 * 60)
+YANDEX_DISK_LINK_REFRESH_AHEAD = config('YANDEX_DISK_LINK_REFRESH_AHEAD', cast=int, default=30 * 60)
+
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.redis.RedisCache",